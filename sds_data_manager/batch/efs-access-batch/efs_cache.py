@@ -0,0 +1,346 @@
+"""Shared read-through cache of S3 inputs on EFS.
+
+Concurrent processing jobs often read the same input files. Rather than each
+job downloading its own copy, the first job to need a file copies it onto the
+shared EFS volume and every later job reads it from there.
+
+Entries are content addressed by S3 bucket, key and ETag, so a file that is
+replaced in S3 gets a new entry and a stale copy is never served. An entry is
+filled under a lock into a temporary file on the same file system and then
+renamed into place, so readers only ever see complete files. When the cache
+grows beyond its size budget the least recently used entries are evicted.
+
+Hits and misses are logged in the CloudWatch embedded metric format, which
+turns the job's log lines into metrics without any extra API calls.
+
+Processing jobs can call ``InputCache.get`` directly, or run this module to
+print the local paths of the given S3 URIs::
+
+    python efs_cache.py s3://bucket/imap/swe/l1a/2024/01/imap_swe_l1a_sci_....cdf
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+import boto3
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The cache access point of the EFS volume is mounted here
+CACHE_DIR = os.getenv("IMAP_INPUT_CACHE_DIR", "/mnt/input-cache")
+CACHE_BUDGET_GB = float(os.getenv("IMAP_INPUT_CACHE_BUDGET_GB", "100"))
+
+METRICS_NAMESPACE = "IMAP/InputCache"
+
+
+# File locks are held per process, so threads also take an in-process lock
+_thread_locks = defaultdict(threading.Lock)
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _locked(lock_path, blocking=True):
+    """Hold an exclusive lock on a file.
+
+    EFS supports NFSv4 locks, so this is safe across jobs.
+
+    Parameters
+    ----------
+    lock_path : Path
+        File to lock, created if it does not exist.
+    blocking : bool, optional
+        Wait for the lock. If False and the lock is held elsewhere,
+        yield False instead.
+
+    Yields
+    ------
+    bool
+        Whether the lock was acquired.
+    """
+    with _thread_locks_guard:
+        thread_lock = _thread_locks[str(lock_path)]
+    if not thread_lock.acquire(blocking=blocking):
+        yield False
+        return
+    try:
+        with open(lock_path, "a") as lock_file:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.lockf(lock_file, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+    finally:
+        thread_lock.release()
+
+
+class InputCache:
+    """Content-addressed read-through cache of S3 objects on a shared volume."""
+
+    def __init__(
+        self,
+        cache_dir=CACHE_DIR,
+        budget_bytes=int(CACHE_BUDGET_GB * 1024**3),
+        s3_client=None,
+    ):
+        """Set up the cache directories.
+
+        Parameters
+        ----------
+        cache_dir : str or Path, optional
+            Root of the cache on the shared volume.
+        budget_bytes : int, optional
+            Size the cache is kept under by evicting the least recently used
+            entries.
+        s3_client : botocore.client.S3, optional
+            S3 client to read the objects with.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.tmp_dir = self.cache_dir / "tmp"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.budget_bytes = budget_bytes
+        self.s3_client = s3_client or boto3.client("s3")
+        self.metrics = {"hits": 0, "misses": 0, "bytes_read": 0, "bytes_filled": 0}
+
+    def get_entry_path(self, bucket, key, etag):
+        """Get the cache path of an S3 object version.
+
+        The original file name is kept so that tools which parse
+        IMAP file names keep working on cached files.
+
+        Parameters
+        ----------
+        bucket : str
+            S3 bucket.
+        key : str
+            S3 object key.
+        etag : str
+            ETag of the object.
+
+        Returns
+        -------
+        Path
+            Path of the cached file.
+        """
+        digest = hashlib.sha256(f"{bucket}/{key}:{etag}".encode()).hexdigest()
+        return self.objects_dir / digest[:2] / digest / Path(key).name
+
+    def get(self, bucket, key):
+        """Get a local path to the current version of an S3 object.
+
+        Parameters
+        ----------
+        bucket : str
+            S3 bucket.
+        key : str
+            S3 object key.
+
+        Returns
+        -------
+        Path
+            Path of the cached file.
+        """
+        head = self.s3_client.head_object(Bucket=bucket, Key=key)
+        etag = head["ETag"].strip('"')
+        path = self.get_entry_path(bucket, key, etag)
+
+        if path.exists():
+            self._record(hit=True, size=head["ContentLength"])
+            # Mark the entry as recently used for the LRU eviction
+            os.utime(path)
+            return path
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _locked(path.parent / ".lock"):
+            # Another job may have filled the entry while we waited
+            if path.exists():
+                self._record(hit=True, size=head["ContentLength"])
+                os.utime(path)
+                return path
+            self._fill(bucket, key, etag, head["ContentLength"], path)
+
+        self._record(hit=False, size=head["ContentLength"])
+        self.evict(keep=path)
+        return path
+
+    def _fill(self, bucket, key, etag, size, path):
+        """Download an object into the cache atomically.
+
+        Parameters
+        ----------
+        bucket : str
+            S3 bucket.
+        key : str
+            S3 object key.
+        etag : str
+            ETag of the object version to download.
+        size : int
+            Expected size of the object in bytes.
+        path : Path
+            Cache path of the object.
+        """
+        tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        try:
+            # IfMatch fails the download if the object changed since the head
+            response = self.s3_client.get_object(Bucket=bucket, Key=key, IfMatch=etag)
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(response["Body"], f, 1024 * 1024)
+                f.flush()
+                os.fsync(f.fileno())
+            if tmp_path.stat().st_size != size:
+                raise OSError(
+                    f"Downloaded {tmp_path.stat().st_size} bytes of s3://{bucket}/"
+                    f"{key}, expected {size}"
+                )
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        logger.info(f"Cached s3://{bucket}/{key} at {path}")
+
+    def _record(self, hit, size):
+        """Count a cache lookup.
+
+        Parameters
+        ----------
+        hit : bool
+            Whether the lookup was a hit.
+        size : int
+            Size of the file in bytes.
+        """
+        self.metrics["hits" if hit else "misses"] += 1
+        self.metrics["bytes_read"] += size
+        if not hit:
+            self.metrics["bytes_filled"] += size
+
+    def get_entries(self):
+        """List the cache entries.
+
+        Returns
+        -------
+        list of tuple
+            ``(last_used, size, path)`` of each cached file.
+        """
+        entries = []
+        for path in self.objects_dir.glob("*/*/*"):
+            if path.name == ".lock":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Evicted by another job
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self, keep=None):
+        """Evict the least recently used entries until under the size budget.
+
+        Only one job evicts at a time, the others skip eviction.
+
+        Parameters
+        ----------
+        keep : Path, optional
+            Entry that must not be evicted, e.g. one that was just filled.
+
+        Returns
+        -------
+        int
+            Number of bytes evicted.
+        """
+        evicted = 0
+        with _locked(self.cache_dir / ".evict.lock", blocking=False) as locked:
+            if not locked:
+                return evicted
+            entries = sorted(self.get_entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.budget_bytes:
+                    break
+                if path == keep:
+                    continue
+                # Readers that already opened the file keep reading it
+                path.unlink(missing_ok=True)
+                total -= size
+                evicted += size
+                logger.info(f"Evicted {path} from the input cache")
+        return evicted
+
+    def log_metrics(self):
+        """Log the hit and miss counts as CloudWatch embedded metrics.
+
+        Returns
+        -------
+        dict
+            The logged metrics document.
+        """
+        document = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [[]],
+                        "Metrics": [
+                            {"Name": "hits", "Unit": "Count"},
+                            {"Name": "misses", "Unit": "Count"},
+                            {"Name": "bytes_read", "Unit": "Bytes"},
+                            {"Name": "bytes_filled", "Unit": "Bytes"},
+                        ],
+                    }
+                ],
+            },
+            **self.metrics,
+        }
+        # Printed rather than logged so the line is pure JSON
+        print(json.dumps(document))
+        return document
+
+
+def _parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        An object containing the parsed arguments and their values
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="efs_cache",
+        description="Print the local paths of S3 objects in the EFS input cache.",
+    )
+    parser.add_argument("s3_uris", nargs="+", help="S3 URIs of the inputs.")
+    return parser.parse_args()
+
+
+def main():
+    """Cache the given S3 objects and print their local paths."""
+    args = _parse_args()
+    cache = InputCache()
+    for s3_uri in args.s3_uris:
+        bucket, key = s3_uri.removeprefix("s3://").split("/", 1)
+        print(cache.get(bucket, key))
+    cache.log_metrics()
+
+
+if __name__ == "__main__":
+    main()
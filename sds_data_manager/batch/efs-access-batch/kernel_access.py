@@ -0,0 +1,250 @@
+"""Memory-mapped, read-only access to the SPICE kernels on the EFS.
+
+SPK and CK kernels can be hundreds of MB, while a job usually needs only the
+file record, the segment summaries and the few data records of its time
+range. Mapping a kernel instead of reading it whole lets the kernel page in
+only the parts that are touched.
+
+Symlinks such as ``latest_attitude_kernel.ah.a`` are resolved once per
+process, as the EFS lambda swaps them atomically and a job should use one
+consistent set of kernels for its whole run. Mapped kernels are cached per
+process as well.
+
+Reads through ``KernelBuffer.read`` are tracked per page, so a job can
+report how much of each kernel it actually touched.
+
+The module can be run to compare mapped access with reading the whole
+kernel::
+
+    python kernel_access.py /mnt/spice/latest_ephemeris_kernel.bsp
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import struct
+import time
+from functools import cache
+from pathlib import Path
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PAGE_SIZE = mmap.PAGESIZE
+# DAF (SPK and CK) files are made of 1024 byte records
+DAF_RECORD_SIZE = 1024
+
+
+@cache
+def resolve_kernel(path):
+    """Resolve the symlinks of a kernel path, once per process.
+
+    Parameters
+    ----------
+    path : str or Path
+        Kernel path, possibly a symlink.
+
+    Returns
+    -------
+    Path
+        The resolved path.
+    """
+    return Path(path).resolve(strict=True)
+
+
+class KernelBuffer:
+    """Read-only memory map of a kernel."""
+
+    def __init__(self, path):
+        """Map the kernel.
+
+        Parameters
+        ----------
+        path : str or Path
+            Kernel path.
+        """
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            # The map stays valid after the file is closed
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+        self.pages = set()
+
+    def __len__(self):
+        """Get the size of the kernel in bytes."""
+        return len(self._mmap)
+
+    def read(self, offset, size):
+        """Get a zero-copy view of part of the kernel.
+
+        Parameters
+        ----------
+        offset : int
+            Start of the view in bytes.
+        size : int
+            Size of the view in bytes.
+
+        Returns
+        -------
+        memoryview
+            The read-only view.
+        """
+        end = min(offset + size, len(self))
+        self.pages.update(range(offset // PAGE_SIZE, (end - 1) // PAGE_SIZE + 1))
+        return self.buffer[offset:end]
+
+    def read_record(self, record_number):
+        """Get a view of a DAF record.
+
+        Parameters
+        ----------
+        record_number : int
+            1-based record number.
+
+        Returns
+        -------
+        memoryview
+            The read-only view of the record.
+        """
+        return self.read((record_number - 1) * DAF_RECORD_SIZE, DAF_RECORD_SIZE)
+
+    @property
+    def bytes_touched(self):
+        """Number of bytes in the pages read so far."""
+        return min(len(self.pages) * PAGE_SIZE, len(self))
+
+    def close(self):
+        """Unmap the kernel."""
+        self.buffer.release()
+        self._mmap.close()
+
+
+# Mapped kernels of this process, keyed by resolved path
+_kernels = {}
+
+
+def open_kernel(path):
+    """Get the memory map of a kernel, cached per process.
+
+    Parameters
+    ----------
+    path : str or Path
+        Kernel path, possibly a symlink.
+
+    Returns
+    -------
+    KernelBuffer
+        The memory-mapped kernel.
+    """
+    resolved_path = resolve_kernel(path)
+    if resolved_path not in _kernels:
+        _kernels[resolved_path] = KernelBuffer(resolved_path)
+    return _kernels[resolved_path]
+
+
+def get_access_report():
+    """Report the bytes touched of every kernel mapped by this process.
+
+    Returns
+    -------
+    dict
+        "size" and "bytes_touched" of each kernel, keyed by path.
+    """
+    return {
+        str(path): {"size": len(kernel), "bytes_touched": kernel.bytes_touched}
+        for path, kernel in _kernels.items()
+    }
+
+
+def read_daf_summaries(kernel):
+    """Read the file record and segment summary records of a DAF kernel.
+
+    This is what a lookup touches before it reads the data of a segment.
+
+    Parameters
+    ----------
+    kernel : KernelBuffer
+        The mapped kernel.
+
+    Returns
+    -------
+    int
+        Number of segments.
+    """
+    file_record = kernel.read_record(1)
+    if bytes(file_record[:4]) != b"DAF/":
+        raise ValueError(f"{kernel.path} is not a DAF file")
+    endian = "<" if bytes(file_record[88:96]) == b"LTL-IEEE" else ">"
+    (next_record,) = struct.unpack(f"{endian}i", file_record[76:80])
+    n_segments = 0
+    while next_record:
+        record = kernel.read_record(next_record)
+        next_record, _, n_summaries = (
+            int(value) for value in struct.unpack(f"{endian}3d", record[:24])
+        )
+        n_segments += n_summaries
+    return n_segments
+
+
+def benchmark(path):
+    """Compare reading a kernel whole with reading its summaries mapped.
+
+    Parameters
+    ----------
+    path : str or Path
+        Kernel path.
+
+    Returns
+    -------
+    dict
+        Seconds and bytes of the full read and of the mapped access.
+    """
+    start = time.perf_counter()
+    with open(resolve_kernel(path), "rb") as f:
+        full_bytes = len(f.read())
+    full_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    kernel = KernelBuffer(resolve_kernel(path))
+    try:
+        segments = read_daf_summaries(kernel)
+        mapped_seconds = time.perf_counter() - start
+        mapped_bytes = kernel.bytes_touched
+    finally:
+        kernel.close()
+
+    return {
+        "kernel": str(path),
+        "segments": segments,
+        "full_read": {"seconds": full_seconds, "bytes": full_bytes},
+        "mapped": {"seconds": mapped_seconds, "bytes": mapped_bytes},
+    }
+
+
+def _parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        An object containing the parsed arguments and their values
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="kernel_access",
+        description="Benchmark mapped access to SPICE kernels against full reads.",
+    )
+    parser.add_argument("kernels", nargs="+", help="Paths of DAF (SPK/CK) kernels.")
+    return parser.parse_args()
+
+
+def main():
+    """Print the benchmark of the given kernels."""
+    args = _parse_args()
+    print(json.dumps([benchmark(path) for path in args.kernels], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@
 import logging
 from pathlib import Path
 
+import kernel_access
+
 # Logger setup
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -19,6 +21,9 @@ def spice_handler():
     This function and code is showing that we can read latest
     spice file from EFS through batch job.
 
+    The kernels are memory mapped, so only the records that are read are
+    loaded from the EFS rather than the whole kernel.
+
     Returns
     -------
     dict
@@ -26,17 +31,18 @@ def spice_handler():
 
     """
     # Check if the old symlink exists
-    if Path(attitude_symlink_path).is_symlink():
-        # Path.resolve() returns the absolute path of the symlink
-        with open(Path(attitude_symlink_path).resolve()) as f:
-            content = f.read()
-            logger.info("Attitude kernel:\n%s", content)
-
-    if Path(ephemeris_symlink_path).is_symlink():
-        with open(Path(ephemeris_symlink_path).resolve()) as f:
-            content = f.read()
-            logger.info("Ephemeris kernel:\n%s", content)
-
+    for symlink_path in [attitude_symlink_path, ephemeris_symlink_path]:
+        if not Path(symlink_path).is_symlink():
+            continue
+        kernel = kernel_access.open_kernel(symlink_path)
+        try:
+            segments = kernel_access.read_daf_summaries(kernel)
+            logger.info(f"{kernel.path} has {segments} segments")
+        except ValueError:
+            # Text kernels have no segments
+            logger.info(f"{kernel.path} is not a DAF kernel")
+
+    logger.info(f"Kernel access: {kernel_access.get_access_report()}")
     return {"statusCode": 200, "body": "Found symlink"}
 
 
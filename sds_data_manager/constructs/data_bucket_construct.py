@@ -45,6 +45,13 @@ class DataBucketConstruct(Construct):
             removal_policy=RemovalPolicy.DESTROY,
             auto_delete_objects=True,
             block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            # Parts of the multipart uploads that were neither completed
+            # nor aborted
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    abort_incomplete_multipart_upload_after=cdk.Duration.days(7)
+                )
+            ],
         )
 
         s3_write_policy = iam.PolicyStatement(
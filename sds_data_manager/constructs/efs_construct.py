@@ -62,6 +62,7 @@ class EFSConstruct(Construct):
         self.volume_name = "SPICE-EFS"
         self.efs_path = "/data"
         self.efs_spice_path = "/data/spice"
+        self.efs_input_cache_path = "/data/input-cache"
 
         # Define EFS security group, ports are added in EC2 stack
         self.efs_security_group = ec2.SecurityGroup(
@@ -110,6 +111,15 @@ class EFSConstruct(Construct):
             posix_user=efs.PosixUser(gid="1000", uid="1000"),
         )
 
+        # Shared read-through cache of the processing job inputs.
+        # The jobs both read and fill it, see batch/efs-access-batch/efs_cache.py
+        self.input_cache_access_point = self.efs.add_access_point(
+            "InputCacheAccessPoint",
+            create_acl=efs.Acl(owner_gid="1000", owner_uid="1000", permissions="770"),
+            path=self.efs_input_cache_path,
+            posix_user=efs.PosixUser(gid="1000", uid="1000"),
+        )
+
 
 class EFSWriteLambda(Construct):
     """Create some Lambdas that write to the EFS file system."""
@@ -176,6 +186,33 @@ class EFSWriteLambda(Construct):
         # This access point is used by other resources to read from EFS
         lambda_mount_path = "/mnt/spice"
 
+        # Merges the historical attitude kernels, invoked asynchronously by
+        # the write lambda so the merge is not part of staging a kernel
+        attitude_merge_function_name = "attitude-merge-lambda"
+        aws_lambda.Function(
+            self,
+            "AttitudeMergeLambda",
+            function_name=attitude_merge_function_name,
+            allow_all_outbound=True,
+            runtime=aws_lambda.Runtime.PYTHON_3_12,
+            code=code,
+            handler="efs_lambda.attitude_merge.lambda_handler",
+            role=efs_lambda_role,
+            description="Lambda that merges the historical attitude kernels",
+            vpc=vpc,
+            filesystem=aws_lambda.FileSystem.from_efs_access_point(
+                efs_construct.spice_access_point, lambda_mount_path
+            ),
+            timeout=Duration.minutes(15),
+            memory_size=1024,
+            architecture=aws_lambda.Architecture.ARM_64,
+            # One merge at a time, every merge appends all new kernels
+            reserved_concurrent_executions=1,
+            environment={
+                "EFS_MOUNT_PATH": lambda_mount_path,
+            },
+        )
+
         self.efs_spice_ingest_lambda = aws_lambda.Function(
             self,
             "EFSWriteLambda",
@@ -193,12 +230,25 @@ class EFSWriteLambda(Construct):
             filesystem=aws_lambda.FileSystem.from_efs_access_point(
                 efs_construct.spice_access_point, lambda_mount_path
             ),
-            timeout=Duration.minutes(1),
+            # Large kernels are streamed in parallel byte ranges
+            timeout=Duration.minutes(5),
+            memory_size=1024,
             architecture=aws_lambda.Architecture.ARM_64,
             environment={
                 "EFS_MOUNT_PATH": lambda_mount_path,
+                "ATTITUDE_MERGE_FUNCTION_NAME": attitude_merge_function_name,
             },
         )
+        # By name, the role is shared with the merge lambda
+        efs_lambda_role.add_to_policy(
+            aws_iam.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    f"arn:aws:lambda:{env.region}:{env.account}"
+                    f":function:{attitude_merge_function_name}"
+                ],
+            )
+        )
 
         # Trigger lambda on all s3 object creations through
         # eventbridge
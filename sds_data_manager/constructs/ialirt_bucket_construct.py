@@ -44,4 +44,10 @@ class IAlirtBucketConstruct(Construct):
             removal_policy=RemovalPolicy.DESTROY,
             auto_delete_objects=True,
             block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            # Parts of the packet uploads that could not be completed or aborted
+            lifecycle_rules=[
+                s3.LifecycleRule(
+                    abort_incomplete_multipart_upload_after=cdk.Duration.days(1)
+                )
+            ],
         )
@@ -12,6 +12,12 @@ from aws_cdk import aws_lambda as lambda_
 from aws_cdk import aws_lambda_python_alpha as lambda_alpha_
 from constructs import Construct
 
+from sds_data_manager.constructs.api_gateway_construct import ApiGateway
+
+# AWS SDK for pandas layer, providing pyarrow to the product compaction, see
+# https://aws-sdk-pandas.readthedocs.io/en/stable/layers.html
+PANDAS_LAYER_ARN = "arn:aws:lambda:{region}:336392948345:layer:AWSSDKPandas-Python312:8"
+
 
 class IalirtIngestLambda(Construct):
     """Construct for ialirt ingest lambda."""
@@ -21,6 +27,7 @@ class IalirtIngestLambda(Construct):
         scope: Construct,
         construct_id: str,
         ialirt_bucket: aws_s3.Bucket,
+        api: ApiGateway = None,
         **kwargs,
     ) -> None:
         """IalirtIngestLambda Stack.
@@ -33,6 +40,8 @@ class IalirtIngestLambda(Construct):
             A unique string identifier for this construct.
         ialirt_bucket : aws_s3.Bucket
             The data bucket.
+        api : ApiGateway, optional
+            API Gateway to serve the algorithm products on, at ``/ialirt``.
         kwargs : dict
             Keyword arguments.
 
@@ -51,6 +60,12 @@ class IalirtIngestLambda(Construct):
         # Create Event Rule
         self.create_event_rule(ialirt_bucket, self.ialirt_ingest_lambda)
 
+        # Compact the products of the algorithm table to S3 daily
+        self.create_compaction_lambda(ialirt_bucket, self.algorithm_data_table)
+
+        if api is not None:
+            self.create_products_api(api, self.algorithm_data_table)
+
     def create_ingest_dynamodb_table(self) -> aws_dynamodb.Table:
         """Create and return the DynamoDB table."""
         table = ddb.Table(
@@ -76,6 +91,8 @@ class IalirtIngestLambda(Construct):
             # Define the read and write capacity units.
             # TODO: change to provisioned capacity mode in production.
             billing_mode=ddb.BillingMode.PAY_PER_REQUEST,  # On-Demand capacity mode.
+            # Packets are deleted once their expiration (epoch seconds) passes.
+            time_to_live_attribute="expiration",
         )
 
         # Add a GSI for ingest time.
@@ -117,6 +134,9 @@ class IalirtIngestLambda(Construct):
             # Define the read and write capacity units.
             # TODO: change to provisioned capacity mode in production.
             billing_mode=ddb.BillingMode.PAY_PER_REQUEST,  # On-Demand capacity mode.
+            # Products are deleted once their expiration (epoch seconds) passes,
+            # after they are compacted to S3.
+            time_to_live_attribute="expiration",
         )
 
         # Add a GSI for ingest time.
@@ -220,3 +240,87 @@ class IalirtIngestLambda(Construct):
         ialirt_data_arrival_rule.add_target(
             targets.LambdaFunction(ialirt_ingest_lambda)
         )
+
+    def create_compaction_lambda(
+        self,
+        ialirt_bucket: aws_s3.Bucket,
+        algorithm_data_table: aws_dynamodb.Table,
+    ) -> lambda_alpha_.PythonFunction:
+        """Create the Lambda function compacting the products daily."""
+        compaction_lambda = lambda_alpha_.PythonFunction(
+            self,
+            id="IalirtProductCompactionLambda",
+            function_name="ialirt-product-compaction",
+            entry=str(
+                pathlib.Path(__file__).parent.joinpath("..", "lambda_code").resolve()
+            ),
+            index="IAlirtCode/ialirt_products.py",
+            handler="compaction_handler",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=cdk.Duration.minutes(15),
+            memory_size=1000,
+            layers=[
+                lambda_.LayerVersion.from_layer_version_arn(
+                    self,
+                    "PandasLayer",
+                    PANDAS_LAYER_ARN.format(region=cdk.Stack.of(self).region),
+                )
+            ],
+            environment={
+                "ALGORITHM_TABLE": algorithm_data_table.table_name,
+                "S3_BUCKET": ialirt_bucket.bucket_name,
+            },
+        )
+
+        algorithm_data_table.grant_read_data(compaction_lambda)
+        ialirt_bucket.grant_put(compaction_lambda)
+
+        # The resource is deleted when the stack is deleted.
+        compaction_lambda.apply_removal_policy(cdk.RemovalPolicy.DESTROY)
+
+        # The products of the previous day, after midnight UTC
+        compaction_rule = events.Rule(
+            self,
+            "IalirtProductCompaction",
+            rule_name="ialirt-product-compaction",
+            schedule=events.Schedule.cron(minute="30", hour="0"),
+        )
+        compaction_rule.add_target(targets.LambdaFunction(compaction_lambda))
+
+        return compaction_lambda
+
+    def create_products_api(
+        self,
+        api: ApiGateway,
+        algorithm_data_table: aws_dynamodb.Table,
+    ) -> lambda_alpha_.PythonFunction:
+        """Create the Lambda function serving the products and its route."""
+        products_api_lambda = lambda_alpha_.PythonFunction(
+            self,
+            id="IalirtProductsApiLambda",
+            function_name="ialirt-products-api",
+            entry=str(
+                pathlib.Path(__file__).parent.joinpath("..", "lambda_code").resolve()
+            ),
+            index="IAlirtCode/ialirt_products_api.py",
+            handler="lambda_handler",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=cdk.Duration.seconds(10),
+            memory_size=512,
+            environment={
+                "ALGORITHM_TABLE": algorithm_data_table.table_name,
+            },
+        )
+
+        algorithm_data_table.grant_read_data(products_api_lambda)
+
+        # The resource is deleted when the stack is deleted.
+        products_api_lambda.apply_removal_policy(cdk.RemovalPolicy.DESTROY)
+
+        api.add_route(
+            route="ialirt",
+            http_method="GET",
+            lambda_function=products_api_lambda,
+        )
+
+        return products_api_lambda
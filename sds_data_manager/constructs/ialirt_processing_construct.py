@@ -5,10 +5,22 @@ I-ALiRT algorithms. It was built using best practices as shown here:
 
 https://docs.aws.amazon.com/AmazonECS/latest/bestpracticesguide/networking-inbound.html
 https://aws.amazon.com/elasticloadbalancing/features/#Product_comparisons
+
+The packet receivers publish their packet rate and processing lag as
+CloudWatch metrics. The number of tasks tracks a packet rate per task, and
+the capacity provider adds EC2 instances as tasks need them.
+
+The network load balancer keeps a TCP connection on the task it was opened
+to, so added tasks only take new connections: scaling out does not relieve
+a task that lags behind on the connections it already has. A task protects
+itself from scale in while it has open connections, so scaling in only stops
+idle tasks instead of cutting streams and losing their packet windows.
 """
 
-from aws_cdk import CfnOutput
+from aws_cdk import CfnOutput, Duration, Stack
 from aws_cdk import aws_autoscaling as autoscaling
+from aws_cdk import aws_cloudwatch as cloudwatch
+from aws_cdk import aws_dynamodb as ddb
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_ecr as ecr
 from aws_cdk import aws_ecs as ecs
@@ -17,6 +29,14 @@ from aws_cdk import aws_iam as iam
 from aws_cdk import aws_s3 as s3
 from constructs import Construct
 
+# CloudWatch namespace and metrics published by the packet receivers
+METRIC_NAMESPACE = "IALiRT"
+PACKET_RATE_METRIC = "PacketsPerSecond"
+# Packets per second of a task, tasks are added or removed to keep it
+PACKETS_PER_TASK = 50
+# Time a deregistered task keeps its connections, e.g. during a deployment
+DEREGISTRATION_DELAY = Duration.minutes(5)
+
 
 class IalirtProcessing(Construct):
     """A processing system for I-ALiRT."""
@@ -31,6 +51,13 @@ class IalirtProcessing(Construct):
         ialirt_ports: list[int],
         container_port: int,
         ialirt_bucket: s3.Bucket,
+        packet_table: ddb.Table = None,
+        instance_type: str = "t3.micro",
+        cpu: int = 256,
+        memory_limit_mib: int = 512,
+        min_tasks: int = 1,
+        max_tasks: int = 4,
+        packets_per_task: float = PACKETS_PER_TASK,
         **kwargs,
     ) -> None:
         """Construct the i-alirt processing stack.
@@ -53,6 +80,22 @@ class IalirtProcessing(Construct):
             Port to be used by the container.
         ialirt_bucket: s3.Bucket
             S3 bucket
+        packet_table : ddb.Table, optional
+            Ingest table of the packets. The containers write the packets
+            they receive to it, and read it back to warm up the packet
+            windows of the algorithms when they start.
+        instance_type : str, optional
+            EC2 instance type of the cluster, e.g. "c6i.large".
+        cpu : int, optional
+            CPU units of a task, 1024 per vCPU.
+        memory_limit_mib : int, optional
+            Memory of a task in MiB.
+        min_tasks : int, optional
+            Number of tasks running without traffic.
+        max_tasks : int, optional
+            Largest number of tasks, and of instances.
+        packets_per_task : float, optional
+            Packets per second the tasks are scaled to handle each.
         kwargs : dict
             Keyword arguments
 
@@ -64,6 +107,13 @@ class IalirtProcessing(Construct):
         self.vpc = vpc
         self.repo = repo
         self.s3_bucket_name = ialirt_bucket.bucket_name
+        self.packet_table = packet_table
+        self.instance_type = instance_type
+        self.cpu = cpu
+        self.memory_limit_mib = memory_limit_mib
+        self.min_tasks = min_tasks
+        self.max_tasks = max_tasks
+        self.packets_per_task = packets_per_task
 
         # Add a security group in which network load balancer will reside
         self.create_load_balancer_security_group(processing_name)
@@ -131,6 +181,7 @@ class IalirtProcessing(Construct):
         self.ecs_cluster = ecs.Cluster(
             self, f"IalirtCluster{processing_name}", vpc=self.vpc
         )
+        self.add_capacity(processing_name)
 
         # Add IAM role and policy for S3 access
         task_role = iam.Role(
@@ -141,7 +192,13 @@ class IalirtProcessing(Construct):
 
         task_role.add_to_policy(
             iam.PolicyStatement(
-                actions=["s3:GetObject", "s3:ListBucket", "s3:PutObject"],
+                # Packets are uploaded as multipart uploads
+                actions=[
+                    "s3:GetObject",
+                    "s3:ListBucket",
+                    "s3:PutObject",
+                    "s3:AbortMultipartUpload",
+                ],
                 resources=[
                     f"arn:aws:s3:::{self.s3_bucket_name}",
                     f"arn:aws:s3:::{self.s3_bucket_name}/*",
@@ -149,6 +206,31 @@ class IalirtProcessing(Construct):
             )
         )
 
+        # The receivers protect their task from scale in while they have
+        # connections
+        task_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["ecs:GetTaskProtection", "ecs:UpdateTaskProtection"],
+                resources=[
+                    Stack.of(self).format_arn(
+                        service="ecs",
+                        resource="task",
+                        resource_name=f"{self.ecs_cluster.cluster_name}/*",
+                    )
+                ],
+            )
+        )
+
+        environment = {
+            "S3_BUCKET": self.s3_bucket_name,
+            "PORT": str(self.container_port),
+            # Dimension of the metrics of the tasks
+            "PROCESSING_NAME": processing_name,
+        }
+        if self.packet_table is not None:
+            self.packet_table.grant_read_write_data(task_role)
+            environment["INGEST_TABLE"] = self.packet_table.table_name
+
         # Specifies the networking mode as AWS_VPC.
         # ECS tasks in AWS_VPC mode can be registered with
         # Network Load Balancers (NLB).
@@ -169,13 +251,10 @@ class IalirtProcessing(Construct):
             # Allowable values:
             # https://docs.aws.amazon.com/cdk/api/v2/docs/
             # aws-cdk-lib.aws_ecs.TaskDefinition.html#cpu
-            memory_limit_mib=512,
-            cpu=256,
+            memory_limit_mib=self.memory_limit_mib,
+            cpu=self.cpu,
             logging=ecs.LogDrivers.aws_logs(stream_prefix=f"Ialirt{processing_name}"),
-            environment={"S3_BUCKET": self.s3_bucket_name},
-            # Ensure the ECS task is running in privileged mode,
-            # which allows the container to use FUSE.
-            privileged=True,
+            environment=environment,
         )
 
         # Map ports to container
@@ -197,47 +276,84 @@ class IalirtProcessing(Construct):
             cluster=self.ecs_cluster,
             task_definition=task_definition,
             security_groups=[self.ecs_security_group],
-            desired_count=1,
+            desired_count=self.min_tasks,
             vpc_subnets=ec2.SubnetSelection(
                 subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
             ),
+            # Tasks are placed through the capacity provider, which adds
+            # instances when they do not fit
+            capacity_provider_strategies=[
+                ecs.CapacityProviderStrategy(
+                    capacity_provider=self.capacity_provider.capacity_provider_name,
+                    weight=1,
+                )
+            ],
         )
 
-    def add_autoscaling(self, processing_name):
-        """Add autoscaling resources."""
+    def add_capacity(self, processing_name):
+        """Add the EC2 instances of the cluster."""
         # This auto-scaling group is used to manage the
         # number of instances in the ECS cluster. If an instance
         # becomes unhealthy, the auto-scaling group will replace it.
-        auto_scaling_group = autoscaling.AutoScalingGroup(
+        self.auto_scaling_group = autoscaling.AutoScalingGroup(
             self,
             f"AutoScalingGroup{processing_name}",
-            instance_type=ec2.InstanceType.of(
-                ec2.InstanceClass.BURSTABLE3, ec2.InstanceSize.MICRO
-            ),
+            instance_type=ec2.InstanceType(self.instance_type),
             machine_image=ecs.EcsOptimizedImage.amazon_linux2(),
             vpc=self.vpc,
-            desired_capacity=1,
+            # In AWS_VPC mode a task takes a network interface, so small
+            # instances may only fit one task each
+            min_capacity=1,
+            max_capacity=self.max_tasks,
         )
 
         # integrates ECS with EC2 Auto Scaling Groups
         # to manage the scaling and provisioning of the underlying
         # EC2 instances based on the requirements of ECS tasks
-        capacity_provider = ecs.AsgCapacityProvider(
+        self.capacity_provider = ecs.AsgCapacityProvider(
             self,
             f"AsgCapacityProvider{processing_name}",
-            auto_scaling_group=auto_scaling_group,
+            auto_scaling_group=self.auto_scaling_group,
         )
 
-        self.ecs_cluster.add_asg_capacity_provider(capacity_provider)
+        self.ecs_cluster.add_asg_capacity_provider(self.capacity_provider)
 
+    def get_metric(self, processing_name, metric_name, statistic):
+        """Get a metric published by the tasks of the service."""
+        return cloudwatch.Metric(
+            namespace=METRIC_NAMESPACE,
+            metric_name=metric_name,
+            dimensions_map={"ProcessingName": processing_name},
+            statistic=statistic,
+            period=Duration.minutes(1),
+        )
+
+    def add_autoscaling(self, processing_name):
+        """Add autoscaling resources."""
         # Allow inbound traffic from the Network Load Balancer
         # to the security groups associated with the EC2 instances
         # within the Auto Scaling Group.
         for port in self.ports:
-            auto_scaling_group.connections.allow_from(
+            self.auto_scaling_group.connections.allow_from(
                 self.load_balancer, ec2.Port.tcp(port)
             )
 
+        scaling = self.ecs_service.auto_scale_task_count(
+            min_capacity=self.min_tasks, max_capacity=self.max_tasks
+        )
+
+        # Keep the packet rate of each task (the average over the tasks)
+        # around the target. New tasks only take new connections, and tasks
+        # with open connections are protected from scale in.
+        scaling.scale_to_track_custom_metric(
+            f"PacketRateScaling{processing_name}",
+            metric=self.get_metric(processing_name, PACKET_RATE_METRIC, "Average"),
+            target_value=self.packets_per_task,
+            scale_out_cooldown=Duration.minutes(1),
+            # Contacts come in bursts, keep the tasks a while after one
+            scale_in_cooldown=Duration.minutes(15),
+        )
+
     def add_load_balancer(self, processing_name):
         """Add a load balancer for a container."""
         # Create the Network Load Balancer and
@@ -264,6 +380,7 @@ class IalirtProcessing(Construct):
                 f"Target{processing_name}{self.container_port}",
                 port=self.container_port,
                 targets=[self.ecs_service],
+                deregistration_delay=DEREGISTRATION_DELAY,
             )
 
             # This simply prints the DNS name of the
@@ -7,6 +7,8 @@ from aws_cdk import aws_events_targets as targets
 from aws_cdk import aws_iam as iam
 from aws_cdk import aws_lambda as lambda_
 from aws_cdk import aws_secretsmanager as secrets
+from aws_cdk import aws_sqs as sqs
+from aws_cdk.aws_lambda_event_sources import SqsEventSource
 from constructs import Construct
 
 
@@ -100,7 +102,7 @@ class IndexerLambda(Construct):
         rds_secret.grant_read(grantee=indexer_lambda)
 
         # Events that triggers Indexer Lambda:
-        # 1. Arrival of all science data
+        # 1. Arrival of all science data and SPICE kernels
         # 2. PutEvent from Lambda that builds dependency and starts Batch Job
         # 3. Batch Job status change
 
@@ -115,11 +117,52 @@ class IndexerLambda(Construct):
                 detail_type=["Object Created"],
                 detail={
                     "bucket": {"name": [data_bucket.bucket_name]},
-                    "object": {"key": [{"prefix": "imap/"}]},
+                    "object": {
+                        "key": [
+                            {"prefix": "imap/"},
+                            {"prefix": "spice/"},
+                            {"prefix": "spin/"},
+                        ]
+                    },
                 },
             ),
         )
 
+        # Status changes that could not be applied after several attempts
+        # are kept in a dead-letter queue
+        batch_job_status_dead_letter_queue = sqs.Queue(
+            self,
+            "BatchJobStatusDeadLetterQueue",
+            queue_name="batch-job-status-dead-letter-queue",
+            encryption=sqs.QueueEncryption.UNENCRYPTED,
+            retention_period=cdk.Duration.days(14),
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+        )
+
+        # Batch job status changes are buffered in a queue so the
+        # indexer can apply them to the database in bulk
+        batch_job_status_queue = sqs.Queue(
+            self,
+            "BatchJobStatusQueue",
+            queue_name="batch-job-status-queue",
+            encryption=sqs.QueueEncryption.UNENCRYPTED,
+            # Must be at least the lambda timeout
+            visibility_timeout=cdk.Duration.minutes(6),
+            removal_policy=cdk.RemovalPolicy.DESTROY,
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=5, queue=batch_job_status_dead_letter_queue
+            ),
+        )
+        indexer_lambda.add_event_source(
+            SqsEventSource(
+                batch_job_status_queue,
+                batch_size=100,
+                max_batching_window=cdk.Duration.seconds(10),
+                # Only the records that failed are retried, not the whole batch
+                report_batch_item_failures=True,
+            )
+        )
+
         # Uses batch job status
         # to update status in the database and
         # update ingested time if status was success
@@ -149,5 +192,5 @@ class IndexerLambda(Construct):
 
         # Add the Lambda function as the target for the rules
         imap_data_arrival_rule.add_target(targets.LambdaFunction(indexer_lambda))
-        batch_job_status_rule.add_target(targets.LambdaFunction(indexer_lambda))
+        batch_job_status_rule.add_target(targets.SqsQueue(batch_job_status_queue))
         batch_job_failure_rule.add_target(targets.SnsTopic(sns_topic))
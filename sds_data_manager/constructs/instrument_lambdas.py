@@ -1,5 +1,7 @@
 """Module containing constructs for instrumenting Lambda functions."""
 
+from typing import Optional
+
 from aws_cdk import Duration, Environment
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_iam as iam
@@ -29,6 +31,7 @@ class BatchStarterLambda(Construct):
         vpc: ec2.Vpc,
         sqs_queue: sqs.Queue,
         layers: list,
+        heavy_job_definitions: Optional[list] = None,
         **kwargs,
     ):
         """BatchStarterLambda Constructor.
@@ -57,6 +60,8 @@ class BatchStarterLambda(Construct):
             A FIFO queue to trigger the lambda with.
         layers : list
             List of Lambda layers cdk.cdfnOutput names
+        heavy_job_definitions : list, optional
+            Names of the job definitions to submit to the heavy job queue.
         kwargs : dict
             Keyword arguments
 
@@ -70,6 +75,7 @@ class BatchStarterLambda(Construct):
             "SECRET_NAME": rds_construct.rds_creds.secret_name,
             "ACCOUNT": f"{env.account}",
             "REGION": f"{env.region}",
+            "HEAVY_JOB_DEFINITIONS": ",".join(heavy_job_definitions or []),
         }
 
         self.instrument_lambda = lambda_.Function(
@@ -4,6 +4,9 @@ We will use batch processing to schedule and execute jobs. This construct
 will create the necessary resources for batch processing.
 """
 
+import json
+from fnmatch import fnmatch
+from pathlib import Path
 from typing import Optional
 
 import aws_cdk as cdk
@@ -11,8 +14,194 @@ from aws_cdk import aws_batch as batch
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_ecr as ecr
 from aws_cdk import aws_ecs as ecs
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_s3 as s3
 from constructs import Construct
 
+# Resource profiles of the job definitions
+JOB_RESOURCES_FILE = Path(__file__).parent / "processing_job_resources.json"
+
+# Valid Fargate vCPU values with their (min, max, step) memory in MiB
+FARGATE_MEMORY = {
+    0.25: (512, 2048, 512),
+    0.5: (1024, 4096, 1024),
+    1: (2048, 8192, 1024),
+    2: (4096, 16384, 1024),
+    4: (8192, 30720, 1024),
+    8: (16384, 61440, 4096),
+    16: (32768, 122880, 8192),
+}
+# Fargate ephemeral storage limits in GiB
+FARGATE_EPHEMERAL_STORAGE = (21, 200)
+COMPUTE_TYPES = ("fargate", "ec2")
+
+# Queue of the optional EC2 compute environments for heavy jobs
+HEAVY_JOB_QUEUE_NAME = "HeavyProcessingJobQueue"
+
+# Mounts the NVMe instance store of the EC2 instances at the scratch path,
+# striping the disks together when an instance has more than one
+SCRATCH_USER_DATA = """\
+DEVICES=$(find /dev/disk/by-id -name 'nvme-Amazon_EC2_NVMe_Instance_Storage_*' \\
+  ! -name '*-ns-*' | sort)
+COUNT=$(echo "$DEVICES" | grep -c . || true)
+mkdir -p {scratch_path}
+if [ "$COUNT" -gt 1 ]; then
+  yum install -y mdadm
+  mdadm --create /dev/md0 --level=0 --raid-devices="$COUNT" $DEVICES
+  DEVICE=/dev/md0
+elif [ "$COUNT" -eq 1 ]; then
+  DEVICE=$DEVICES
+fi
+if [ -n "${{DEVICE:-}}" ]; then
+  mkfs.xfs -f "$DEVICE"
+  mount -o noatime "$DEVICE" {scratch_path}
+fi
+chmod 1777 {scratch_path}
+"""
+
+
+def load_job_resources(path=JOB_RESOURCES_FILE):
+    """Load the job resource profiles from a JSON file.
+
+    The file has a "default" profile and a "jobs" mapping of job name
+    patterns (e.g. "hit-l3" or "*-l3") to the settings that differ from it.
+    A profile has "compute" ("fargate" or "ec2"), "vcpu", "memory" (MiB) and
+    "ephemeral_storage" (GiB, Fargate only). Jobs run on x86_64, the only
+    architecture of Fargate Spot and of the configured instance classes.
+
+    The optional "ec2" section configures the EC2 compute environments that
+    jobs with an "ec2" profile run on: "enabled", "instance_classes",
+    "allocation_strategy", "max_vcpus" and "scratch_path". The environments
+    are not enabled by default, all jobs then run on Fargate.
+
+    Parameters
+    ----------
+    path : str or Path, optional
+        Path to the resource configuration file.
+
+    Returns
+    -------
+    dict
+        Resource configuration.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def get_job_profile(job_resources, job_name):
+    """Get the resource profile of a job.
+
+    Patterns are applied in file order and an exact job name match is applied
+    last, so the most specific settings win.
+
+    Parameters
+    ----------
+    job_resources : dict
+        Resource configuration, see ``load_job_resources``.
+    job_name : str
+        Name of the job, e.g. "swe" or "swe-l3".
+
+    Returns
+    -------
+    dict
+        Resource profile of the job.
+    """
+    profile = dict(job_resources["default"])
+    jobs = job_resources.get("jobs", {})
+    for pattern, settings in jobs.items():
+        if pattern != job_name and fnmatch(job_name, pattern):
+            profile.update(settings)
+    profile.update(jobs.get(job_name, {}))
+    return profile
+
+
+def get_heavy_job_definitions(job_resources, job_names):
+    """Get the job definitions that run in the EC2 compute environments.
+
+    The batch starter submits these to ``HEAVY_JOB_QUEUE_NAME``.
+
+    Parameters
+    ----------
+    job_resources : dict
+        Resource configuration, see ``load_job_resources``.
+    job_names : list of str
+        Names of the jobs.
+
+    Returns
+    -------
+    list of str
+        Names of the job definitions with an "ec2" profile.
+    """
+    return [
+        f"ProcessingJob-{job_name}"
+        for job_name in job_names
+        if get_job_profile(job_resources, job_name)["compute"] == "ec2"
+    ]
+
+
+def validate_job_profile(job_name, profile, ec2_enabled=False):
+    """Ensure a resource profile can run in its compute environment.
+
+    Parameters
+    ----------
+    job_name : str
+        Name of the job, used in the error message.
+    profile : dict
+        Resource profile of the job.
+    ec2_enabled : bool, optional
+        Whether the EC2 compute environments exist.
+
+    Raises
+    ------
+    ValueError
+        If the profile is not valid for its compute environment.
+    """
+    expected = {"compute", "vcpu", "memory", "ephemeral_storage"}
+    if set(profile) != expected:
+        raise ValueError(
+            f"Resource profile of {job_name} must have exactly {sorted(expected)}, "
+            f"got {sorted(profile)}"
+        )
+    if profile["compute"] not in COMPUTE_TYPES:
+        raise ValueError(
+            f"Invalid compute {profile['compute']} for {job_name}, "
+            f"must be one of {COMPUTE_TYPES}"
+        )
+    vcpu = profile["vcpu"]
+    memory = profile["memory"]
+
+    if profile["compute"] == "ec2":
+        if not ec2_enabled:
+            raise ValueError(
+                f"{job_name} runs on ec2, but the EC2 compute environment "
+                "is not enabled"
+            )
+        if not isinstance(vcpu, int) or vcpu < 1:
+            raise ValueError(f"Invalid vcpu {vcpu} for {job_name}, must be >= 1")
+        if not isinstance(memory, int) or memory < 512:
+            raise ValueError(
+                f"Invalid memory {memory} MiB for {job_name}, must be >= 512 MiB"
+            )
+        return
+
+    if vcpu not in FARGATE_MEMORY:
+        raise ValueError(
+            f"Invalid vcpu {vcpu} for {job_name}, "
+            f"must be one of {sorted(FARGATE_MEMORY)}"
+        )
+    min_memory, max_memory, step = FARGATE_MEMORY[vcpu]
+    if not min_memory <= memory <= max_memory or (memory - min_memory) % step:
+        raise ValueError(
+            f"Invalid memory {memory} MiB for {job_name} with {vcpu} vCPU, must be "
+            f"between {min_memory} and {max_memory} MiB in steps of {step} MiB"
+        )
+    min_storage, max_storage = FARGATE_EPHEMERAL_STORAGE
+    if not min_storage <= profile["ephemeral_storage"] <= max_storage:
+        raise ValueError(
+            f"Invalid ephemeral_storage {profile['ephemeral_storage']} GiB for "
+            f"{job_name}, must be between {min_storage} and {max_storage} GiB"
+        )
+
 
 class ProcessingConstruct(Construct):
     """Construct for processing jobs."""
@@ -23,10 +212,14 @@ class ProcessingConstruct(Construct):
         construct_id: str,
         vpc: ec2.Vpc,
         volumes: Optional[list] = None,
+        data_bucket: Optional[s3.Bucket] = None,
+        job_resources: Optional[dict] = None,
         **kwargs,
     ):
         """Set up the primary processing environment and queue.
 
+        If enabled in the resource configuration, EC2 compute environments and
+        a queue for heavy jobs are set up as well.
         Additional job definitions can be added to the construct later.
 
         Parameters
@@ -39,6 +232,13 @@ class ProcessingConstruct(Construct):
             VPC into which to launch the compute instance.
         volumes : list, optional
             List of volumes to attach to the compute instance, by default None.
+        data_bucket : s3.Bucket, optional
+            The data bucket. If given, the jobs are allowed to read the
+            manifests that the batch starter writes to it and the science
+            files they fill the input cache with.
+        job_resources : dict, optional
+            Resource profiles of the jobs, see ``load_job_resources``.
+            By default they are loaded from ``JOB_RESOURCES_FILE``.
         kwargs : dict
             Keyword arguments.
         """
@@ -67,6 +267,106 @@ class ProcessingConstruct(Construct):
         )
 
         self.volumes = volumes
+        self.job_resources = job_resources or load_job_resources()
+
+        # Optional EC2 compute for heavy jobs that need more than Fargate offers
+        self.heavy_job_queue = None
+        self.scratch_volume = None
+        ec2_config = self.job_resources.get("ec2", {})
+        if ec2_config.get("enabled", False):
+            self.add_ec2_compute(vpc, ec2_config)
+
+        # Role for the containers themselves (not the ECS agent)
+        self.job_role = None
+        if data_bucket is not None:
+            self.job_role = iam.Role(
+                self,
+                "ProcessingJobRole",
+                assumed_by=iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
+            )
+            # Array job children read their command from a manifest
+            data_bucket.grant_read(self.job_role, "batch-manifests/*")
+            # Inputs are read straight from S3 into the shared input cache
+            data_bucket.grant_read(self.job_role, "imap/*")
+
+    def add_ec2_compute(self, vpc: ec2.Vpc, ec2_config: dict):
+        """Create the EC2 compute environments and queue for heavy jobs.
+
+        The queue places jobs on Spot instances first and only falls back to
+        on-demand instances when no Spot capacity is available. The instances
+        mount their NVMe instance store as scratch space for the jobs.
+
+        Parameters
+        ----------
+        vpc : ec2.Vpc
+            VPC into which to launch the compute instances.
+        ec2_config : dict
+            The "ec2" section of the resource configuration.
+        """
+        scratch_path = ec2_config.get("scratch_path", "/scratch")
+        # Batch requires MIME multipart user data in launch templates
+        user_data = ec2.MultipartUserData()
+        scratch_commands = ec2.UserData.for_linux()
+        scratch_commands.add_commands(
+            SCRATCH_USER_DATA.format(scratch_path=scratch_path)
+        )
+        user_data.add_part(ec2.MultipartBody.from_user_data(scratch_commands))
+        launch_template = ec2.LaunchTemplate(
+            self,
+            "HeavyProcessingLaunchTemplate",
+            user_data=user_data,
+            require_imdsv2=True,
+        )
+
+        instance_classes = [
+            ec2.InstanceClass[instance_class.upper()]
+            for instance_class in ec2_config.get("instance_classes", [])
+        ]
+        compute_environments = []
+        for order, spot in enumerate([True, False], start=1):
+            purchase = "spot" if spot else "ondemand"
+            compute_environments.append(
+                batch.OrderedComputeEnvironment(
+                    compute_environment=batch.ManagedEc2EcsComputeEnvironment(
+                        self,
+                        f"HeavyProcessingComputeEnvironment-{purchase}",
+                        compute_environment_name=(
+                            f"HeavyProcessingComputeEnvironment-{purchase}"
+                        ),
+                        vpc=vpc,
+                        vpc_subnets=ec2.SubnetSelection(
+                            subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS
+                        ),
+                        spot=spot,
+                        allocation_strategy=(
+                            batch.AllocationStrategy[
+                                ec2_config.get(
+                                    "allocation_strategy",
+                                    "SPOT_PRICE_CAPACITY_OPTIMIZED",
+                                )
+                            ]
+                            if spot
+                            else batch.AllocationStrategy.BEST_FIT_PROGRESSIVE
+                        ),
+                        instance_classes=instance_classes,
+                        use_optimal_instance_classes=False,
+                        launch_template=launch_template,
+                        minv_cpus=0,
+                        maxv_cpus=ec2_config.get("max_vcpus", 256),
+                    ),
+                    order=order,
+                )
+            )
+
+        self.heavy_job_queue = batch.JobQueue(
+            self,
+            HEAVY_JOB_QUEUE_NAME,
+            job_queue_name=HEAVY_JOB_QUEUE_NAME,
+            compute_environments=compute_environments,
+        )
+        self.scratch_volume = batch.HostVolume(
+            name="scratch", host_path=scratch_path, container_path=scratch_path
+        )
 
     def add_job(self, job_name: str):
         """Create an ECR repo and a job definition for the given job.
@@ -76,6 +376,11 @@ class ProcessingConstruct(Construct):
         job_name : str
             Name of the job for which to create the job definition.
         """
+        profile = get_job_profile(self.job_resources, job_name)
+        validate_job_profile(
+            job_name, profile, ec2_enabled=self.heavy_job_queue is not None
+        )
+
         # Create a registry for each job definition (swe-repo)
         container_repo = ecr.Repository(
             self,
@@ -84,26 +389,47 @@ class ProcessingConstruct(Construct):
             empty_on_delete=True,
             removal_policy=cdk.RemovalPolicy.DESTROY,
         )
+        image = ecs.ContainerImage.from_ecr_repository(
+            repository=container_repo, tag="latest"
+        )
+        environment = {
+            "IMAP_SPICE_DIR": "/mnt/spice",
+            "IMAP_INPUT_CACHE_DIR": "/mnt/input-cache",
+        }
+        if profile["compute"] == "ec2":
+            # Heavy jobs run on EC2 instances with NVMe scratch space
+            environment["IMAP_SCRATCH_DIR"] = self.scratch_volume.container_path
+            container = batch.EcsEc2ContainerDefinition(
+                self,
+                f"Ec2Container-{job_name}",
+                image=image,
+                memory=cdk.Size.mebibytes(profile["memory"]),
+                cpu=profile["vcpu"],
+                environment=environment,
+                volumes=[*(self.volumes or []), self.scratch_volume],
+                job_role=self.job_role,
+            )
+        else:
+            container = batch.EcsFargateContainerDefinition(
+                self,
+                f"FargateContainer-{job_name}",
+                assign_public_ip=True,  # Required to pull ECR images
+                image=image,
+                memory=cdk.Size.mebibytes(profile["memory"]),
+                cpu=profile["vcpu"],
+                ephemeral_storage_size=cdk.Size.gibibytes(profile["ephemeral_storage"]),
+                environment=environment,
+                volumes=self.volumes,
+                job_role=self.job_role,
+                # Fargate Spot only runs x86_64 images
+                fargate_cpu_architecture=ecs.CpuArchitecture.X86_64,
+                fargate_operating_system_family=ecs.OperatingSystemFamily.LINUX,
+            )
+
         # Create the job definition
         batch.EcsJobDefinition(
             self,
             f"ProcessingJob-{job_name}",
             job_definition_name=f"ProcessingJob-{job_name}",
-            container=batch.EcsFargateContainerDefinition(
-                self,
-                f"FargateContainer-{job_name}",
-                assign_public_ip=True,  # Required to pull ECR images
-                image=ecs.ContainerImage.from_ecr_repository(
-                    repository=container_repo, tag="latest"
-                ),
-                memory=cdk.Size.mebibytes(4096),
-                cpu=1,
-                environment={"IMAP_SPICE_DIR": "/mnt/spice"},
-                volumes=self.volumes,
-                # TODO: Do we need to explicitly specify architecture and OS family?
-                #       We are building containers in GitHub Actions and need to
-                #       make sure these are aligned.
-                # fargate_cpu_architecture=ecs.CpuArchitecture.ARM64,
-                # fargate_operating_system_family=ecs.OperatingSystemFamily.LINUX
-            ),
+            container=container,
         )
@@ -1,6 +1,10 @@
 """Configure the SDS API Manager."""
 
+from typing import Optional
+
 import aws_cdk as cdk
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
 from aws_cdk import aws_iam as iam
 from aws_cdk import aws_lambda as lambda_
 from aws_cdk import aws_secretsmanager as secrets
@@ -24,6 +28,7 @@ class SdsApiManager(Construct):
         rds_security_group,
         db_secret_name: str,
         layers: list,
+        heavy_job_definitions: Optional[list] = None,
         **kwargs,
     ) -> None:
         """Initialize the SdsApiManagerConstruct.
@@ -50,6 +55,9 @@ class SdsApiManager(Construct):
             The DB secret name
         layers : list
             List of Lambda layers arns
+        heavy_job_definitions : list, optional
+            Names of the job definitions that the reprocessing lambda
+            submits to the heavy job queue.
         kwargs : dict
             Keyword arguments
         """
@@ -129,6 +137,57 @@ class SdsApiManager(Construct):
             lambda_function=query_api_lambda,
         )
 
+        # reprocessing API lambda
+        reprocessing_api_lambda = lambda_.Function(
+            self,
+            id="ReprocessingAPILambda",
+            function_name="reprocessing-api-handler",
+            code=code,
+            handler="SDSCode.reprocessing.lambda_handler",
+            runtime=lambda_.Runtime.PYTHON_3_12,
+            timeout=cdk.Duration.minutes(5),
+            memory_size=1000,
+            allow_public_subnet=True,
+            vpc=vpc,
+            security_groups=[rds_security_group],
+            environment={
+                "REGION": env.region,
+                "SECRET_NAME": db_secret_name,
+                # Input manifests and metakernels of the released jobs
+                "S3_BUCKET": data_bucket.bucket_name,
+                "RELEASE_RATE": "10",
+                "HEAVY_JOB_DEFINITIONS": ",".join(heavy_job_definitions or []),
+            },
+            layers=layers,
+            architecture=lambda_.Architecture.ARM_64,
+        )
+        reprocessing_api_lambda.add_to_role_policy(s3_write_policy)
+        reprocessing_api_lambda.add_to_role_policy(s3_read_policy)
+        reprocessing_api_lambda.add_to_role_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["batch:SubmitJob"],
+                resources=["*"],
+            )
+        )
+
+        api.add_route(
+            route="reprocessing",
+            http_method="GET",
+            lambda_function=reprocessing_api_lambda,
+        )
+
+        # Release PENDING reprocessing jobs to batch at a limited rate
+        reprocessing_release_rule = events.Rule(
+            self,
+            "ReprocessingReleaseSchedule",
+            rule_name="reprocessing-release-schedule",
+            schedule=events.Schedule.rate(cdk.Duration.minutes(5)),
+        )
+        reprocessing_release_rule.add_target(
+            targets.LambdaFunction(reprocessing_api_lambda)
+        )
+
         # download API lambda
         download_api = lambda_.Function(
             self,
@@ -180,6 +239,7 @@ class SdsApiManager(Construct):
         rds_secret.grant_read(grantee=universal_spin_table_handler)
         rds_secret.grant_read(grantee=query_api_lambda)
         rds_secret.grant_read(grantee=upload_api_lambda)
+        rds_secret.grant_read(grantee=reprocessing_api_lambda)
 
         api.add_route(
             route="spin_table",
@@ -1,8 +1,28 @@
-"""IALiRT ingest lambda."""
+"""IALiRT ingest lambda.
+
+Packet files dropped under ``packets/`` in the I-ALiRT bucket are streamed
+from S3 and split into CCSDS packets as the bytes arrive, so the file is
+never held in memory whole. The APID, sequence count and MET of each packet
+are decoded from its headers and the packet is written to the ingest table.
+
+Items are keyed by APID and by the MET of the packet with its sequence count
+as a fraction (``met.sssss``). The key only depends on the packet, so
+replaying a file overwrites its items instead of duplicating them, while
+packets of the same APID within the same second are kept apart.
+
+Algorithms only read back the window of packets they need, e.g. the last
+ten minutes of an APID, with a ``between`` condition on the sort key, so a
+query costs the same however full the table is. Items carry an
+``expiration`` time to live and are deleted by DynamoDB once it passes.
+"""
 
 import json
 import logging
 import os
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 
 import boto3
 from boto3.dynamodb.conditions import Key
@@ -10,6 +30,226 @@ from boto3.dynamodb.conditions import Key
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# CCSDS primary header: version, type, secondary header flag and APID,
+# sequence flags and count, packet data length minus one
+PRIMARY_HEADER = struct.Struct(">HHH")
+# The secondary header starts with the MET in seconds
+MET = struct.Struct(">I")
+# Bytes read from S3 at a time
+CHUNK_SIZE = 64 * 1024
+# Sequence counts are 14 bits, they are the five decimals of the sort key
+SEQUENCE_COUNT_DIGITS = 5
+
+# How long packets are kept in the ingest table
+PACKET_TTL = timedelta(days=7)
+# Seconds of packets before the latest packet that algorithms read back
+WINDOW_SECONDS = 10 * 60
+# Attributes the algorithms read, "met" is a reserved word
+PACKET_ATTRIBUTES = ("apid", "met", "seq_count", "packet_blob")
+
+Packet = namedtuple("Packet", ["apid", "seq_count", "met", "data"])
+
+
+def decode_packet(data):
+    """Decode the headers of a CCSDS packet.
+
+    Parameters
+    ----------
+    data : bytes
+        The whole packet.
+
+    Returns
+    -------
+    Packet
+        The APID, sequence count, MET (seconds) and bytes of the packet.
+    """
+    if len(data) < PRIMARY_HEADER.size + MET.size:
+        raise ValueError(f"Packet of {len(data)} bytes is too short for a MET")
+    first, second, _ = PRIMARY_HEADER.unpack_from(data)
+    (met,) = MET.unpack_from(data, PRIMARY_HEADER.size)
+    return Packet(
+        apid=first & 0x7FF, seq_count=second & 0x3FFF, met=met, data=bytes(data)
+    )
+
+
+def iter_packets(stream, chunk_size=CHUNK_SIZE):
+    """Split a stream of CCSDS packets into packets.
+
+    Parameters
+    ----------
+    stream : file-like
+        Binary stream with a ``read(size)`` method, e.g. an S3 object body.
+    chunk_size : int, optional
+        Bytes read at a time.
+
+    Yields
+    ------
+    Packet
+        The decoded packets, in order.
+    """
+    buffer = bytearray()
+    while chunk := stream.read(chunk_size):
+        buffer += chunk
+        offset = 0
+        while len(buffer) - offset >= PRIMARY_HEADER.size:
+            (length,) = struct.unpack_from(">H", buffer, offset + 4)
+            # The length field is the data length minus one
+            end = offset + PRIMARY_HEADER.size + length + 1
+            if end > len(buffer):
+                break
+            yield decode_packet(buffer[offset:end])
+            offset = end
+        del buffer[:offset]
+    if buffer:
+        logger.warning(f"Dropped {len(buffer)} bytes of a truncated packet")
+
+
+def get_sort_key(met, seq_count):
+    """Get the sort key of a packet, its MET with the sequence count fraction.
+
+    Parameters
+    ----------
+    met : int
+        MET of the packet in seconds.
+    seq_count : int
+        Sequence count of the packet.
+
+    Returns
+    -------
+    Decimal
+        The sort key, e.g. 406334173.00057.
+    """
+    return Decimal(f"{met}.{seq_count:0{SEQUENCE_COUNT_DIGITS}d}")
+
+
+def get_item(packet, ingest_time, source):
+    """Get the ingest table item of a packet.
+
+    Parameters
+    ----------
+    packet : Packet
+        The decoded packet.
+    ingest_time : datetime
+        Time of the ingest.
+    source : str
+        S3 key of the packet file.
+
+    Returns
+    -------
+    dict
+        The item.
+    """
+    return {
+        "apid": packet.apid,
+        "met": get_sort_key(packet.met, packet.seq_count),
+        "seq_count": packet.seq_count,
+        "ingest_time": ingest_time.isoformat(),
+        "packet_blob": packet.data,
+        "source": source,
+        # Epoch seconds after which DynamoDB deletes the item
+        "expiration": int((ingest_time + PACKET_TTL).timestamp()),
+    }
+
+
+def ingest_packets(stream, ingest_table, source):
+    """Write the packets of a stream to the ingest table.
+
+    ``batch_writer`` sends the items in BatchWriteItem calls of 25 items
+    and resends the unprocessed items of each call until they are written.
+
+    Parameters
+    ----------
+    stream : file-like
+        Binary stream of CCSDS packets.
+    ingest_table : boto3 DynamoDB Table
+        The ingest table.
+    source : str
+        S3 key of the packet file.
+
+    Returns
+    -------
+    dict
+        "packets" (number of packets) and "last_met" (latest MET in
+        seconds) of each APID.
+    """
+    ingest_time = datetime.now(timezone.utc)
+    apids = {}
+    # A batch must not contain the same key twice, a repeated packet
+    # replaces the pending one
+    with ingest_table.batch_writer(overwrite_by_pkeys=["apid", "met"]) as batch:
+        for packet in iter_packets(stream):
+            batch.put_item(Item=get_item(packet, ingest_time, source))
+            summary = apids.setdefault(packet.apid, {"packets": 0, "last_met": 0})
+            summary["packets"] += 1
+            summary["last_met"] = max(summary["last_met"], packet.met)
+    return apids
+
+
+def query_packets(ingest_table, apid, start_met, end_met, attributes=PACKET_ATTRIBUTES):
+    """Query the packets of an APID within a MET window.
+
+    Every page of the query is read, a single query returns at most 1 MB.
+
+    Parameters
+    ----------
+    ingest_table : boto3 DynamoDB Table
+        The ingest table.
+    apid : int
+        The APID.
+    start_met : int
+        Start of the window, MET in seconds.
+    end_met : int
+        End of the window (inclusive), MET in seconds.
+    attributes : iterable of str, optional
+        The attributes to return, all if None.
+
+    Returns
+    -------
+    list of dict
+        The packets, sorted by MET and sequence count.
+    """
+    query = {
+        "KeyConditionExpression": Key("apid").eq(apid)
+        & Key("met").between(
+            Decimal(start_met), get_sort_key(end_met, 10**SEQUENCE_COUNT_DIGITS - 1)
+        ),
+    }
+    if attributes is not None:
+        # Placeholders, as some attribute names are reserved words
+        names = {f"#a{index}": name for index, name in enumerate(attributes)}
+        query["ProjectionExpression"] = ", ".join(names)
+        query["ExpressionAttributeNames"] = names
+
+    items = []
+    while True:
+        response = ingest_table.query(**query)
+        items += response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return items
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def query_recent_packets(ingest_table, apid, last_met, window=WINDOW_SECONDS):
+    """Query the packets of an APID within a window before a MET.
+
+    Parameters
+    ----------
+    ingest_table : boto3 DynamoDB Table
+        The ingest table.
+    apid : int
+        The APID.
+    last_met : int
+        End of the window (inclusive), MET in seconds.
+    window : int, optional
+        Length of the window in seconds.
+
+    Returns
+    -------
+    list of dict
+        The packets, sorted by MET and sequence count.
+    """
+    return query_packets(ingest_table, apid, last_met - window, last_met)
+
 
 def lambda_handler(event, context):
     """Create metadata and add it to the database.
@@ -28,43 +268,23 @@ def lambda_handler(event, context):
         and runtime environment.
 
     """
-    # TODO: these steps will be put into different functions.
     logger.info("Received event: %s", json.dumps(event))
 
     ingest_table_name = os.environ.get("INGEST_TABLE")
-    algorithm_table_name = os.environ.get("ALGORITHM_TABLE")
-    dynamodb = boto3.resource("dynamodb")
-    ingest_table = dynamodb.Table(ingest_table_name)
-    algorithm_table = dynamodb.Table(algorithm_table_name)
+    ingest_table = boto3.resource("dynamodb").Table(ingest_table_name)
 
     s3_filepath = event["detail"]["object"]["key"]
     filename = os.path.basename(s3_filepath)
     logger.info("Retrieved filename: %s", filename)
 
-    # TODO: Each of these steps in temporary, but provides an idea
-    #  of how the lambda will be used.
-    # 1. Ingest Data to Ingest Table.
-    item = {
-        "apid": 478,
-        "met": 123,
-        "ingest_time": "2021-01-01T00:00:00Z",
-        "packet_blob": b"binary_data_string",
-    }
-
-    ingest_table.put_item(Item=item)
-    logger.info("Successfully wrote item to DynamoDB: %s", item)
+    # Ingest the packets of the file to the Ingest Table.
+    response = boto3.client("s3").get_object(
+        Bucket=os.environ.get("S3_BUCKET"), Key=s3_filepath
+    )
+    apids = ingest_packets(response["Body"], ingest_table, s3_filepath)
+    logger.info("Ingested packets per APID: %s", apids)
 
-    # 2. Query Ingest Table for previous times as required by instrument.
-    response = ingest_table.query(KeyConditionExpression=Key("apid").eq(478))
-    items = response["Items"]
-    logger.info("Scan successful. Retrieved items: %s", items)
-
-    # 3. After processing insert data into Algorithm Table.
-    item = {
-        "product_name": "hit_product_1",
-        "met": 123,
-        "insert_time": "2021-01-01T00:00:00Z",
-        "data_product_1": str(1234.56),
-    }
-    algorithm_table.put_item(Item=item)
-    logger.info("Successfully wrote item to DynamoDB: %s", item)
+    # TODO: run the algorithms on the window of packets they need, read
+    #  with query_recent_packets from the last MET of each APID, and write
+    #  their products to the algorithm table with
+    #  ialirt_products.ProductWriter.
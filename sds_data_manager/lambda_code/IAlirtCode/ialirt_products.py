@@ -0,0 +1,331 @@
+"""Write I-ALiRT algorithm products to the algorithm table.
+
+Products are buffered per product name and MET and written every
+``FLUSH_SECONDS`` seconds with BatchWriteItem, instead of one PutItem per
+product. A product computed again before a flush replaces the buffered one.
+
+Scalar values are stored as DynamoDB numbers. Numeric arrays are stored as
+binary attributes holding the little-endian bytes of the values, with their
+type code (see the ``array`` module) in the ``array_types`` map of the item,
+e.g. 8 bytes per float instead of a stringified list of floats.
+
+Items carry an ``expiration`` time to live, so the table only holds the last
+few days of products. Every day the products of the previous day are
+compacted to one Parquet file per product in the I-ALiRT bucket, before they
+expire from the table.
+"""
+
+import io
+import json
+import logging
+import os
+import sys
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Seconds products are buffered before they are written
+FLUSH_SECONDS = 1.0
+# How long products are kept in the algorithm table, longer than a day so
+# that the daily compaction sees all of them
+PRODUCT_TTL = timedelta(days=3)
+# Type code of the arrays of floats
+FLOAT_TYPE = "d"
+# Attributes of the items that are not product values
+KEY_ATTRIBUTES = ("product_name", "met", "insert_time", "expiration", "array_types")
+
+
+def encode_array(values, typecode=FLOAT_TYPE):
+    """Encode numeric values as little-endian bytes.
+
+    Parameters
+    ----------
+    values : iterable of numbers
+        The values, e.g. a list or a NumPy array.
+    typecode : str, optional
+        Type code of the values, see the ``array`` module.
+
+    Returns
+    -------
+    bytes
+        The encoded values.
+    """
+    values = array(typecode, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def decode_array(data, typecode=FLOAT_TYPE):
+    """Decode values encoded by ``encode_array``.
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded values.
+    typecode : str, optional
+        Type code of the values.
+
+    Returns
+    -------
+    list
+        The values.
+    """
+    values = array(typecode)
+    values.frombytes(bytes(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
+
+
+def get_item(product_name, met, values, insert_time):
+    """Get the algorithm table item of a product.
+
+    Parameters
+    ----------
+    product_name : str
+        Name of the product.
+    met : int or float
+        MET of the product in seconds.
+    values : dict
+        Values of the product, numbers or sequences of numbers.
+    insert_time : datetime
+        Time of the write.
+
+    Returns
+    -------
+    dict
+        The item.
+    """
+    item = {
+        "product_name": product_name,
+        "met": Decimal(str(met)),
+        "insert_time": insert_time.isoformat(),
+        # Epoch seconds after which DynamoDB deletes the item
+        "expiration": int((insert_time + PRODUCT_TTL).timestamp()),
+    }
+    array_types = {}
+    for name, value in values.items():
+        if isinstance(value, (int, float, Decimal)):
+            item[name] = Decimal(str(value))
+        elif isinstance(value, str):
+            item[name] = value
+        else:
+            item[name] = encode_array(value)
+            array_types[name] = FLOAT_TYPE
+    if array_types:
+        item["array_types"] = array_types
+    return item
+
+
+def decode_item(item):
+    """Get the values of a product from its item.
+
+    Parameters
+    ----------
+    item : dict
+        The algorithm table item.
+
+    Returns
+    -------
+    dict
+        The item with numbers as floats and arrays as lists of floats.
+    """
+    array_types = item.get("array_types", {})
+    product = {}
+    for name, value in item.items():
+        if name == "array_types":
+            continue
+        if name in array_types:
+            # boto3 wraps binary attributes in Binary
+            data = getattr(value, "value", value)
+            product[name] = decode_array(data, array_types[name])
+        elif isinstance(value, Decimal):
+            integral = value == value.to_integral_value()
+            product[name] = int(value) if integral else float(value)
+        else:
+            product[name] = value
+    return product
+
+
+class ProductWriter:
+    """Buffer algorithm products and write them in batches."""
+
+    def __init__(self, algorithm_table, flush_seconds=FLUSH_SECONDS):
+        """Create an empty buffer.
+
+        Parameters
+        ----------
+        algorithm_table : boto3 DynamoDB Table
+            The algorithm table.
+        flush_seconds : float, optional
+            Seconds products are buffered before they are written.
+        """
+        self.algorithm_table = algorithm_table
+        self.flush_seconds = flush_seconds
+        # Buffered products by product name and MET
+        self.products = {}
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        """Use the writer as a context manager, flushing on exit."""
+        return self
+
+    def __exit__(self, *args):
+        """Write the remaining products."""
+        self.flush()
+
+    def add(self, product_name, met, values):
+        """Buffer a product, writing the buffer if the interval has passed.
+
+        Parameters
+        ----------
+        product_name : str
+            Name of the product.
+        met : int or float
+            MET of the product in seconds.
+        values : dict
+            Values of the product, numbers or sequences of numbers.
+        """
+        self.products[(product_name, met)] = values
+        if time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered products.
+
+        Returns
+        -------
+        int
+            Number of products written.
+        """
+        products, self.products = self.products, {}
+        self.last_flush = time.monotonic()
+        if not products:
+            return 0
+        insert_time = datetime.now(timezone.utc)
+        with self.algorithm_table.batch_writer() as batch:
+            for (product_name, met), values in products.items():
+                batch.put_item(Item=get_item(product_name, met, values, insert_time))
+        logger.info(f"Wrote {len(products)} products")
+        return len(products)
+
+
+def scan_products(algorithm_table, start, end):
+    """Get the products inserted within a time range.
+
+    The table only holds the last few days of products, so a scan stays
+    small.
+
+    Parameters
+    ----------
+    algorithm_table : boto3 DynamoDB Table
+        The algorithm table.
+    start : datetime
+        Start of the time range.
+    end : datetime
+        End of the time range (exclusive).
+
+    Returns
+    -------
+    dict
+        The decoded products of each product name, sorted by MET.
+    """
+    scan = {
+        "FilterExpression": Attr("insert_time").gte(start.isoformat())
+        & Attr("insert_time").lt(end.isoformat())
+    }
+    products = defaultdict(list)
+    while True:
+        response = algorithm_table.scan(**scan)
+        for item in response["Items"]:
+            products[item["product_name"]].append(decode_item(item))
+        if "LastEvaluatedKey" not in response:
+            break
+        scan["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    for rows in products.values():
+        rows.sort(key=lambda row: row["met"])
+    return products
+
+
+def compact_products(algorithm_table, s3_client, bucket, day):
+    """Write the products of a day to Parquet files in S3.
+
+    Parameters
+    ----------
+    algorithm_table : boto3 DynamoDB Table
+        The algorithm table.
+    s3_client : boto3 S3 client
+        Client of the bucket.
+    bucket : str
+        The bucket of the Parquet files.
+    day : datetime
+        Start of the day (UTC).
+
+    Returns
+    -------
+    list of str
+        S3 keys of the Parquet files, one per product.
+    """
+    # Only available in the compaction lambda, through the AWS SDK for
+    # pandas layer
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    keys = []
+    products = scan_products(algorithm_table, day, day + timedelta(days=1))
+    for product_name, rows in sorted(products.items()):
+        for row in rows:
+            # Identical within a file
+            del row["product_name"], row["expiration"]
+        buffer = io.BytesIO()
+        pq.write_table(pa.Table.from_pylist(rows), buffer, compression="zstd")
+        key = (
+            f"products/{product_name}/{day:%Y/%m}/"
+            f"imap_ialirt_{product_name}_{day:%Y%m%d}.parquet"
+        )
+        s3_client.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+        logger.info(f"Compacted {len(rows)} {product_name} products to {key}")
+        keys.append(key)
+    return keys
+
+
+def compaction_handler(event, context):
+    """Compact the products of the previous day.
+
+    This function is the handler of the daily compaction schedule.
+
+    Parameters
+    ----------
+    event : dict
+        The JSON formatted document of the schedule. A "day" (YYYYMMDD)
+        can be given to compact another day.
+    context : LambdaContext
+        This object provides methods and properties that provide
+        information about the invocation, function,
+        and runtime environment.
+
+    """
+    logger.info("Received event: %s", json.dumps(event))
+
+    if "day" in event:
+        day = datetime.strptime(event["day"], "%Y%m%d").replace(tzinfo=timezone.utc)
+    else:
+        today = datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        day = today - timedelta(days=1)
+
+    algorithm_table = boto3.resource("dynamodb").Table(os.environ["ALGORITHM_TABLE"])
+    keys = compact_products(
+        algorithm_table, boto3.client("s3"), os.environ["S3_BUCKET"], day
+    )
+    return {"statusCode": 200, "body": json.dumps(keys)}
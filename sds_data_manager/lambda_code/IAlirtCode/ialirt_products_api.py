@@ -0,0 +1,319 @@
+"""Define lambda to serve the I-ALiRT products.
+
+``GET /ialirt?product_name=<name>&latest=<N>`` returns the latest N products
+and ``GET /ialirt?product_name=<name>&start_met=<MET>&end_met=<MET>`` the
+products of a time range, sorted by MET. With ``format=columnar`` the
+products are returned as one list per value instead of one object per
+product::
+
+    {"met": [123, 124], "flux": [[1.0, 2.0], [1.5, 2.5]], ...}
+
+Space weather clients poll every second or so. Responses are cached in the
+lambda for ``CACHE_SECONDS``, so the polling of many clients costs one query
+per cache period. Responses carry an ``ETag`` made of the full-precision
+insert time of their newest product and the number of products. A client
+sending it back as ``If-None-Match`` gets an empty 304 response until the
+products change. The insert time is also sent as ``Last-Modified``,
+truncated to the second of HTTP dates, and ``If-Modified-Since`` gets a 304
+response unless the newest product is from a later second. Products written
+within the same second are only told apart by the ``ETag``.
+"""
+
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from email.utils import format_datetime, parsedate_to_datetime
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+from .ialirt_products import decode_item
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Seconds a query result is served from the cache of the lambda
+CACHE_SECONDS = 2
+# Largest number of latest products of a request
+MAX_LATEST = 1000
+# Longest time range of a request, in seconds of MET
+MAX_TIME_RANGE = 24 * 60 * 60
+# Item attributes that are not returned
+HIDDEN_ATTRIBUTES = ("expiration",)
+
+# Query results of this lambda, by query, with the time they were loaded
+_cache = {}
+
+
+def _response(status_code, body, headers=None):
+    """Format an API response.
+
+    Parameters
+    ----------
+    status_code : int
+        HTTP status code.
+    body : object
+        JSON serializable body, None for an empty body.
+    headers : dict, optional
+        Additional headers.
+
+    Returns
+    -------
+    dict
+        The response.
+    """
+    return {
+        "statusCode": status_code,
+        "body": json.dumps(body) if body is not None else "",
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",  # Allow CORS
+            **(headers or {}),
+        },
+    }
+
+
+def query_latest(algorithm_table, product_name, latest):
+    """Query the latest products of a product name.
+
+    Parameters
+    ----------
+    algorithm_table : boto3 DynamoDB Table
+        The algorithm table.
+    product_name : str
+        Name of the products.
+    latest : int
+        Number of products.
+
+    Returns
+    -------
+    list of dict
+        The items, sorted by MET.
+    """
+    response = algorithm_table.query(
+        KeyConditionExpression=Key("product_name").eq(product_name),
+        # Newest first, a single page as the number of items is limited
+        ScanIndexForward=False,
+        Limit=latest,
+    )
+    return response["Items"][::-1]
+
+
+def query_time_range(algorithm_table, product_name, start_met, end_met):
+    """Query the products of a product name within a time range.
+
+    Parameters
+    ----------
+    algorithm_table : boto3 DynamoDB Table
+        The algorithm table.
+    product_name : str
+        Name of the products.
+    start_met : float
+        Start of the time range, MET in seconds.
+    end_met : float
+        End of the time range (inclusive), MET in seconds.
+
+    Returns
+    -------
+    list of dict
+        The items, sorted by MET.
+    """
+    query = {
+        "KeyConditionExpression": Key("product_name").eq(product_name)
+        & Key("met").between(Decimal(str(start_met)), Decimal(str(end_met)))
+    }
+    items = []
+    while True:
+        response = algorithm_table.query(**query)
+        items += response["Items"]
+        if "LastEvaluatedKey" not in response:
+            return items
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def get_products(query, *args):
+    """Get the products of a query, from the cache if it is recent.
+
+    Parameters
+    ----------
+    query : callable
+        ``query_latest`` or ``query_time_range``.
+    *args : tuple
+        Arguments of the query after the table.
+
+    Returns
+    -------
+    tuple
+        The decoded products and the insert time of the newest one (None if
+        there are no products).
+    """
+    key = (query.__name__, *args)
+    cached = _cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < CACHE_SECONDS:
+        return cached[1:]
+
+    algorithm_table = boto3.resource("dynamodb").Table(os.environ["ALGORITHM_TABLE"])
+    products = []
+    for item in query(algorithm_table, *args):
+        product = decode_item(item)
+        for name in HIDDEN_ATTRIBUTES:
+            product.pop(name, None)
+        products.append(product)
+    insert_times = [product["insert_time"] for product in products]
+    last_modified = datetime.fromisoformat(max(insert_times)) if products else None
+
+    now = time.monotonic()
+    # Forget the expired results, the queries of the clients vary
+    for expired in [k for k, v in _cache.items() if now - v[0] >= CACHE_SECONDS]:
+        del _cache[expired]
+    _cache[key] = (now, products, last_modified)
+    return products, last_modified
+
+
+def to_columns(products):
+    """Get products as one list per value.
+
+    Parameters
+    ----------
+    products : list of dict
+        The products.
+
+    Returns
+    -------
+    dict
+        The list of each value, None where a product has no such value.
+    """
+    names = dict.fromkeys(name for product in products for name in product)
+    return {name: [product.get(name) for product in products] for name in names}
+
+
+def _get_header(event, name):
+    """Get a request header, whatever its case."""
+    headers = event.get("headers") or {}
+    for header, value in headers.items():
+        if header.lower() == name.lower():
+            return value
+    return None
+
+
+def _is_modified(event, last_modified, etag):
+    """Check the conditional headers of a request.
+
+    ``If-None-Match`` takes precedence over ``If-Modified-Since``, as in
+    RFC 9110.
+
+    Parameters
+    ----------
+    event : dict
+        The request.
+    last_modified : datetime
+        Insert time of the newest product, full precision.
+    etag : str
+        Entity tag of the products.
+
+    Returns
+    -------
+    bool
+        False if the client already has the products.
+    """
+    if_none_match = _get_header(event, "If-None-Match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag not in tags and "*" not in tags
+
+    if_modified_since = _get_header(event, "If-Modified-Since")
+    if if_modified_since is None:
+        return True
+    try:
+        modified_since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        # Invalid dates are ignored
+        return True
+    if modified_since.tzinfo is None:
+        # Dates with a -0000 zone are UTC as well
+        modified_since = modified_since.replace(tzinfo=timezone.utc)
+    # Compared to the second, as in the Last-Modified header, so a client
+    # sending its Last-Modified back gets a 304
+    return last_modified.replace(microsecond=0) > modified_since
+
+
+def _parse_params(query_params):
+    """Get the query of the request parameters.
+
+    Parameters
+    ----------
+    query_params : dict
+        The query string parameters.
+
+    Returns
+    -------
+    tuple
+        The query function and its arguments after the table.
+    """
+    product_name = query_params["product_name"]
+    if "latest" in query_params:
+        latest = int(query_params["latest"])
+        if not 0 < latest <= MAX_LATEST:
+            raise ValueError(f"latest must be between 1 and {MAX_LATEST}")
+        return query_latest, product_name, latest
+
+    start_met = float(query_params["start_met"])
+    end_met = float(query_params["end_met"])
+    if not 0 <= end_met - start_met <= MAX_TIME_RANGE:
+        raise ValueError(
+            "end_met must be after start_met and at most "
+            f"{MAX_TIME_RANGE} seconds later"
+        )
+    return query_time_range, product_name, start_met, end_met
+
+
+def lambda_handler(event, context):
+    """Return the latest products, or the products of a time range.
+
+    Parameters
+    ----------
+    event : dict
+        The JSON formatted document with the data required for the
+        lambda function to process
+    context : LambdaContext
+        This object provides methods and properties that provide
+        information about the invocation, function,
+        and runtime environment.
+
+    Returns
+    -------
+    dict
+        The products, a list of products or a list per value.
+    """
+    logger.info(f"Event: {event}")
+    query_params = event.get("queryStringParameters") or {}
+
+    output_format = query_params.get("format", "json")
+    if output_format not in ("json", "columnar"):
+        return _response(400, "format must be json or columnar")
+    try:
+        query, *args = _parse_params(query_params)
+    except KeyError:
+        return _response(
+            400, "product_name and either latest or start_met and end_met are required"
+        )
+    except ValueError as error:
+        return _response(400, str(error))
+
+    products, last_modified = get_products(query, *args)
+    headers = {"Cache-Control": f"max-age={CACHE_SECONDS}"}
+    if last_modified is not None:
+        etag = f'"{last_modified:%Y%m%dT%H%M%S.%f}-{len(products)}"'
+        headers["ETag"] = etag
+        # HTTP dates have a resolution of a second
+        headers["Last-Modified"] = format_datetime(
+            last_modified.replace(microsecond=0), usegmt=True
+        )
+        if not _is_modified(event, last_modified, etag):
+            return _response(304, None, headers)
+
+    body = to_columns(products) if output_format == "columnar" else products
+    return _response(200, body, headers)
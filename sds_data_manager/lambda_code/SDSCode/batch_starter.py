@@ -2,14 +2,18 @@
 
 import json
 import logging
-from datetime import datetime
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
 
 import boto3
+import botocore
 from imap_data_access import ScienceFilePath
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
 
-from . import dependency_config
+from . import dependency_config, repointing, spice_registry
 from .database import database as db
 from .database import models
 
@@ -20,6 +24,16 @@ logger.setLevel(logging.INFO)
 # Create a batch client
 BATCH_CLIENT = boto3.client("batch", region_name="us-west-2")
 
+# S3 prefix (in the data bucket) of the manifests read by the processing jobs.
+# Array job manifests are at the top level, input manifests under "inputs/"
+MANIFEST_PREFIX = "batch-manifests"
+# Keys of the upstream dependencies passed to the jobs as --dependency
+DEPENDENCY_KEYS = ("instrument", "data_level", "descriptor", "start_date", "version")
+
+# Queues of the Fargate and the EC2 (heavy job) compute environments
+JOB_QUEUE = "ProcessingJobQueue"
+HEAVY_JOB_QUEUE = "HeavyProcessingJobQueue"
+
 
 def get_dependencies(node, direction, relationship):
     """Lookup the dependencies for the given ``node``.
@@ -130,10 +144,14 @@ def get_downstream_dependencies(session, filename_components):
         #  of each downstream_dependent.
         dependent["version"] = filename_components["version"]  # placeholder
 
-        # TODO: add repointing table query if dependent is ENA or GLOWS
-        # Use start_date to query repointing table.
-        # Add pointing number to dependent.
         dependent["start_date"] = filename_components["start_date"]
+        # ENA and GLOWS products are per pointing
+        if dependent["instrument"] in repointing.POINTING_INSTRUMENTS:
+            dependent["repointing"] = repointing.get_day_repointing(
+                session,
+                dependent["instrument"],
+                datetime.strptime(dependent["start_date"], "%Y%m%d"),
+            )
 
     return downstream_dependents
 
@@ -187,12 +205,13 @@ def is_job_in_processing_table(
     return False
 
 
-def try_to_submit_job(session, job_info):
-    """Try to submit a batch job with the given job information.
+def get_ready_job(session, job_info):
+    """Check whether a job is ready and record it in the processing table.
 
     Go through the job information to retrieve all necessary input files
     (upstream dependencies). If any are missing, return. If we have
-    all the necessary input files, submit the job to the batch queue.
+    all the necessary input files, write the job as INPROGRESS to the
+    processing table so that it can be submitted to the batch queue.
 
     Parameters
     ----------
@@ -203,8 +222,9 @@ def try_to_submit_job(session, job_info):
 
     Returns
     -------
-    bool
-        Whether or not this job is ready to be processed.
+    tuple or None
+        The ``(processing_job, upstream_dependencies)`` of the job if it is
+        ready to be processed, None otherwise.
     """
     instrument = job_info["instrument"]
     data_level = job_info["data_level"]
@@ -266,6 +286,7 @@ def try_to_submit_job(session, job_info):
                 f"{upstream_version}"
             )
             return  # Exit the loop early as we already found a missing dependency
+        upstream_dependency["file_path"] = record.file_path
     logger.info(f"All dependencies found for the job: {job_info}")
 
     # All of our upstream requirements have been met.
@@ -279,6 +300,7 @@ def try_to_submit_job(session, job_info):
         descriptor=descriptor,
         start_date=datetime.strptime(start_date, "%Y%m%d"),
         version=version,
+        repointing=job_info.get("repointing"),
     )
 
     try:
@@ -292,14 +314,220 @@ def try_to_submit_job(session, job_info):
         f"Wrote job INPROGRESS to Processing Jobs Table with id: {processing_job.id}"
     )
 
-    # FYI, these are the keys the upstream_dependencies should contain:
-    # {
-    #     'instrument': 'swe',
-    #     'data_level': 'l0',
-    #     'descriptor': 'lveng-hk',
-    #     'start_date': '20231212',
-    #     'version': 'v001',
-    # },
+    return processing_job, upstream_dependencies
+
+
+def try_to_submit_job(session, job_info):
+    """Try to submit a batch job with the given job information.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    job_info : dict
+        Dictionary containing components with dates and versions appended.
+
+    Returns
+    -------
+    bool
+        Whether or not this job was ready and submitted.
+    """
+    ready_job = get_ready_job(session, job_info)
+    if ready_job is None:
+        return False
+    return submit_jobs(session, [ready_job]) == 1
+
+
+def get_job_definition(instrument, data_level):
+    """Get the name of the batch job definition for a data product.
+
+    Parameters
+    ----------
+    instrument : str
+        Instrument name.
+    data_level : str
+        Data level.
+
+    Returns
+    -------
+    str
+        Job definition name. Eg. "ProcessingJob-swe" or "ProcessingJob-swe-l3"
+    """
+    step = "-l3" if data_level >= "l3" else ""
+    return f"ProcessingJob-{instrument}{step}"
+
+
+def get_job_queue(job_definition):
+    """Get the batch job queue to submit a job definition to.
+
+    Heavy job definitions, listed in the ``HEAVY_JOB_DEFINITIONS``
+    environment variable, run in the EC2 compute environments.
+
+    Parameters
+    ----------
+    job_definition : str
+        Job definition name.
+
+    Returns
+    -------
+    str
+        Job queue name.
+    """
+    heavy_job_definitions = os.getenv("HEAVY_JOB_DEFINITIONS", "").split(",")
+    if job_definition in heavy_job_definitions:
+        return HEAVY_JOB_QUEUE
+    return JOB_QUEUE
+
+
+def get_job_name(processing_job):
+    """Get the batch job name of a processing job.
+
+    NOTE: The batch job name should contain only alphanumeric characters and
+    hyphens. Eg. "codice-l1a-sci-job-1". The ``processing_job.id`` is used
+    later for updating the job processing table.
+
+    Parameters
+    ----------
+    processing_job : models.ProcessingJob
+        The processing table record for this job.
+
+    Returns
+    -------
+    str
+        Job name.
+    """
+    return (
+        f"{processing_job.instrument}-{processing_job.data_level}-"
+        f"{processing_job.descriptor}-job-{processing_job.id}"
+    )
+
+
+def write_input_manifest(processing_job, upstream_dependencies):
+    """Write the resolved input files of a job to a JSON manifest in S3.
+
+    The manifest lists the concrete file path, size and ETag of every input,
+    so the job can fetch (and verify) all of its inputs directly instead of
+    looking them up through the query API, the metakernel of the SPICE
+    kernels covering the job and its pointing number, if any. Eg.
+
+    {"inputs":[{"instrument":"swe","data_level":"l0","descriptor":"raw",
+    "start_date":"20231212","version":"v001",
+    "file_path":"imap/swe/l0/2023/12/imap_swe_l0_raw_20231212_v001.pkts",
+    "size":1024,"etag":"d41d8cd98f00b204e9800998ecf8427e"}],
+    "metakernel":"s3://sds-data/batch-manifests/metakernels/swe-l1a-sci-job-1.tm",
+    "repointing":null}
+
+    Parameters
+    ----------
+    processing_job : models.ProcessingJob
+        The processing table record for this job.
+    upstream_dependencies : list of dict
+        The upstream dependencies of the job, each containing the
+        instrument, data_level, descriptor, start_date, version and
+        file_path keys.
+
+    Returns
+    -------
+    str
+        S3 URI of the manifest.
+    """
+    bucket = os.getenv("S3_BUCKET")
+    s3_client = boto3.client("s3")
+
+    inputs = []
+    for upstream_dependency in upstream_dependencies:
+        try:
+            response = s3_client.head_object(
+                Bucket=bucket, Key=upstream_dependency["file_path"]
+            )
+            size = response["ContentLength"]
+            etag = response["ETag"].strip('"')
+        except botocore.exceptions.ClientError:
+            logger.warning(
+                f"Could not get the size of {upstream_dependency['file_path']}"
+            )
+            size = etag = None
+        inputs.append({**upstream_dependency, "size": size, "etag": etag})
+
+    manifest = {
+        "inputs": inputs,
+        "metakernel": write_metakernel(processing_job),
+        "repointing": processing_job.repointing,
+    }
+    manifest_key = f"{MANIFEST_PREFIX}/inputs/{get_job_name(processing_job)}.json"
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=manifest_key,
+        Body=json.dumps(manifest, separators=(",", ":")),
+        ContentType="application/json",
+    )
+    return f"s3://{bucket}/{manifest_key}"
+
+
+def write_metakernel(processing_job):
+    """Write a metakernel of the SPICE kernels covering a job's day to S3.
+
+    Parameters
+    ----------
+    processing_job : models.ProcessingJob
+        The processing table record for this job.
+
+    Returns
+    -------
+    str or None
+        S3 URI of the metakernel, None if no kernels are registered.
+    """
+    session = object_session(processing_job)
+    if session is None:
+        return None
+    start = processing_job.start_date
+    kernels = spice_registry.resolve_kernels(session, start, start + timedelta(days=1))
+    if not kernels:
+        return None
+
+    bucket = os.getenv("S3_BUCKET")
+    metakernel_key = f"{MANIFEST_PREFIX}/metakernels/{get_job_name(processing_job)}.tm"
+    boto3.client("s3").put_object(
+        Bucket=bucket,
+        Key=metakernel_key,
+        Body=spice_registry.get_metakernel(kernels),
+        ContentType="text/plain",
+    )
+    return f"s3://{bucket}/{metakernel_key}"
+
+
+def get_batch_command(processing_job, upstream_dependencies, input_manifest):
+    """Create the container command for a processing job.
+
+    The container receives the location of the input manifest of the job,
+    and the upstream dependencies as ``--dependency`` for the containers that
+    do not read the manifest yet.
+
+    Parameters
+    ----------
+    processing_job : models.ProcessingJob
+        The processing table record for this job.
+    upstream_dependencies : list of dict
+        The upstream dependencies of the job, each containing the
+        instrument, data_level, descriptor, start_date and version keys.
+    input_manifest : str
+        S3 URI of the input manifest of the job.
+
+    Returns
+    -------
+    list of str
+        Container command.
+    """
+    instrument = processing_job.instrument
+    data_level = processing_job.data_level
+    descriptor = processing_job.descriptor
+    start_date = processing_job.start_date.strftime("%Y%m%d")
+    version = processing_job.version
+    dependencies = [
+        {key: dependency[key] for key in DEPENDENCY_KEYS}
+        for dependency in upstream_dependencies
+    ]
+
     batch_command = [
         "--instrument",
         instrument,
@@ -312,19 +540,38 @@ def try_to_submit_job(session, job_info):
         "--version",
         version,
         "--dependency",
-        f"{upstream_dependencies}",
+        json.dumps(dependencies),
+        "--dependency-manifest",
+        input_manifest,
         "--upload-to-sdc",
     ]
+    return batch_command
+
 
-    # NOTE: The batch job name should contain only alphanumeric characters and hyphens
-    # Eg. "codice-l1a-sci-job-1"
-    # The `processing_job.id` is used later for updating the job processing table
-    job_name = f"{instrument}-{data_level}-{descriptor}-job-{processing_job.id}"
+def submit_job(processing_job, upstream_dependencies):
+    """Submit a processing job to the batch queue.
+
+    Parameters
+    ----------
+    processing_job : models.ProcessingJob
+        The processing table record for this job. The record must already
+        be committed so that its ``id`` can be put into the job name.
+    upstream_dependencies : list of dict
+        The upstream dependencies of the job, each containing the
+        instrument, data_level, descriptor, start_date and version keys.
+    """
+    input_manifest = write_input_manifest(processing_job, upstream_dependencies)
+    batch_command = get_batch_command(
+        processing_job, upstream_dependencies, input_manifest
+    )
+
+    job_name = get_job_name(processing_job)
     # Get the necessary AWS information
     # NOTE: These are here for easier mocking in tests rather than at the module level
-    step = "-l3" if data_level >= "l3" else ""
-    job_definition = f"ProcessingJob-{instrument}{step}"
-    job_queue = "ProcessingJobQueue"
+    job_definition = get_job_definition(
+        processing_job.instrument, processing_job.data_level
+    )
+    job_queue = get_job_queue(job_definition)
     BATCH_CLIENT.submit_job(
         jobName=job_name,
         jobQueue=job_queue,
@@ -336,12 +583,125 @@ def try_to_submit_job(session, job_info):
     logger.info(f"Submitted job {job_name} with this command: {batch_command}")
 
 
+def submit_array_job(session, ready_jobs):
+    """Submit a group of jobs sharing a job definition as one batch array job.
+
+    The container command of each child job is written to a manifest in S3,
+    and every child receives only the manifest location. A child picks its
+    own command out of the manifest using the ``AWS_BATCH_JOB_ARRAY_INDEX``
+    environment variable that batch sets. The child job ids ("<parent>:<index>")
+    are stored in the processing table so the indexer can map the status of
+    each child back to its own record.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    ready_jobs : list of tuple
+        ``(processing_job, upstream_dependencies)`` of each job, all of
+        which must use the same job definition.
+    """
+    first_job = ready_jobs[0][0]
+    job_definition = get_job_definition(first_job.instrument, first_job.data_level)
+    job_queue = get_job_queue(job_definition)
+    job_name = f"{first_job.instrument}-{first_job.data_level}-array-job-{first_job.id}"
+
+    manifest = {
+        "jobs": [
+            {
+                "processing_job_id": processing_job.id,
+                "command": get_batch_command(
+                    processing_job,
+                    upstream_dependencies,
+                    write_input_manifest(processing_job, upstream_dependencies),
+                ),
+            }
+            for processing_job, upstream_dependencies in ready_jobs
+        ]
+    }
+    bucket = os.getenv("S3_BUCKET")
+    manifest_key = f"{MANIFEST_PREFIX}/{job_name}.json"
+    boto3.client("s3").put_object(
+        Bucket=bucket, Key=manifest_key, Body=json.dumps(manifest)
+    )
+
+    response = BATCH_CLIENT.submit_job(
+        jobName=job_name,
+        jobQueue=job_queue,
+        jobDefinition=job_definition,
+        arrayProperties={"size": len(ready_jobs)},
+        containerOverrides={
+            "command": ["--array-manifest", f"s3://{bucket}/{manifest_key}"],
+        },
+    )
+
+    for index, (processing_job, _) in enumerate(ready_jobs):
+        processing_job.batch_job_id = f"{response['jobId']}:{index}"
+    session.commit()
+    logger.info(
+        f"Submitted array job {job_name} of size {len(ready_jobs)} "
+        f"with manifest s3://{bucket}/{manifest_key}"
+    )
+
+
+def submit_jobs(session, ready_jobs):
+    """Submit ready jobs, grouping homogeneous jobs into array jobs.
+
+    Jobs that share a job definition (eg. the same instrument and level with
+    different descriptors or dates) are submitted together as a single array
+    job, which avoids a separate submission and container start-up per job.
+
+    The jobs are already INPROGRESS in the processing table. If writing their
+    manifests or submitting them fails, they are marked FAILED so that they
+    do not block a later submission of the same jobs.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    ready_jobs : list of tuple
+        ``(processing_job, upstream_dependencies)`` of each job.
+
+    Returns
+    -------
+    int
+        Number of jobs submitted.
+    """
+    groups = defaultdict(list)
+    for processing_job, upstream_dependencies in ready_jobs:
+        job_definition = get_job_definition(
+            processing_job.instrument, processing_job.data_level
+        )
+        groups[job_definition].append((processing_job, upstream_dependencies))
+
+    submitted = 0
+    for group in groups.values():
+        try:
+            # Batch array jobs must have at least two children
+            if len(group) == 1:
+                submit_job(*group[0])
+            else:
+                submit_array_job(session, group)
+        except Exception:
+            logger.exception(f"Failed to submit {len(group)} jobs, marking FAILED")
+            session.rollback()
+            for processing_job, _ in group:
+                processing_job.status = models.Status.FAILED
+            session.commit()
+            continue
+        submitted += len(group)
+    return submitted
+
+
 def lambda_handler(events: dict, context):
     """Lambda handler."""
     logger.info(f"Events: {events}")
     logger.info(f"Context: {context}")
 
     with db.Session() as session:
+        # Jobs from all of the events are collected before submitting them,
+        # so that homogeneous jobs can be grouped into array jobs.
+        ready_jobs = []
         # Since the SQS events can be batched together, we need to loop through
         # each event. In this loop, "event" represents one file landing.
         for event in events["Records"]:
@@ -360,4 +720,8 @@ def lambda_handler(events: dict, context):
             )
 
             for job in potential_jobs:
-                try_to_submit_job(session, job)
+                ready_job = get_ready_job(session, job)
+                if ready_job is not None:
+                    ready_jobs.append(ready_job)
+
+        submit_jobs(session, ready_jobs)
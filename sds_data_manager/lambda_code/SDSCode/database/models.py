@@ -11,12 +11,14 @@ from sqlalchemy import (
     Boolean,
     Column,
     DateTime,
+    Float,
     Identity,
     Index,
     Integer,
     String,
     UniqueConstraint,
     and_,
+    func,
 )
 from sqlalchemy import (
     Enum as SqlEnum,
@@ -54,6 +56,9 @@ DEPENDENCY_RELATIONSHIPS = SqlEnum("SOFT", "HARD", name="dependency_relationship
 class Status(Enum):
     """Enum to store the status."""
 
+    # PENDING jobs have been planned (eg. by a reprocessing campaign),
+    # but have not been submitted to batch yet.
+    PENDING = "PENDING"
     INPROGRESS = "INPROGRESS"
     SUCCEEDED = "SUCCEEDED"
     FAILED = "FAILED"
@@ -74,16 +79,41 @@ class UniversalSpinTable(Base):
     __tablename__ = "universal_spin_table"
     id = Column(Integer, primary_key=True)
     spin_number = Column(Integer, nullable=False)
+    # Spin start in whole seconds of mission elapsed time (MET), plus the
+    # microseconds within that second
     spin_start_sc_time = Column(Integer, nullable=False)
+    spin_start_subsec = Column(Integer, nullable=False, default=0)
     spin_start_utc_time = Column(DateTime, nullable=False)
     star_tracker_flag = Column(Boolean, nullable=False)
+    # Spin period in milliseconds
     spin_duration = Column(Integer, nullable=False)
     thruster_firing_event = Column(Boolean, nullable=False)
     repointing = Column(Boolean, nullable=False)
-    # TODO: create table for repointing and then make
-    # a foreign key to universal_spin_table
+    # Pointing the spin belongs to, see the repointing table
     repointing_number = Column(Integer, nullable=False)
 
+    __table_args__ = (
+        Index(
+            "idx_universal_spin_table_start", "spin_start_sc_time", "spin_start_subsec"
+        ),
+    )
+
+
+class Repointing(Base):
+    """Pointings between spacecraft repointings, derived from the spin table."""
+
+    __tablename__ = "repointing"
+
+    repointing_number = Column(Integer, primary_key=True, autoincrement=False)
+    # Pointing interval, the end is exclusive
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    # Same interval in seconds of MET
+    start_sc_time = Column(Integer, nullable=False)
+    end_sc_time = Column(Integer, nullable=False)
+
+    __table_args__ = (Index("idx_repointing_time", "start_time", "end_time"),)
+
 
 class ProcessingJob(Base):
     """Track all processing jobs."""
@@ -104,7 +134,23 @@ class ProcessingJob(Base):
     job_log_stream_id = Column(String)
     container_image = Column(String)
     container_command = Column(String)
+    # Runtime of the job in seconds
     processing_time = Column(Integer)
+    # Time the job waited in the batch queue before starting, in seconds
+    queue_time = Column(Integer)
+    # Resources the job ran with
+    vcpu = Column(Float)
+    memory = Column(Integer)  # MiB
+    # Reason batch gave for stopping the job, e.g. running out of memory
+    status_reason = Column(String)
+    # Time of the last batch state change event applied to this record
+    last_event_time = Column(DateTime(timezone=True))
+    # Batch job id of the child of an array job ("<parent job id>:<index>")
+    batch_job_id = Column(String, index=True)
+    # Name of the reprocessing campaign that created this job, if any
+    campaign = Column(String, nullable=True)
+    # Pointing number of the job, for pointing-based (ENA and GLOWS) products
+    repointing = Column(Integer, nullable=True)
 
     __table_args__ = (
         # Partial unique index to ensure only one INPROGRESS or COMPLETED for a record
@@ -146,12 +192,28 @@ class SPICEFiles(Base):
     __tablename__ = "spice_files"
 
     file_path = Column(String, nullable=False, primary_key=True, unique=True)
+    # SPICE kernel type, e.g. ck, spk, lsk
+    kernel_type = Column(String, nullable=True)
+    # recon, burn, nom or pred for time-dependent kernels
+    source = Column(String, nullable=True)
+    # Coverage window, the end date is exclusive
     start_date = Column(DateTime, nullable=True)
     end_date = Column(DateTime, nullable=True)
     version = Column(String(4), nullable=True)  # vXXX
     extension = Column(String, nullable=False)
     ingestion_date = Column(DateTime(timezone=True))
 
+    __table_args__ = (
+        Index("idx_spice_files_coverage", "kernel_type", "start_date", "end_date"),
+        # GiST index of the coverage range for overlap (&&) queries
+        # NOTE: This does not work with sqllite (testing) DBs, only postgres
+        Index(
+            "idx_spice_files_coverage_range",
+            func.tsrange(start_date, end_date),
+            postgresql_using="gist",
+        ).ddl_if(dialect="postgresql"),
+    )
+
 
 class AncillaryFiles(Base):
     """Ancillary files table."""
@@ -1,13 +1,30 @@
 """Functions for supporting the indexer component of the architecture."""
 
+import io
 import json
 import logging
 import os
+import struct
 from datetime import datetime
 
 import boto3
 from imap_data_access import ScienceFilePath
-
+from sqlalchemy import (
+    DateTime,
+    Float,
+    Integer,
+    String,
+    bindparam,
+    cast,
+    column,
+    func,
+    or_,
+    select,
+    values,
+)
+from sqlalchemy import update as update_
+
+from . import repointing, spice_registry, spin_table
 from .database import database as db
 from .database import models
 from .lambda_custom_events import IMAPLambdaPutEvent
@@ -126,6 +143,54 @@ def send_event_from_indexer(filename):
     return response
 
 
+def spice_event_handler(s3_filepath):
+    """Register a SPICE kernel.
+
+    The coverage of SPK kernels is read from their segment summaries,
+    falling back to the dates in the file name.
+
+    Parameters
+    ----------
+    s3_filepath : str
+        S3 key of the kernel.
+
+    """
+    coverage = None
+    if s3_filepath.endswith(".bsp"):
+        try:
+            coverage = spice_registry.get_spk_coverage(
+                boto3.client("s3"), os.getenv("S3_BUCKET"), s3_filepath
+            )
+        except (ValueError, struct.error) as e:
+            logger.warning(f"Could not read the coverage of {s3_filepath}: {e}")
+
+    with db.Session() as session:
+        spice_registry.register_kernel(
+            session,
+            s3_filepath,
+            get_file_creation_date(s3_filepath),
+            coverage=coverage,
+        )
+
+
+def spin_event_handler(s3_filepath):
+    """Load a spin file into the universal spin table.
+
+    Parameters
+    ----------
+    s3_filepath : str
+        S3 key of the spin file.
+
+    """
+    response = boto3.client("s3").get_object(
+        Bucket=os.getenv("S3_BUCKET"), Key=s3_filepath
+    )
+    with db.Session() as session:
+        spin_table.ingest_spin_file(
+            session, io.TextIOWrapper(response["Body"], encoding="utf-8")
+        )
+
+
 def s3_event_handler(event):
     """S3 events handler.
 
@@ -148,9 +213,16 @@ def s3_event_handler(event):
     # Retrieve the Object name
     s3_filepath = event["detail"]["object"]["key"]
 
+    if s3_filepath.startswith("spice/"):
+        # Kernels are registered, they do not trigger processing
+        spice_event_handler(s3_filepath)
+        return
+    if s3_filepath.startswith("spin/"):
+        spin_event_handler(s3_filepath)
+        return
+
     filename = os.path.basename(s3_filepath)
-    # TODO: add checks for SPICE or other
-    # data types
+    # TODO: add checks for other data types
 
     # setup a dictionary of metadata parameters to unpack in the
     # ScienceFiles table. Eg.
@@ -179,6 +251,11 @@ def s3_event_handler(event):
 
     file_params["ingestion_date"] = ingestion_date_object
     with db.Session() as session, session.begin():
+        if file_params["repointing"] is None:
+            # Tag pointing-based products with the pointing of their day
+            file_params["repointing"] = repointing.get_day_repointing(
+                session, file_params["instrument"], file_params["start_date"]
+            )
         session.add(models.ScienceFiles(**file_params))
     logger.info("Wrote data to the ScienceFiles table")
 
@@ -229,14 +306,10 @@ def batch_event_handler(event):
                     "--descriptor", "sci",
                     "--start-date", "20230724",
                     "--version", "v001",
-                    "--dependency", \"""[
-                        {
-                            'instrument': 'swapi',
-                            'level': 'l0',
-                            'start_date': 20230724,
-                            'version': 'v001'
-                        }
-                    ]\""",
+                    "--dependency-manifest", (
+                        "s3://sds-data-012345678910/batch-manifests/inputs/"
+                        "swapi-l1-sci-job-1.json"
+                    ),
                     "--upload-to-sdc",
                 ],
                 "logStreamName": (
@@ -253,41 +326,308 @@ def batch_event_handler(event):
         HTTP response
 
     """
-    # Get job status
-    job_status = (
-        models.Status.SUCCEEDED
-        if event["detail"]["status"] == "SUCCEEDED"
-        else models.Status.FAILED
-    )
+    with db.Session() as session:
+        update_processing_jobs(session, [event])
+
+    return http_response(status_code=200, body="Success")
+
+
+def get_batch_event_update(event):
+    """Get the processing table update from a batch job state change event.
+
+    Parameters
+    ----------
+    event : dict
+        Batch job state change event, see ``batch_event_handler``.
+
+    Returns
+    -------
+    dict or None
+        Column values to update, with the processing table "id" or, for the
+        children of array jobs, the "batch_job_id" to identify the record.
+        None if the event does not correspond to a processing table record.
+    """
+    detail = event["detail"]
+    array_properties = detail.get("arrayProperties", {})
+    if "size" in array_properties:
+        # The parent of an array job only summarizes its children, each
+        # child sends its own event that we use to update the table.
+        logger.info("Skipping array parent job: %s", detail.get("jobName"))
+        return None
+
+    container = detail.get("container", {})
+    update = {
+        "status": (
+            models.Status.SUCCEEDED.value
+            if detail["status"] == "SUCCEEDED"
+            else models.Status.FAILED.value
+        ),
+        "job_definition": detail.get("jobDefinition"),
+        "job_log_stream_id": container.get("logStreamName"),
+        "container_image": container.get("image"),
+        "container_command": " ".join(container.get("command", [])),
+        "processing_time": None,
+        "queue_time": None,
+        "vcpu": container.get("vcpus"),
+        "memory": container.get("memory"),
+        "status_reason": container.get("reason") or detail.get("statusReason"),
+        "last_event_time": None,
+    }
+    # Fargate jobs report their resources as resource requirements
+    for requirement in container.get("resourceRequirements", []):
+        if requirement["type"] == "VCPU":
+            update["vcpu"] = float(requirement["value"])
+        elif requirement["type"] == "MEMORY":
+            update["memory"] = int(requirement["value"])
+    # createdAt, startedAt and stoppedAt are milliseconds since the epoch
+    if "startedAt" in detail and "stoppedAt" in detail:
+        update["processing_time"] = (detail["stoppedAt"] - detail["startedAt"]) // 1000
+    if "createdAt" in detail and "startedAt" in detail:
+        update["queue_time"] = (detail["startedAt"] - detail["createdAt"]) // 1000
+    if "time" in event:
+        update["last_event_time"] = datetime.strptime(
+            event["time"], "%Y-%m-%dT%H:%M:%S%z"
+        )
+
+    if "index" in array_properties:
+        # Children of array jobs share the parent's job name, but their
+        # job id ("<parent job id>:<index>") was stored at submission
+        update["batch_job_id"] = detail["jobId"]
+        return update
 
     # We injected our table ID into the job name
-    job_id = event["detail"]["jobName"].split("-")[-1]
+    job_id = detail.get("jobName", "").split("-")[-1]
+    if not job_id.isdigit():
+        logger.warning("No processing table ID in job name: %s", detail.get("jobName"))
+        return None
+    update["id"] = int(job_id)
+    return update
 
-    with db.Session() as session:
-        # Get the batch job by its ID
-        job = session.get(models.ProcessingJob, job_id)
-        # Make the updates
-        job.status = job_status
-        job.job_definition = event["detail"]["jobDefinition"]
-        job.job_log_stream_id = event["detail"]["container"]["logStreamName"]
-        job.container_image = event["detail"]["container"]["image"]
-        job.container_command = " ".join(event["detail"]["container"]["command"])
-        session.commit()
 
-    return http_response(status_code=200, body="Success")
+def update_processing_jobs(session, events):
+    """Apply a batch of job state change events to the processing table.
+
+    All of the updates are applied with a single
+    ``UPDATE ... FROM (VALUES ...)`` statement. Each event's timestamp is
+    stored with the record, and an event that is not newer than the last one
+    applied to the record is ignored, so duplicate and out-of-order deliveries
+    do not overwrite a later state. Events for records that do not exist are
+    ignored as well.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    events : list of dict
+        Batch job state change events.
+
+    Returns
+    -------
+    int
+        Number of processing table records that were updated.
+    """
+    updates = [
+        update
+        for update in (get_batch_event_update(event) for event in events)
+        if update is not None
+    ]
+
+    # Look up the table IDs of any array job children
+    batch_job_ids = [update["batch_job_id"] for update in updates if "id" not in update]
+    if batch_job_ids:
+        job_ids = dict(
+            session.execute(
+                select(
+                    models.ProcessingJob.batch_job_id, models.ProcessingJob.id
+                ).where(models.ProcessingJob.batch_job_id.in_(batch_job_ids))
+            ).all()
+        )
+        for update in updates:
+            if "id" not in update:
+                update["id"] = job_ids.get(update.pop("batch_job_id"))
+
+    # Only keep the newest update for each record
+    latest_updates = {}
+    for update in updates:
+        if update["id"] is None:
+            continue
+        previous = latest_updates.get(update["id"])
+        if previous is None or (
+            update["last_event_time"] is not None
+            and (
+                previous["last_event_time"] is None
+                or update["last_event_time"] > previous["last_event_time"]
+            )
+        ):
+            latest_updates[update["id"]] = update
+
+    if not latest_updates:
+        logger.info("No processing table records to update")
+        return 0
+
+    table = models.ProcessingJob.__table__
+    value_columns = {
+        "id": Integer,
+        "status": table.c.status.type,
+        "job_definition": String,
+        "job_log_stream_id": String,
+        "container_image": String,
+        "container_command": String,
+        "processing_time": Integer,
+        "queue_time": Integer,
+        "vcpu": Float,
+        "memory": Integer,
+        "status_reason": String,
+        "last_event_time": DateTime(timezone=True),
+    }
+    rows = [
+        {name: update[name] for name in value_columns}
+        for update in latest_updates.values()
+    ]
+
+    if session.get_bind().dialect.name == "postgresql":
+        # One UPDATE ... FROM (VALUES ...) statement for all of the records.
+        # The VALUES columns are untyped in the database, so cast them.
+        batch_updates = values(
+            *[column(name, type_) for name, type_ in value_columns.items()],
+            name="batch_updates",
+        ).data([tuple(row.values()) for row in rows])
+        new = {
+            name: cast(batch_updates.c[name], type_)
+            for name, type_ in value_columns.items()
+        }
+        result = session.execute(_get_update_statement(table, new))
+    else:
+        # SQLite (testing) does not support named VALUES columns,
+        # so bind each row to the same statement instead.
+        new = {
+            name: bindparam(f"new_{name}", type_=type_)
+            for name, type_ in value_columns.items()
+        }
+        result = session.execute(
+            _get_update_statement(table, new),
+            [{f"new_{name}": value for name, value in row.items()} for row in rows],
+        )
+    session.commit()
+    logger.info(
+        f"Updated {result.rowcount} of {len(latest_updates)} processing table records"
+    )
+    return result.rowcount
+
+
+def _get_update_statement(table, new):
+    """Get the processing table update statement for new column values.
+
+    Parameters
+    ----------
+    table : sqlalchemy.Table
+        Processing job table.
+    new : dict
+        Column expressions of the new values, by column name.
+
+    Returns
+    -------
+    sqlalchemy.Update
+        Statement that only updates a record when the new event is newer
+        than the last event applied to it.
+    """
+    return (
+        update_(table)
+        .where(
+            table.c.id == new["id"],
+            or_(
+                table.c.last_event_time.is_(None),
+                new["last_event_time"].is_(None),
+                table.c.last_event_time < new["last_event_time"],
+            ),
+        )
+        .values(
+            status=new["status"],
+            job_definition=new["job_definition"],
+            job_log_stream_id=new["job_log_stream_id"],
+            container_image=new["container_image"],
+            container_command=new["container_command"],
+            processing_time=func.coalesce(
+                new["processing_time"], table.c.processing_time
+            ),
+            queue_time=func.coalesce(new["queue_time"], table.c.queue_time),
+            vcpu=func.coalesce(new["vcpu"], table.c.vcpu),
+            memory=func.coalesce(new["memory"], table.c.memory),
+            status_reason=new["status_reason"],
+            last_event_time=new["last_event_time"],
+        )
+    )
+
+
+def sqs_event_handler(event):
+    """SQS events handler.
+
+    Batch job state change events are delivered through an SQS queue so that
+    they can be applied to the processing table in bulk.
+
+    Records that cannot be read are reported as batch item failures, so that
+    only they are retried (and eventually sent to the dead-letter queue)
+    instead of the whole batch. If the bulk update fails, every record of the
+    batch is reported.
+
+    Parameters
+    ----------
+    event : dict
+        SQS event, with one batch job state change event in the body
+        of each record.
+
+    Returns
+    -------
+    dict
+        HTTP response, with the ``batchItemFailures`` of the batch.
+
+    """
+    batch_events = []
+    message_ids = []
+    failures = []
+    for record in event["Records"]:
+        try:
+            batch_event = json.loads(record["body"])
+            if batch_event.get("source") != "aws.batch":
+                continue
+            get_batch_event_update(batch_event)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            logger.exception(f"Invalid batch event: {record['body']}")
+            failures.append(record.get("messageId"))
+            continue
+        batch_events.append(batch_event)
+        message_ids.append(record.get("messageId"))
+    logger.info(f"Received {len(batch_events)} batch events")
+
+    try:
+        with db.Session() as session:
+            update_processing_jobs(session, batch_events)
+    except Exception:
+        logger.exception("Failed to update the processing table")
+        failures += message_ids
+
+    response = http_response(status_code=200, body="Success")
+    response["batchItemFailures"] = [
+        {"itemIdentifier": message_id} for message_id in failures
+    ]
+    return response
 
 
 # Handlers mapping
 event_handlers = {
     "aws.s3": s3_event_handler,
     "aws.batch": batch_event_handler,
+    "aws:sqs": sqs_event_handler,
 }
 
 
 def handle_event(event, handler):
     """Event handling logic."""
     try:
-        handler(event)
+        response = handler(event)
+        # SQS batches report the records that failed in the response
+        if isinstance(response, dict) and "batchItemFailures" in response:
+            return response
         return http_response(status_code=200, body="Success")
     except ScienceFilePath.InvalidScienceFileError as e:
         logger.error(str(e))
@@ -298,8 +638,9 @@ def lambda_handler(event, context):
     """Create metadata and add it to the database.
 
     This function is an event handler for multiple event sources.
-    List of event sources are aws.s3, aws.batch and imap.lambda.
-    imap.lambda is custom PutEvent from AWS lambda.
+    List of event sources are aws.s3, aws.batch, aws:sqs and imap.lambda.
+    imap.lambda is custom PutEvent from AWS lambda. aws:sqs delivers
+    batches of aws.batch events.
 
     Parameters
     ----------
@@ -314,6 +655,9 @@ def lambda_handler(event, context):
     """
     logger.info("Received event: " + json.dumps(event, indent=2))
     source = event.get("source")
+    # SQS events do not have a source, only their records do
+    if "Records" in event:
+        source = event["Records"][0].get("eventSource")
 
     handler = event_handlers.get(source)
     if handler:
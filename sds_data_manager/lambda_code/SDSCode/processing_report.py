@@ -0,0 +1,346 @@
+r"""Processing time analytics and cost model from the processing table.
+
+The indexer records the runtime, the time spent waiting in the batch queue
+and the resources of every processing job. This module aggregates that
+history per product (instrument, data level, descriptor) to report runtime
+percentiles and the estimated Fargate cost, and suggests vCPU and memory
+settings for each job definition in place of the blanket values used by the
+``ProcessingConstruct``.
+
+Batch state change events do not report the memory a job actually used, so
+the suggestions are based on runtime and on jobs killed for running out of
+memory. The suggestions are keyed by job name, the same as the "jobs" of the
+processing job resource configuration, so they can be reviewed and copied
+over.
+
+This module can be run from the command line, which requires the
+``SECRET_NAME`` environment variable to point at the database credentials::
+
+    python -m sds_data_manager.lambda_code.SDSCode.processing_report \
+        --instrument hit --suggest
+"""
+
+import argparse
+import json
+import logging
+from collections import defaultdict
+
+from sqlalchemy import Integer, case, cast, func, select
+
+from . import batch_starter
+from .database import database as db
+from .database import models
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Fargate on-demand prices (us-west-2, x86) in USD per hour
+FARGATE_VCPU_HOUR_PRICE = 0.04048
+FARGATE_GB_HOUR_PRICE = 0.004445
+
+# Resources of jobs that ran before the indexer recorded them.
+# These match the job definitions in the ProcessingConstruct.
+DEFAULT_VCPU = 1
+DEFAULT_MEMORY = 4096
+
+PERCENTILES = (50, 95, 99)
+
+# Suggestions aim to keep the p95 runtime between these bounds (seconds)
+TARGET_RUNTIME = 30 * 60
+MIN_RUNTIME = 5 * 60
+
+# Valid Fargate vCPU values with their (min, max, step) memory in MiB
+FARGATE_MEMORY = {
+    0.25: (512, 2048, 512),
+    0.5: (1024, 4096, 1024),
+    1: (2048, 8192, 1024),
+    2: (4096, 16384, 1024),
+    4: (8192, 30720, 1024),
+    8: (16384, 61440, 4096),
+    16: (32768, 122880, 8192),
+}
+
+
+def get_runtime_statistics(session, instrument=None, since=None):
+    """Aggregate the processing history of each data product.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    instrument : str, optional
+        Only report on this instrument.
+    since : datetime, optional
+        Only include jobs that finished after this time.
+
+    Returns
+    -------
+    list of dict
+        One entry per (instrument, data_level, descriptor) with the number of
+        jobs and failures, runtime percentiles (p50, p95, p99) and mean queue
+        time in seconds, and the estimated cost in USD.
+    """
+    job = models.ProcessingJob
+    vcpu = func.coalesce(job.vcpu, DEFAULT_VCPU)
+    memory_gb = func.coalesce(job.memory, DEFAULT_MEMORY) / 1024.0
+    hourly_price = vcpu * FARGATE_VCPU_HOUR_PRICE + memory_gb * FARGATE_GB_HOUR_PRICE
+    group = (job.instrument, job.data_level, job.descriptor)
+
+    columns = [
+        *group,
+        func.count().label("jobs"),
+        func.sum(cast(job.status == models.Status.FAILED, Integer)).label("failed"),
+        func.avg(job.queue_time).label("mean_queue_time"),
+        # Failed jobs are billed too
+        func.sum(job.processing_time * hourly_price / 3600).label("cost"),
+    ]
+    postgres = session.get_bind().dialect.name == "postgresql"
+    if postgres:
+        # Runtime percentiles of the successful jobs
+        succeeded = job.status == models.Status.SUCCEEDED
+        columns += [
+            func.percentile_cont(percentile / 100)
+            .within_group(case((succeeded, job.processing_time)))
+            .label(f"p{percentile}")
+            for percentile in PERCENTILES
+        ]
+
+    query = select(*columns).where(job.processing_time.is_not(None)).group_by(*group)
+    if instrument is not None:
+        query = query.where(job.instrument == instrument)
+    if since is not None:
+        query = query.where(job.last_event_time >= since)
+
+    statistics = [
+        {
+            **row._asdict(),
+            "mean_queue_time": (
+                None if row.mean_queue_time is None else float(row.mean_queue_time)
+            ),
+            "cost": round(float(row.cost), 4),
+        }
+        for row in session.execute(query.order_by(*group))
+    ]
+    if not postgres:
+        # SQLite (testing) has no percentile aggregate
+        _add_percentiles(session, statistics, since)
+    return statistics
+
+
+def _add_percentiles(session, statistics, since=None):
+    """Compute the runtime percentiles of each product in Python.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    statistics : list of dict
+        Output of the aggregate query, updated in place.
+    since : datetime, optional
+        Only include jobs that finished after this time.
+    """
+    job = models.ProcessingJob
+    query = select(
+        job.instrument, job.data_level, job.descriptor, job.processing_time
+    ).where(
+        job.status == models.Status.SUCCEEDED,
+        job.processing_time.is_not(None),
+    )
+    if since is not None:
+        query = query.where(job.last_event_time >= since)
+
+    runtimes = defaultdict(list)
+    for instrument, data_level, descriptor, runtime in session.execute(query):
+        runtimes[(instrument, data_level, descriptor)].append(runtime)
+
+    for entry in statistics:
+        values = sorted(
+            runtimes[(entry["instrument"], entry["data_level"], entry["descriptor"])]
+        )
+        for percentile in PERCENTILES:
+            entry[f"p{percentile}"] = _percentile(values, percentile)
+
+
+def _percentile(values, percentile):
+    """Linearly interpolated percentile, matching postgres' percentile_cont.
+
+    Parameters
+    ----------
+    values : list of float
+        Sorted values.
+    percentile : float
+        Percentile between 0 and 100.
+
+    Returns
+    -------
+    float or None
+        The percentile, None if there are no values.
+    """
+    if not values:
+        return None
+    position = (len(values) - 1) * percentile / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def get_job_resources(session):
+    """Get the resources and out of memory failures of each job definition.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+
+    Returns
+    -------
+    dict
+        Maximum vCPU and memory (MiB) the jobs ran with, and the number of
+        jobs killed for running out of memory, keyed by
+        (instrument, data_level).
+    """
+    job = models.ProcessingJob
+    query = select(
+        job.instrument,
+        job.data_level,
+        func.max(func.coalesce(job.vcpu, DEFAULT_VCPU)).label("vcpu"),
+        func.max(func.coalesce(job.memory, DEFAULT_MEMORY)).label("memory"),
+        func.sum(cast(job.status_reason.like("%OutOfMemory%"), Integer)).label(
+            "out_of_memory"
+        ),
+    ).group_by(job.instrument, job.data_level)
+    return {
+        (row.instrument, row.data_level): row._asdict()
+        for row in session.execute(query)
+    }
+
+
+def suggest_resources(vcpu, memory, p95_runtime, out_of_memory):
+    """Suggest the vCPU and memory of a job.
+
+    Memory is doubled when jobs ran out of it. The number of vCPUs is scaled
+    so the p95 runtime would fall under ``TARGET_RUNTIME``, assuming the
+    processing scales with the number of vCPUs, and halved when the jobs
+    finish in under ``MIN_RUNTIME``. The result is a valid Fargate size.
+
+    Parameters
+    ----------
+    vcpu : float
+        Current number of vCPUs.
+    memory : int
+        Current memory in MiB.
+    p95_runtime : float or None
+        95th percentile runtime in seconds.
+    out_of_memory : int
+        Number of jobs that ran out of memory.
+
+    Returns
+    -------
+    dict
+        Suggested "vcpu" and "memory" (MiB).
+    """
+    if out_of_memory:
+        memory *= 2
+
+    if p95_runtime is not None:
+        if p95_runtime > TARGET_RUNTIME:
+            vcpu = vcpu * p95_runtime / TARGET_RUNTIME
+        elif p95_runtime < MIN_RUNTIME:
+            vcpu = vcpu / 2
+
+    # Round up to the nearest Fargate vCPU that supports the memory
+    sizes = sorted(FARGATE_MEMORY)
+    vcpu = next(
+        (size for size in sizes if size >= vcpu and FARGATE_MEMORY[size][1] >= memory),
+        sizes[-1],
+    )
+    min_memory, max_memory, step = FARGATE_MEMORY[vcpu]
+    memory = min(max(memory, min_memory), max_memory)
+    # Round up to a valid memory step
+    memory = min_memory + -(-(memory - min_memory) // step) * step
+    return {"vcpu": vcpu, "memory": memory}
+
+
+def get_resource_suggestions(session, statistics=None):
+    """Suggest the vCPU and memory of each job definition.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    statistics : list of dict, optional
+        Output of ``get_runtime_statistics``, queried if not given.
+
+    Returns
+    -------
+    dict
+        Suggested "vcpu" and "memory" (MiB), keyed by job name, e.g. "hit"
+        for the "ProcessingJob-hit" job definition.
+        Products that share a job definition get the largest suggestion.
+    """
+    if statistics is None:
+        statistics = get_runtime_statistics(session)
+    resources = get_job_resources(session)
+
+    # The slowest descriptor decides for its data level
+    p95_runtimes = defaultdict(lambda: None)
+    for entry in statistics:
+        key = (entry["instrument"], entry["data_level"])
+        if entry["p95"] is not None:
+            p95_runtimes[key] = max(entry["p95"], p95_runtimes[key] or 0)
+
+    suggestions = {}
+    for (instrument, data_level), resource in resources.items():
+        suggestion = suggest_resources(
+            resource["vcpu"],
+            resource["memory"],
+            p95_runtimes[(instrument, data_level)],
+            resource["out_of_memory"],
+        )
+        name = batch_starter.get_job_definition(instrument, data_level).removeprefix(
+            "ProcessingJob-"
+        )
+        current = suggestions.get(name, {"vcpu": 0, "memory": 0})
+        suggestions[name] = {
+            "vcpu": max(current["vcpu"], suggestion["vcpu"]),
+            "memory": max(current["memory"], suggestion["memory"]),
+        }
+    return suggestions
+
+
+def _parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        An object containing the parsed arguments and their values
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="processing_report",
+        description="Report IMAP processing times and estimated costs.",
+    )
+    parser.add_argument("--instrument", type=str, help="Instrument to report on.")
+    parser.add_argument(
+        "--suggest",
+        action="store_true",
+        help="Also suggest the vCPU and memory of each job definition.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Print the processing report from the command line."""
+    args = _parse_args()
+    with db.Session() as session:
+        statistics = get_runtime_statistics(session, instrument=args.instrument)
+        result = {"statistics": statistics}
+        if args.suggest:
+            result["suggestions"] = get_resource_suggestions(session, statistics)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Derive the repointing table and look up pointing numbers.
+
+IMAP repoints about once a day. The spins of the universal spin table are
+flagged while the spacecraft repoints, and carry the number of the pointing
+they belong to. After spins are loaded, the pointings they touched are
+recomputed from all of their spins: a pointing starts with its first spin
+outside of a repointing and ends with the end of its last one.
+
+Files and jobs of the pointing-based products (ENA and GLOWS) are tagged
+with the number of the pointing covering most of their day, as pointings
+cross midnight. Pointings do not overlap, so the lookup is a bisection over
+the sorted pointing starts. The pointings are
+held in memory per process and reloaded every ``REPOINTING_CACHE_SECONDS``,
+so tagging does not take a database round trip per file or job.
+"""
+
+import logging
+import math
+import time
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from .database import models
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Instruments whose products are per pointing
+POINTING_INSTRUMENTS = ("glows", "hi", "lo", "ultra")
+# How long a process keeps the pointings in memory before reloading them
+REPOINTING_CACHE_SECONDS = 300
+
+
+def update_repointings(session, repointing_numbers):
+    """Recompute pointings from the spins of the spin table.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    repointing_numbers : iterable of int
+        The pointings to recompute.
+
+    Returns
+    -------
+    int
+        Number of pointings recomputed.
+    """
+    spin_table = models.UniversalSpinTable
+    query = (
+        select(
+            spin_table.repointing_number,
+            func.min(spin_table.spin_start_sc_time),
+            func.max(spin_table.spin_start_sc_time),
+            func.min(spin_table.spin_start_utc_time),
+            func.max(spin_table.spin_start_utc_time),
+            func.max(spin_table.spin_duration),
+        )
+        .where(
+            spin_table.repointing_number.in_(set(repointing_numbers)),
+            # Spins during the repointing maneuver are not part of the pointing
+            spin_table.repointing.is_(False),
+        )
+        .group_by(spin_table.repointing_number)
+    )
+    rows = session.execute(query).all()
+    for number, start_sc, last_sc, start_utc, last_utc, duration in rows:
+        session.merge(
+            models.Repointing(
+                repointing_number=number,
+                start_time=start_utc,
+                end_time=last_utc + timedelta(milliseconds=duration),
+                start_sc_time=start_sc,
+                end_sc_time=last_sc + math.ceil(duration / 1000),
+            )
+        )
+    session.commit()
+    # The pointings of this process are stale
+    _repointing_index.clear()
+    logger.info(f"Updated pointings {sorted(row[0] for row in rows)}")
+    return len(rows)
+
+
+class RepointingIndex:
+    """Sorted in-memory index of pointing intervals."""
+
+    def __init__(self, repointings):
+        """Build the index.
+
+        Parameters
+        ----------
+        repointings : iterable
+            Pointings with ``repointing_number``, ``start_time`` and
+            ``end_time`` attributes. They must not overlap.
+        """
+        repointings = sorted(repointings, key=lambda pointing: pointing.start_time)
+        self.numbers = [pointing.repointing_number for pointing in repointings]
+        self.starts = [pointing.start_time for pointing in repointings]
+        # Sorted as well, as the pointings do not overlap
+        self.ends = [pointing.end_time for pointing in repointings]
+
+    def __len__(self):
+        """Get the number of pointings in the index."""
+        return len(self.numbers)
+
+    def find(self, time):
+        """Get the pointing in progress at a time.
+
+        Parameters
+        ----------
+        time : datetime
+            The time.
+
+        Returns
+        -------
+        int or None
+            The pointing number, None between pointings.
+        """
+        index = bisect_right(self.starts, time) - 1
+        if index >= 0 and time < self.ends[index]:
+            return self.numbers[index]
+        return None
+
+    def overlapping(self, start, end):
+        """Get the pointings overlapping a time range.
+
+        Parameters
+        ----------
+        start : datetime
+            Start of the time range.
+        end : datetime
+            End of the time range (exclusive).
+
+        Returns
+        -------
+        list of int
+            The pointing numbers, sorted by start.
+        """
+        first = bisect_right(self.ends, start)
+        stop = bisect_left(self.starts, end)
+        return self.numbers[first:stop]
+
+    def find_most_overlapping(self, start, end):
+        """Get the pointing covering most of a time range.
+
+        Parameters
+        ----------
+        start : datetime
+            Start of the time range.
+        end : datetime
+            End of the time range (exclusive).
+
+        Returns
+        -------
+        int or None
+            The pointing number, the earliest one if several cover as much.
+            None if no pointing overlaps the time range.
+        """
+        first = bisect_right(self.ends, start)
+        stop = bisect_left(self.starts, end)
+        if first == stop:
+            return None
+        index = max(
+            range(first, stop),
+            key=lambda index: min(self.ends[index], end)
+            - max(self.starts[index], start),
+        )
+        return self.numbers[index]
+
+
+# Pointing index of this process, with the time it was loaded
+_repointing_index = {}
+
+
+def get_repointing_index(session):
+    """Get the in-memory pointing index, cached per process.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session, only used when the index is reloaded.
+
+    Returns
+    -------
+    RepointingIndex
+        The pointing index.
+    """
+    loaded = _repointing_index.get("loaded")
+    if loaded is not None and time.monotonic() - loaded < REPOINTING_CACHE_SECONDS:
+        return _repointing_index["index"]
+
+    repointing = models.Repointing
+    query = select(
+        repointing.repointing_number, repointing.start_time, repointing.end_time
+    )
+    index = RepointingIndex(session.execute(query))
+    _repointing_index.update(index=index, loaded=time.monotonic())
+    logger.info(f"Loaded the index of {len(index)} pointings")
+    return index
+
+
+def get_day_repointing(session, instrument, day):
+    """Get the pointing number of a pointing-based product for a day.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    instrument : str
+        Instrument of the product.
+    day : datetime
+        Start of the day.
+
+    Returns
+    -------
+    int or None
+        The pointing covering most of the day. None if the instrument's
+        products are not per pointing, or no pointing is known for the day.
+    """
+    if instrument not in POINTING_INSTRUMENTS:
+        return None
+    return get_repointing_index(session).find_most_overlapping(
+        day, day + timedelta(days=1)
+    )
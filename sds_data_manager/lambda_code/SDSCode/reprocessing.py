@@ -0,0 +1,609 @@
+r"""Functions for supporting reprocessing campaigns.
+
+A reprocessing campaign takes a product selector (instrument, and optionally
+data level and descriptor) and a date range. The files matching the selector
+are looked up in the ScienceFiles table and the dependency graph is walked
+downstream from each of them to find every product that needs to be
+regenerated. Those targets are written to the processing table as PENDING
+jobs tagged with the campaign name.
+
+PENDING jobs are released to Batch at a limited rate, ``RELEASE_RATE`` jobs
+per invocation, by a scheduled EventBridge rule. A job is held until the
+inputs it needs exist, including the new versions of its inputs that are
+targets of the same campaign. A campaign is resumable because anything that
+has not been released is still PENDING in the table, and re-creating a
+campaign with the same parameters does not duplicate jobs.
+
+Campaigns are only created from the command line, which requires the
+``SECRET_NAME`` environment variable to point at the database credentials::
+
+    python -m sds_data_manager.lambda_code.SDSCode.reprocessing \
+        --instrument codice --data-level l0 --start-date 20250101 \
+        --end-date 20250331 --version v002 --dry-run
+
+The API only reports the progress of a campaign, as creating one writes the
+jobs that are then submitted to batch.
+"""
+
+import argparse
+import json
+import logging
+import os
+from collections import Counter, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from . import batch_starter, dependency_config
+from .database import database as db
+from .database import models
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Maximum number of PENDING jobs submitted to batch per invocation
+RELEASE_RATE = int(os.getenv("RELEASE_RATE", "10"))
+
+# Nominal job resources used for the dry-run compute estimate.
+# These match the job definitions in the ProcessingConstruct.
+JOB_VCPU = 1
+JOB_MEMORY_GIB = 4
+ESTIMATED_JOB_RUNTIME_MINUTES = 10
+
+
+def get_campaign_name(
+    instrument, data_level, descriptor, start_date, end_date, version
+):
+    """Create a deterministic name for a campaign from its parameters.
+
+    Using the parameters as the name means that requesting the same
+    campaign twice resumes the existing campaign instead of creating a new one.
+
+    Parameters
+    ----------
+    instrument : str
+        Instrument name.
+    data_level : str or None
+        Data level, None selects all data levels.
+    descriptor : str or None
+        Data descriptor, None selects all descriptors.
+    start_date : str
+        Start date of the campaign, YYYYMMDD.
+    end_date : str
+        End date of the campaign (inclusive), YYYYMMDD.
+    version : str
+        Version of the data products to produce.
+
+    Returns
+    -------
+    str
+        Campaign name.
+    """
+    return "-".join(
+        [
+            instrument,
+            data_level or "all",
+            descriptor or "all",
+            start_date,
+            end_date,
+            version,
+        ]
+    )
+
+
+def get_all_downstream_nodes(node):
+    """Walk the dependency graph to find all products downstream of ``node``.
+
+    Parameters
+    ----------
+    node : tuple
+        (instrument, data_level, descriptor) of the starting product.
+
+    Returns
+    -------
+    list of tuple
+        All downstream (instrument, data_level, descriptor) nodes, in
+        breadth-first order. The starting node itself is not included.
+    """
+    downstream = dependency_config.DEPENDENCIES["HARD"]["DOWNSTREAM"]
+    visited = set()
+    nodes = []
+    queue = deque([node])
+    while queue:
+        for child in downstream.get(queue.popleft(), []):
+            if child in visited:
+                continue
+            visited.add(child)
+            nodes.append(child)
+            queue.append(child)
+    return nodes
+
+
+def get_campaign_targets(
+    session, instrument, data_level, descriptor, start_date, end_date, version
+):
+    """Enumerate the products to regenerate for a campaign.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    instrument : str
+        Instrument name.
+    data_level : str or None
+        Data level, None selects all data levels.
+    descriptor : str or None
+        Data descriptor, None selects all descriptors.
+    start_date : str
+        Start date of the campaign, YYYYMMDD.
+    end_date : str
+        End date of the campaign (inclusive), YYYYMMDD.
+    version : str
+        Version of the data products to produce.
+
+    Returns
+    -------
+    targets : list of dict
+        Dictionaries containing the instrument, data_level, descriptor,
+        start_date and version of each product, sorted by data level so
+        that lower levels are released first.
+    """
+    query = select(
+        models.ScienceFiles.instrument,
+        models.ScienceFiles.data_level,
+        models.ScienceFiles.descriptor,
+        models.ScienceFiles.start_date,
+    ).where(
+        models.ScienceFiles.instrument == instrument,
+        models.ScienceFiles.start_date >= datetime.strptime(start_date, "%Y%m%d"),
+        # Make the end date inclusive of the whole day
+        models.ScienceFiles.start_date
+        < datetime.strptime(end_date, "%Y%m%d") + timedelta(days=1),
+    )
+    if data_level is not None:
+        query = query.where(models.ScienceFiles.data_level == data_level)
+    if descriptor is not None:
+        query = query.where(models.ScienceFiles.descriptor == descriptor)
+
+    targets = set()
+    # Multiple versions of the same file only need to be walked once
+    for file_instrument, file_level, file_descriptor, file_date in set(
+        session.execute(query).all()
+    ):
+        for node in get_all_downstream_nodes(
+            (file_instrument, file_level, file_descriptor)
+        ):
+            targets.add((*node, file_date.strftime("%Y%m%d")))
+
+    return [
+        {
+            "instrument": target_instrument,
+            "data_level": target_level,
+            "descriptor": target_descriptor,
+            "start_date": target_date,
+            "version": version,
+        }
+        for (target_instrument, target_level, target_descriptor, target_date) in sorted(
+            targets, key=lambda target: (target[1], target[3], target[0], target[2])
+        )
+    ]
+
+
+def estimate_compute(n_jobs, runtime_minutes=ESTIMATED_JOB_RUNTIME_MINUTES):
+    """Estimate the compute needed to run ``n_jobs`` processing jobs.
+
+    Parameters
+    ----------
+    n_jobs : int
+        Number of jobs.
+    runtime_minutes : float, optional
+        Estimated runtime of a single job.
+
+    Returns
+    -------
+    dict
+        Number of jobs, vCPU hours and memory GiB hours.
+    """
+    job_hours = n_jobs * runtime_minutes / 60
+    return {
+        "jobs": n_jobs,
+        "vcpu_hours": job_hours * JOB_VCPU,
+        "memory_gib_hours": job_hours * JOB_MEMORY_GIB,
+    }
+
+
+def create_campaign(session, campaign, targets):
+    """Write the campaign targets to the processing table as PENDING jobs.
+
+    Targets that already have a PENDING, INPROGRESS or SUCCEEDED job in this
+    campaign are skipped, so calling this again with the same campaign only
+    adds back the jobs that failed.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    campaign : str
+        Campaign name.
+    targets : list of dict
+        Targets from ``get_campaign_targets``.
+
+    Returns
+    -------
+    int
+        Number of PENDING jobs that were added.
+    """
+    existing = {
+        (job.instrument, job.data_level, job.descriptor, job.start_date, job.version)
+        for job in session.query(models.ProcessingJob).filter(
+            models.ProcessingJob.campaign == campaign,
+            models.ProcessingJob.status != models.Status.FAILED,
+        )
+    }
+
+    new_jobs = []
+    for target in targets:
+        start_date = datetime.strptime(target["start_date"], "%Y%m%d")
+        key = (
+            target["instrument"],
+            target["data_level"],
+            target["descriptor"],
+            start_date,
+            target["version"],
+        )
+        if key in existing:
+            continue
+        new_jobs.append(
+            models.ProcessingJob(
+                status=models.Status.PENDING,
+                instrument=target["instrument"],
+                data_level=target["data_level"],
+                descriptor=target["descriptor"],
+                start_date=start_date,
+                version=target["version"],
+                campaign=campaign,
+            )
+        )
+
+    session.add_all(new_jobs)
+    session.commit()
+    logger.info(f"Wrote {len(new_jobs)} PENDING jobs for campaign {campaign}")
+    return len(new_jobs)
+
+
+def get_upstream_dependencies(session, job):
+    """Find the input files of a PENDING job.
+
+    An upstream product that is being produced at the version of the job,
+    e.g. an earlier level of the same campaign, is waited for and then used
+    at that version. Otherwise the newest available version of the upstream
+    file is used, since the inputs of a reprocessed product are not
+    necessarily reprocessed themselves.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    job : models.ProcessingJob
+        The PENDING job.
+
+    Returns
+    -------
+    list of dict or None
+        The upstream dependencies with their dates and versions, or None if
+        any of the upstream files are not available yet.
+    """
+    upstream_dependencies = batch_starter.get_dependencies(
+        node=(job.instrument, job.data_level, job.descriptor),
+        direction="UPSTREAM",
+        relationship="HARD",
+    )
+    for upstream_dependency in upstream_dependencies:
+        upstream_statuses = set(
+            session.execute(
+                select(models.ProcessingJob.status).where(
+                    models.ProcessingJob.instrument
+                    == upstream_dependency["instrument"],
+                    models.ProcessingJob.data_level
+                    == upstream_dependency["data_level"],
+                    models.ProcessingJob.descriptor
+                    == upstream_dependency["descriptor"],
+                    models.ProcessingJob.start_date == job.start_date,
+                    models.ProcessingJob.version == job.version,
+                )
+            ).scalars()
+        )
+        if upstream_statuses & {models.Status.PENDING, models.Status.INPROGRESS}:
+            # The new version of the input is not produced yet
+            return None
+
+        query = session.query(models.ScienceFiles).filter(
+            models.ScienceFiles.instrument == upstream_dependency["instrument"],
+            models.ScienceFiles.data_level == upstream_dependency["data_level"],
+            models.ScienceFiles.descriptor == upstream_dependency["descriptor"],
+            models.ScienceFiles.start_date == job.start_date,
+        )
+        if upstream_statuses:
+            # Built from the new version of the input, not an older one
+            query = query.filter(models.ScienceFiles.version == job.version)
+        record = query.order_by(models.ScienceFiles.version.desc()).first()
+        if record is None:
+            return None
+        upstream_dependency.update(
+            {
+                "start_date": job.start_date.strftime("%Y%m%d"),
+                "version": record.version,
+                "file_path": record.file_path,
+            }
+        )
+    return upstream_dependencies
+
+
+def release_pending_jobs(session, campaign=None, max_jobs=RELEASE_RATE):
+    """Submit PENDING jobs whose inputs are available to batch.
+
+    Jobs are released in order of data level and date. A PENDING job whose
+    product is already in progress or complete (for example, because the
+    regular file-arrival processing got to it first) is removed.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    campaign : str, optional
+        Only release jobs from this campaign, by default all campaigns.
+    max_jobs : int, optional
+        Maximum number of jobs to submit.
+
+    Returns
+    -------
+    dict
+        Number of jobs released, removed as duplicates, and still waiting
+        on their inputs.
+    """
+    query = session.query(models.ProcessingJob).filter(
+        models.ProcessingJob.status == models.Status.PENDING
+    )
+    if campaign is not None:
+        query = query.filter(models.ProcessingJob.campaign == campaign)
+    pending_jobs = query.order_by(
+        models.ProcessingJob.data_level,
+        models.ProcessingJob.start_date,
+        models.ProcessingJob.id,
+    ).all()
+
+    summary = {"released": 0, "duplicate": 0, "waiting": 0}
+    ready_jobs = []
+    for job in pending_jobs:
+        if summary["released"] >= max_jobs:
+            break
+
+        if batch_starter.is_job_in_processing_table(
+            session=session,
+            instrument=job.instrument,
+            data_level=job.data_level,
+            descriptor=job.descriptor,
+            start_date=job.start_date.strftime("%Y%m%d"),
+            version=job.version,
+        ):
+            session.delete(job)
+            session.commit()
+            summary["duplicate"] += 1
+            continue
+
+        upstream_dependencies = get_upstream_dependencies(session, job)
+        if upstream_dependencies is None:
+            summary["waiting"] += 1
+            continue
+
+        try:
+            job.status = models.Status.INPROGRESS
+            session.commit()
+        except IntegrityError:
+            # Another process started this job between our check and update
+            session.rollback()
+            session.delete(job)
+            session.commit()
+            summary["duplicate"] += 1
+            continue
+
+        ready_jobs.append((job, upstream_dependencies))
+        summary["released"] += 1
+
+    # Homogeneous jobs (eg. many days of one product) go out as array jobs
+    batch_starter.submit_jobs(session, ready_jobs)
+
+    logger.info(f"Released PENDING jobs: {summary}")
+    return summary
+
+
+def get_campaign_progress(session, campaign):
+    """Count the jobs of a campaign by status.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    campaign : str
+        Campaign name.
+
+    Returns
+    -------
+    dict
+        Mapping of status name to number of jobs.
+    """
+    statuses = session.execute(
+        select(models.ProcessingJob.status).where(
+            models.ProcessingJob.campaign == campaign
+        )
+    ).scalars()
+    counts = Counter(status.value for status in statuses)
+    return {status.value: counts.get(status.value, 0) for status in models.Status}
+
+
+def run_campaign(
+    session,
+    instrument,
+    start_date,
+    end_date,
+    version,
+    data_level=None,
+    descriptor=None,
+    dry_run=False,
+):
+    """Plan a campaign, and create its PENDING jobs unless ``dry_run`` is set.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    instrument : str
+        Instrument name.
+    start_date : str
+        Start date of the campaign, YYYYMMDD.
+    end_date : str
+        End date of the campaign (inclusive), YYYYMMDD.
+    version : str
+        Version of the data products to produce.
+    data_level : str, optional
+        Data level, by default all data levels.
+    descriptor : str, optional
+        Data descriptor, by default all descriptors.
+    dry_run : bool, optional
+        Only report the number of jobs and the estimated compute.
+
+    Returns
+    -------
+    dict
+        Campaign name, job count per data level, compute estimate and,
+        if the campaign was created, its progress.
+    """
+    campaign = get_campaign_name(
+        instrument, data_level, descriptor, start_date, end_date, version
+    )
+    targets = get_campaign_targets(
+        session, instrument, data_level, descriptor, start_date, end_date, version
+    )
+    result = {
+        "campaign": campaign,
+        "dry_run": dry_run,
+        "jobs_per_level": dict(Counter(target["data_level"] for target in targets)),
+        "estimate": estimate_compute(len(targets)),
+    }
+    if not dry_run:
+        result["created"] = create_campaign(session, campaign, targets)
+        result["progress"] = get_campaign_progress(session, campaign)
+    return result
+
+
+def http_response(status_code=200, body="Success"):
+    """Create a JSON HTTP response for the lambda function."""
+    return {
+        "statusCode": status_code,
+        "body": json.dumps(body),
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",  # Allow CORS
+        },
+    }
+
+
+def lambda_handler(event, context):
+    """Entry point to the reprocessing lambda.
+
+    Scheduled EventBridge events (source "aws.events") release PENDING jobs.
+    API Gateway events report the progress of the campaign given by the
+    ``campaign`` parameter. Campaigns are created from the command line only,
+    as they write the jobs that are then submitted to batch.
+
+    Parameters
+    ----------
+    event : dict
+        The JSON formatted document with the data required for the
+        lambda function to process
+    context : LambdaContext
+        This object provides methods and properties that provide
+        information about the invocation, function,
+        and runtime environment.
+
+    """
+    logger.info(f"Event: {event}")
+    logger.info(f"Context: {context}")
+
+    if event.get("source") == "aws.events":
+        with db.Session() as session:
+            summary = release_pending_jobs(session)
+        return http_response(body=summary)
+
+    query_params = event.get("queryStringParameters") or {}
+    if set(query_params) != {"campaign"}:
+        return http_response(
+            status_code=400,
+            body="campaign is the only valid query parameter. Campaigns are "
+            "created with the reprocessing command line.",
+        )
+
+    with db.Session() as session:
+        progress = get_campaign_progress(session, query_params["campaign"])
+    return http_response(
+        body={"campaign": query_params["campaign"], "progress": progress}
+    )
+
+
+def _parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        An object containing the parsed arguments and their values
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="reprocessing",
+        description="Create or release IMAP reprocessing campaigns.",
+    )
+    parser.add_argument("--instrument", type=str, help="Instrument name.")
+    parser.add_argument("--data-level", type=str, help="Data level to select.")
+    parser.add_argument("--descriptor", type=str, help="Descriptor to select.")
+    parser.add_argument("--start-date", type=str, help="Start date, YYYYMMDD.")
+    parser.add_argument("--end-date", type=str, help="End date (inclusive), YYYYMMDD.")
+    parser.add_argument("--version", type=str, help="Version of the new products.")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only report the number of jobs and the estimated compute.",
+    )
+    parser.add_argument(
+        "--release",
+        type=int,
+        metavar="MAX_JOBS",
+        help="Release up to MAX_JOBS PENDING jobs to batch instead.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Create a campaign, or release PENDING jobs, from the command line."""
+    args = _parse_args()
+    with db.Session() as session:
+        if args.release is not None:
+            result = release_pending_jobs(session, max_jobs=args.release)
+        else:
+            result = run_campaign(
+                session,
+                instrument=args.instrument,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                version=args.version,
+                data_level=args.data_level,
+                descriptor=args.descriptor,
+                dry_run=args.dry_run,
+            )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
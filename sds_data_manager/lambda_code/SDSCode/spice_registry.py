@@ -0,0 +1,600 @@
+"""Registry of the SPICE kernels in the spice_files table.
+
+Every kernel uploaded under ``spice/`` is registered by the indexer with its
+type, source, coverage window and version, taken from the file name.
+E.g. ``spice/spk/imap_recon_20240101_20240107_v02.bsp`` is a reconstructed
+SPK covering 2024-01-01 through 2024-01-07, version 2.
+
+From the registry, the best set of kernels for any time range is resolved:
+
+- Kernels without coverage (leapseconds, clock, frames and planetary
+  constants) are always needed, the latest version of each is used.
+- Attitude (CK) and ephemeris (SPK) kernels are chosen by source precedence,
+  reconstructed > burn > nominal > predicted, and then by version. Kernels of
+  a lower precedence only fill the parts of the range that the better kernels
+  do not cover.
+
+The result is written out as a metakernel that processing jobs can furnish
+directly, so they load only the kernels covering their time range rather than
+everything on the EFS.
+
+SPK coverage is read from the segment summaries of the kernel itself when it
+is registered, the file name is the fallback. CK summaries are in encoded
+spacecraft clock ticks, which need the clock kernel to convert, so CK
+coverage always comes from the file name.
+
+Coverage windows are indexed twice. In the database, a GiST index on the
+time range (postgres) answers overlap queries in O(log n). In memory, each
+process keeps a ``CoverageIndex`` of each kernel type that answers the
+repeated lookups of e.g. a batch of jobs without a database round trip.
+It is rebuilt when a kernel is registered.
+
+Which kernels cover a time range can also be queried from the command line,
+which requires the ``SECRET_NAME`` environment variable to point at the
+database credentials::
+
+    python -m sds_data_manager.lambda_code.SDSCode.spice_registry \
+        ck 2025-03-01T00:00 2025-03-02T00:00
+"""
+
+import argparse
+import logging
+import re
+import struct
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from itertools import accumulate
+from pathlib import PurePosixPath
+
+from sqlalchemy import func, select
+
+from .database import database as db
+from .database import models
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The EFS lambda stages every kernel here, and the processing jobs mount it
+SPICE_MOUNT_PATH = "/mnt/spice"
+
+# Sources of time-dependent kernels, highest precedence first
+SOURCE_PRECEDENCE = ("recon", "burn", "nom", "pred")
+
+# Kernel types with a coverage window, resolved by precedence
+COVERAGE_TYPES = ("ck", "spk")
+
+# Kernel types without a coverage window, the latest of each is always loaded.
+# They are listed in the order they are furnished.
+GENERIC_TYPES = ("lsk", "sclk", "fk", "pck")
+
+# Coverage in the file name, either yyyymmdd_yyyymmdd or yyyy_doy_yyyy_doy
+COVERAGE_PATTERNS = (
+    (re.compile(r"_(\d{8})_(\d{8})(?:_|\.)"), "%Y%m%d"),
+    (re.compile(r"_(\d{4}_\d{3})_(\d{4}_\d{3})(?:_|\.)"), "%Y_%j"),
+)
+SOURCE_PATTERN = re.compile(rf"^imap_({'|'.join(SOURCE_PRECEDENCE)})_")
+# Version at the end of the name before the extensions. Either "_v##", a bare
+# "_##" (historical attitude, clock kernels) or e.g. "naif0012" (leapseconds)
+VERSION_PATTERN = re.compile(r"(?:_v?|naif)(\d{1,4})$")
+
+# DAF (SPK and CK) files are made of 1024 byte records
+DAF_RECORD_SIZE = 1024
+# J2000, the epoch of ephemeris time (TDB), in UTC
+J2000_UTC = datetime(2000, 1, 1, 11, 58, 55, 816000)
+# Leap seconds added since J2000 (TAI - UTC was 32 s at J2000)
+LEAP_SECONDS = (
+    datetime(2006, 1, 1),
+    datetime(2009, 1, 1),
+    datetime(2012, 7, 1),
+    datetime(2015, 7, 1),
+    datetime(2017, 1, 1),
+)
+
+# Columns of the registry that kernel lookups return
+KERNEL_COLUMNS = (
+    models.SPICEFiles.file_path,
+    models.SPICEFiles.source,
+    models.SPICEFiles.version,
+    models.SPICEFiles.start_date,
+    models.SPICEFiles.end_date,
+)
+
+
+def parse_kernel_path(file_path):
+    """Get the registry information of a kernel from its S3 key.
+
+    Historical attitude kernels (imap_yyyy_doy_yyyy_doy_##.ah.bc) have no
+    source in their name, they are reconstructed from telemetry.
+
+    Parameters
+    ----------
+    file_path : str
+        S3 key of the kernel, e.g. "spice/ck/imap_2024_001_2024_003_01.ah.bc".
+
+    Returns
+    -------
+    dict
+        The spice_files columns: file_path, kernel_type, source, start_date,
+        end_date (exclusive), version and extension.
+        The source, dates and version are None if not in the file name.
+    """
+    path = PurePosixPath(file_path)
+    filename = path.name
+
+    start_date = end_date = None
+    for pattern, date_format in COVERAGE_PATTERNS:
+        match = pattern.search(filename)
+        if match:
+            start_date = datetime.strptime(match.group(1), date_format)
+            # The end date is inclusive, store the (exclusive) end of that day
+            end_date = datetime.strptime(match.group(2), date_format) + timedelta(
+                days=1
+            )
+            break
+
+    source = None
+    match = SOURCE_PATTERN.search(filename)
+    if match:
+        source = match.group(1)
+    elif start_date is not None and path.parent.name == "ck":
+        source = "recon"
+
+    version = None
+    match = VERSION_PATTERN.search(filename.split(".")[0])
+    if match:
+        version = f"v{int(match.group(1)):03d}"
+
+    return {
+        "file_path": file_path,
+        # Uploads are stored under spice/<type>/ by the upload API
+        "kernel_type": path.parent.name,
+        "source": source,
+        "start_date": start_date,
+        "end_date": end_date,
+        "version": version,
+        "extension": path.suffix.lstrip("."),
+    }
+
+
+def _et_to_utc(et):
+    """Convert ephemeris time to UTC.
+
+    TDB and TT differ by less than 2 ms, which is ignored.
+
+    Parameters
+    ----------
+    et : float
+        Ephemeris time, seconds past J2000.
+
+    Returns
+    -------
+    datetime
+        The UTC time.
+    """
+    utc = J2000_UTC + timedelta(seconds=et)
+    leap_seconds = bisect_right(LEAP_SECONDS, utc)
+    return utc - timedelta(seconds=leap_seconds)
+
+
+def read_daf_coverage(read):
+    """Read the coverage of a DAF kernel from its segment summaries.
+
+    Parameters
+    ----------
+    read : callable
+        ``read(offset, size)`` returning ``size`` bytes of the kernel from
+        ``offset``, so that only the file and summary records are read.
+
+    Returns
+    -------
+    tuple of float or None
+        (start, end) of the segments in the time system of the kernel,
+        None if the kernel has no segments.
+    """
+    file_record = read(0, DAF_RECORD_SIZE)
+    if not file_record.startswith(b"DAF/"):
+        raise ValueError("Not a DAF file")
+    endian = "<" if file_record[88:96] == b"LTL-IEEE" else ">"
+    nd, ni = struct.unpack(f"{endian}2i", file_record[8:16])
+    (next_record,) = struct.unpack(f"{endian}i", file_record[76:80])
+    # Size of a summary in doubles
+    summary_size = nd + (ni + 1) // 2
+
+    start = end = None
+    while next_record:
+        record = read((next_record - 1) * DAF_RECORD_SIZE, DAF_RECORD_SIZE)
+        next_record, _, n_summaries = (
+            int(value) for value in struct.unpack(f"{endian}3d", record[:24])
+        )
+        for index in range(n_summaries):
+            offset = 24 + index * summary_size * 8
+            # The first two doubles are the start and end of the segment
+            segment_start, segment_end = struct.unpack(
+                f"{endian}2d", record[offset : offset + 16]
+            )
+            start = segment_start if start is None else min(start, segment_start)
+            end = segment_end if end is None else max(end, segment_end)
+    if start is None:
+        return None
+    return start, end
+
+
+def get_spk_coverage(s3_client, bucket, key):
+    """Read the UTC coverage of an SPK kernel in S3.
+
+    Parameters
+    ----------
+    s3_client : botocore.client.S3
+        S3 client.
+    bucket : str
+        S3 bucket.
+    key : str
+        S3 key of the SPK.
+
+    Returns
+    -------
+    tuple of datetime or None
+        (start, end) of the segments, None if the kernel has no segments.
+    """
+
+    def read(offset, size):
+        response = s3_client.get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={offset}-{offset + size - 1}"
+        )
+        return response["Body"].read()
+
+    coverage = read_daf_coverage(read)
+    if coverage is None:
+        return None
+    return _et_to_utc(coverage[0]), _et_to_utc(coverage[1])
+
+
+def register_kernel(session, file_path, ingestion_date=None, coverage=None):
+    """Add a kernel to the registry, replacing any previous record of it.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    file_path : str
+        S3 key of the kernel.
+    ingestion_date : datetime, optional
+        Time the kernel was uploaded.
+    coverage : tuple of datetime, optional
+        (start, end) coverage read from the kernel, in place of the one
+        in the file name.
+
+    Returns
+    -------
+    models.SPICEFiles
+        The registry record.
+    """
+    record = parse_kernel_path(file_path)
+    if coverage is not None:
+        record["start_date"], record["end_date"] = coverage
+    kernel = session.merge(models.SPICEFiles(**record, ingestion_date=ingestion_date))
+    session.commit()
+    logger.info(f"Registered SPICE kernel {file_path}")
+    return kernel
+
+
+class CoverageIndex:
+    """Sorted in-memory index of kernel coverage windows.
+
+    The windows are sorted by start, alongside the running maximum of their
+    ends. A window overlapping ``[start, end)`` starts before ``end``, and
+    can only come at or after the first position where the running maximum
+    end passes ``start``, both found by bisection in O(log n).
+    """
+
+    def __init__(self, kernels):
+        """Build the index.
+
+        Parameters
+        ----------
+        kernels : iterable
+            Kernels with ``start_date`` and ``end_date`` attributes.
+        """
+        self.kernels = sorted(kernels, key=lambda kernel: kernel.start_date)
+        self.starts = [kernel.start_date for kernel in self.kernels]
+        self.max_ends = list(
+            accumulate((kernel.end_date for kernel in self.kernels), max)
+        )
+
+    def __len__(self):
+        """Get the number of kernels in the index."""
+        return len(self.kernels)
+
+    def overlapping(self, start, end):
+        """Get the kernels overlapping a time range.
+
+        Parameters
+        ----------
+        start : datetime
+            Start of the time range.
+        end : datetime
+            End of the time range (exclusive).
+
+        Returns
+        -------
+        list
+            The kernels, sorted by start.
+        """
+        stop = bisect_left(self.starts, end)
+        first = bisect_right(self.max_ends, start)
+        return [
+            kernel for kernel in self.kernels[first:stop] if kernel.end_date > start
+        ]
+
+
+# Coverage index of each kernel type, with the registry state it was built from
+_coverage_indexes = {}
+
+
+def get_coverage_index(session, kernel_type):
+    """Get the in-memory coverage index of a kernel type.
+
+    The index is cached per process and rebuilt when the number of kernels
+    or the latest ingestion date of the type changes.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    kernel_type : str
+        "ck" or "spk".
+
+    Returns
+    -------
+    CoverageIndex
+        The coverage index.
+    """
+    spice_files = models.SPICEFiles
+    state = tuple(
+        session.execute(
+            select(func.count(), func.max(spice_files.ingestion_date)).where(
+                spice_files.kernel_type == kernel_type
+            )
+        ).one()
+    )
+    cached = _coverage_indexes.get(kernel_type)
+    if cached is not None and cached[0] == state:
+        return cached[1]
+
+    query = select(*KERNEL_COLUMNS).where(
+        spice_files.kernel_type == kernel_type,
+        spice_files.start_date.is_not(None),
+    )
+    index = CoverageIndex(session.execute(query))
+    _coverage_indexes[kernel_type] = (state, index)
+    logger.info(f"Built the {kernel_type} coverage index of {len(index)} kernels")
+    return index
+
+
+def query_kernels(session, kernel_type, start, end):
+    """Query the database for the kernels overlapping a time range.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    kernel_type : str
+        The kernel type, e.g. "ck".
+    start : datetime
+        Start of the time range.
+    end : datetime
+        End of the time range (exclusive).
+
+    Returns
+    -------
+    list
+        The kernels, sorted by start.
+    """
+    spice_files = models.SPICEFiles
+    if session.get_bind().dialect.name == "postgresql":
+        # Matches the expression of the GiST coverage index
+        overlaps = func.tsrange(spice_files.start_date, spice_files.end_date).op("&&")(
+            func.tsrange(start, end)
+        )
+    else:
+        overlaps = (spice_files.start_date < end) & (spice_files.end_date > start)
+    query = (
+        select(*KERNEL_COLUMNS)
+        .where(spice_files.kernel_type == kernel_type, overlaps)
+        .order_by(spice_files.start_date)
+    )
+    return list(session.execute(query))
+
+
+def _subtract(intervals, start, end):
+    """Remove [start, end) from a list of disjoint intervals.
+
+    Parameters
+    ----------
+    intervals : list of tuple
+        Disjoint (start, end) intervals.
+    start : datetime
+        Start of the interval to remove.
+    end : datetime
+        End of the interval to remove.
+
+    Returns
+    -------
+    list of tuple
+        The remaining intervals.
+    """
+    remaining = []
+    for interval_start, interval_end in intervals:
+        if end <= interval_start or start >= interval_end:
+            remaining.append((interval_start, interval_end))
+            continue
+        if interval_start < start:
+            remaining.append((interval_start, start))
+        if end < interval_end:
+            remaining.append((end, interval_end))
+    return remaining
+
+
+def _get_generic_kernels(session):
+    """Get the latest kernel of each type without coverage.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+
+    Returns
+    -------
+    list
+        The kernels, in furnishing order.
+    """
+    kernels = []
+    for kernel_type in GENERIC_TYPES:
+        query = (
+            select(*KERNEL_COLUMNS)
+            .where(models.SPICEFiles.kernel_type == kernel_type)
+            .order_by(
+                models.SPICEFiles.version.desc().nulls_last(),
+                models.SPICEFiles.ingestion_date.desc().nulls_last(),
+            )
+            .limit(1)
+        )
+        kernel = session.execute(query).first()
+        if kernel is not None:
+            kernels.append(kernel)
+    return kernels
+
+
+def _get_covering_kernels(session, kernel_type, start, end):
+    """Choose the kernels of a type covering a time range by precedence.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    kernel_type : str
+        "ck" or "spk".
+    start : datetime
+        Start of the time range.
+    end : datetime
+        End of the time range (exclusive).
+
+    Returns
+    -------
+    kernels : list
+        The chosen kernels, in furnishing order. SPICE gives precedence to
+        the kernel loaded last, so the best kernels come last.
+    gaps : list of tuple
+        (start, end) of the parts of the range no kernel covers.
+    """
+    candidates = sorted(
+        get_coverage_index(session, kernel_type).overlapping(start, end),
+        key=lambda kernel: (
+            SOURCE_PRECEDENCE.index(kernel.source)
+            if kernel.source
+            else len(SOURCE_PRECEDENCE),
+            # Newest version first
+            -int(kernel.version[1:]) if kernel.version else 1,
+        ),
+    )
+
+    chosen = []
+    gaps = [(start, end)]
+    for kernel in candidates:
+        if not gaps:
+            break
+        remaining = _subtract(gaps, kernel.start_date, kernel.end_date)
+        if remaining != gaps:
+            chosen.append(kernel)
+            gaps = remaining
+    return chosen[::-1], gaps
+
+
+def resolve_kernels(session, start, end):
+    """Resolve the best set of kernels for a time range.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    start : datetime
+        Start of the time range.
+    end : datetime
+        End of the time range (exclusive).
+
+    Returns
+    -------
+    list
+        The kernels, in furnishing order, with the file_path, source,
+        version, start_date and end_date of each.
+    """
+    kernels = _get_generic_kernels(session)
+    for kernel_type in COVERAGE_TYPES:
+        covering_kernels, gaps = _get_covering_kernels(session, kernel_type, start, end)
+        if gaps:
+            logger.warning(f"No {kernel_type} kernels cover {gaps}")
+        kernels += covering_kernels
+    return kernels
+
+
+def get_metakernel(kernels, kernel_dir=SPICE_MOUNT_PATH):
+    """Create the text of a metakernel that furnishes the given kernels.
+
+    Parameters
+    ----------
+    kernels : list
+        The kernels, in furnishing order.
+    kernel_dir : str, optional
+        Directory the kernels are staged in.
+
+    Returns
+    -------
+    str
+        The metakernel.
+    """
+    # The EFS lambda stages the kernels without the S3 prefix
+    kernel_paths = "\n".join(
+        f"    '$KERNELS/{PurePosixPath(kernel.file_path).name}'" for kernel in kernels
+    )
+    return (
+        "KPL/MK\n"
+        "\\begindata\n"
+        f"  PATH_VALUES = ( '{kernel_dir}' )\n"
+        "  PATH_SYMBOLS = ( 'KERNELS' )\n"
+        "  KERNELS_TO_LOAD = (\n"
+        f"{kernel_paths}\n"
+        "  )\n"
+        "\\begintext\n"
+    )
+
+
+def _parse_args():
+    """Parse the command line arguments.
+
+    Returns
+    -------
+    args : argparse.Namespace
+        An object containing the parsed arguments and their values
+
+    """
+    parser = argparse.ArgumentParser(
+        prog="spice_registry",
+        description="List the SPICE kernels covering a time range.",
+    )
+    parser.add_argument("kernel_type", help="Kernel type, e.g. ck or spk.")
+    parser.add_argument("start", type=datetime.fromisoformat, help="Start time.")
+    parser.add_argument("end", type=datetime.fromisoformat, help="End time.")
+    return parser.parse_args()
+
+
+def main():
+    """Print the kernels covering a time range from the command line."""
+    args = _parse_args()
+    with db.Session() as session:
+        for kernel in query_kernels(session, args.kernel_type, args.start, args.end):
+            print(f"{kernel.start_date} {kernel.end_date} {kernel.file_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Ingest and query the universal spin table.
+
+Spin files are CSV files with a header row of the spin table columns, one
+row per spin::
+
+    spin_number,spin_start_sc_time,spin_start_subsec,spin_start_utc_time,...
+    1,453051323,250000,2024-05-10T12:01:04.184,...
+
+They are dropped under the ``spin/`` prefix of the data bucket and loaded
+by the indexer. A spin file supersedes the spins already in the table over
+the time range it covers, so a reprocessed spin file replaces the old rows
+instead of duplicating them, and the pointings of its spins are recomputed.
+On postgres the rows are bulk loaded with COPY, which is an order of
+magnitude faster than row inserts for the tens of thousands of spins of a
+week.
+
+The spins of a time range are returned as columnar arrays, one list per
+column, so that clients can turn them into arrays directly and look up the
+spin of millions of events at once.
+"""
+
+import csv
+import io
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select
+
+from . import repointing
+from .database import models
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Columns of the spin files, in the order they are loaded
+SPIN_COLUMNS = (
+    "spin_number",
+    "spin_start_sc_time",
+    "spin_start_subsec",
+    "spin_start_utc_time",
+    "star_tracker_flag",
+    "spin_duration",
+    "thruster_firing_event",
+    "repointing",
+    "repointing_number",
+)
+INTEGER_COLUMNS = (
+    "spin_number",
+    "spin_start_sc_time",
+    "spin_start_subsec",
+    "spin_duration",
+    "repointing_number",
+)
+BOOLEAN_COLUMNS = ("star_tracker_flag", "thruster_firing_event", "repointing")
+
+
+def _parse_boolean(value):
+    """Parse a boolean column of a spin file.
+
+    Parameters
+    ----------
+    value : str
+        The value, e.g. "1", "0", "true" or "False".
+
+    Returns
+    -------
+    bool
+        The parsed value.
+    """
+    value = value.strip().lower()
+    if value in ("1", "true", "t", "yes"):
+        return True
+    if value in ("0", "false", "f", "no", ""):
+        return False
+    raise ValueError(f"{value} is not a boolean")
+
+
+def read_spin_file(file_obj):
+    """Read the spins of a spin file.
+
+    Parameters
+    ----------
+    file_obj : file-like
+        The spin file, opened in text mode.
+
+    Returns
+    -------
+    list of dict
+        The spins, keyed by column.
+    """
+    reader = csv.DictReader(file_obj)
+    missing = set(SPIN_COLUMNS) - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Spin file is missing the columns {sorted(missing)}")
+
+    records = []
+    for row in reader:
+        record = {column: row[column] for column in SPIN_COLUMNS}
+        for column in INTEGER_COLUMNS:
+            record[column] = int(record[column] or 0)
+        for column in BOOLEAN_COLUMNS:
+            record[column] = _parse_boolean(record[column])
+        record["spin_start_utc_time"] = datetime.fromisoformat(
+            record["spin_start_utc_time"]
+        )
+        records.append(record)
+    return records
+
+
+def _copy_records(session, records):
+    """Bulk load spins with COPY, within the transaction of the session.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session, bound to postgres.
+    records : list of dict
+        The spins, keyed by column.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for record in records:
+        writer.writerow(
+            [
+                ("t" if record[column] else "f")
+                if column in BOOLEAN_COLUMNS
+                else record[column]
+                for column in SPIN_COLUMNS
+            ]
+        )
+    sql = (
+        f"COPY {models.UniversalSpinTable.__tablename__} "
+        f"({', '.join(SPIN_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    )
+    # The driver connection of the session, so COPY is part of its transaction
+    driver_connection = session.connection().connection.driver_connection
+    with driver_connection.cursor() as cursor:
+        if hasattr(cursor, "copy"):
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+        else:
+            # psycopg2
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+
+
+def ingest_spin_records(session, records):
+    """Load spins into the spin table, replacing those of their time range.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    records : list of dict
+        The spins, keyed by column.
+
+    Returns
+    -------
+    int
+        Number of spins loaded.
+    """
+    if not records:
+        return 0
+    spin_table = models.UniversalSpinTable
+    starts = [record["spin_start_sc_time"] for record in records]
+    session.execute(
+        delete(spin_table).where(
+            spin_table.spin_start_sc_time.between(min(starts), max(starts))
+        )
+    )
+    if session.get_bind().dialect.name == "postgresql":
+        _copy_records(session, records)
+    else:
+        session.execute(insert(spin_table), records)
+    session.commit()
+    logger.info(f"Loaded {len(records)} spins from MET {min(starts)} to {max(starts)}")
+    repointing.update_repointings(
+        session, {record["repointing_number"] for record in records}
+    )
+    return len(records)
+
+
+def ingest_spin_file(session, file_obj):
+    """Load the spins of a spin file into the spin table.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    file_obj : file-like
+        The spin file, opened in text mode.
+
+    Returns
+    -------
+    int
+        Number of spins loaded.
+    """
+    return ingest_spin_records(session, read_spin_file(file_obj))
+
+
+def query_spins(session, start_time, end_time):
+    """Query the spins of a time range as columnar arrays.
+
+    The spin in progress at ``start_time`` is included, so every time in the
+    range falls within one of the returned spins.
+
+    Parameters
+    ----------
+    session : orm session
+        Database session.
+    start_time : float
+        Start of the time range, in seconds of MET.
+    end_time : float
+        End of the time range (exclusive), in seconds of MET.
+
+    Returns
+    -------
+    dict
+        A list of values of each of ``SPIN_COLUMNS``, sorted by spin start.
+        UTC times are in ISO format.
+    """
+    spin_table = models.UniversalSpinTable
+    # Start of a spin started before start_time, as the whole seconds of the
+    # start are compared. Both bounds use the index.
+    first_start = (
+        select(func.max(spin_table.spin_start_sc_time))
+        .where(spin_table.spin_start_sc_time < int(start_time))
+        .scalar_subquery()
+    )
+    query = (
+        select(*(getattr(spin_table, column) for column in SPIN_COLUMNS))
+        .where(
+            spin_table.spin_start_sc_time
+            >= func.coalesce(first_start, int(start_time)),
+            spin_table.spin_start_sc_time < end_time,
+        )
+        .order_by(spin_table.spin_start_sc_time, spin_table.spin_start_subsec)
+    )
+    rows = session.execute(query).all()
+    columns = {
+        column: [row[index] for row in rows]
+        for index, column in enumerate(SPIN_COLUMNS)
+    }
+    columns["spin_start_utc_time"] = [
+        utc_time.isoformat() for utc_time in columns["spin_start_utc_time"]
+    ]
+    return columns
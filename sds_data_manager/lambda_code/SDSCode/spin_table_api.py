@@ -1,11 +1,87 @@
-"""Define lambda to support the spin table API."""
+"""Define lambda to support the spin table API.
+
+``GET /spin_table?start_time=<MET>&end_time=<MET>`` returns the spins of a
+time range as columnar arrays, one list per column of the spin table::
+
+    {"spin_number": [1, 2], "spin_start_sc_time": [453051323, 453051338], ...}
+"""
 
 import json
+import logging
+
+from . import spin_table
+from .database import database as db
+
+# Logger setup
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Longest time range of a single request, in seconds (about 4 spins a minute)
+MAX_TIME_RANGE = 7 * 24 * 60 * 60
+
+
+def _response(status_code, body):
+    """Format an API response.
+
+    Parameters
+    ----------
+    status_code : int
+        HTTP status code.
+    body : object
+        JSON serializable body.
+
+    Returns
+    -------
+    dict
+        The response.
+    """
+    return {
+        "statusCode": status_code,
+        "body": json.dumps(body),
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*",  # Allow CORS
+        },
+    }
 
 
 def lambda_handler(event, context):
-    """TODO: write this docstring."""
-    print(event)
-    # TODO: extend this lambda code once we finish creating
-    # spin table schema
-    return {"statusCode": 200, "body": json.dumps("Hello from Spin Table Lambda!")}
+    """Return the spins of a time range.
+
+    Parameters
+    ----------
+    event : dict
+        The JSON formatted document with the data required for the
+        lambda function to process
+    context : LambdaContext
+        This object provides methods and properties that provide
+        information about the invocation, function,
+        and runtime environment.
+
+    Returns
+    -------
+    dict
+        The spins of the time range, as a list per column.
+    """
+    logger.info(f"Event: {event}")
+    query_params = event.get("queryStringParameters") or {}
+
+    try:
+        start_time = float(query_params["start_time"])
+        end_time = float(query_params["end_time"])
+    except (KeyError, ValueError):
+        return _response(400, "start_time and end_time are required, in seconds of MET")
+    if not 0 < end_time - start_time <= MAX_TIME_RANGE:
+        return _response(
+            400,
+            "end_time must be after start_time and at most "
+            f"{MAX_TIME_RANGE} seconds later",
+        )
+
+    with db.Session() as session:
+        spins = spin_table.query_spins(session, start_time, end_time)
+
+    logger.info(
+        f"Found {len(spins['spin_number'])} spins between {start_time} and {end_time}"
+    )
+    return _response(200, spins)
@@ -25,6 +25,11 @@ REGION = os.getenv("REGION")
 S3_CLIENT = boto3.client(
     "s3", region_name=REGION, config=botocore.client.Config(signature_version="s3v4")
 )
+# S3 allows up to 10,000 parts per multipart upload
+MAX_PARTS = 10000
+# Pre-signed part urls per response, which must stay under the 6 MB
+# response limit of lambda (a url is up to about 2 KB)
+MAX_PART_URLS = 1000
 
 
 def _file_exists(s3_key_path):
@@ -39,7 +44,9 @@ def _file_exists(s3_key_path):
         return False
 
 
-def _generate_signed_upload_response(s3_key_path, tags=None):
+def _generate_signed_upload_response(
+    s3_key_path, tags=None, parts=None, upload_id=None, first_part=1
+):
     """Create a presigned url for a file in the SDS storage bucket.
 
     Parameters
@@ -48,6 +55,12 @@ def _generate_signed_upload_response(s3_key_path, tags=None):
         The fully qualified path of the object to upload.
     tags : dict, optional
          Additional S3 object metadata to add to the object.
+    parts : int, optional
+        Upload the file in this many parts with a multipart upload.
+    upload_id : str, optional
+        The multipart upload to get more part urls of.
+    first_part : int, optional
+        Number of the first part to get the url of.
 
     Returns
     -------
@@ -63,6 +76,11 @@ def _generate_signed_upload_response(s3_key_path, tags=None):
                 "Access-Control-Allow-Origin": "*",
             },
         }
+    if parts is not None:
+        return _generate_signed_multipart_response(
+            s3_key_path, parts, tags, upload_id, first_part
+        )
+
     # We know there isn't an object at this location, so
     # generate a pre-signed URL for the client to upload to
     url = S3_CLIENT.generate_presigned_url(
@@ -74,10 +92,75 @@ def _generate_signed_upload_response(s3_key_path, tags=None):
         },
         ExpiresIn=3600,
     )
-
     return {"statusCode": 200, "body": json.dumps(url)}
 
 
+def _generate_signed_multipart_response(
+    s3_key_path, parts, tags=None, upload_id=None, first_part=1
+):
+    """Start a multipart upload and create presigned urls for it.
+
+    Large files are uploaded in parts, concurrently. Every part gets its own
+    pre-signed url, and the upload is finished (or abandoned) with the
+    pre-signed complete (or abort) url.
+
+    A response has the urls of up to ``MAX_PART_URLS`` parts. The urls of
+    the next parts are requested again with the upload id and the
+    ``next_part`` of the response, until it is null.
+
+    Parameters
+    ----------
+    s3_key_path : str
+        The fully qualified path of the object to upload.
+    parts : int
+        The number of parts the file will be uploaded in.
+    tags : dict, optional
+         Additional S3 object metadata to add to the object.
+    upload_id : str, optional
+        The multipart upload to get more part urls of, a new upload is
+        started by default.
+    first_part : int, optional
+        Number of the first part to get the url of.
+
+    Returns
+    -------
+    Response with status code and the upload id and pre-signed URLs.
+    """
+    if upload_id is None:
+        upload_id = S3_CLIENT.create_multipart_upload(
+            Bucket=BUCKET_NAME, Key=s3_key_path, Metadata=tags or dict()
+        )["UploadId"]
+    upload_params = {
+        "Bucket": BUCKET_NAME,
+        "Key": s3_key_path,
+        "UploadId": upload_id,
+    }
+    last_part = min(first_part + MAX_PART_URLS - 1, parts)
+    body = {
+        "upload_id": upload_id,
+        "part_urls": [
+            S3_CLIENT.generate_presigned_url(
+                ClientMethod="upload_part",
+                Params={**upload_params, "PartNumber": part_number},
+                ExpiresIn=3600,
+            )
+            for part_number in range(first_part, last_part + 1)
+        ],
+        "next_part": last_part + 1 if last_part < parts else None,
+        "complete_url": S3_CLIENT.generate_presigned_url(
+            ClientMethod="complete_multipart_upload",
+            Params=upload_params,
+            ExpiresIn=3600,
+        ),
+        "abort_url": S3_CLIENT.generate_presigned_url(
+            ClientMethod="abort_multipart_upload",
+            Params=upload_params,
+            ExpiresIn=3600,
+        ),
+    }
+    return {"statusCode": 200, "body": json.dumps(body)}
+
+
 def lambda_handler(event, context):
     """Entry point to the upload API lambda.
 
@@ -88,14 +171,18 @@ def lambda_handler(event, context):
     ----------
     event : dict
         Specifically looking at the event['pathParameters']['proxy'], which
-        specifies the filename to upload.
+        specifies the filename to upload, and the optional "parts" query
+        string parameter to upload the file with a multipart upload. The
+        "upload_id" and "first_part" parameters get the urls of the next
+        parts of a multipart upload.
     context : None
         Currently not used
 
     Returns
     -------
     dict
-        A pre-signed url where users can upload a data file to the SDS.
+        A pre-signed url where users can upload a data file to the SDS,
+        or the pre-signed urls of a multipart upload.
 
     """
     path_params = event.get("pathParameters", {}).get("proxy", None)
@@ -135,4 +222,36 @@ def lambda_handler(event, context):
         s3_key_path.relative_to(imap_data_access.config["DATA_DIR"]).as_posix()
     )
 
-    return _generate_signed_upload_response(s3_key_path_str)
+    query_params = event.get("queryStringParameters") or {}
+    parts = query_params.get("parts")
+    if parts is not None:
+        if not parts.isdigit() or not 1 <= int(parts) <= MAX_PARTS:
+            return {
+                "statusCode": 400,
+                "body": json.dumps(
+                    f"parts must be an integer between 1 and {MAX_PARTS}"
+                ),
+            }
+        parts = int(parts)
+
+    # The urls of the next parts of a multipart upload
+    upload_id = query_params.get("upload_id")
+    first_part = query_params.get("first_part", "1")
+    if upload_id is not None or first_part != "1":
+        if (
+            parts is None
+            or upload_id is None
+            or not first_part.isdigit()
+            or not 1 <= int(first_part) <= parts
+        ):
+            return {
+                "statusCode": 400,
+                "body": json.dumps(
+                    "upload_id and first_part require the parts of the upload, "
+                    "first_part must be between 1 and parts"
+                ),
+            }
+
+    return _generate_signed_upload_response(
+        s3_key_path_str, parts=parts, upload_id=upload_id, first_part=int(first_part)
+    )
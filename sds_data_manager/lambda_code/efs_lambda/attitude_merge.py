@@ -0,0 +1,570 @@
+"""Merge historical attitude kernels on the EFS into one kernel.
+
+Historical attitude kernels (imap_yyyy_doy_yyyy_doy_##.ah.bc) arrive three
+times a week, each covering a few days. Rather than every processing job
+loading dozens of them, their segments are appended into a single merged
+attitude kernel, the same as NAIF's DAFCAT utility. The original kernels are
+only read, never modified.
+
+The merge is incremental: the coverage report next to the merged kernel
+lists the kernels already merged, and only the new ones are appended. The
+kernels are appended in file name order, so a newer version of a kernel
+comes later and takes precedence in SPICE where their segments overlap.
+Kernels that cannot be merged are listed as skipped, so they are not
+retried on every merge.
+
+The coverage report also lists the gaps between the coverage windows of
+the merged kernels, so missing attitude deliveries can be spotted::
+
+    {"kernel": "merged_attitude_kernel.ah.bc",
+     "sources": [{"file": "imap_2024_001_2024_003_01.ah.bc",
+                  "start": "2024-01-01T00:00:00", "end": "2024-01-04T00:00:00",
+                  "segments": 1}],
+     "skipped": [],
+     "coverage": [["2024-01-01T00:00:00", "2024-01-04T00:00:00"]],
+     "gaps": []}
+
+New segments are appended to the merged kernel in place, so a merge only
+costs as much as the new kernels, however long the mission has run. Their
+data and summary records are written past the end of the file and only
+then linked into it, so the existing segments never move and readers see
+either the old or the new segments. The merge runs in its own lambda,
+invoked asynchronously once a historical attitude kernel is staged.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import struct
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MERGED_KERNEL_NAME = "merged_attitude_kernel.ah.bc"
+REPORT_NAME = "merged_attitude_kernel.json"
+
+# Historical attitude kernels, predicted attitude (imap_pred_) is not merged
+HISTORICAL_ATTITUDE_PATTERN = re.compile(
+    r"^imap_(\d{4}_\d{3})_(\d{4}_\d{3})_\d+\.ah\.bc$"
+)
+
+# DAF files are made of records of 128 double precision numbers
+RECORD_SIZE = 1024
+DOUBLES_PER_RECORD = RECORD_SIZE // 8
+# Validation string of the FTP transfer mode, part of every DAF file record
+FTP_STRING = b"FTPSTR:\r:\n:\r\n:\r\x00:\x81:\x10\xce:ENDFTP"
+
+
+def get_coverage(filename):
+    """Get the coverage window of a historical attitude kernel from its name.
+
+    Parameters
+    ----------
+    filename : str
+        Kernel file name.
+
+    Returns
+    -------
+    tuple of datetime or None
+        (start, end) of the coverage, the end is exclusive. None if this is
+        not a historical attitude kernel.
+    """
+    match = HISTORICAL_ATTITUDE_PATTERN.match(filename)
+    if match is None:
+        return None
+    start = datetime.strptime(match.group(1), "%Y_%j")
+    end = datetime.strptime(match.group(2), "%Y_%j") + timedelta(days=1)
+    return start, end
+
+
+def read_daf(path):
+    """Read the arrays of a DAF file.
+
+    Parameters
+    ----------
+    path : Path
+        The DAF file.
+
+    Returns
+    -------
+    dict
+        The "idword", "nd", "ni", "internal_name" of the file and its
+        "arrays", a list of (doubles, integers, name, data) of each array,
+        where data are the raw little-endian doubles of the array.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    file_record = content[:RECORD_SIZE]
+    if not file_record.startswith(b"DAF/"):
+        raise ValueError(f"{path} is not a DAF file")
+    endian = "<" if file_record[88:96] == b"LTL-IEEE" else ">"
+    nd, ni = struct.unpack(f"{endian}2i", file_record[8:16])
+    (next_record,) = struct.unpack(f"{endian}i", file_record[76:80])
+    summary_size = nd + (ni + 1) // 2
+
+    arrays = []
+    while next_record:
+        offset = (next_record - 1) * RECORD_SIZE
+        record = content[offset : offset + RECORD_SIZE]
+        # The names of the arrays are in the record after their summaries
+        names = content[offset + RECORD_SIZE : offset + 2 * RECORD_SIZE]
+        next_record, _, n_summaries = (
+            int(value) for value in struct.unpack(f"{endian}3d", record[:24])
+        )
+        for index in range(n_summaries):
+            start = 24 + index * summary_size * 8
+            doubles = struct.unpack(f"{endian}{nd}d", record[start : start + nd * 8])
+            integers = struct.unpack(
+                f"{endian}{ni}i", record[start + nd * 8 : start + nd * 8 + ni * 4]
+            )
+            name = names[index * summary_size * 8 : (index + 1) * summary_size * 8]
+            # The last two integers are the first and last address of the data
+            begin, end = integers[-2:]
+            data = content[(begin - 1) * 8 : end * 8]
+            if endian != "<":
+                count = end - begin + 1
+                data = struct.pack(f"<{count}d", *struct.unpack(f">{count}d", data))
+            arrays.append((doubles, integers, name, data))
+
+    return {
+        "idword": file_record[:8],
+        "nd": nd,
+        "ni": ni,
+        "internal_name": file_record[16:76],
+        "arrays": arrays,
+    }
+
+
+def _pack_summaries(summaries, nd, ni):
+    """Pack array summaries and names into their DAF records layout.
+
+    Parameters
+    ----------
+    summaries : list of tuple
+        (doubles, integers, name) of each array.
+    nd : int
+        Number of double precision components of the summaries.
+    ni : int
+        Number of integer components of the summaries.
+
+    Returns
+    -------
+    tuple of bytes
+        The packed summaries and the packed names.
+    """
+    summary_size = nd + (ni + 1) // 2
+    packed = names = b""
+    for doubles, integers, name in summaries:
+        summary = struct.pack(f"<{nd}d", *doubles) + struct.pack(f"<{ni}i", *integers)
+        packed += summary.ljust(summary_size * 8, b"\0")
+        names += name.ljust(summary_size * 8)[: summary_size * 8]
+    return packed, names
+
+
+def write_daf(path, idword, nd, ni, internal_name, arrays):
+    """Write arrays to a new little-endian DAF file.
+
+    All summary and name records come first, followed by the data of the
+    arrays in order.
+
+    Parameters
+    ----------
+    path : Path
+        The DAF file to write.
+    idword : bytes
+        File identification word, e.g. b"DAF/CK  ".
+    nd : int
+        Number of double precision components of the summaries.
+    ni : int
+        Number of integer components of the summaries.
+    internal_name : bytes
+        Internal file name, up to 60 characters.
+    arrays : list of tuple
+        (doubles, integers, name, data) of each array, as from ``read_daf``.
+    """
+    summary_size = nd + (ni + 1) // 2
+    per_record = (DOUBLES_PER_RECORD - 3) // summary_size
+    n_summary_records = max(1, -(-len(arrays) // per_record))
+    # Record numbers are 1-based, the file record is record 1
+    first_data_record = 2 + 2 * n_summary_records
+    address = (first_data_record - 1) * DOUBLES_PER_RECORD + 1
+
+    summaries = []
+    for doubles, integers, name, data in arrays:
+        count = len(data) // 8
+        # Point the summary at the new location of the data
+        addresses = (address, address + count - 1)
+        summaries.append((doubles, (*integers[:-2], *addresses), name))
+        address += count
+    free = address
+
+    with open(path, "wb") as f:
+        file_record = (
+            idword.ljust(8)[:8]
+            + struct.pack("<2i", nd, ni)
+            + internal_name.ljust(60)[:60]
+            # First and last summary records, first free address
+            + struct.pack("<3i", 2, 2 * n_summary_records, free)
+            + b"LTL-IEEE"
+        )
+        file_record = file_record.ljust(699, b"\0") + FTP_STRING
+        f.write(file_record.ljust(RECORD_SIZE, b"\0"))
+
+        for index in range(n_summary_records):
+            chunk = summaries[index * per_record : (index + 1) * per_record]
+            record_number = 2 + 2 * index
+            next_record = record_number + 2 if index < n_summary_records - 1 else 0
+            previous_record = record_number - 2 if index else 0
+            packed, names = _pack_summaries(chunk, nd, ni)
+            record = struct.pack("<3d", next_record, previous_record, len(chunk))
+            f.write((record + packed).ljust(RECORD_SIZE, b"\0"))
+            f.write(names.ljust(RECORD_SIZE))
+
+        for _, _, _, data in arrays:
+            f.write(data)
+        # Pad the last data record
+        f.write(b"\0" * (-f.tell() % RECORD_SIZE))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_summary_format(path):
+    """Read the summary format of a DAF file from its file record.
+
+    Parameters
+    ----------
+    path : Path
+        The DAF file.
+
+    Returns
+    -------
+    tuple of int
+        (nd, ni), the number of double precision and integer components of
+        the summaries.
+    """
+    with open(path, "rb") as f:
+        file_record = f.read(RECORD_SIZE)
+    endian = "<" if file_record[88:96] == b"LTL-IEEE" else ">"
+    return struct.unpack(f"{endian}2i", file_record[8:16])
+
+
+def _read_last_summary_record(f, record_number):
+    """Follow the summary records of a little-endian DAF file to the last one.
+
+    The records are followed rather than trusting the last summary record
+    in the file record, which ``append_daf`` updates last.
+
+    Parameters
+    ----------
+    f : file
+        The open DAF file.
+    record_number : int
+        The first summary record.
+
+    Returns
+    -------
+    tuple
+        The record number, the summary record and the name record of the
+        last summary record.
+    """
+    while True:
+        f.seek((record_number - 1) * RECORD_SIZE)
+        record = bytearray(f.read(RECORD_SIZE))
+        (next_record,) = struct.unpack("<d", record[:8])
+        if not next_record:
+            return record_number, record, bytearray(f.read(RECORD_SIZE))
+        record_number = int(next_record)
+
+
+def _write_record(f, record_number, record):
+    """Write a record of a DAF file in place and flush it to disk.
+
+    Parameters
+    ----------
+    f : file
+        The open DAF file.
+    record_number : int
+        The record to write, 1-based.
+    record : bytes
+        The content of the record.
+    """
+    f.seek((record_number - 1) * RECORD_SIZE)
+    f.write(record)
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def append_daf(path, arrays):
+    """Append arrays to a little-endian DAF file in place.
+
+    Only the file record and the summary records are read. The data and
+    any new summary records are written past the end of the file before
+    the last summary record and the file record are updated to link them,
+    so a failed append leaves at most unreferenced records at the end.
+
+    Parameters
+    ----------
+    path : Path
+        The DAF file, as written by ``write_daf``.
+    arrays : list of tuple
+        (doubles, integers, name, data) of each array, as from ``read_daf``.
+    """
+    with open(path, "r+b") as f:
+        file_record = bytearray(f.read(RECORD_SIZE))
+        if file_record[88:96] != b"LTL-IEEE":
+            raise ValueError(f"{path} is not a little-endian DAF file")
+        nd, ni = struct.unpack("<2i", file_record[8:16])
+        (first_record,) = struct.unpack("<i", file_record[76:80])
+        summary_size = nd + (ni + 1) // 2
+        per_record = (DOUBLES_PER_RECORD - 3) // summary_size
+        last_record, record, names = _read_last_summary_record(f, first_record)
+        n_summaries = int(struct.unpack("<d", record[16:24])[0])
+
+        # Never write over anything already in the file
+        address = -(-f.seek(0, os.SEEK_END) // RECORD_SIZE) * DOUBLES_PER_RECORD + 1
+        f.seek((address - 1) * 8)
+        summaries = []
+        for doubles, integers, name, data in arrays:
+            count = len(data) // 8
+            addresses = (address, address + count - 1)
+            summaries.append((doubles, (*integers[:-2], *addresses), name))
+            f.write(data)
+            address += count
+        f.write(b"\0" * (-f.tell() % RECORD_SIZE))
+
+        # Fill up the last summary record, the rest go in new records
+        fill = per_record - n_summaries
+        chunks = [
+            summaries[index : index + per_record]
+            for index in range(fill, len(summaries), per_record)
+        ]
+        first_new_record = f.tell() // RECORD_SIZE + 1 if chunks else 0
+        previous_record = last_record
+        for index, chunk in enumerate(chunks):
+            record_number = first_new_record + 2 * index
+            next_record = record_number + 2 if index < len(chunks) - 1 else 0
+            packed, chunk_names = _pack_summaries(chunk, nd, ni)
+            header = struct.pack("<3d", next_record, previous_record, len(chunk))
+            f.write((header + packed).ljust(RECORD_SIZE, b"\0"))
+            f.write(chunk_names.ljust(RECORD_SIZE))
+            previous_record = record_number
+        free = f.tell() // 8 + 1
+        f.flush()
+        os.fsync(f.fileno())
+
+        # Link the new arrays, the names first as the count makes them visible
+        packed, new_names = _pack_summaries(summaries[:fill], nd, ni)
+        start = n_summaries * summary_size * 8
+        names[start : start + len(new_names)] = new_names
+        _write_record(f, last_record + 1, names)
+        record[24 + start : 24 + start + len(packed)] = packed
+        record[0:8] = struct.pack("<d", first_new_record)
+        record[16:24] = struct.pack("<d", n_summaries + len(summaries[:fill]))
+        _write_record(f, last_record, record)
+
+        # Last summary record and first free address
+        file_record[80:88] = struct.pack("<2i", previous_record, free)
+        _write_record(f, 1, file_record)
+
+
+def _merge_intervals(intervals):
+    """Merge overlapping and adjacent intervals.
+
+    Parameters
+    ----------
+    intervals : list of tuple
+        (start, end) intervals.
+
+    Returns
+    -------
+    list of list
+        The merged [start, end] intervals, sorted by start.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def get_coverage_report(sources, skipped=()):
+    """Summarize the coverage of the merged kernels.
+
+    Parameters
+    ----------
+    sources : list of dict
+        "file", "start", "end" (ISO format) and "segments" of each merged
+        kernel.
+    skipped : list of dict
+        "file" and "reason" of each kernel that could not be merged.
+
+    Returns
+    -------
+    dict
+        The coverage report.
+    """
+    coverage = _merge_intervals(
+        [(source["start"], source["end"]) for source in sources]
+    )
+    gaps = [
+        [coverage[index][1], coverage[index + 1][0]]
+        for index in range(len(coverage) - 1)
+    ]
+    return {
+        "kernel": MERGED_KERNEL_NAME,
+        "sources": sources,
+        "skipped": list(skipped),
+        "coverage": coverage,
+        "gaps": gaps,
+    }
+
+
+def _write_report(mount_path, report):
+    """Atomically write the coverage report next to the merged kernel.
+
+    Parameters
+    ----------
+    mount_path : Path
+        Directory the kernels are staged in.
+    report : dict
+        The coverage report.
+    """
+    tmp_report_path = mount_path / f".{REPORT_NAME}.{uuid.uuid4().hex}"
+    tmp_report_path.write_text(json.dumps(report, indent=2))
+    os.replace(tmp_report_path, mount_path / REPORT_NAME)
+
+
+def _write_merged_kernel(merged_path, kernel):
+    """Start the merged kernel with the arrays of a first kernel.
+
+    The merged kernel is written next to its final path and renamed, so
+    readers never see a partial kernel.
+
+    Parameters
+    ----------
+    merged_path : Path
+        The merged kernel.
+    kernel : dict
+        The first kernel, as from ``read_daf``.
+    """
+    tmp_path = merged_path.with_name(f".{merged_path.name}.{uuid.uuid4().hex}.part")
+    try:
+        write_daf(
+            tmp_path,
+            b"DAF/CK  ",
+            kernel["nd"],
+            kernel["ni"],
+            b"IMAP merged historical attitude",
+            kernel["arrays"],
+        )
+        os.replace(tmp_path, merged_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def merge_attitude_kernels(mount_path):
+    """Append the historical attitude kernels not yet merged to the merged kernel.
+
+    Parameters
+    ----------
+    mount_path : Path
+        Directory the kernels are staged in.
+
+    Returns
+    -------
+    dict
+        The coverage report.
+    """
+    mount_path = Path(mount_path)
+    merged_path = mount_path / MERGED_KERNEL_NAME
+    report_path = mount_path / REPORT_NAME
+
+    # Only one merge at a time, EFS supports NFSv4 locks
+    with open(mount_path / ".merged_attitude_kernel.lock", "a") as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            sources = []
+            skipped = []
+            summary_format = None
+            if report_path.exists() and merged_path.exists():
+                report = json.loads(report_path.read_text())
+                sources = report["sources"]
+                skipped = report.get("skipped", [])
+                if sources:
+                    summary_format = read_summary_format(merged_path)
+            done_files = {kernel["file"] for kernel in sources + skipped}
+            new_files = sorted(
+                path
+                for path in mount_path.iterdir()
+                if get_coverage(path.name) and path.name not in done_files
+            )
+
+            for path in new_files:
+                try:
+                    kernel = read_daf(path)
+                except ValueError as e:
+                    logger.error(f"{e}, skipped")
+                    skipped.append({"file": path.name, "reason": str(e)})
+                    _write_report(mount_path, get_coverage_report(sources, skipped))
+                    continue
+                if summary_format is None:
+                    _write_merged_kernel(merged_path, kernel)
+                    summary_format = (kernel["nd"], kernel["ni"])
+                elif (kernel["nd"], kernel["ni"]) != summary_format:
+                    logger.error(f"{path} has a different summary format, skipped")
+                    skipped.append(
+                        {"file": path.name, "reason": "different summary format"}
+                    )
+                    _write_report(mount_path, get_coverage_report(sources, skipped))
+                    continue
+                else:
+                    append_daf(merged_path, kernel["arrays"])
+
+                start, end = get_coverage(path.name)
+                sources.append(
+                    {
+                        "file": path.name,
+                        "start": start.isoformat(),
+                        "end": end.isoformat(),
+                        "segments": len(kernel["arrays"]),
+                    }
+                )
+                logger.info(f"Merged {len(kernel['arrays'])} segments of {path}")
+                # Recorded after each kernel, so a failed merge resumes
+                # after the last kernel merged
+                _write_report(mount_path, get_coverage_report(sources, skipped))
+
+            report = get_coverage_report(sources, skipped)
+            if new_files and report["gaps"]:
+                logger.warning(f"Gaps in the merged attitude: {report['gaps']}")
+            return report
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+
+def lambda_handler(event, context):
+    """Merge the staged historical attitude kernels.
+
+    Invoked asynchronously by the EFS write lambda after it stages a
+    historical attitude kernel, the event is not used.
+
+    Parameters
+    ----------
+    event : dict
+        The invocation event.
+    context : LambdaContext
+        The lambda context.
+
+    Returns
+    -------
+    dict
+        The coverage report.
+    """
+    return merge_attitude_kernels(Path(os.getenv("EFS_MOUNT_PATH", "/mnt/spice")))
@@ -1,23 +1,44 @@
-"""Functions for EFS lambdas."""
+"""Functions for EFS lambdas.
 
+Kernels are staged atomically so that processing jobs reading from the EFS
+never see a partial kernel or a missing symlink. Each kernel is downloaded
+into a temporary file on the EFS itself, verified against the size and ETag
+of the S3 object, flushed to disk and only then renamed into place. The
+"latest" symlinks are swapped by renaming a new symlink over the old one,
+so the link always points at a complete kernel.
+"""
+
+import hashlib
 import logging
 import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import boto3
 
+from . import attitude_merge
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # Define the paths
-mount_path = Path(os.getenv("EFS_MOUNT_PATH"))
+mount_path = Path(os.getenv("EFS_MOUNT_PATH", "/mnt/spice"))
 
 attitude_symlink_path = mount_path / "latest_attitude_kernel.ah.a"
 ephemeris_symlink_path = mount_path / "latest_ephemeris_kernel.bsp"
 
+# Kernels larger than this are downloaded in byte ranges in parallel
+CHUNK_SIZE = 16 * 1024 * 1024
+MAX_WORKERS = 8
+
 
 def create_symlink(source_path: Path, destination_path: Path) -> None:
-    """Create a symlink from source_path to destination_path.
+    """Atomically point the symlink at destination_path to source_path.
+
+    A new symlink is created next to the old one and renamed over it,
+    so readers see either the old or the new target, never a missing link.
 
     Parameters
     ----------
@@ -27,14 +48,163 @@ def create_symlink(source_path: Path, destination_path: Path) -> None:
         Destination path of the symlink
 
     """
-    # Remove the old symlink
-    destination_path.unlink(missing_ok=True)
+    tmp_path = destination_path.with_name(
+        f".{destination_path.name}.{uuid.uuid4().hex}"
+    )
+    tmp_path.symlink_to(source_path)
+    try:
+        os.replace(tmp_path, destination_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    _fsync_directory(destination_path.parent)
+
+
+def _fsync_directory(path: Path) -> None:
+    """Flush the entries of a directory to disk.
+
+    Parameters
+    ----------
+    path : Path
+        The directory
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
 
-    # Create a new symlink pointing to the new file
-    destination_path.symlink_to(source_path)
+def verify_download(file_path: Path, size: int, etag: str) -> None:
+    """Verify a downloaded file against its S3 object.
 
+    The ETag of an object uploaded in a single part is the MD5 of its
+    content. Multipart ETags depend on the part size of the upload,
+    so only the size is checked for those.
 
-def write_data_to_efs(s3_key: str, s3_bucket: str):
+    Parameters
+    ----------
+    file_path : Path
+        The downloaded file
+    size : int
+        Size of the S3 object in bytes
+    etag : str
+        ETag of the S3 object
+
+    Raises
+    ------
+    ValueError
+        If the file does not match the object.
+    """
+    actual_size = file_path.stat().st_size
+    if actual_size != size:
+        raise ValueError(f"Downloaded {actual_size} bytes, expected {size}")
+
+    etag = etag.strip('"')
+    if "-" in etag:
+        return
+    md5 = hashlib.md5()  # noqa: S324 (S3 ETags are MD5)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            md5.update(chunk)
+    if md5.hexdigest() != etag:
+        raise ValueError(f"MD5 {md5.hexdigest()} does not match the ETag {etag}")
+
+
+def _download(s3_client, s3_bucket, s3_key, etag, size, file_path, chunk_size):
+    """Stream an S3 object into a file, in parallel byte ranges if large.
+
+    Parameters
+    ----------
+    s3_client : botocore.client.S3
+        S3 client
+    s3_bucket : str
+        The S3 bucket
+    s3_key : str
+        S3 object key
+    etag : str
+        ETag of the object, the download fails if the object changes
+    size : int
+        Size of the object in bytes
+    file_path : Path
+        The file to write
+    chunk_size : int
+        Size of the byte ranges
+    """
+    with open(file_path, "wb") as f:
+        if size <= chunk_size:
+            response = s3_client.get_object(Bucket=s3_bucket, Key=s3_key, IfMatch=etag)
+            shutil.copyfileobj(response["Body"], f, 1024 * 1024)
+        else:
+            # Allocate the file so each range can be written at its offset
+            f.truncate(size)
+            fd = f.fileno()
+
+            def download_range(offset):
+                end = min(offset + chunk_size, size) - 1
+                response = s3_client.get_object(
+                    Bucket=s3_bucket,
+                    Key=s3_key,
+                    IfMatch=etag,
+                    Range=f"bytes={offset}-{end}",
+                )
+                position = offset
+                for chunk in response["Body"].iter_chunks(1024 * 1024):
+                    position += os.pwrite(fd, chunk, position)
+
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                # list() re-raises the first failure
+                list(executor.map(download_range, range(0, size, chunk_size)))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def stage_file(
+    s3_key: str,
+    s3_bucket: str,
+    destination_path: Path,
+    s3_client=None,
+    chunk_size: int = CHUNK_SIZE,
+) -> None:
+    """Atomically download an S3 object to destination_path.
+
+    The object is downloaded into a temporary file in the same directory,
+    verified, flushed and renamed over the destination, so the destination
+    is never a partial file.
+
+    Parameters
+    ----------
+    s3_key : str
+        S3 object key
+    s3_bucket : str
+        The S3 bucket
+    destination_path : Path
+        Final path of the file
+    s3_client : botocore.client.S3, optional
+        S3 client
+    chunk_size : int, optional
+        Objects larger than this are downloaded in parallel ranges of this size
+    """
+    s3_client = s3_client or boto3.client("s3")
+    head = s3_client.head_object(Bucket=s3_bucket, Key=s3_key)
+    etag = head["ETag"]
+    size = head["ContentLength"]
+
+    # The temporary file must be on the same file system for the rename
+    tmp_path = destination_path.with_name(
+        f".{destination_path.name}.{uuid.uuid4().hex}.part"
+    )
+    try:
+        _download(s3_client, s3_bucket, s3_key, etag, size, tmp_path, chunk_size)
+        verify_download(tmp_path, size, etag)
+        os.replace(tmp_path, destination_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    _fsync_directory(destination_path.parent)
+    logger.info(f"Staged s3://{s3_bucket}/{s3_key} at {destination_path}")
+
+
+def write_data_to_efs(s3_key: str, s3_bucket: str, s3_client=None, lambda_client=None):
     """Write data to EFS and create/update symlink.
 
     Parameters
@@ -43,24 +213,20 @@ def write_data_to_efs(s3_key: str, s3_bucket: str):
         S3 object key
     s3_bucket : str
         The S3 bucket
+    s3_client : botocore.client.S3, optional
+        S3 client
+    lambda_client : botocore.client.Lambda, optional
+        Lambda client, to start the attitude merge
 
     """
     filename = os.path.basename(s3_key)
 
-    # Create an S3 client
-    s3_client = boto3.client("s3")
-
     # Download the file to the mount directory. Eg. /mnt/efs
     download_path = mount_path / filename
 
-    try:
-        # Download the file from S3
-        s3_client.download_file(s3_bucket, s3_key, download_path)
-        logger.debug(f"File downloaded: {download_path}")
-    except Exception as e:
-        logger.error(f"Error downloading file: {e!s}")
-
-    logger.debug("After downloading file: %s", os.listdir(mount_path))
+    # Failures are raised so the symlinks are never pointed at a bad file
+    # and the invocation is retried
+    stage_file(s3_key, s3_bucket, download_path, s3_client=s3_client)
 
     # TODO: we only want historical attitude kernels delivery
     #  following each track (3/wk)
@@ -94,6 +260,16 @@ def write_data_to_efs(s3_key: str, s3_bucket: str):
     elif filename.startswith("imap_pred") and filename.endswith(".bsp"):
         create_symlink(download_path, ephemeris_symlink_path)
 
+    if attitude_merge.get_coverage(filename):
+        # Append the new historical attitude to the merged attitude kernel
+        # in the merge lambda, outside of this invocation. A failed merge is
+        # retried, and the merge picks up every kernel not merged yet.
+        lambda_client = lambda_client or boto3.client("lambda")
+        lambda_client.invoke(
+            FunctionName=os.environ["ATTITUDE_MERGE_FUNCTION_NAME"],
+            InvocationType="Event",
+        )
+
 
 def lambda_handler(event, context):
     """Lambda  is triggered by eventbridge.
@@ -189,6 +189,19 @@ def build_sds(
         layers=[db_lambda_layer],
     )
 
+    # Jobs whose resource profile needs the EC2 compute environments
+    # are submitted to the heavy job queue
+    job_resources = processing_construct.load_job_resources()
+    # "swe" or "swe-l3"
+    job_names = [
+        f"{instrument.lower()}{step}"
+        for instrument in imap_data_access.VALID_INSTRUMENTS
+        for step in ["", "-l3"]
+    ]
+    heavy_job_definitions = processing_construct.get_heavy_job_definitions(
+        job_resources, job_names
+    )
+
     sds_api_manager_construct.SdsApiManager(
         scope=sdc_stack,
         construct_id="SdsApiManager",
@@ -200,6 +213,7 @@ def build_sds(
         rds_security_group=rds_construct.rds_security_group,
         db_secret_name=db_secret_name,
         layers=[db_lambda_layer],
+        heavy_job_definitions=heavy_job_definitions,
     )
 
     # create EFS
@@ -216,15 +230,27 @@ def build_sds(
             container_path="/mnt/spice",
             enable_transit_encryption=True,
             transit_encryption_port=2049,
-        )
+        ),
+        batch.EfsVolume(
+            name="input-cache-ECS-mount",
+            access_point_id=efs_instance.input_cache_access_point.access_point_id,
+            file_system=efs_instance.efs,
+            container_path="/mnt/input-cache",
+            enable_transit_encryption=True,
+            transit_encryption_port=2049,
+            readonly=False,
+        ),
     ]
     processing = processing_construct.ProcessingConstruct(
-        sdc_stack, "ProcessingConstruct", vpc=networking.vpc, volumes=processing_volumes
+        sdc_stack,
+        "ProcessingConstruct",
+        vpc=networking.vpc,
+        volumes=processing_volumes,
+        data_bucket=data_bucket.data_bucket,
+        job_resources=job_resources,
     )
-    for instrument in imap_data_access.VALID_INSTRUMENTS:
-        for step in ["", "-l3"]:
-            # "swe" or "swe-l3"
-            processing.add_job(f"{instrument.lower()}{step}")
+    for job_name in job_names:
+        processing.add_job(job_name)
 
     # Create SQS pipeline for each instrument and add it to instrument_sqs
     instrument_sqs = sqs_construct.SqsConstruct(
@@ -245,6 +271,7 @@ def build_sds(
         vpc=networking.vpc,
         sqs_queue=instrument_sqs,
         layers=[db_lambda_layer],
+        heavy_job_definitions=heavy_job_definitions,
     )
 
     # Create lambda that mounts EFS and writes data to EFS
@@ -277,6 +304,14 @@ def build_sds(
             scope=ialirt_stack, construct_id="IAlirtBucket", env=env
         )
 
+        # I-ALiRT IOIS ingest lambda (facilitates s3 to dynamodb)
+        ialirt_ingest = ialirt_ingest_lambda_construct.IalirtIngestLambda(
+            scope=ialirt_stack,
+            construct_id="IalirtIngestLambda",
+            ialirt_bucket=ialirt_bucket.ialirt_bucket,
+            api=api,
+        )
+
         # All traffic to I-ALiRT is directed to listed container ports
         ialirt_ports = {"Primary": [8080, 8081], "Secondary": [80]}
         container_ports = {"Primary": 8080, "Secondary": 80}
@@ -291,15 +326,9 @@ def build_sds(
                 ialirt_ports=ialirt_ports[primary_or_secondary],
                 container_port=container_ports[primary_or_secondary],
                 ialirt_bucket=ialirt_bucket.ialirt_bucket,
+                packet_table=ialirt_ingest.packet_data_table,
             )
 
-        # I-ALiRT IOIS ingest lambda (facilitates s3 to dynamodb)
-        ialirt_ingest_lambda_construct.IalirtIngestLambda(
-            scope=ialirt_stack,
-            construct_id="IalirtIngestLambda",
-            ialirt_bucket=ialirt_bucket.ialirt_bucket,
-        )
-
 
 def build_backup(scope: App, env: Environment, source_account: str):
     """Build backup bucket with permissions for replication from source_account.
@@ -0,0 +1,76 @@
+"""Tests for the EFS input cache."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import efs_cache
+
+from .conftest import BUCKET_NAME
+
+KEY = "imap/swe/l1a/2024/01/imap_swe_l1a_sci_20240101_v001.cdf"
+
+
+def test_read_through(s3_client, tmp_path):
+    """Test filling the cache on a miss and serving hits from it."""
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=KEY, Body=b"version 1")
+    cache = efs_cache.InputCache(tmp_path, s3_client=s3_client)
+
+    path = cache.get(BUCKET_NAME, KEY)
+    assert path.name == "imap_swe_l1a_sci_20240101_v001.cdf"
+    assert path.read_bytes() == b"version 1"
+    assert cache.get(BUCKET_NAME, KEY) == path
+    assert cache.metrics == {
+        "hits": 1,
+        "misses": 1,
+        "bytes_read": 18,
+        "bytes_filled": 9,
+    }
+    # Nothing is left behind from the fill
+    assert list(cache.tmp_dir.iterdir()) == []
+
+    # A new version of the object is a new entry
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=KEY, Body=b"version 2")
+    new_path = cache.get(BUCKET_NAME, KEY)
+    assert new_path != path
+    assert new_path.read_bytes() == b"version 2"
+    assert cache.metrics["misses"] == 2
+
+    document = cache.log_metrics()
+    assert document["_aws"]["CloudWatchMetrics"][0]["Namespace"] == ("IMAP/InputCache")
+    assert document["hits"] == 1
+
+
+def test_lru_eviction(s3_client, tmp_path):
+    """Test evicting the least recently used entries over the budget."""
+    cache = efs_cache.InputCache(tmp_path, budget_bytes=25, s3_client=s3_client)
+    paths = {}
+    for index, name in enumerate(["a", "b", "c"]):
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=name, Body=b"0123456789")
+        paths[name] = cache.get(BUCKET_NAME, name)
+        os.utime(paths[name], (index, index))
+
+    # "c" pushed the cache over budget, so "a" was evicted
+    assert not paths["a"].exists()
+    assert paths["b"].exists()
+    assert paths["c"].exists()
+
+    # Using "b" makes "c" the least recently used
+    cache.get(BUCKET_NAME, "b")
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="d", Body=b"0123456789")
+    cache.get(BUCKET_NAME, "d")
+    assert paths["b"].exists()
+    assert not paths["c"].exists()
+
+
+def test_concurrent_fill(s3_client, tmp_path):
+    """Test that concurrent readers fill an entry once."""
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=KEY, Body=b"x" * 100_000)
+    cache = efs_cache.InputCache(tmp_path, s3_client=s3_client)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = set(executor.map(lambda _: cache.get(BUCKET_NAME, KEY), range(8)))
+
+    assert len(paths) == 1
+    assert paths.pop().stat().st_size == 100_000
+    assert cache.metrics["misses"] == 1
+    assert cache.metrics["hits"] == 7
@@ -0,0 +1,82 @@
+"""Tests for memory-mapped access to the SPICE kernels."""
+
+import struct
+
+import kernel_access
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    """Start every test without cached symlinks or kernels."""
+    kernel_access.resolve_kernel.cache_clear()
+    yield
+    for kernel in kernel_access._kernels.values():
+        kernel.close()
+    kernel_access._kernels.clear()
+
+
+def make_spk(path, n_segments, data_records):
+    """Write an SPK with summaries in record 2 and filler data after."""
+    file_record = (
+        b"DAF/SPK "
+        + struct.pack("<2i", 2, 6)
+        + b"test".ljust(60)
+        + struct.pack("<3i", 2, 2, 4)
+        + b"LTL-IEEE"
+    ).ljust(kernel_access.DAF_RECORD_SIZE, b"\0")
+    summary_record = struct.pack("<3d", 0, 0, n_segments).ljust(
+        kernel_access.DAF_RECORD_SIZE, b"\0"
+    )
+    path.write_bytes(
+        file_record
+        + summary_record
+        + bytes(kernel_access.DAF_RECORD_SIZE * (data_records + 1))
+    )
+
+
+def test_open_kernel_resolves_once(tmp_path):
+    """Test that a symlink is resolved once and the kernel is cached."""
+    make_spk(tmp_path / "first.bsp", 1, 10)
+    make_spk(tmp_path / "second.bsp", 2, 10)
+    symlink = tmp_path / "latest_ephemeris_kernel.bsp"
+    symlink.symlink_to(tmp_path / "first.bsp")
+
+    kernel = kernel_access.open_kernel(symlink)
+    assert kernel.path == tmp_path / "first.bsp"
+
+    # The EFS lambda swaps the symlink, this process keeps its kernel
+    symlink.unlink()
+    symlink.symlink_to(tmp_path / "second.bsp")
+    assert kernel_access.open_kernel(symlink) is kernel
+    assert kernel_access.open_kernel(tmp_path / "first.bsp") is kernel
+
+
+def test_bytes_touched(tmp_path):
+    """Test that only the pages that are read are counted."""
+    make_spk(tmp_path / "test.bsp", 3, 1000)
+    kernel = kernel_access.open_kernel(tmp_path / "test.bsp")
+    assert kernel.bytes_touched == 0
+
+    assert kernel_access.read_daf_summaries(kernel) == 3
+    # The file and summary records share the first page
+    assert kernel.bytes_touched == kernel_access.PAGE_SIZE
+
+    view = kernel.read(len(kernel) - 8, 100)
+    assert view.readonly
+    assert len(view) == 8
+    assert kernel_access.get_access_report() == {
+        str(tmp_path / "test.bsp"): {
+            "size": len(kernel),
+            "bytes_touched": 2 * kernel_access.PAGE_SIZE,
+        }
+    }
+
+
+def test_benchmark(tmp_path):
+    """Test the mapped access touches less than a full read."""
+    make_spk(tmp_path / "test.bsp", 3, 1000)
+    result = kernel_access.benchmark(tmp_path / "test.bsp")
+    assert result["segments"] == 3
+    assert result["full_read"]["bytes"] == (tmp_path / "test.bsp").stat().st_size
+    assert result["mapped"]["bytes"] == kernel_access.PAGE_SIZE
@@ -1,19 +1,62 @@
-"""Module for testing API utilities."""
+"""Module for testing API utilities.
+
+Downloads are streamed to disk in chunks. Files larger than one chunk are
+fetched with byte-range requests in parallel, and the chunks that completed
+are recorded next to the partial file so that a failed download resumes where
+it stopped. Uploads larger than one part go through a multipart upload with
+the parts sent concurrently. All requests share a pooled ``requests.Session``
+and are retried with exponential backoff.
+
+Batch array jobs are started with ``--array-manifest <s3 uri>`` only. Each
+child reads its own command from the manifest, at the index batch sets in
+``AWS_BATCH_JOB_ARRAY_INDEX``. The inputs of a job can be downloaded from its
+``--dependency-manifest``.
+"""
 
 import argparse
+import base64
+import hashlib
 import json
 import logging
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+DEFAULT_API_ENDPOINT = "https://api.dev.imap-mission.com"
+
+# Size of the byte ranges that downloads are split into
+CHUNK_SIZE = 8 * 1024 * 1024
+# Size of the parts of multipart uploads, S3 requires at least 5 MiB
+PART_SIZE = 16 * 1024 * 1024
+# Concurrent requests per file, and concurrent files
+MAX_WORKERS = 8
+# Attempts of each request before giving up
+MAX_RETRIES = 5
+# Seconds to wait before the first retry, doubled every retry
+RETRY_BACKOFF = 0.5
+TIMEOUT = 60
+# Index of the child of an array job, set by batch
+ARRAY_INDEX_VARIABLE = "AWS_BATCH_JOB_ARRAY_INDEX"
 
-def _parse_args():
+
+def _parse_args(args=None):
     """Parse the command line arguments.
 
+    Parameters
+    ----------
+    args : list of str, optional
+        The arguments, those of the command line by default.
+
     Returns
     -------
     args : argparse.Namespace
@@ -51,33 +94,76 @@ def _parse_args():
         required=True,
         help="Dependency information in JSON format.",
     )
+    parser.add_argument(
+        "--dependency-manifest",
+        type=str,
+        help="S3 URI of the manifest of the input files.",
+    )
     parser.add_argument("--api_endpoint", type=str, help=api_endpoint_help)
-    args = parser.parse_args()
+    args = parser.parse_args(args)
 
     return args
 
 
-def download(s3_uri, api_endpoint="https://api.dev.imap-mission.com"):
-    """Download a file from a given S3 URI via the specified API endpoint.
+def create_session(pool_size=MAX_WORKERS):
+    """Create a session that reuses connections across requests.
 
     Parameters
     ----------
-    s3_uri : str
-        The S3 URI of the file to be downloaded.
-    api_endpoint : str, optional
-        The API endpoint to use for downloading the file.
+    pool_size : int, optional
+        Number of connections to keep open per host.
 
     Returns
     -------
-    file_name_and_path : str
-        The file path where the downloaded file is saved.
+    requests.Session
+        The session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
+
+def _with_retries(request, description):
+    """Call ``request`` until it succeeds, backing off between attempts.
+
+    Parameters
+    ----------
+    request : callable
+        Function making the request, it should raise on failure.
+    description : str
+        What is being requested, for the log messages.
+
+    Returns
+    -------
+    object
+        The return value of ``request``.
     """
-    logger.info(f"Starting download from S3 URI: {s3_uri}")
+    for attempt in range(MAX_RETRIES):
+        try:
+            return request()
+        except (requests.RequestException, OSError) as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            delay = RETRY_BACKOFF * 2**attempt
+            logger.warning(f"{description} failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
+
 
-    url_with_parameters = f"{api_endpoint}/download?{s3_uri}"
-    response = requests.get(url_with_parameters, timeout=60)
+def get_local_path(s3_uri):
+    """Get the local path a file from S3 is downloaded to.
 
+    Parameters
+    ----------
+    s3_uri : str
+        The S3 URI of the file.
+
+    Returns
+    -------
+    Path
+        The local path of the file.
+    """
     # Set the base directory
     base_directory = Path("/mnt/data")
 
@@ -85,59 +171,518 @@ def download(s3_uri, api_endpoint="https://api.dev.imap-mission.com"):
         base_directory = Path.cwd()
 
     # Join the base directory with the file name
-    file_name_and_path = base_directory / Path(s3_uri.replace("s3://", ""))
+    return base_directory / Path(s3_uri.replace("s3://", ""))
+
+
+def get_download_url(s3_uri, api_endpoint, session):
+    """Get the pre-signed url of a file from the download API.
+
+    Parameters
+    ----------
+    s3_uri : str
+        The S3 URI of the file.
+    api_endpoint : str
+        The API endpoint.
+    session : requests.Session
+        The session to make the request with.
+
+    Returns
+    -------
+    str
+        Pre-signed url of the file.
+    """
+    # Strip off the bucket to get the key
+    s3_key = s3_uri.replace("s3://", "").split("/", 1)[1]
+
+    def request():
+        response = session.get(
+            f"{api_endpoint}/download/{s3_key}",
+            allow_redirects=False,
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.headers["Location"]
+
+    return _with_retries(request, f"Download url of {s3_uri}")
+
+
+def compute_md5(file_path, offset=0, size=None):
+    """Compute the MD5 digest of a file, or a part of it.
+
+    Parameters
+    ----------
+    file_path : str or Path
+        The file.
+    offset : int, optional
+        Start of the part in bytes.
+    size : int, optional
+        Size of the part in bytes, by default the rest of the file.
+
+    Returns
+    -------
+    bytes
+        MD5 digest.
+    """
+    md5 = hashlib.md5()  # noqa: S324 (used as a checksum, as S3 does)
+    remaining = math.inf if size is None else size
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        while remaining > 0:
+            chunk = f.read(int(min(CHUNK_SIZE, remaining)))
+            if not chunk:
+                break
+            md5.update(chunk)
+            remaining -= len(chunk)
+    return md5.digest()
+
+
+def verify_checksum(file_path, size, etag):
+    """Check a downloaded file against the size and ETag S3 reported.
+
+    The ETag of an object uploaded in one request is the MD5 of its content.
+    The ETag of a multipart upload ("<digest>-<parts>") depends on the part
+    sizes, which are unknown, so only the size is checked for those; S3 has
+    already checked each part against its Content-MD5 on upload.
+
+    Parameters
+    ----------
+    file_path : str or Path
+        The downloaded file.
+    size : int
+        Size of the object in bytes.
+    etag : str or None
+        ETag of the object.
+
+    Raises
+    ------
+    ValueError
+        If the file does not match.
+    """
+    actual_size = os.path.getsize(file_path)
+    if actual_size != size:
+        raise ValueError(f"{file_path} has {actual_size} bytes, expected {size}")
+    etag = (etag or "").strip('"')
+    if etag and "-" not in etag and compute_md5(file_path).hex() != etag:
+        raise ValueError(f"{file_path} does not match its ETag {etag}")
+
+
+def _download_ranges(session, url, first_response, part_path, chunk_size, max_workers):
+    """Download a file in byte ranges, in parallel, resuming a partial download.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session to make the requests with.
+    url : str
+        Pre-signed url of the file.
+    first_response : requests.Response
+        Response to the request of the first byte range.
+    part_path : Path
+        Partial file the ranges are written to.
+    chunk_size : int
+        Size in bytes of the byte ranges.
+    max_workers : int
+        Maximum number of byte ranges fetched at the same time.
+
+    Returns
+    -------
+    int
+        Size of the file in bytes.
+    """
+    etag = first_response.headers.get("ETag")
+    size = int(first_response.headers["Content-Range"].split("/")[-1])
+    state_path = Path(f"{part_path}.json")
+    state = {"etag": etag, "size": size, "done": []}
+    if state_path.exists() and part_path.exists():
+        previous = json.loads(state_path.read_text())
+        # Only resume if the object did not change
+        if (previous["etag"], previous["size"]) == (etag, size):
+            state = previous
+            logger.info(f"Resuming download of {part_path}")
+    if not state["done"]:
+        # Allocate the whole file so chunks can be written at their offset
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    done = set(state["done"])
+    state_lock = threading.Lock()
+
+    def write_chunk(offset, content):
+        with open(part_path, "r+b") as f:
+            f.seek(offset)
+            f.write(content)
+        with state_lock:
+            done.add(offset)
+            state["done"] = sorted(done)
+            state_path.write_text(json.dumps(state))
+
+    def fetch_chunk(offset):
+        end = min(offset + chunk_size, size) - 1
+
+        def request():
+            response = session.get(
+                url, headers={"Range": f"bytes={offset}-{end}"}, timeout=TIMEOUT
+            )
+            response.raise_for_status()
+            if len(response.content) != end - offset + 1:
+                raise OSError(f"Incomplete range {offset}-{end} of {part_path}")
+            return response.content
+
+        write_chunk(offset, _with_retries(request, f"Range {offset}-{end}"))
+
+    if 0 not in done:
+        write_chunk(0, first_response.content)
+    offsets = [offset for offset in range(0, size, chunk_size) if offset not in done]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() re-raises the first failure
+        list(executor.map(fetch_chunk, offsets))
+    return size
+
+
+def download(
+    s3_uri,
+    api_endpoint=DEFAULT_API_ENDPOINT,
+    session=None,
+    chunk_size=CHUNK_SIZE,
+    max_workers=MAX_WORKERS,
+):
+    """Download a file from a given S3 URI via the specified API endpoint.
+
+    The file is written to ``<name>.part`` and only renamed once it is
+    complete and verified. The chunks that completed are recorded in
+    ``<name>.part.json``, so calling this again after a failure only fetches
+    the missing chunks, as long as the object did not change in between.
+
+    Parameters
+    ----------
+    s3_uri : str
+        The S3 URI of the file to be downloaded.
+    api_endpoint : str, optional
+        The API endpoint to use for downloading the file.
+    session : requests.Session, optional
+        Session to make the requests with, by default a new pooled session.
+    chunk_size : int, optional
+        Size in bytes of the byte ranges that are fetched in parallel.
+    max_workers : int, optional
+        Maximum number of byte ranges fetched at the same time.
+
+    Returns
+    -------
+    file_name_and_path : str
+        The file path where the downloaded file is saved.
+
+    """
+    logger.info(f"Starting download from S3 URI: {s3_uri}")
+    session = session or create_session(max_workers)
+    url = get_download_url(s3_uri, api_endpoint, session)
 
+    file_name_and_path = get_local_path(s3_uri)
     # Make parent directories if they don't exist
     file_name_and_path.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(file_name_and_path, "wb") as file:
-        file.write(response.content)
+    part_path = file_name_and_path.with_name(file_name_and_path.name + ".part")
+
+    # The first chunk tells us the size of the file and whether the server
+    # supports range requests
+    def first_request():
+        response = session.get(
+            url,
+            headers={"Range": f"bytes=0-{chunk_size - 1}"},
+            stream=True,
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        return response
+
+    response = _with_retries(first_request, f"Download of {s3_uri}")
+    etag = response.headers.get("ETag")
+
+    if response.status_code == 206:
+        size = _download_ranges(
+            session, url, response, part_path, chunk_size, max_workers
+        )
+    else:
+        # No range support, stream the whole file
+        size = int(response.headers["Content-Length"])
+        with open(part_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                f.write(chunk)
+
+    verify_checksum(part_path, size, etag)
+    os.replace(part_path, file_name_and_path)
+    Path(f"{part_path}.json").unlink(missing_ok=True)
 
     logger.info(f"File downloaded and saved to: {file_name_and_path}")
 
     return str(file_name_and_path)
 
 
-def upload(local_file_location, api_endpoint="https://api.dev.imap-mission.com"):
+def download_dependencies(
+    s3_uris, api_endpoint=DEFAULT_API_ENDPOINT, max_workers=MAX_WORKERS
+):
+    """Download several files concurrently.
+
+    Parameters
+    ----------
+    s3_uris : list of str
+        The S3 URIs of the files to be downloaded.
+    api_endpoint : str, optional
+        The API endpoint to use for downloading the files.
+    max_workers : int, optional
+        Maximum number of files downloaded at the same time.
+
+    Returns
+    -------
+    list of str
+        The file paths of the downloaded files, in the order of ``s3_uris``.
+    """
+    # One pool of connections shared by all of the downloads
+    session = create_session(max_workers * 2)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                lambda s3_uri: download(s3_uri, api_endpoint, session=session),
+                s3_uris,
+            )
+        )
+
+
+def read_manifest(s3_uri, api_endpoint=DEFAULT_API_ENDPOINT, session=None):
+    """Download a JSON manifest written by the batch starter.
+
+    Parameters
+    ----------
+    s3_uri : str
+        The S3 URI of the manifest.
+    api_endpoint : str, optional
+        The API endpoint to use for downloading the manifest.
+    session : requests.Session, optional
+        Session to make the requests with.
+
+    Returns
+    -------
+    dict
+        The manifest.
+    """
+    with open(download(s3_uri, api_endpoint, session=session)) as f:
+        return json.load(f)
+
+
+def get_array_command(array_manifest, api_endpoint=DEFAULT_API_ENDPOINT, session=None):
+    """Get the command of this child of an array job.
+
+    Parameters
+    ----------
+    array_manifest : str
+        The S3 URI of the manifest of the array job.
+    api_endpoint : str, optional
+        The API endpoint to use for downloading the manifest.
+    session : requests.Session, optional
+        Session to make the requests with.
+
+    Returns
+    -------
+    list of str
+        The command of the child.
+    """
+    manifest = read_manifest(array_manifest, api_endpoint, session)
+    index = int(os.environ[ARRAY_INDEX_VARIABLE])
+    return manifest["jobs"][index]["command"]
+
+
+def download_inputs(dependency_manifest, api_endpoint=DEFAULT_API_ENDPOINT):
+    """Download the input files listed in the manifest of a job.
+
+    Parameters
+    ----------
+    dependency_manifest : str
+        The S3 URI of the input manifest, in the bucket of the inputs.
+    api_endpoint : str, optional
+        The API endpoint to use for downloading the files.
+
+    Returns
+    -------
+    list of str
+        The file paths of the downloaded inputs.
+    """
+    manifest = read_manifest(dependency_manifest, api_endpoint)
+    bucket = dependency_manifest.replace("s3://", "").split("/", 1)[0]
+    return download_dependencies(
+        [f"s3://{bucket}/{item['file_path']}" for item in manifest["inputs"]],
+        api_endpoint,
+    )
+
+
+def _put(session, url, file_path, offset, size, description):
+    """Upload a file, or a part of it, to a pre-signed url.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The session to make the request with.
+    url : str
+        Pre-signed url.
+    file_path : Path
+        The file to upload.
+    offset : int
+        Start of the part in bytes.
+    size : int
+        Size of the part in bytes.
+    description : str
+        What is being uploaded, for the log messages.
+
+    Returns
+    -------
+    str
+        ETag of the uploaded object or part.
+    """
+    # S3 rejects the upload if the content does not match this checksum
+    content_md5 = base64.b64encode(compute_md5(file_path, offset, size)).decode()
+
+    def request():
+        with open(file_path, "rb") as f:
+            f.seek(offset)
+            response = session.put(
+                url,
+                data=f.read(size),
+                headers={"Content-MD5": content_md5},
+                timeout=TIMEOUT,
+            )
+        response.raise_for_status()
+        return response.headers.get("ETag")
+
+    return _with_retries(request, description)
+
+
+def upload(
+    local_file_location,
+    api_endpoint=DEFAULT_API_ENDPOINT,
+    session=None,
+    part_size=PART_SIZE,
+    max_workers=MAX_WORKERS,
+):
     """Upload a local file to a remote server using the specified API endpoint.
 
+    Files larger than ``part_size`` are uploaded with a multipart upload.
+
     Parameters
     ----------
     local_file_location : str
         The file path of the file to be uploaded.
     api_endpoint : str, optional
         The API endpoint to use for uploading the file.
+    session : requests.Session, optional
+        Session to make the requests with, by default a new pooled session.
+    part_size : int, optional
+        Size in bytes of the parts of a multipart upload.
+    max_workers : int, optional
+        Maximum number of parts uploaded at the same time.
 
     """
     logger.info(f"Starting upload for file: {local_file_location}")
+    session = session or create_session(max_workers)
 
     local_file_path = Path(local_file_location)
     remote_file_name = local_file_path.name
+    size = local_file_path.stat().st_size
 
     # Modify descriptor in file name
     modified_file_name = remote_file_name.replace(
         remote_file_name[12:15], f"{remote_file_name[12:15]}-test"
     )
-    # Upload the file
-    url_with_parameters = f"{api_endpoint}/upload?filename={modified_file_name}"
-    get_response = requests.get(url_with_parameters, timeout=60)
-    upload_url = get_response.json()
-    requests.put(upload_url, timeout=60)
-
-    logger.info(f"File uploaded: {modified_file_name}")
-
+    url_with_parameters = f"{api_endpoint}/upload/{modified_file_name}"
+    parts = math.ceil(size / part_size)
+
+    if parts <= 1:
+        get_response = session.get(url_with_parameters, timeout=TIMEOUT)
+        get_response.raise_for_status()
+        upload_url = get_response.json()
+        _put(session, upload_url, local_file_path, 0, size, modified_file_name)
+        logger.info(f"File uploaded: {modified_file_name}")
+        return
+
+    get_response = session.get(
+        url_with_parameters, params={"parts": parts}, timeout=TIMEOUT
+    )
+    get_response.raise_for_status()
+    multipart = get_response.json()
+    part_urls = list(multipart["part_urls"])
+    try:
+        # The urls of large uploads come in pages
+        while multipart.get("next_part") is not None:
+            get_response = session.get(
+                url_with_parameters,
+                params={
+                    "parts": parts,
+                    "upload_id": multipart["upload_id"],
+                    "first_part": multipart["next_part"],
+                },
+                timeout=TIMEOUT,
+            )
+            get_response.raise_for_status()
+            multipart = get_response.json()
+            part_urls += multipart["part_urls"]
+    except Exception:
+        session.delete(multipart["abort_url"], timeout=TIMEOUT)
+        raise
+
+    def upload_part(part_number):
+        offset = (part_number - 1) * part_size
+        return _put(
+            session,
+            part_urls[part_number - 1],
+            local_file_path,
+            offset,
+            min(part_size, size - offset),
+            f"Part {part_number} of {modified_file_name}",
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            etags = list(executor.map(upload_part, range(1, parts + 1)))
+        complete = "".join(
+            f"<Part><PartNumber>{part_number}</PartNumber><ETag>{etag}</ETag></Part>"
+            for part_number, etag in enumerate(etags, start=1)
+        )
+        response = session.post(
+            multipart["complete_url"],
+            data=f"<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>",
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        # S3 can report a failure to complete in the body of a 200 response
+        if "<Error>" in response.text:
+            raise OSError(f"Failed to complete the upload: {response.text}")
+    except Exception:
+        # Don't leave the uploaded parts behind
+        session.delete(multipart["abort_url"], timeout=TIMEOUT)
+        raise
+
+    logger.info(f"File uploaded in {parts} parts: {modified_file_name}")
+
+
+def main(args=None):
+    """Parse args and perform an upload via the API.
 
-def main():
-    """Parse args and perform an upload via the API."""
-    args = _parse_args()
+    Parameters
+    ----------
+    args : list of str, optional
+        The arguments, those of the command line by default.
+    """
+    args = sys.argv[1:] if args is None else args
+    session = create_session()
+    if args[:1] == ["--array-manifest"]:
+        # A child of an array job, its command is in the manifest
+        args = get_array_command(args[1], session=session)
+    args = _parse_args(args)
 
     endpoint = (
         args.api_endpoint
         if args.api_endpoint is not None
         else "https://api.dev.imap-mission.com"
     )
-    file_name_and_path = download(args.s3_uri, endpoint)
-    upload(file_name_and_path, endpoint)
+    if args.dependency_manifest is not None:
+        download_inputs(args.dependency_manifest, endpoint)
+    file_name_and_path = download(args.s3_uri, endpoint, session=session)
+    upload(file_name_and_path, endpoint, session=session)
 
     logger.info("Process completed successfully")
 
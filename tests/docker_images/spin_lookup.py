@@ -0,0 +1,102 @@
+"""Look up the spin number and phase of event times.
+
+The spin table API returns the spins of a time range as columnar arrays.
+They are turned into NumPy arrays once, and the spin of every event is then
+found with a single ``searchsorted`` over the spin start times, so the
+lookup of millions of events is a handful of vectorized operations instead
+of a loop::
+
+    spins = get_spins(start_time, end_time, api_endpoint)
+    spin_number, spin_phase = interpolate_spin(spins, event_times)
+"""
+
+import numpy as np
+from imap_api import DEFAULT_API_ENDPOINT, TIMEOUT, _with_retries, create_session
+
+
+def get_spins(start_time, end_time, api_endpoint=DEFAULT_API_ENDPOINT, session=None):
+    """Get the spins of a time range from the spin table API.
+
+    Parameters
+    ----------
+    start_time : float
+        Start of the time range, in seconds of MET.
+    end_time : float
+        End of the time range (exclusive), in seconds of MET.
+    api_endpoint : str, optional
+        The API endpoint.
+    session : requests.Session, optional
+        The session to make the request with.
+
+    Returns
+    -------
+    dict
+        A NumPy array of each column of the spin table, sorted by spin start.
+        "spin_start_met" is the spin start in seconds of MET.
+    """
+    session = session or create_session()
+
+    def request():
+        response = session.get(
+            f"{api_endpoint}/spin_table",
+            params={"start_time": start_time, "end_time": end_time},
+            timeout=TIMEOUT,
+        )
+        response.raise_for_status()
+        return response.json()
+
+    columns = _with_retries(request, f"Spin table query {start_time}-{end_time}")
+    spins = {
+        name: np.asarray(values)
+        for name, values in columns.items()
+        if name != "spin_start_utc_time"
+    }
+    spins["spin_start_utc_time"] = np.asarray(
+        columns["spin_start_utc_time"], dtype="datetime64[us]"
+    )
+    spins["spin_start_met"] = (
+        spins["spin_start_sc_time"].astype(np.float64)
+        + spins["spin_start_subsec"] / 1e6
+    )
+    return spins
+
+
+def interpolate_spin(spins, times):
+    """Interpolate the spin number and phase of event times.
+
+    Parameters
+    ----------
+    spins : dict
+        Arrays of the spins, as from ``get_spins``. Only "spin_number",
+        "spin_start_met" and "spin_duration" (milliseconds) are used.
+    times : numpy.ndarray
+        Event times, in seconds of MET.
+
+    Returns
+    -------
+    spin_number : numpy.ndarray
+        The spin of each event, -1 for events outside of every spin.
+    spin_phase : numpy.ndarray
+        The fraction of the spin elapsed at each event, in [0, 1). NaN for
+        events outside of every spin.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    starts = spins["spin_start_met"]
+    periods = np.asarray(spins["spin_duration"], dtype=np.float64) / 1e3
+
+    spin_number = np.full(times.shape, -1, dtype=np.int64)
+    spin_phase = np.full(times.shape, np.nan)
+    if len(starts) == 0:
+        return spin_number, spin_phase
+
+    # Index of the last spin started at or before each time
+    index = np.searchsorted(starts, times, side="right") - 1
+    clipped = np.maximum(index, 0)
+    elapsed = times - starts[clipped]
+    # Times before the first spin, in a gap between spins or after the last
+    # one are not in any spin
+    valid = (index >= 0) & (elapsed < periods[clipped])
+
+    spin_number[valid] = np.asarray(spins["spin_number"])[clipped[valid]]
+    spin_phase[valid] = elapsed[valid] / periods[clipped[valid]]
+    return spin_number, spin_phase
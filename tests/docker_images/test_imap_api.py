@@ -0,0 +1,296 @@
+"""Tests for the imap_api client against a local stand-in for the API."""
+
+import base64
+import hashlib
+import json
+import re
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import ClassVar
+from urllib.parse import parse_qs, urlparse
+
+import imap_api
+import pytest
+import requests
+
+
+class LocalAPI(BaseHTTPRequestHandler):
+    """Stand-in for the download/upload APIs and the S3 pre-signed urls."""
+
+    # Objects by key, shared with the tests
+    files: ClassVar[dict] = {}
+    # Byte range offsets that fail with a 500
+    failing_offsets: ClassVar[set] = set()
+    range_requests: ClassVar[Counter] = Counter()
+    multipart_uploads: ClassVar[dict] = {}
+    # Part urls per response of the upload API
+    max_part_urls: ClassVar[int] = 1000
+
+    def log_message(self, *args):
+        """Keep the test output quiet."""
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # noqa: N802
+        """Serve the APIs and the files."""
+        url = urlparse(self.path)
+        # Pre-signed urls are absolute
+        base = f"http://{self.headers['Host']}"
+        if url.path.startswith("/download/"):
+            key = url.path.removeprefix("/download/")
+            if key not in self.files:
+                return self._respond(404)
+            return self._respond(302, headers={"Location": f"{base}/files/{key}"})
+        if url.path.startswith("/upload/"):
+            name = url.path.removeprefix("/upload/")
+            params = {key: value[0] for key, value in parse_qs(url.query).items()}
+            if "parts" not in params:
+                body = json.dumps(f"{base}/objects/{name}")
+            else:
+                parts = int(params["parts"])
+                upload_id = params.get("upload_id")
+                if upload_id is None:
+                    upload_id = str(len(self.multipart_uploads))
+                    self.multipart_uploads[upload_id] = {"name": name, "parts": {}}
+                first_part = int(params.get("first_part", 1))
+                last_part = min(first_part + self.max_part_urls - 1, parts)
+                body = json.dumps(
+                    {
+                        "upload_id": upload_id,
+                        "part_urls": [
+                            f"{base}/parts/{upload_id}/{number}"
+                            for number in range(first_part, last_part + 1)
+                        ],
+                        "next_part": last_part + 1 if last_part < parts else None,
+                        "complete_url": f"{base}/complete/{upload_id}",
+                        "abort_url": f"{base}/abort/{upload_id}",
+                    }
+                )
+            return self._respond(200, body.encode())
+        if url.path.startswith("/files/"):
+            return self._get_file(url.path.removeprefix("/files/"))
+        return self._respond(404)
+
+    def _get_file(self, key):
+        content = self.files[key]
+        etag = f'"{hashlib.md5(content).hexdigest()}"'  # noqa: S324
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match is None:
+            return self._respond(200, content, {"ETag": etag})
+        start, end = int(match[1]), min(int(match[2]), len(content) - 1)
+        self.range_requests[start] += 1
+        if start in self.failing_offsets:
+            return self._respond(500)
+        return self._respond(
+            206,
+            content[start : end + 1],
+            {"ETag": etag, "Content-Range": f"bytes {start}-{end}/{len(content)}"},
+        )
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_PUT(self):  # noqa: N802
+        """Receive uploads and upload parts, checking their Content-MD5."""
+        body = self._read_body()
+        digest = hashlib.md5(body).digest()  # noqa: S324
+        if base64.b64decode(self.headers["Content-MD5"]) != digest:
+            return self._respond(400)
+        etag = f'"{digest.hex()}"'
+        path = urlparse(self.path).path
+        if path.startswith("/objects/"):
+            self.files[path.removeprefix("/objects/")] = body
+        else:
+            _, _, upload_id, number = path.split("/")
+            self.multipart_uploads[upload_id]["parts"][int(number)] = (etag, body)
+        return self._respond(200, headers={"ETag": etag})
+
+    def do_POST(self):  # noqa: N802
+        """Complete a multipart upload."""
+        upload = self.multipart_uploads[self.path.split("/")[-1]]
+        requested = re.findall(
+            r"<PartNumber>(\d+)</PartNumber><ETag>(.*?)</ETag>",
+            self._read_body().decode(),
+        )
+        content = b""
+        for number, etag in requested:
+            part_etag, part = upload["parts"][int(number)]
+            if etag != part_etag:
+                return self._respond(200, b"<Error>InvalidPart</Error>")
+            content += part
+        self.files[upload["name"]] = content
+        return self._respond(200, b"<CompleteMultipartUploadResult/>")
+
+
+@pytest.fixture()
+def api_endpoint(monkeypatch, tmp_path):
+    """Run the stand-in API on a local port."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(imap_api, "RETRY_BACKOFF", 0)
+    LocalAPI.files = {}
+    LocalAPI.failing_offsets = set()
+    LocalAPI.range_requests = Counter()
+    LocalAPI.multipart_uploads = {}
+    LocalAPI.max_part_urls = 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LocalAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+KEY = "imap/swe/l1a/2024/01/imap_swe_l1a_sci_20240101_v001.cdf"
+S3_URI = f"s3://test-bucket/{KEY}"
+
+
+def test_download_small_file(api_endpoint, tmp_path):
+    """Test downloading a file smaller than a chunk."""
+    LocalAPI.files[KEY] = b"small file"
+    path = imap_api.download(S3_URI, api_endpoint)
+    assert path == str(tmp_path / "test-bucket" / KEY)
+    with open(path, "rb") as f:
+        assert f.read() == b"small file"
+
+
+def test_parallel_range_download(api_endpoint):
+    """Test downloading a large file in parallel byte ranges."""
+    content = bytes(range(256)) * 40
+    LocalAPI.files[KEY] = content
+    path = imap_api.download(S3_URI, api_endpoint, chunk_size=1000)
+    with open(path, "rb") as f:
+        assert f.read() == content
+    assert sorted(LocalAPI.range_requests) == list(range(0, len(content), 1000))
+
+
+def test_download_retries_and_resumes(api_endpoint, monkeypatch, tmp_path):
+    """Test that a failed download only fetches the missing chunks again."""
+    content = b"0123456789" * 500
+    LocalAPI.files[KEY] = content
+    LocalAPI.failing_offsets = {3000}
+    monkeypatch.setattr(imap_api, "MAX_RETRIES", 2)
+
+    with pytest.raises(requests.HTTPError):
+        imap_api.download(S3_URI, api_endpoint, chunk_size=1000)
+    assert LocalAPI.range_requests[3000] == 2
+    state_path = tmp_path / "test-bucket" / f"{KEY}.part.json"
+    assert json.loads(state_path.read_text())["done"] == [0, 1000, 2000, 4000]
+
+    LocalAPI.failing_offsets = set()
+    LocalAPI.range_requests.clear()
+    path = imap_api.download(S3_URI, api_endpoint, chunk_size=1000)
+    with open(path, "rb") as f:
+        assert f.read() == content
+    # The first chunk is always requested to check the object did not change
+    assert sorted(LocalAPI.range_requests) == [0, 3000]
+    assert not state_path.exists()
+
+
+def test_download_checksum_mismatch(api_endpoint, monkeypatch):
+    """Test that a corrupted download is rejected."""
+    LocalAPI.files[KEY] = b"content"
+    monkeypatch.setattr(imap_api, "compute_md5", lambda *args: b"wrong")
+    with pytest.raises(ValueError, match="does not match its ETag"):
+        imap_api.download(S3_URI, api_endpoint)
+
+
+def test_download_dependencies(api_endpoint):
+    """Test downloading several files concurrently."""
+    keys = [KEY.replace("20240101", f"2024010{day}") for day in range(1, 6)]
+    for key in keys:
+        LocalAPI.files[key] = key.encode() * 100
+    paths = imap_api.download_dependencies(
+        [f"s3://test-bucket/{key}" for key in keys], api_endpoint
+    )
+    for key, path in zip(keys, paths):
+        assert path.endswith(key)
+        with open(path, "rb") as f:
+            assert f.read() == key.encode() * 100
+
+
+def test_array_command(api_endpoint, monkeypatch):
+    """Test that a child of an array job reads its command from the manifest."""
+    manifest_key = "batch-manifests/swe-l1a-array-job-1.json"
+    LocalAPI.files[manifest_key] = json.dumps(
+        {
+            "jobs": [
+                {"processing_job_id": 1, "command": ["--instrument", "swe"]},
+                {"processing_job_id": 2, "command": ["--instrument", "hit"]},
+            ]
+        }
+    ).encode()
+    monkeypatch.setenv(imap_api.ARRAY_INDEX_VARIABLE, "1")
+    command = imap_api.get_array_command(
+        f"s3://test-bucket/{manifest_key}", api_endpoint
+    )
+    assert command == ["--instrument", "hit"]
+
+
+def test_download_inputs(api_endpoint):
+    """Test downloading the inputs listed in an input manifest."""
+    LocalAPI.files[KEY] = b"input"
+    manifest_key = "batch-manifests/inputs/swe-l1b-sci-job-1.json"
+    LocalAPI.files[manifest_key] = json.dumps(
+        {"inputs": [{"file_path": KEY}], "metakernel": None, "repointing": None}
+    ).encode()
+    (path,) = imap_api.download_inputs(f"s3://test-bucket/{manifest_key}", api_endpoint)
+    assert path.endswith(KEY)
+
+
+def test_parse_args():
+    """Test that the commands of the batch starter are accepted."""
+    args = imap_api._parse_args(
+        [
+            "--instrument",
+            "swe",
+            "--level",
+            "l1a",
+            "--s3_uri",
+            S3_URI,
+            "--dependency",
+            "[]",
+            "--dependency-manifest",
+            "s3://test-bucket/batch-manifests/inputs/swe-l1a-sci-job-1.json",
+        ]
+    )
+    assert args.dependency == []
+    assert args.dependency_manifest.endswith("swe-l1a-sci-job-1.json")
+
+
+def test_upload(api_endpoint, tmp_path):
+    """Test uploading a small file in one request."""
+    file_path = tmp_path / "imap_swe_l1a_sci_20240101_v001.cdf"
+    file_path.write_bytes(b"small file")
+    imap_api.upload(file_path, api_endpoint)
+    assert LocalAPI.files == {"imap_swe_l1a_sc-testi_20240101_v001.cdf": b"small file"}
+    assert LocalAPI.multipart_uploads == {}
+
+
+def test_multipart_upload(api_endpoint, tmp_path):
+    """Test uploading a large file in parts."""
+    content = bytes(range(256)) * 40
+    file_path = tmp_path / "imap_swe_l1a_sci_20240101_v001.cdf"
+    file_path.write_bytes(content)
+    imap_api.upload(file_path, api_endpoint, part_size=1000)
+    assert LocalAPI.files == {"imap_swe_l1a_sc-testi_20240101_v001.cdf": content}
+    assert len(LocalAPI.multipart_uploads["0"]["parts"]) == 11
+
+
+def test_multipart_upload_pages(api_endpoint, tmp_path):
+    """Test uploading a file with more parts than urls in a response."""
+    LocalAPI.max_part_urls = 4
+    content = bytes(range(256)) * 40
+    file_path = tmp_path / "imap_swe_l1a_sci_20240101_v001.cdf"
+    file_path.write_bytes(content)
+    imap_api.upload(file_path, api_endpoint, part_size=1000)
+    assert LocalAPI.files == {"imap_swe_l1a_sc-testi_20240101_v001.cdf": content}
+    # The pages are of the same upload
+    assert list(LocalAPI.multipart_uploads) == ["0"]
+    assert len(LocalAPI.multipart_uploads["0"]["parts"]) == 11
@@ -0,0 +1,78 @@
+"""Tests for the vectorized spin lookup."""
+
+import numpy as np
+import pytest
+import spin_lookup
+
+
+def make_spins():
+    """Spins of 15 s from MET 1000.5, with a gap after the third spin."""
+    return {
+        "spin_number": np.array([1, 2, 3, 10]),
+        "spin_start_met": np.array([1000.5, 1015.5, 1030.5, 1100.0]),
+        "spin_duration": np.array([15000, 15000, 15000, 15000]),
+    }
+
+
+def test_interpolate_spin():
+    """Test the spin number and phase of events in and out of the spins."""
+    times = np.array([1000.0, 1000.5, 1008.0, 1030.5, 1050.0, 1107.5, 1115.0])
+    spin_number, spin_phase = spin_lookup.interpolate_spin(make_spins(), times)
+
+    np.testing.assert_array_equal(spin_number, [-1, 1, 1, 3, -1, 10, -1])
+    np.testing.assert_allclose(spin_phase, [np.nan, 0.0, 0.5, 0.0, np.nan, 0.5, np.nan])
+
+
+def test_interpolate_spin_matches_loop():
+    """Test the vectorized lookup against a lookup of each event."""
+    spins = make_spins()
+    rng = np.random.default_rng(0)
+    times = rng.uniform(990, 1120, 10_000)
+    spin_number, spin_phase = spin_lookup.interpolate_spin(spins, times)
+
+    for time, number, phase in zip(times[:200], spin_number, spin_phase):
+        expected = -1
+        for start, spin in zip(spins["spin_start_met"], spins["spin_number"]):
+            if start <= time < start + 15:
+                expected = spin
+                assert phase == pytest.approx((time - start) / 15)
+        assert number == expected
+
+
+def test_interpolate_spin_without_spins():
+    """Test that no spins leaves every event outside of a spin."""
+    spins = {
+        "spin_number": np.array([]),
+        "spin_start_met": np.array([]),
+        "spin_duration": np.array([]),
+    }
+    spin_number, spin_phase = spin_lookup.interpolate_spin(spins, [1.0, 2.0])
+    np.testing.assert_array_equal(spin_number, [-1, -1])
+    assert np.isnan(spin_phase).all()
+
+
+def test_get_spins():
+    """Test that the API columns are turned into arrays."""
+
+    class Response:
+        def raise_for_status(self):
+            pass
+
+        def json(self):
+            return {
+                "spin_number": [1, 2],
+                "spin_start_sc_time": [1000, 1015],
+                "spin_start_subsec": [500000, 500000],
+                "spin_start_utc_time": ["2024-01-01T00:16:40.500000"] * 2,
+                "spin_duration": [15000, 15000],
+            }
+
+    class Session:
+        def get(self, url, params, timeout):
+            assert url == "http://api/spin_table"
+            assert params == {"start_time": 1000, "end_time": 1030}
+            return Response()
+
+    spins = spin_lookup.get_spins(1000, 1030, "http://api", session=Session())
+    np.testing.assert_array_equal(spins["spin_start_met"], [1000.5, 1015.5])
+    assert spins["spin_start_utc_time"].dtype == np.dtype("datetime64[us]")
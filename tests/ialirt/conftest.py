@@ -0,0 +1,29 @@
+"""Setup testing environment to test the I-ALiRT container code."""
+
+import sys
+from pathlib import Path
+
+import boto3
+import pytest
+from moto import mock_s3
+
+BUCKET_NAME = "test-data-bucket"
+
+# The container code is copied into the image as top level modules
+sys.path.insert(0, str(Path(__file__).parents[1] / "test-data/ialirt_ec2"))
+
+
+@pytest.fixture()
+def s3_client(monkeypatch):
+    """Mock S3 Client, so we don't need network requests."""
+    # Mock AWS Credentials for moto
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SECURITY_TOKEN", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+    # Uploaded parts are not checksummed, moto does not decode them
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+    with mock_s3():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        yield s3_client
@@ -0,0 +1,546 @@
+"""Replay packet captures through the I-ALiRT pipeline and measure it.
+
+The packets of a capture, e.g. ``science_block_*.bin``, are streamed to a
+packet receiver over a local socket at a multiple of real time, following the
+spacing of their METs. The receiver runs as in the container, with its
+algorithms, flushes to the ingest table and S3 writer, on moto stand-ins of
+DynamoDB and S3. Its S3 objects are then ingested by the ingest lambda code.
+
+Latencies are measured from the time each packet is due, not from the time it
+is sent: when the receiver falls behind and its socket stops being read, the
+packets waiting to be sent count as late. Two latencies are reported:
+
+- ``processed``: until the algorithm of the instrument has run on the packet;
+- ``stored``: until the packet is written to the ingest table.
+
+The report gives their percentiles, the throughput of the receiver and of the
+ingest, and the received packets and traced memory over time. A latency
+percentile over its budget is a violation, and fails the tests and the
+command line run::
+
+    python -m tests.ialirt.replay_harness --speed 100 --repeat 10
+"""
+
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from pathlib import Path
+
+import boto3
+import numpy as np
+from moto import mock_dynamodb, mock_s3
+
+from sds_data_manager.lambda_code.IAlirtCode import ialirt_ingest
+
+from .conftest import BUCKET_NAME
+
+# Imported once the container code is on the path
+packet_receiver = importlib.import_module("packet_receiver")
+s3_writer = importlib.import_module("s3_writer")
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+PACKET_FILE = (
+    Path(__file__).parent.parent
+    / "test-data"
+    / "science_block_20221116_163611Z_idle.bin"
+)
+# Percentiles of the latencies in the report
+PERCENTILES = (50, 90, 99, 100)
+# Percentile the budgets apply to
+BUDGET_PERCENTILE = 99
+# Latency budget of each stage, in seconds. Packets are stored when they are
+# flushed, at most FLUSH_SECONDS after they are received.
+LATENCY_BUDGETS = {
+    "processed": 1.0,
+    "stored": packet_receiver.FLUSH_SECONDS + 1.0,
+}
+# Seconds between the samples of the receiver
+SAMPLE_SECONDS = 0.5
+# Sequence counts are 14 bits
+SEQUENCE_COUNT_MODULUS = 2**14
+
+Sample = namedtuple("Sample", ["elapsed", "received", "processed", "memory"])
+
+
+def get_key(packet):
+    """Get the key identifying a packet of a replay."""
+    return packet.apid, packet.met, packet.seq_count
+
+
+def shift_packet(packet, met_offset, seq_offset):
+    """Get a copy of a packet later in time.
+
+    Parameters
+    ----------
+    packet : ialirt_ingest.Packet
+        The packet.
+    met_offset : int
+        Seconds added to the MET.
+    seq_offset : int
+        Added to the sequence count, which wraps around.
+
+    Returns
+    -------
+    ialirt_ingest.Packet
+        The shifted packet.
+    """
+    data = bytearray(packet.data)
+    first, second, length = ialirt_ingest.PRIMARY_HEADER.unpack_from(data)
+    seq_count = (packet.seq_count + seq_offset) % SEQUENCE_COUNT_MODULUS
+    # Keep the sequence flags
+    ialirt_ingest.PRIMARY_HEADER.pack_into(
+        data, 0, first, (second & 0xC000) | seq_count, length
+    )
+    ialirt_ingest.MET.pack_into(
+        data, ialirt_ingest.PRIMARY_HEADER.size, packet.met + met_offset
+    )
+    return ialirt_ingest.decode_packet(data)
+
+
+def load_packets(path=PACKET_FILE, repeat=1):
+    """Read the packets of a capture, repeated one after the other.
+
+    Parameters
+    ----------
+    path : Path, optional
+        The capture, a file of CCSDS packets.
+    repeat : int, optional
+        Number of copies of the capture. Each copy follows the previous one,
+        with later METs and sequence counts.
+
+    Returns
+    -------
+    list of ialirt_ingest.Packet
+        The packets, sorted by MET.
+    """
+    with open(path, "rb") as stream:
+        packets = sorted(ialirt_ingest.iter_packets(stream), key=lambda p: p.met)
+    span = packets[-1].met - packets[0].met
+    # The copies are as far apart as the packets of the capture
+    met_offset = span + max(span // max(len(packets) - 1, 1), 1)
+    return [
+        shift_packet(packet, copy * met_offset, copy * len(packets))
+        for copy in range(repeat)
+        for packet in packets
+    ]
+
+
+class TimedFlusher(packet_receiver.PacketFlusher):
+    """Flusher recording when each packet is stored."""
+
+    def __init__(self, *args, **kwargs):
+        """Create the flusher, see ``PacketFlusher``."""
+        super().__init__(*args, **kwargs)
+        self.stored = {}
+
+    def write(self, packets):
+        """Write the packets and record the time.
+
+        Parameters
+        ----------
+        packets : list of Packet
+            The packets.
+        """
+        super().write(packets)
+        now = time.monotonic()
+        for packet in packets:
+            self.stored[get_key(packet)] = now
+
+
+class LoadReport:
+    """Latencies, throughput and memory of a replay."""
+
+    def __init__(self, speed, duration, latencies, samples, ingest):
+        """Create the report.
+
+        Parameters
+        ----------
+        speed : float
+            Multiple of real time of the replay.
+        duration : float
+            Seconds from the first packet due to the last one stored.
+        latencies : dict
+            Array of the latencies of each stage, in seconds.
+        samples : list of Sample
+            The receiver over time.
+        ingest : dict
+            "packets" and "seconds" of the ingest of the S3 objects.
+        """
+        self.speed = speed
+        self.duration = duration
+        self.latencies = latencies
+        self.samples = samples
+        self.ingest = ingest
+
+    @property
+    def packets(self):
+        """int: Number of packets processed."""
+        return len(self.latencies["processed"])
+
+    def get_percentiles(self, stage):
+        """Get the latency percentiles of a stage.
+
+        Parameters
+        ----------
+        stage : str
+            "processed" or "stored".
+
+        Returns
+        -------
+        dict
+            Latency of each percentile, in seconds.
+        """
+        values = np.percentile(self.latencies[stage], PERCENTILES)
+        return dict(zip(PERCENTILES, values.tolist()))
+
+    def get_violations(self, budgets=None):
+        """Get the stages over their latency budget.
+
+        Parameters
+        ----------
+        budgets : dict, optional
+            Budget of each stage, in seconds, ``LATENCY_BUDGETS`` by default.
+
+        Returns
+        -------
+        list of str
+            Description of each violation, empty within budget.
+        """
+        budgets = budgets or LATENCY_BUDGETS
+        violations = []
+        for stage, budget in budgets.items():
+            latency = np.percentile(self.latencies[stage], BUDGET_PERCENTILE)
+            if latency > budget:
+                violations.append(
+                    f"{stage} p{BUDGET_PERCENTILE} latency {latency:.3f} s is over "
+                    f"the budget of {budget:.3f} s"
+                )
+        return violations
+
+    def format(self):
+        """Format the report as text.
+
+        Returns
+        -------
+        str
+            The report.
+        """
+        lines = [
+            f"Replayed {self.packets} packets at {self.speed:g}x real time "
+            f"in {self.duration:.2f} s ({self.packets / self.duration:.1f} "
+            "packets/s)",
+            "Latency (s)  "
+            + "  ".join(f"{f'p{percentile}':>7}" for percentile in PERCENTILES),
+        ]
+        for stage in self.latencies:
+            values = self.get_percentiles(stage).values()
+            lines.append(
+                f"{stage:<11}  " + "  ".join(f"{value:7.3f}" for value in values)
+            )
+        lines.append(
+            f"Ingested {self.ingest['packets']} packets from S3 in "
+            f"{self.ingest['seconds']:.2f} s"
+        )
+        lines.append("Time (s)  Received  Processed  Memory (MiB)")
+        for sample in self.samples:
+            lines.append(
+                f"{sample.elapsed:8.2f}  {sample.received:8d}  "
+                f"{sample.processed:9d}  {sample.memory / 2**20:12.2f}"
+            )
+        return "\n".join(lines)
+
+
+async def replay(packets, port, speed, due_times):
+    """Send packets to a local port when they are due.
+
+    Parameters
+    ----------
+    packets : list of ialirt_ingest.Packet
+        The packets, sorted by MET.
+    port : int
+        Port of the receiver.
+    speed : float
+        Multiple of real time.
+    due_times : dict
+        Filled with the time each packet is due.
+    """
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    start = time.monotonic()
+    for packet in packets:
+        due_time = start + (packet.met - packets[0].met) / speed
+        delay = due_time - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        due_times[get_key(packet)] = due_time
+        writer.write(packet.data)
+        # Waits while the receiver is not reading
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+def sample_receiver(receiver, start):
+    """Get a sample of the receiver now."""
+    return Sample(
+        elapsed=time.monotonic() - start,
+        received=receiver.received,
+        processed=receiver.processed,
+        memory=tracemalloc.get_traced_memory()[0],
+    )
+
+
+async def sample_periodically(receiver, samples, start, sample_seconds):
+    """Record the receiver periodically, until cancelled."""
+    while True:
+        samples.append(sample_receiver(receiver, start))
+        await asyncio.sleep(sample_seconds)
+
+
+async def replay_to_receiver(
+    packets, flusher, speed, algorithm=None, sample_seconds=SAMPLE_SECONDS
+):
+    """Replay packets to a receiver and time them.
+
+    Parameters
+    ----------
+    packets : list of ialirt_ingest.Packet
+        The packets, sorted by MET.
+    flusher : TimedFlusher
+        Flusher of the receiver.
+    speed : float
+        Multiple of real time.
+    algorithm : callable, optional
+        Algorithm of every instrument, called with the window and the packet.
+    sample_seconds : float, optional
+        Seconds between the samples of the receiver.
+
+    Returns
+    -------
+    tuple
+        Time each packet is due, time each packet is processed, and the
+        samples of the receiver.
+    """
+    due_times = {}
+    processed = {}
+
+    def timed_algorithm(window, packet):
+        if algorithm is not None:
+            algorithm(window, packet)
+        processed[get_key(packet)] = time.monotonic()
+
+    # An instrument per APID
+    apids = {packet.apid for packet in packets}
+    receiver = packet_receiver.PacketReceiver(
+        flusher,
+        instruments={apid: str(apid) for apid in apids},
+        algorithms={str(apid): timed_algorithm for apid in apids},
+    )
+    server = await receiver.serve(host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    samples = []
+    start = time.monotonic()
+    sampler = asyncio.create_task(
+        sample_periodically(receiver, samples, start, sample_seconds)
+    )
+    async with server:
+        await replay(packets, port, speed, due_times)
+        # Wait for the connection to be read to its end
+        while receiver.received < len(packets):
+            await asyncio.sleep(0.01)
+        await receiver.drain()
+        await receiver.close()
+    sampler.cancel()
+    await asyncio.gather(sampler, return_exceptions=True)
+    samples.append(sample_receiver(receiver, start))
+    return due_times, processed, samples
+
+
+def ingest_objects(s3_client, bucket, ingest_table):
+    """Ingest the packet objects of a bucket as the ingest lambda does.
+
+    Returns
+    -------
+    dict
+        "packets" and "seconds" of the ingest.
+    """
+    start = time.monotonic()
+    count = 0
+    response = s3_client.list_objects_v2(Bucket=bucket, Prefix="packets/")
+    for obj in response.get("Contents", []):
+        body = s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"]
+        apids = ialirt_ingest.ingest_packets(body, ingest_table, obj["Key"])
+        count += sum(summary["packets"] for summary in apids.values())
+    return {"packets": count, "seconds": time.monotonic() - start}
+
+
+def run_load_test(
+    packets,
+    ingest_table,
+    s3_client,
+    bucket,
+    speed=1.0,
+    flush_seconds=packet_receiver.FLUSH_SECONDS,
+    algorithm=None,
+    sample_seconds=SAMPLE_SECONDS,
+):
+    """Replay packets through the receiver and the ingest.
+
+    Parameters
+    ----------
+    packets : list of ialirt_ingest.Packet
+        The packets, sorted by MET.
+    ingest_table : boto3 DynamoDB Table
+        The ingest table.
+    s3_client : boto3 S3 client
+        Client of the packet bucket.
+    bucket : str
+        The packet bucket.
+    speed : float, optional
+        Multiple of real time.
+    flush_seconds : float, optional
+        Longest time packets wait to be flushed.
+    algorithm : callable, optional
+        Algorithm of every instrument, called with the window and the packet.
+    sample_seconds : float, optional
+        Seconds between the samples of the receiver.
+
+    Returns
+    -------
+    LoadReport
+        The report of the replay.
+    """
+    writer = s3_writer.PartitionedS3Writer(s3_client, bucket, "Replay")
+    flusher = TimedFlusher(writer, ingest_table, flush_seconds=flush_seconds)
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        due_times, processed, samples = asyncio.run(
+            replay_to_receiver(packets, flusher, speed, algorithm, sample_seconds)
+        )
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    latencies = {
+        "processed": np.array([processed[key] - due_times[key] for key in processed]),
+        "stored": np.array(
+            [flusher.stored[key] - due_times[key] for key in flusher.stored]
+        ),
+    }
+    duration = max(flusher.stored.values()) - min(due_times.values())
+    ingest = ingest_objects(s3_client, bucket, ingest_table)
+    return LoadReport(speed, duration, latencies, samples, ingest)
+
+
+def create_ingest_table():
+    """Create the ingest table in the mocked DynamoDB.
+
+    Returns
+    -------
+    boto3 DynamoDB Table
+        The ingest table.
+    """
+    dynamodb = boto3.resource("dynamodb", region_name="us-west-2")
+    return dynamodb.create_table(
+        TableName="imap-ingest-table",
+        KeySchema=[
+            {"AttributeName": "apid", "KeyType": "HASH"},
+            {"AttributeName": "met", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "apid", "AttributeType": "N"},
+            {"AttributeName": "met", "AttributeType": "N"},
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def parse_args(args=None):
+    """Parse the command line arguments.
+
+    Parameters
+    ----------
+    args : list of str, optional
+        The arguments, those of the command line by default.
+
+    Returns
+    -------
+    argparse.Namespace
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog="replay_harness",
+        description="Replay packet captures through the I-ALiRT pipeline.",
+    )
+    parser.add_argument("--file", type=Path, default=PACKET_FILE)
+    parser.add_argument(
+        "--speed", type=float, default=100.0, help="Multiple of real time."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="Copies of the capture to replay."
+    )
+    parser.add_argument(
+        "--flush-seconds", type=float, default=packet_receiver.FLUSH_SECONDS
+    )
+    for stage, budget in LATENCY_BUDGETS.items():
+        parser.add_argument(
+            f"--{stage}-budget",
+            type=float,
+            default=budget,
+            help=f"p{BUDGET_PERCENTILE} {stage} latency budget in seconds.",
+        )
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """Run a replay on moto stand-ins and print its report.
+
+    Parameters
+    ----------
+    args : list of str, optional
+        The arguments, those of the command line by default.
+
+    Returns
+    -------
+    int
+        Exit status, 1 if a latency is over budget.
+    """
+    args = parse_args(args)
+    budgets = {stage: getattr(args, f"{stage}_budget") for stage in LATENCY_BUDGETS}
+    # Credentials of the moto stand-ins
+    for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        os.environ.setdefault(name, "testing")
+    os.environ.setdefault("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+
+    packets = load_packets(args.file, args.repeat)
+    with mock_s3(), mock_dynamodb():
+        s3_client = boto3.client("s3", region_name="us-east-1")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        report = run_load_test(
+            packets,
+            create_ingest_table(),
+            s3_client,
+            BUCKET_NAME,
+            speed=args.speed,
+            flush_seconds=args.flush_seconds,
+        )
+
+    print(report.format())
+    violations = report.get_violations(budgets)
+    for violation in violations:
+        print(f"FAIL: {violation}")
+    return 1 if violations else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Tests for the TCP packet receiver of the I-ALiRT service."""
+
+import asyncio
+import io
+import json
+from pathlib import Path
+from unittest.mock import patch
+
+import packet_receiver
+import s3_writer
+from boto3.dynamodb.conditions import Key
+
+from ..lambda_endpoints.test_ialirt_ingest import make_packet
+from .conftest import BUCKET_NAME
+
+PACKET_FILE = (
+    Path(__file__).parent.parent
+    / "test-data"
+    / "science_block_20221116_163611Z_idle.bin"
+)
+# Bytes per second of the replays, faster than the real-time downlink
+DATA_RATE = 1_000_000
+
+
+def make_flusher(s3_client, ingest_table, **kwargs):
+    """Get a flusher writing the packets of a day to a single object."""
+    writer = s3_writer.PartitionedS3Writer(
+        s3_client, BUCKET_NAME, "Test", partition_seconds=24 * 60 * 60
+    )
+    return packet_receiver.PacketFlusher(writer, ingest_table, **kwargs)
+
+
+async def replay(data, port, data_rate=DATA_RATE, segment_size=500):
+    """Stream bytes to a local port at a data rate, in arbitrary segments."""
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    for start in range(0, len(data), segment_size):
+        writer.write(data[start : start + segment_size])
+        await writer.drain()
+        await asyncio.sleep(segment_size / data_rate)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def run_receiver(receiver, *streams):
+    """Replay streams to a receiver concurrently, until they are processed."""
+    server = await receiver.serve(host="127.0.0.1", port=0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        await asyncio.gather(*(replay(stream, port) for stream in streams))
+        # Wait for the connections to be read to their end
+        while receiver.received < sum(len(stream) for stream in streams) // 1294:
+            await asyncio.sleep(0.01)
+        await receiver.drain()
+        await receiver.close()
+
+
+def test_receive_packet_file(setup_dynamodb, s3_client):
+    """Test replaying the sample file through a socket."""
+    ingest_table = setup_dynamodb["ingest_table"]
+    flusher = make_flusher(s3_client, ingest_table, flush_packets=10)
+    processed = []
+    receiver = packet_receiver.PacketReceiver(
+        flusher,
+        instruments={1344: "swe"},
+        algorithms={"swe": lambda window, packet: processed.append(len(window))},
+    )
+    asyncio.run(run_receiver(receiver, PACKET_FILE.read_bytes()))
+
+    assert receiver.received == receiver.processed == 23
+    # The algorithm sees the window grow packet by packet
+    assert processed == list(range(1, 24))
+    window = receiver.cache[1344].window()
+    assert window["seq_count"].tolist() == list(range(57, 80))
+
+    # Flushed in batches of 10 packets, the last one partial, all appended to
+    # the object of the day
+    assert flusher.flushed == 23
+    (obj,) = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix="packets/")[
+        "Contents"
+    ]
+    assert obj["Key"].startswith("packets/")
+    assert "imap_ialirt_test_" in obj["Key"]
+    body = s3_client.get_object(Bucket=BUCKET_NAME, Key=obj["Key"])["Body"].read()
+    assert body == PACKET_FILE.read_bytes()
+    items = ingest_table.query(KeyConditionExpression=Key("apid").eq(1344))["Items"]
+    assert [item["seq_count"] for item in items] == list(range(57, 80))
+    assert items[0]["packet_blob"].value == PACKET_FILE.read_bytes()[:1294]
+    assert {item["source"] for item in items} == {obj["Key"]}
+
+
+def test_fan_out_and_backpressure(setup_dynamodb, s3_client):
+    """Test that a slow instrument pauses the reads of its packets."""
+    ingest_table = setup_dynamodb["ingest_table"]
+    flusher = make_flusher(s3_client, ingest_table)
+    released = asyncio.Event()
+    received_while_blocked = []
+
+    async def slow_algorithm(window, packet):
+        if not released.is_set():
+            received_while_blocked.append(receiver.received)
+            await released.wait()
+
+    receiver = packet_receiver.PacketReceiver(
+        flusher,
+        instruments={478: "hit", 1344: "swe"},
+        algorithms={"hit": slow_algorithm},
+        queue_size=2,
+    )
+    hit = b"".join(make_packet(478, seq, 100, b"\x00" * 1284) for seq in range(50))
+
+    async def run():
+        server = await receiver.serve(host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            sender = asyncio.create_task(replay(hit, port, data_rate=10**8))
+            await asyncio.sleep(0.2)
+            # The queue of 2 packets is full, the socket is not read further
+            assert receiver.received <= 4
+            # Other instruments are not blocked by hit
+            await replay(PACKET_FILE.read_bytes(), port)
+            while receiver.cache[1344].count < 23:
+                await asyncio.sleep(0.01)
+            released.set()
+            await sender
+            while receiver.received < 73:
+                await asyncio.sleep(0.01)
+            await receiver.drain()
+            await receiver.close()
+
+    asyncio.run(run())
+    assert received_while_blocked == [1]
+    assert len(receiver.cache[478]) == 50
+    assert receiver.processed == 73
+    assert ingest_table.scan(Select="COUNT")["Count"] == 73
+
+
+def test_failed_flush(setup_dynamodb, s3_client):
+    """Test that a batch that fails to be written is written with the next one."""
+    ingest_table = setup_dynamodb["ingest_table"]
+    flusher = make_flusher(s3_client, ingest_table, flush_packets=2)
+    packets = [
+        packet_receiver.Packet(478, seq, 100, make_packet(478, seq, 100))
+        for seq in range(3)
+    ]
+
+    async def run():
+        with patch.object(flusher.s3_writer, "write", side_effect=OSError):
+            # The failure does not reach the connection adding the packets
+            for packet in packets[:2]:
+                await flusher.add(packet)
+        assert flusher.flushed == 0
+        assert flusher.packets == packets[:2]
+        # Already in the ingest table, the writes are idempotent
+        assert ingest_table.scan(Select="COUNT")["Count"] == 2
+
+        await flusher.add(packets[2])
+        await flusher.close()
+
+    asyncio.run(run())
+    assert flusher.flushed == 3
+    assert ingest_table.scan(Select="COUNT")["Count"] == 3
+    (obj,) = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix="packets/")[
+        "Contents"
+    ]
+    body = s3_client.get_object(Bucket=BUCKET_NAME, Key=obj["Key"])["Body"].read()
+    assert body == b"".join(packet.data for packet in packets)
+
+
+def test_truncated_stream():
+    """Test that a truncated last packet of a stream is dropped."""
+
+    async def read(data):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        packets = []
+        while (packet := await packet_receiver.read_packet(reader)) is not None:
+            packets.append(packet)
+        return packets
+
+    data = make_packet(478, 1, 100) + make_packet(478, 2, 101)[:-3]
+    packets = asyncio.run(read(data))
+    assert [(p.apid, p.seq_count, p.met) for p in packets] == [(478, 1, 100)]
+
+
+def test_set_task_protection(monkeypatch):
+    """Test protecting the task from scale in through the ECS agent."""
+    monkeypatch.delenv("ECS_AGENT_URI", raising=False)
+    assert not packet_receiver.set_task_protection(True)
+
+    monkeypatch.setenv("ECS_AGENT_URI", "http://169.254.170.2/api/abc")
+    with patch.object(packet_receiver.urllib.request, "urlopen") as urlopen:
+        assert packet_receiver.set_task_protection(True)
+    request = urlopen.call_args.args[0]
+    assert request.full_url == "http://169.254.170.2/api/abc/task-protection/v1/state"
+    assert request.method == "PUT"
+    assert json.loads(request.data) == {
+        "ProtectionEnabled": True,
+        "ExpiresInMinutes": packet_receiver.PROTECTION_MINUTES,
+    }
+
+    with patch.object(packet_receiver.urllib.request, "urlopen", side_effect=OSError):
+        assert not packet_receiver.set_task_protection(False)
+
+
+def test_task_protection(setup_dynamodb, s3_client, monkeypatch):
+    """Test that the task is protected while it has connections."""
+    updates = []
+    monkeypatch.setattr(
+        packet_receiver,
+        "set_task_protection",
+        lambda enabled: updates.append(enabled) or True,
+    )
+    flusher = make_flusher(s3_client, setup_dynamodb["ingest_table"])
+    receiver = packet_receiver.PacketReceiver(flusher)
+
+    async def wait_for(condition):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+    async def close(writer):
+        writer.close()
+        await writer.wait_closed()
+
+    async def run():
+        server = await receiver.serve(host="127.0.0.1", port=0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            connections = [
+                await asyncio.open_connection("127.0.0.1", port) for _ in range(2)
+            ]
+            await wait_for(lambda: receiver.connections == 2 and receiver.protected)
+            # Protected once for both connections
+            assert updates == [True]
+
+            # Still protected for the other connection
+            await close(connections[0][1])
+            await wait_for(lambda: receiver.connections == 1)
+            assert receiver.protected
+
+            await close(connections[1][1])
+            await wait_for(lambda: not receiver.protected)
+            await receiver.close()
+
+    asyncio.run(run())
+    # Until the last connection is closed
+    assert updates == [True, False]
+    assert receiver.connections == 0
+
+
+def test_parse_instruments():
+    """Test reading the instruments of the APIDs from the environment."""
+    assert packet_receiver.parse_instruments("478:hit, 1344:swe") == {
+        478: "hit",
+        1344: "swe",
+    }
+    assert packet_receiver.parse_instruments("") == {}
+
+
+def test_metrics(setup_dynamodb, s3_client):
+    """Test the packet rate and lag logged in the embedded metric format."""
+    flusher = make_flusher(s3_client, setup_dynamodb["ingest_table"])
+    receiver = packet_receiver.PacketReceiver(flusher, processing_name="Primary")
+    asyncio.run(run_receiver(receiver, PACKET_FILE.read_bytes()))
+
+    stream = io.StringIO()
+    receiver.log_metrics(stream)
+    record = json.loads(stream.getvalue())
+    assert record["ProcessingName"] == "Primary"
+    assert record["PacketsPerSecond"] > 0
+    assert 0 < record["ProcessingLag"] < 1
+    (directive,) = record["_aws"]["CloudWatchMetrics"]
+    assert directive["Namespace"] == packet_receiver.METRIC_NAMESPACE
+    assert [metric["Name"] for metric in directive["Metrics"]] == [
+        "PacketsPerSecond",
+        "ProcessingLag",
+    ]
+
+    # The metrics restart from the last ones
+    assert receiver.get_metrics() == {"PacketsPerSecond": 0, "ProcessingLag": 0}
@@ -0,0 +1,60 @@
+"""Replay the sample capture through the I-ALiRT pipeline within budget."""
+
+import pytest
+
+from . import replay_harness
+from .conftest import BUCKET_NAME
+
+# Multiple of real time, the sample packets are about 16 s apart
+SPEED = 1000
+FLUSH_SECONDS = 0.5
+
+
+def test_load_packets():
+    """Test that the copies of a capture follow each other."""
+    packets = replay_harness.load_packets(repeat=3)
+    assert len(packets) == 69
+    mets = [packet.met for packet in packets]
+    assert mets == sorted(mets)
+    assert len(set(mets)) == 69
+    assert [packet.seq_count for packet in packets[:24]] == [*range(57, 80), 80]
+    # The packets are rewritten, not only their fields
+    assert packets[23].data[6:10] == packets[23].met.to_bytes(4, "big")
+
+
+def run_replay(setup_dynamodb, s3_client):
+    """Replay 4 copies of the sample capture through the pipeline."""
+    packets = replay_harness.load_packets(repeat=4)
+    report = replay_harness.run_load_test(
+        packets,
+        setup_dynamodb["ingest_table"],
+        s3_client,
+        BUCKET_NAME,
+        speed=SPEED,
+        flush_seconds=FLUSH_SECONDS,
+        sample_seconds=0.1,
+    )
+    return packets, report
+
+
+def test_replay(setup_dynamodb, s3_client):
+    """Test that a replay at load receives, stores and reports every packet."""
+    packets, report = run_replay(setup_dynamodb, s3_client)
+
+    assert report.packets == len(packets)
+    assert report.ingest["packets"] == len(packets)
+    assert report.samples[-1].received == len(packets)
+    assert all(sample.memory > 0 for sample in report.samples[1:])
+    assert report.get_violations({"processed": 0.0})
+
+
+@pytest.mark.load()
+def test_latency_budget(setup_dynamodb, s3_client):
+    """Test the latencies of a replay of the sample capture at load."""
+    _, report = run_replay(setup_dynamodb, s3_client)
+    assert (
+        report.get_violations(
+            {"processed": 1.0, "stored": FLUSH_SECONDS + 1.0},
+        )
+        == []
+    ), report.format()
@@ -0,0 +1,135 @@
+"""Tests for the time-partitioned S3 writer of the I-ALiRT service."""
+
+import io
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+import s3_writer
+
+from .conftest import BUCKET_NAME
+
+START = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+# Smallest part size accepted by S3
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def read(s3_client, key):
+    """Get the content of an object."""
+    return s3_client.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+
+
+def test_partition_start():
+    """Test that partitions start on multiples of their length."""
+    assert s3_writer.get_partition_start(START) == START.replace(second=0)
+    assert s3_writer.get_partition_start(START, 3600) == START.replace(
+        minute=0, second=0
+    )
+
+
+def test_task_id(monkeypatch):
+    """Test that the task ID is read from the ECS task metadata."""
+    monkeypatch.delenv("ECS_CONTAINER_METADATA_URI_V4", raising=False)
+    with patch.object(s3_writer.socket, "gethostname", return_value="host"):
+        assert s3_writer.get_task_id() == "host"
+
+        monkeypatch.setenv("ECS_CONTAINER_METADATA_URI_V4", "http://169.254.170.2/v4")
+        metadata = io.BytesIO(
+            json.dumps(
+                {"TaskARN": "arn:aws:ecs:us-west-2:123:task/cluster/abc123"}
+            ).encode()
+        )
+        with patch.object(s3_writer.urllib.request, "urlopen", return_value=metadata):
+            assert s3_writer.get_task_id() == "abc123"
+        # Falls back to the host name if the endpoint cannot be read
+        with patch.object(s3_writer.urllib.request, "urlopen", side_effect=OSError):
+            assert s3_writer.get_task_id() == "host"
+
+
+def test_partitions(s3_client):
+    """Test that packets are appended to the object of their partition."""
+    writer = s3_writer.PartitionedS3Writer(
+        s3_client, BUCKET_NAME, "Primary", task_id="abc123"
+    )
+    key = writer.write(b"a" * 10, START)
+    assert key == "packets/2024/01/02/imap_ialirt_primary_abc123_20240102T030400.bin"
+    assert writer.write(b"b" * 10, START + timedelta(seconds=30)) == key
+    # Nothing is uploaded until the partition ends
+    assert "Contents" not in s3_client.list_objects_v2(Bucket=BUCKET_NAME)
+
+    # The next partition closes the previous one
+    next_key = writer.write(b"c", START + timedelta(seconds=60))
+    assert (
+        next_key == "packets/2024/01/02/imap_ialirt_primary_abc123_20240102T030500.bin"
+    )
+    assert writer.get_time_key(START + timedelta(seconds=61)) == next_key
+    assert read(s3_client, key) == b"a" * 10 + b"b" * 10
+
+    # Closed by the periodic roll over once the partition has ended
+    assert writer.roll_over(START + timedelta(seconds=90)) is None
+    assert writer.roll_over(START + timedelta(seconds=120)) == next_key
+    assert read(s3_client, next_key) == b"c"
+    assert writer.close() is None
+
+
+def test_multipart_upload(s3_client):
+    """Test that large partitions are uploaded in parts while they grow."""
+    writer = s3_writer.PartitionedS3Writer(
+        s3_client, BUCKET_NAME, "Primary", part_size=MIN_PART_SIZE
+    )
+    chunks = [bytes([i]) * (MIN_PART_SIZE // 2 + 1) for i in range(5)]
+    for chunk in chunks:
+        key = writer.write(chunk, START)
+    # Two parts are uploaded, the rest is buffered
+    assert len(writer.parts) == 2
+    assert writer.buffer.tell() == len(chunks[-1])
+
+    assert writer.close() == key
+    assert read(s3_client, key) == b"".join(chunks)
+    assert s3_client.list_multipart_uploads(Bucket=BUCKET_NAME).get("Uploads") is None
+
+
+def test_failed_upload_is_aborted(s3_client):
+    """Test that the upload of a partition that cannot be completed is aborted."""
+    writer = s3_writer.PartitionedS3Writer(
+        s3_client, BUCKET_NAME, "Primary", part_size=MIN_PART_SIZE
+    )
+    writer.write(b"a" * MIN_PART_SIZE, START)
+    # Lose the first part, completing the upload fails
+    writer.parts[0]["ETag"] = '"0"'
+
+    assert writer.close() is None
+    assert s3_client.list_multipart_uploads(Bucket=BUCKET_NAME).get("Uploads") is None
+    assert "Contents" not in s3_client.list_objects_v2(Bucket=BUCKET_NAME)
+    # The writer is ready for the next partition
+    key = writer.write(b"b", START + timedelta(seconds=60))
+    assert writer.close() == key
+
+
+def test_failed_part_is_retried(s3_client):
+    """Test that a part that fails to upload is sent with the next one."""
+    writer = s3_writer.PartitionedS3Writer(
+        s3_client, BUCKET_NAME, "Primary", part_size=MIN_PART_SIZE
+    )
+    with patch.object(writer, "_upload_part", side_effect=OSError):
+        key = writer.write(b"a" * MIN_PART_SIZE, START)
+    assert writer.buffer.tell() == MIN_PART_SIZE
+    writer.write(b"b", START)
+    assert len(writer.parts) == 1
+    assert writer.close() == key
+    assert read(s3_client, key) == b"a" * MIN_PART_SIZE + b"b"
+
+
+def test_failed_abort(s3_client):
+    """Test that the writer is reset even if the upload cannot be aborted."""
+    writer = s3_writer.PartitionedS3Writer(
+        s3_client, BUCKET_NAME, "Primary", part_size=MIN_PART_SIZE
+    )
+    writer.write(b"a" * MIN_PART_SIZE, START)
+    writer.parts[0]["ETag"] = '"0"'
+    writer.s3_client = Mock(wraps=s3_client)
+    writer.s3_client.abort_multipart_upload.side_effect = OSError
+
+    assert writer.close() is None
+    assert writer.key is None
+    assert writer.upload_id is None
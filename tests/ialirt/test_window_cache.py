@@ -0,0 +1,87 @@
+"""Tests for the in-memory packet windows of the I-ALiRT service."""
+
+import io
+import time
+
+import pytest
+import window_cache
+
+from sds_data_manager.lambda_code.IAlirtCode import ialirt_ingest
+
+from ..lambda_endpoints.test_ialirt_ingest import make_packet
+
+
+def test_packet_window_wraps_around():
+    """Test that a full window overwrites its oldest packets."""
+    window = window_cache.PacketWindow(capacity=4, packet_size=32)
+    for seq in range(3):
+        window.append(100 + seq, seq, make_packet(478, seq, 100 + seq))
+    assert len(window) == 3
+    assert window.window()["seq_count"].tolist() == [0, 1, 2]
+
+    for seq in range(3, 7):
+        window.append(100 + seq, seq, make_packet(478, seq, 100 + seq))
+    packets = window.window()
+    assert len(window) == 4
+    assert packets["seq_count"].tolist() == [3, 4, 5, 6]
+    assert packets["met"].tolist() == [103, 104, 105, 106]
+    packet = make_packet(478, 6, 106)
+    assert packets["data"][-1, : packets["length"][-1]].tobytes() == packet
+
+    assert window.window(start_met=105)["seq_count"].tolist() == [5, 6]
+    assert window.latest(2)["seq_count"].tolist() == [5, 6]
+    assert len(window.latest(0)) == 0
+
+    with pytest.raises(ValueError, match="larger than"):
+        window.append(107, 7, b"\x00" * 33)
+
+
+def test_window_cache_per_apid():
+    """Test that each APID has its own window."""
+    cache = window_cache.WindowCache(capacity=8, packet_size=32)
+    cache.append(478, 100, 1, make_packet(478, 1, 100))
+    cache.append(1344, 100, 5, make_packet(1344, 5, 100))
+    cache.append(478, 101, 2, make_packet(478, 2, 101))
+
+    assert cache[478].window()["seq_count"].tolist() == [1, 2]
+    assert cache[1344].window()["seq_count"].tolist() == [5]
+    assert len(cache[1]) == 0
+
+
+def test_warm_up(setup_dynamodb):
+    """Test that the windows are refilled with the ingested packets."""
+    ingest_table = setup_dynamodb["ingest_table"]
+    packets = [make_packet(478, seq, 100 + seq // 4) for seq in range(40)]
+    packets.append(make_packet(1344, 0, 105))
+    ialirt_ingest.ingest_packets(
+        io.BytesIO(b"".join(packets)), ingest_table, "packets/test.bin"
+    )
+
+    # moto applies the query limit before the descending order, so the
+    # windows hold every packet here
+    cache = window_cache.WindowCache(capacity=64, packet_size=32)
+    counts = cache.warm_up(ingest_table, [478, 1344, 1])
+
+    assert counts == {478: 40, 1344: 1, 1: 0}
+    window = cache[478].window()
+    assert window["seq_count"].tolist() == list(range(40))
+    assert window["met"][-1] == 109
+    assert window["data"][24, : window["length"][24]].tobytes() == packets[24]
+    assert cache[1344].window()["met"].tolist() == [105]
+
+
+def test_window_latency():
+    """Test that appending and reading windows stays far below a millisecond."""
+    cache = window_cache.WindowCache(capacity=4096, packet_size=1464)
+    packet = make_packet(478, 0, 0, b"\x00" * 1400)
+    n_packets = 10000
+
+    start = time.perf_counter()
+    for seq in range(n_packets):
+        window = cache.append(478, seq // 4, seq % 16384, packet)
+        window.window(start_met=seq // 4 - 600)
+    elapsed = time.perf_counter() - start
+
+    assert len(window) == 4096
+    # Generous bound for slow CI runners
+    assert elapsed / n_packets < 1e-3
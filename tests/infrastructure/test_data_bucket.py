@@ -93,3 +93,20 @@ def test_s3_bucket(template):
             "BucketName": {"Ref": Match.string_like_regexp("DataBucket*")},
         },
     )
+
+
+def test_abort_incomplete_uploads(template):
+    """Ensure abandoned multipart uploads are removed."""
+    template.has_resource_properties(
+        "AWS::S3::Bucket",
+        {
+            "LifecycleConfiguration": {
+                "Rules": [
+                    {
+                        "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 7},
+                        "Status": "Enabled",
+                    }
+                ]
+            }
+        },
+    )
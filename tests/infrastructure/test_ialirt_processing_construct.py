@@ -1,8 +1,177 @@
 """Tests I-ALiRT processing."""
 
+import socket
+from pathlib import Path
+from urllib.parse import urlparse
+
 import boto3
 import pytest
-import requests
+from aws_cdk import aws_ecr as ecr
+from aws_cdk import aws_s3 as s3
+from aws_cdk.assertions import Match, Template
+
+from sds_data_manager.constructs.ialirt_processing_construct import (
+    METRIC_NAMESPACE,
+    IalirtProcessing,
+)
+from sds_data_manager.constructs.networking_construct import NetworkingConstruct
+
+PACKET_FILE = (
+    Path(__file__).parent.parent
+    / "test-data"
+    / "science_block_20221116_163611Z_idle.bin"
+)
+
+
+@pytest.fixture()
+def template(stack):
+    """Return an I-ALiRT processing template with a larger configuration."""
+    networking = NetworkingConstruct(stack, "Networking")
+    IalirtProcessing(
+        stack,
+        "IalirtProcessingPrimary",
+        vpc=networking.vpc,
+        repo=ecr.Repository(stack, "Repo"),
+        processing_name="Primary",
+        ialirt_ports=[8080, 8081],
+        container_port=8080,
+        ialirt_bucket=s3.Bucket(stack, "Bucket"),
+        instance_type="c6i.large",
+        cpu=1024,
+        memory_limit_mib=2048,
+        min_tasks=2,
+        max_tasks=6,
+        packets_per_task=80,
+    )
+    return Template.from_stack(stack)
+
+
+def test_instance_and_task_sizes(template):
+    """Ensure the instance type and task sizes are configurable."""
+    template.has_resource_properties(
+        "AWS::AutoScaling::LaunchConfiguration", {"InstanceType": "c6i.large"}
+    )
+    template.has_resource_properties(
+        "AWS::AutoScaling::AutoScalingGroup", {"MinSize": "1", "MaxSize": "6"}
+    )
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition",
+        {
+            "ContainerDefinitions": [
+                Match.object_like(
+                    {
+                        "Cpu": 1024,
+                        "Memory": 2048,
+                        "Environment": Match.array_with(
+                            [{"Name": "PROCESSING_NAME", "Value": "Primary"}]
+                        ),
+                    }
+                )
+            ]
+        },
+    )
+    template.has_resource_properties(
+        "AWS::ECS::Service",
+        {
+            "DesiredCount": 2,
+            "CapacityProviderStrategy": [Match.object_like({"Weight": 1})],
+        },
+    )
+
+
+def test_unprivileged_container(template):
+    """Ensure the container writes to S3 without privileges."""
+    template.has_resource_properties(
+        "AWS::ECS::TaskDefinition",
+        {"ContainerDefinitions": [Match.object_like({"Privileged": Match.absent()})]},
+    )
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        {
+            "PolicyDocument": {
+                "Statement": Match.array_with(
+                    [
+                        Match.object_like(
+                            {
+                                "Action": Match.array_with(
+                                    ["s3:PutObject", "s3:AbortMultipartUpload"]
+                                )
+                            }
+                        )
+                    ]
+                )
+            }
+        },
+    )
+
+
+def test_task_scaling(template):
+    """Ensure the tasks scale on the packet rate."""
+    template.has_resource_properties(
+        "AWS::ApplicationAutoScaling::ScalableTarget",
+        {
+            "MinCapacity": 2,
+            "MaxCapacity": 6,
+            "ScalableDimension": "ecs:service:DesiredCount",
+        },
+    )
+    template.has_resource_properties(
+        "AWS::ApplicationAutoScaling::ScalingPolicy",
+        {
+            "PolicyType": "TargetTrackingScaling",
+            "TargetTrackingScalingPolicyConfiguration": Match.object_like(
+                {
+                    "TargetValue": 80,
+                    "CustomizedMetricSpecification": Match.object_like(
+                        {
+                            "MetricName": "PacketsPerSecond",
+                            "Namespace": METRIC_NAMESPACE,
+                            "Statistic": "Average",
+                            "Dimensions": [
+                                {"Name": "ProcessingName", "Value": "Primary"}
+                            ],
+                        }
+                    ),
+                }
+            ),
+        },
+    )
+    # Added tasks only take new connections, scaling on the lag of the
+    # existing ones would not relieve them
+    template.resource_count_is("AWS::ApplicationAutoScaling::ScalingPolicy", 1)
+
+
+def test_connections_survive_scaling(template):
+    """Ensure connections are drained and busy tasks can protect themselves."""
+    template.has_resource_properties(
+        "AWS::ElasticLoadBalancingV2::TargetGroup",
+        {
+            "Protocol": "TCP",
+            "TargetGroupAttributes": Match.array_with(
+                [{"Key": "deregistration_delay.timeout_seconds", "Value": "300"}]
+            ),
+        },
+    )
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        {
+            "PolicyDocument": {
+                "Statement": Match.array_with(
+                    [
+                        Match.object_like(
+                            {
+                                "Action": [
+                                    "ecs:GetTaskProtection",
+                                    "ecs:UpdateTaskProtection",
+                                ],
+                                "Effect": "Allow",
+                            }
+                        )
+                    ]
+                )
+            }
+        },
+    )
 
 
 def get_nlb_dns(stack_name, port, container_name):
@@ -19,25 +188,14 @@ def get_nlb_dns(stack_name, port, container_name):
 
 @pytest.mark.xfail(reason="Will fail unless IALiRT stack is deployed.")
 def test_nlb_response():
-    """Test to ensure the NLB responds with HTTP 200 status."""
+    """Test to ensure the NLB forwards packet streams to the receivers."""
     ialirt_ports = {"Primary": [8080, 8081], "Secondary": [80]}
-    container_ports = {"Primary": 8080, "Secondary": 80}
 
     for stack_name, ports in ialirt_ports.items():
         for port in ports:
             nlb_dns = get_nlb_dns(f"IalirtProcessing{stack_name}", port, stack_name)
             print(f"Testing URL: {nlb_dns}")
-            # Specify a timeout for the request
-            response = requests.get(nlb_dns, timeout=10)  # timeout in seconds
-            assert (
-                response.status_code == 200
-            ), f"NLB did not return HTTP 200 on port {port} for {stack_name}"
-            assert (
-                response.text == f"Hello World from Port {container_ports[stack_name]}."
-            ), f"NLB did not return expected text on port {port} for {stack_name}"
-            s3_response = requests.get(
-                nlb_dns + "/list", timeout=10
-            )  # timeout in seconds
-            assert (
-                f"test_file{container_ports[stack_name]}.txt" in s3_response.text
-            ), f"NLB did not return expected file name on port {port} for {stack_name}"
+            url = urlparse(nlb_dns)
+            # The receiver accepts the connection and reads the packets
+            with socket.create_connection((url.hostname, url.port), timeout=10) as s:
+                s.sendall(PACKET_FILE.read_bytes())
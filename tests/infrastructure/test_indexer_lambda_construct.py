@@ -3,7 +3,7 @@
 import pytest
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_rds as rds
-from aws_cdk.assertions import Template
+from aws_cdk.assertions import Match, Template
 
 from sds_data_manager.constructs.data_bucket_construct import DataBucketConstruct
 from sds_data_manager.constructs.database_construct import SdpDatabase
@@ -59,3 +59,57 @@ def test_indexer_role(template):
     template.resource_count_is("AWS::IAM::Role", 6)
     # 4 for RDS stack + 1 for indexer lambda
     template.resource_count_is("AWS::Lambda::Function", 5)
+
+
+def test_batch_job_status_queue(template):
+    """Ensure batch job status changes are delivered in batches."""
+    template.resource_count_is("AWS::SQS::Queue", 2)
+    template.has_resource_properties(
+        "AWS::SQS::Queue",
+        {
+            "QueueName": "batch-job-status-queue",
+            "RedrivePolicy": Match.object_like({"maxReceiveCount": 5}),
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Events::Rule",
+        {
+            "Name": "batch-job-status",
+            "Targets": [
+                Match.object_like({"Arn": {"Fn::GetAtt": [Match.any_value(), "Arn"]}})
+            ],
+        },
+    )
+    template.has_resource_properties(
+        "AWS::Lambda::EventSourceMapping",
+        {
+            "BatchSize": 100,
+            "MaximumBatchingWindowInSeconds": 10,
+            "FunctionResponseTypes": ["ReportBatchItemFailures"],
+        },
+    )
+
+
+def test_data_arrival_rule(template):
+    """Ensure science files and SPICE kernels trigger the indexer."""
+    template.has_resource_properties(
+        "AWS::Events::Rule",
+        {
+            "Name": "imap-data-arrival",
+            "EventPattern": Match.object_like(
+                {
+                    "detail": Match.object_like(
+                        {
+                            "object": {
+                                "key": [
+                                    {"prefix": "imap/"},
+                                    {"prefix": "spice/"},
+                                    {"prefix": "spin/"},
+                                ]
+                            }
+                        }
+                    )
+                }
+            ),
+        },
+    )
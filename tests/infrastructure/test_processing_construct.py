@@ -0,0 +1,251 @@
+"""Test the processing construct."""
+
+import pytest
+from aws_cdk.assertions import Match, Template
+
+from sds_data_manager.constructs.data_bucket_construct import DataBucketConstruct
+from sds_data_manager.constructs.networking_construct import NetworkingConstruct
+from sds_data_manager.constructs.processing_construct import (
+    ProcessingConstruct,
+    get_heavy_job_definitions,
+    get_job_profile,
+    load_job_resources,
+    validate_job_profile,
+)
+
+
+def load_ec2_job_resources():
+    """Load the resource profiles, with the l3 jobs running on EC2."""
+    job_resources = load_job_resources()
+    job_resources["ec2"]["enabled"] = True
+    job_resources["jobs"]["*-l3"]["compute"] = "ec2"
+    return job_resources
+
+
+@pytest.fixture()
+def template(stack, env):
+    """Return a processing template with a couple of jobs."""
+    data_bucket = DataBucketConstruct(stack, "DataBucket", env=env)
+    networking_construct = NetworkingConstruct(stack, "Networking")
+    processing = ProcessingConstruct(
+        stack,
+        "ProcessingConstruct",
+        vpc=networking_construct.vpc,
+        data_bucket=data_bucket.data_bucket,
+        job_resources=load_ec2_job_resources(),
+    )
+    processing.add_job("swe")
+    processing.add_job("swe-l3")
+
+    return Template.from_stack(stack)
+
+
+def test_job_definitions(template):
+    """Ensure a job definition and repository are created per job."""
+    template.resource_count_is("AWS::Batch::JobDefinition", 2)
+    template.resource_count_is("AWS::ECR::Repository", 2)
+    template.has_resource_properties(
+        "AWS::Batch::JobDefinition",
+        {
+            "JobDefinitionName": "ProcessingJob-swe",
+            "ContainerProperties": {"JobRoleArn": Match.any_value()},
+        },
+    )
+
+
+def test_job_role_reads_manifests(template):
+    """Ensure the jobs can read the array job manifests."""
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        {
+            "PolicyDocument": {
+                "Statement": Match.array_with(
+                    [
+                        Match.object_like(
+                            {
+                                "Action": Match.array_with(["s3:GetObject*"]),
+                                "Resource": Match.array_with(
+                                    [
+                                        {
+                                            "Fn::Join": [
+                                                "",
+                                                [
+                                                    Match.any_value(),
+                                                    "/batch-manifests/*",
+                                                ],
+                                            ]
+                                        }
+                                    ]
+                                ),
+                            }
+                        )
+                    ]
+                )
+            }
+        },
+    )
+
+
+def test_job_resource_profiles(template):
+    """Ensure the job definitions get the resources of their profiles."""
+    template.has_resource_properties(
+        "AWS::Batch::JobDefinition",
+        {
+            "JobDefinitionName": "ProcessingJob-swe",
+            "PlatformCapabilities": ["FARGATE"],
+            "ContainerProperties": Match.object_like(
+                {
+                    "ResourceRequirements": Match.array_with(
+                        [
+                            {"Type": "MEMORY", "Value": "4096"},
+                            {"Type": "VCPU", "Value": "1"},
+                        ]
+                    ),
+                    "EphemeralStorage": {"SizeInGiB": 21},
+                    "RuntimePlatform": {
+                        "CpuArchitecture": "X86_64",
+                        "OperatingSystemFamily": "LINUX",
+                    },
+                }
+            ),
+        },
+    )
+    # Heavy jobs run on EC2 with the NVMe scratch space mounted
+    template.has_resource_properties(
+        "AWS::Batch::JobDefinition",
+        {
+            "JobDefinitionName": "ProcessingJob-swe-l3",
+            "PlatformCapabilities": ["EC2"],
+            "ContainerProperties": Match.object_like(
+                {
+                    "ResourceRequirements": Match.array_with(
+                        [
+                            {"Type": "MEMORY", "Value": "15360"},
+                            {"Type": "VCPU", "Value": "4"},
+                        ]
+                    ),
+                    "MountPoints": [
+                        {"ContainerPath": "/scratch", "SourceVolume": "scratch"}
+                    ],
+                    "Volumes": [
+                        {"Host": {"SourcePath": "/scratch"}, "Name": "scratch"}
+                    ],
+                }
+            ),
+        },
+    )
+
+
+def test_heavy_job_queue(template):
+    """Ensure heavy jobs are placed on Spot first, then on-demand instances."""
+    template.resource_count_is("AWS::Batch::JobQueue", 2)
+    template.resource_count_is("AWS::Batch::ComputeEnvironment", 3)
+    template.has_resource_properties(
+        "AWS::Batch::JobQueue",
+        {
+            "JobQueueName": "HeavyProcessingJobQueue",
+            "ComputeEnvironmentOrder": [
+                {"ComputeEnvironment": Match.any_value(), "Order": 1},
+                {"ComputeEnvironment": Match.any_value(), "Order": 2},
+            ],
+        },
+    )
+    for name, compute_type, strategy in [
+        ("spot", "SPOT", "SPOT_PRICE_CAPACITY_OPTIMIZED"),
+        ("ondemand", "EC2", "BEST_FIT_PROGRESSIVE"),
+    ]:
+        template.has_resource_properties(
+            "AWS::Batch::ComputeEnvironment",
+            {
+                "ComputeEnvironmentName": f"HeavyProcessingComputeEnvironment-{name}",
+                "ComputeResources": Match.object_like(
+                    {
+                        "Type": compute_type,
+                        "AllocationStrategy": strategy,
+                        "InstanceTypes": ["c6id", "m6id", "r6id"],
+                        "MinvCpus": 0,
+                        "MaxvCpus": 256,
+                        "LaunchTemplate": Match.any_value(),
+                    }
+                ),
+            },
+        )
+    template.resource_count_is("AWS::EC2::LaunchTemplate", 1)
+
+
+def test_ec2_compute_disabled(stack):
+    """Ensure only the Fargate queue exists by default."""
+    networking_construct = NetworkingConstruct(stack, "Networking")
+    job_resources = load_job_resources()
+    assert not job_resources["ec2"]["enabled"]
+    processing = ProcessingConstruct(
+        stack,
+        "ProcessingConstruct",
+        vpc=networking_construct.vpc,
+    )
+    processing.add_job("swe-l3")
+
+    template = Template.from_stack(stack)
+    template.resource_count_is("AWS::Batch::JobQueue", 1)
+    template.resource_count_is("AWS::Batch::ComputeEnvironment", 1)
+    assert get_heavy_job_definitions(job_resources, ["swe", "swe-l3"]) == []
+
+
+def test_get_heavy_job_definitions():
+    """Test listing the job definitions that run on EC2."""
+    job_definitions = get_heavy_job_definitions(
+        load_ec2_job_resources(), ["swe", "swe-l3", "hit", "hit-l3"]
+    )
+    assert job_definitions == ["ProcessingJob-swe-l3", "ProcessingJob-hit-l3"]
+
+
+def test_get_job_profile():
+    """Test that the most specific settings win."""
+    job_resources = {
+        "default": {"vcpu": 1, "memory": 4096},
+        "jobs": {"hit": {"memory": 2048}, "*-l3": {"vcpu": 2}, "hit-l3": {"vcpu": 4}},
+    }
+    assert get_job_profile(job_resources, "swe") == {"vcpu": 1, "memory": 4096}
+    assert get_job_profile(job_resources, "hit") == {"vcpu": 1, "memory": 2048}
+    assert get_job_profile(job_resources, "swe-l3") == {"vcpu": 2, "memory": 4096}
+    assert get_job_profile(job_resources, "hit-l3") == {"vcpu": 4, "memory": 4096}
+
+
+def test_configured_profiles_are_valid():
+    """Ensure every configured profile is valid for its compute."""
+    for job_resources in [load_job_resources(), load_ec2_job_resources()]:
+        for job_name in ["default", *job_resources["jobs"]]:
+            validate_job_profile(
+                job_name,
+                get_job_profile(job_resources, job_name),
+                ec2_enabled=job_resources["ec2"]["enabled"],
+            )
+
+
+@pytest.mark.parametrize(
+    ("settings", "message"),
+    [
+        ({"vcpu": 3}, "Invalid vcpu"),
+        ({"memory": 1024}, "Invalid memory"),
+        ({"memory": 4500}, "Invalid memory"),
+        ({"ephemeral_storage": 500}, "Invalid ephemeral_storage"),
+        ({"gpu": 1}, "must have exactly"),
+        ({"architecture": "arm64"}, "must have exactly"),
+        ({"compute": "lambda"}, "Invalid compute"),
+        ({"compute": "ec2", "vcpu": 0.5}, "Invalid vcpu"),
+        ({"compute": "ec2", "memory": 256}, "Invalid memory"),
+    ],
+)
+def test_invalid_profile(stack, settings, message):
+    """Ensure invalid profiles are rejected at synth time."""
+    networking_construct = NetworkingConstruct(stack, "Networking")
+    job_resources = load_ec2_job_resources()
+    job_resources["jobs"] = {"swe": settings}
+    processing = ProcessingConstruct(
+        stack,
+        "ProcessingConstruct",
+        vpc=networking_construct.vpc,
+        job_resources=job_resources,
+    )
+    with pytest.raises(ValueError, match=message):
+        processing.add_job("swe")
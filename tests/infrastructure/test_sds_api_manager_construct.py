@@ -3,7 +3,7 @@
 import pytest
 from aws_cdk import aws_ec2 as ec2
 from aws_cdk import aws_lambda as lambda_
-from aws_cdk.assertions import Template
+from aws_cdk.assertions import Match, Template
 
 from sds_data_manager.constructs.api_gateway_construct import ApiGateway
 from sds_data_manager.constructs.data_bucket_construct import DataBucketConstruct
@@ -42,6 +42,27 @@ def template(stack, env):
 
 def test_indexer_role(template):
     """Ensure that the template has appropriate IAM roles."""
-    template.resource_count_is("AWS::IAM::Role", 8)
+    template.resource_count_is("AWS::IAM::Role", 9)
     # Ensure that the template has appropriate lambda count
-    template.resource_count_is("AWS::Lambda::Function", 6)
+    template.resource_count_is("AWS::Lambda::Function", 7)
+
+
+def test_reprocessing_release_schedule(template):
+    """Ensure PENDING reprocessing jobs are released on a schedule."""
+    template.has_resource_properties(
+        "AWS::Events::Rule",
+        {"ScheduleExpression": "rate(5 minutes)", "State": "ENABLED"},
+    )
+
+
+def test_reprocessing_lambda_bucket_access(template):
+    """Ensure the reprocessing lambda can write the manifests of its jobs."""
+    template.has_resource_properties(
+        "AWS::Lambda::Function",
+        {
+            "FunctionName": "reprocessing-api-handler",
+            "Environment": {
+                "Variables": Match.object_like({"S3_BUCKET": Match.any_value()})
+            },
+        },
+    )
@@ -9,6 +9,8 @@ from moto import mock_events, mock_s3
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from sds_data_manager.lambda_code.IAlirtCode import ialirt_products_api
+from sds_data_manager.lambda_code.SDSCode import repointing, spice_registry
 from sds_data_manager.lambda_code.SDSCode.database import database as db
 from sds_data_manager.lambda_code.SDSCode.database.models import Base
 
@@ -27,6 +29,24 @@ def _set_env(monkeypatch):
     monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
 
 
+@pytest.fixture(autouse=True)
+def _clear_coverage_indexes():
+    """Start every test without the cached SPICE coverage indexes."""
+    spice_registry._coverage_indexes.clear()
+
+
+@pytest.fixture(autouse=True)
+def _clear_repointing_index():
+    """Start every test without the cached pointings."""
+    repointing._repointing_index.clear()
+
+
+@pytest.fixture(autouse=True)
+def _clear_ialirt_products_cache():
+    """Start every test without the cached I-ALiRT products."""
+    ialirt_products_api._cache.clear()
+
+
 @pytest.fixture(scope="module")
 def science_file():
     """Path to a valid science file."""
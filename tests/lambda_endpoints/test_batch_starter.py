@@ -1,5 +1,6 @@
 """Tests the batch starter."""
 
+import json
 from datetime import datetime
 from unittest.mock import Mock, patch
 
@@ -7,7 +8,7 @@ import pytest
 from imap_data_access import ScienceFilePath
 from sqlalchemy.exc import IntegrityError
 
-from sds_data_manager.lambda_code.SDSCode import batch_starter
+from sds_data_manager.lambda_code.SDSCode import batch_starter, spice_registry
 from sds_data_manager.lambda_code.SDSCode.batch_starter import (
     get_downstream_dependencies,
     get_file,
@@ -310,3 +311,171 @@ def test_duplicate_job(session, first_status, second_status):
     session.add(record)
     session.commit()
     assert session.query(ProcessingJob).count() == 5
+
+
+def test_submit_jobs_array(session, s3_client):
+    """Jobs sharing a job definition are submitted as one array job."""
+    ready_jobs = []
+    for descriptor in ["sci", "hk"]:
+        processing_job = ProcessingJob(
+            status=models.Status.INPROGRESS,
+            instrument="codice",
+            data_level="l1a",
+            descriptor=descriptor,
+            start_date=datetime(2024, 1, 1),
+            version="v001",
+        )
+        session.add(processing_job)
+        session.commit()
+        ready_jobs.append((processing_job, []))
+
+    mock_batch_client = Mock(**{"submit_job.return_value": {"jobId": "parent-id"}})
+    with patch.object(batch_starter, "BATCH_CLIENT", mock_batch_client):
+        batch_starter.submit_jobs(session, ready_jobs)
+
+    mock_batch_client.submit_job.assert_called_once()
+    kwargs = mock_batch_client.submit_job.call_args.kwargs
+    assert kwargs["jobDefinition"] == "ProcessingJob-codice"
+    assert kwargs["arrayProperties"] == {"size": 2}
+    command = kwargs["containerOverrides"]["command"]
+    assert command[0] == "--array-manifest"
+
+    # The manifest holds the command of each child, in index order
+    manifest_key = command[1].split("/", 3)[-1]
+    manifest = json.loads(
+        s3_client.get_object(Bucket="test-data-bucket", Key=manifest_key)["Body"].read()
+    )
+    assert [job["processing_job_id"] for job in manifest["jobs"]] == [
+        job.id for job, _ in ready_jobs
+    ]
+    assert manifest["jobs"][1]["command"][5] == "hk"
+
+    # The child job ids are recorded for the indexer
+    assert [job.batch_job_id for job, _ in ready_jobs] == [
+        "parent-id:0",
+        "parent-id:1",
+    ]
+
+
+def test_submit_jobs_single(session):
+    """A job with a unique job definition is submitted on its own."""
+    processing_job = ProcessingJob(
+        status=models.Status.INPROGRESS,
+        instrument="swe",
+        data_level="l1a",
+        descriptor="sci",
+        start_date=datetime(2024, 1, 1),
+        version="v001",
+    )
+    session.add(processing_job)
+    session.commit()
+
+    with patch.object(batch_starter, "BATCH_CLIENT", Mock()) as mock_batch_client:
+        batch_starter.submit_jobs(session, [(processing_job, [])])
+
+    kwargs = mock_batch_client.submit_job.call_args.kwargs
+    assert "arrayProperties" not in kwargs
+    assert kwargs["jobName"] == f"swe-l1a-sci-job-{processing_job.id}"
+
+
+def test_submit_jobs_failure(session):
+    """Jobs that cannot be submitted are marked FAILED, not left INPROGRESS."""
+    processing_job = ProcessingJob(
+        status=models.Status.INPROGRESS,
+        instrument="swe",
+        data_level="l1a",
+        descriptor="sci",
+        start_date=datetime(2024, 1, 1),
+        version="v001",
+    )
+    session.add(processing_job)
+    session.commit()
+
+    mock_batch_client = Mock(**{"submit_job.side_effect": RuntimeError("Throttled")})
+    with patch.object(batch_starter, "BATCH_CLIENT", mock_batch_client):
+        assert batch_starter.submit_jobs(session, [(processing_job, [])]) == 0
+    assert processing_job.status == models.Status.FAILED
+
+
+def test_input_manifest(session, s3_client):
+    """The resolved inputs are passed to the job through a manifest in S3."""
+    s3_client.put_object(Bucket="test-data-bucket", Key="/path/to/file3", Body=b"abc")
+    _populate_file_catalog(session)
+    spice_registry.register_kernel(session, "spice/lsk/naif0012.tls")
+    spice_registry.register_kernel(
+        session, "spice/spk/imap_recon_20231230_20240102_v01.bsp"
+    )
+
+    events = {
+        "Records": [
+            {
+                "body": '{"detail": '
+                '{"object": {"key": "imap_swe_l0_raw_20240101_v001.pkts"}}'
+                "}"
+            }
+        ]
+    }
+    with patch.object(batch_starter, "BATCH_CLIENT", Mock()) as mock_batch_client:
+        lambda_handler(events, {})
+
+    command = mock_batch_client.submit_job.call_args.kwargs["containerOverrides"][
+        "command"
+    ]
+    # Passed as well to the containers that do not read the manifest
+    dependency = json.loads(command[command.index("--dependency") + 1])
+    assert dependency == [
+        {
+            "instrument": "swe",
+            "data_level": "l0",
+            "descriptor": "raw",
+            "start_date": "20240101",
+            "version": "v001",
+        }
+    ]
+    manifest_uri = command[command.index("--dependency-manifest") + 1]
+    assert manifest_uri.startswith("s3://test-data-bucket/batch-manifests/inputs/")
+
+    body = s3_client.get_object(
+        Bucket="test-data-bucket", Key=manifest_uri.split("/", 3)[-1]
+    )["Body"].read()
+    # Compact JSON without whitespace between items
+    assert b", " not in body
+    manifest = json.loads(body)
+    assert manifest["inputs"] == [
+        {
+            "instrument": "swe",
+            "data_level": "l0",
+            "descriptor": "raw",
+            "start_date": "20240101",
+            "version": "v001",
+            "file_path": "/path/to/file3",
+            "size": 3,
+            "etag": "900150983cd24fb0d6963f7d28e17f72",
+        }
+    ]
+
+    # The metakernel furnishes the kernels covering the job
+    assert manifest["metakernel"].startswith(
+        "s3://test-data-bucket/batch-manifests/metakernels/"
+    )
+    metakernel = (
+        s3_client.get_object(
+            Bucket="test-data-bucket", Key=manifest["metakernel"].split("/", 3)[-1]
+        )["Body"]
+        .read()
+        .decode()
+    )
+    assert "'$KERNELS/naif0012.tls'" in metakernel
+    assert "'$KERNELS/imap_recon_20231230_20240102_v01.bsp'" in metakernel
+
+
+def test_get_job_queue(monkeypatch):
+    """Test that heavy job definitions go to the EC2 queue."""
+    monkeypatch.setenv("HEAVY_JOB_DEFINITIONS", "ProcessingJob-hit-l3")
+    assert batch_starter.get_job_queue("ProcessingJob-hit-l3") == (
+        "HeavyProcessingJobQueue"
+    )
+    assert batch_starter.get_job_queue("ProcessingJob-hit") == "ProcessingJobQueue"
+
+    monkeypatch.delenv("HEAVY_JOB_DEFINITIONS")
+    assert batch_starter.get_job_queue("ProcessingJob-hit-l3") == "ProcessingJobQueue"
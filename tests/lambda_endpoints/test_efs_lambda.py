@@ -0,0 +1,326 @@
+"""Test the EFS lambda that stages SPICE kernels."""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+
+import pytest
+
+from sds_data_manager.lambda_code.efs_lambda import attitude_merge, lambda_function
+
+from .conftest import BUCKET_NAME
+
+
+@pytest.fixture()
+def mount_path(tmp_path, monkeypatch):
+    """Stage the kernels into a local directory in place of the EFS."""
+    monkeypatch.setattr(lambda_function, "mount_path", tmp_path)
+    monkeypatch.setattr(
+        lambda_function,
+        "ephemeris_symlink_path",
+        tmp_path / "latest_ephemeris_kernel.bsp",
+    )
+    monkeypatch.setattr(
+        lambda_function,
+        "attitude_symlink_path",
+        tmp_path / "latest_attitude_kernel.ah.a",
+    )
+    return tmp_path
+
+
+def test_write_data_to_efs(s3_client, mount_path):
+    """Test staging a kernel and pointing the symlink at it."""
+    s3_key = "spice/imap_recon_20240101_20240102_v01.bsp"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=b"kernel")
+
+    lambda_function.write_data_to_efs(s3_key, BUCKET_NAME, s3_client=s3_client)
+
+    symlink = mount_path / "latest_ephemeris_kernel.bsp"
+    assert symlink.is_symlink()
+    assert symlink.resolve() == mount_path / "imap_recon_20240101_20240102_v01.bsp"
+    assert symlink.read_bytes() == b"kernel"
+    # No temporary files are left behind
+    assert sorted(path.name for path in mount_path.iterdir()) == [
+        "imap_recon_20240101_20240102_v01.bsp",
+        "latest_ephemeris_kernel.bsp",
+    ]
+
+
+def test_stage_file_in_ranges(s3_client, tmp_path):
+    """Test downloading a large kernel in parallel byte ranges."""
+    content = os.urandom(10_000)
+    s3_client.put_object(Bucket=BUCKET_NAME, Key="spice/large.bsp", Body=content)
+
+    destination = tmp_path / "large.bsp"
+    lambda_function.stage_file(
+        "spice/large.bsp", BUCKET_NAME, destination, s3_client, chunk_size=1024
+    )
+    assert destination.read_bytes() == content
+
+
+def test_verify_download(tmp_path):
+    """Test that downloads are checked against the size and ETag."""
+    file_path = tmp_path / "kernel.bsp"
+    file_path.write_bytes(b"kernel")
+    etag = '"50484c19f1afdaf3841a0d821ed393d2"'
+
+    lambda_function.verify_download(file_path, 6, etag)
+    # Only the size is checked for multipart ETags
+    lambda_function.verify_download(file_path, 6, '"abc-2"')
+    with pytest.raises(ValueError, match="expected 7"):
+        lambda_function.verify_download(file_path, 7, etag)
+    with pytest.raises(ValueError, match="does not match the ETag"):
+        lambda_function.verify_download(file_path, 6, '"0123"')
+
+
+def test_failed_download_keeps_symlink(s3_client, mount_path, monkeypatch):
+    """Test that a failed download leaves the current kernel in place."""
+    s3_key = "spice/imap_recon_20240101_20240102_v01.bsp"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=b"kernel")
+    lambda_function.write_data_to_efs(s3_key, BUCKET_NAME, s3_client=s3_client)
+
+    def corrupt(file_path, size, etag):
+        raise ValueError("corrupt")
+
+    monkeypatch.setattr(lambda_function, "verify_download", corrupt)
+    new_key = "spice/imap_recon_20240102_20240103_v01.bsp"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=new_key, Body=b"new kernel")
+    with pytest.raises(ValueError, match="corrupt"):
+        lambda_function.write_data_to_efs(new_key, BUCKET_NAME, s3_client=s3_client)
+
+    symlink = mount_path / "latest_ephemeris_kernel.bsp"
+    assert symlink.read_bytes() == b"kernel"
+    assert not (mount_path / "imap_recon_20240102_20240103_v01.bsp").exists()
+    assert len(list(mount_path.iterdir())) == 2
+
+
+def test_concurrent_readers(s3_client, mount_path):
+    """Test that readers always see a complete kernel through the symlink."""
+    kernels = {}
+    for day in range(1, 11):
+        s3_key = f"spice/imap_recon_202401{day:02}_202401{day + 1:02}_v01.bsp"
+        # Each kernel is a different size, so a partial read would be caught
+        kernels[s3_key] = bytes([day]) * (1000 * day)
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=kernels[s3_key])
+
+    symlink = mount_path / "latest_ephemeris_kernel.bsp"
+    first_key = next(iter(kernels))
+    lambda_function.write_data_to_efs(first_key, BUCKET_NAME, s3_client=s3_client)
+
+    done = threading.Event()
+    errors = []
+    reads = []
+
+    def read_kernel():
+        while not done.is_set():
+            try:
+                content = symlink.read_bytes()
+            except OSError as e:
+                errors.append(e)
+                return
+            if content not in kernels.values():
+                errors.append(ValueError(f"Read a partial kernel of {len(content)}"))
+                return
+            reads.append(len(content))
+
+    readers = [threading.Thread(target=read_kernel) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for s3_key in kernels:
+            lambda_function.write_data_to_efs(s3_key, BUCKET_NAME, s3_client=s3_client)
+    finally:
+        done.set()
+        for reader in readers:
+            reader.join()
+
+    assert errors == []
+    assert reads
+    assert symlink.read_bytes() == kernels[s3_key]
+
+
+def make_ck(path, segments):
+    """Write a CK with a segment of the given (start, end, values) each."""
+    arrays = [
+        (
+            (start, end),
+            (-43000, -43000, 1, 3, 0, 0),
+            f"SEGMENT {start}".encode(),
+            struct.pack(f"<{len(values)}d", *values),
+        )
+        for start, end, values in segments
+    ]
+    attitude_merge.write_daf(path, b"DAF/CK  ", 2, 6, b"test", arrays)
+
+
+def test_daf_round_trip(tmp_path):
+    """Test that arrays written to a DAF are read back unchanged."""
+    # More arrays than fit in one summary record
+    segments = [(i, i + 1.0, [float(i)] * (i + 1)) for i in range(60)]
+    make_ck(tmp_path / "test.bc", segments)
+    assert (tmp_path / "test.bc").stat().st_size % attitude_merge.RECORD_SIZE == 0
+
+    daf = attitude_merge.read_daf(tmp_path / "test.bc")
+    assert (daf["idword"], daf["nd"], daf["ni"]) == (b"DAF/CK  ", 2, 6)
+    assert len(daf["arrays"]) == 60
+    for (doubles, integers, name, data), (start, end, values) in zip(
+        daf["arrays"], segments
+    ):
+        assert doubles == (start, end)
+        assert integers[:4] == (-43000, -43000, 1, 3)
+        assert name.rstrip() == f"SEGMENT {start}".encode()
+        assert struct.unpack(f"<{len(values)}d", data) == tuple(values)
+
+
+def test_merge_attitude_kernels(tmp_path):
+    """Test the incremental, gap-aware merge of historical attitude."""
+    make_ck(tmp_path / "imap_2024_001_2024_002_01.ah.bc", [(0, 10, [1.0, 2.0])])
+    make_ck(tmp_path / "imap_2024_003_2024_004_01.ah.bc", [(10, 20, [3.0])])
+    # Neither predicted attitude nor other kernels are merged
+    make_ck(tmp_path / "imap_pred_2024_005_2024_006_01.ah.bc", [(20, 30, [4.0])])
+    originals = {
+        path.name: hashlib.md5(path.read_bytes()).hexdigest()  # noqa: S324
+        for path in tmp_path.iterdir()
+    }
+
+    report = attitude_merge.merge_attitude_kernels(tmp_path)
+    assert [source["file"] for source in report["sources"]] == [
+        "imap_2024_001_2024_002_01.ah.bc",
+        "imap_2024_003_2024_004_01.ah.bc",
+    ]
+    assert report["coverage"] == [["2024-01-01T00:00:00", "2024-01-05T00:00:00"]]
+    assert report["gaps"] == []
+
+    # A new delivery, after a missing one, is appended
+    make_ck(tmp_path / "imap_2024_008_2024_009_01.ah.bc", [(30, 40, [5.0, 6.0])])
+    report = attitude_merge.merge_attitude_kernels(tmp_path)
+    assert report["gaps"] == [["2024-01-05T00:00:00", "2024-01-08T00:00:00"]]
+    assert json.loads((tmp_path / "merged_attitude_kernel.json").read_text()) == (
+        report
+    )
+
+    merged = attitude_merge.read_daf(tmp_path / "merged_attitude_kernel.ah.bc")
+    assert [doubles for doubles, _, _, _ in merged["arrays"]] == [
+        (0, 10),
+        (10, 20),
+        (30, 40),
+    ]
+    assert merged["arrays"][2][3] == struct.pack("<2d", 5.0, 6.0)
+
+    # Nothing new to merge
+    assert attitude_merge.merge_attitude_kernels(tmp_path) == report
+    # The original kernels are untouched
+    for name, md5 in originals.items():
+        assert hashlib.md5((tmp_path / name).read_bytes()).hexdigest() == md5  # noqa: S324
+
+
+def test_append_daf(tmp_path):
+    """Test appending arrays in place, past a full summary record."""
+    path = tmp_path / "test.bc"
+    make_ck(path, [(i, i + 1.0, [float(i)]) for i in range(20)])
+    data_record = path.read_bytes()[3 * attitude_merge.RECORD_SIZE :]
+    assert data_record.startswith(struct.pack("<2d", 0.0, 1.0))
+
+    for first in (20, 40):
+        arrays = attitude_merge.read_daf(path)["arrays"][:20]
+        attitude_merge.append_daf(
+            path,
+            [
+                ((i, i + 1.0), integers, f"SEGMENT {i}".encode(), data)
+                for i, (_, integers, _, data) in enumerate(arrays, first)
+            ],
+        )
+
+    daf = attitude_merge.read_daf(path)
+    assert [doubles for doubles, _, _, _ in daf["arrays"]] == [
+        (i, i + 1.0) for i in range(60)
+    ]
+    assert [name.rstrip() for _, _, name, _ in daf["arrays"]][-1] == b"SEGMENT 59"
+    assert daf["arrays"][59][3] == struct.pack("<d", 19.0)
+    # The existing data did not move
+    assert path.read_bytes()[3 * attitude_merge.RECORD_SIZE :].startswith(data_record)
+    # The file record points at the last summary record and past the end
+    content = path.read_bytes()
+    _, last_record, free = struct.unpack("<3i", content[76:88])
+    (next_record,) = struct.unpack("<d", content[(last_record - 1) * 1024 :][:8])
+    assert next_record == 0
+    assert free == len(content) // 8 + 1
+
+
+def test_merge_skips_kernels(tmp_path):
+    """Test that a kernel that cannot be merged is recorded as skipped."""
+    make_ck(tmp_path / "imap_2024_001_2024_002_01.ah.bc", [(0, 10, [1.0])])
+    attitude_merge.write_daf(
+        tmp_path / "imap_2024_003_2024_004_01.ah.bc",
+        b"DAF/CK  ",
+        2,
+        5,
+        b"test",
+        [((10, 20), (-43000, -43000, 1, 0, 0), b"SEGMENT", struct.pack("<d", 2.0))],
+    )
+    (tmp_path / "imap_2024_005_2024_006_01.ah.bc").write_bytes(b"not a kernel")
+
+    report = attitude_merge.merge_attitude_kernels(tmp_path)
+    assert [source["file"] for source in report["sources"]] == [
+        "imap_2024_001_2024_002_01.ah.bc"
+    ]
+    assert [kernel["file"] for kernel in report["skipped"]] == [
+        "imap_2024_003_2024_004_01.ah.bc",
+        "imap_2024_005_2024_006_01.ah.bc",
+    ]
+
+    # The skipped kernels are not retried
+    merged = (tmp_path / "merged_attitude_kernel.ah.bc").read_bytes()
+    assert attitude_merge.merge_attitude_kernels(tmp_path) == report
+    assert (tmp_path / "merged_attitude_kernel.ah.bc").read_bytes() == merged
+
+
+def test_attitude_merge_lambda_handler(tmp_path, monkeypatch):
+    """Test that the merge lambda merges the kernels on the EFS."""
+    monkeypatch.setenv("EFS_MOUNT_PATH", str(tmp_path))
+    make_ck(tmp_path / "imap_2024_001_2024_002_01.ah.bc", [(0, 10, [1.0])])
+
+    report = attitude_merge.lambda_handler({}, None)
+
+    assert report["sources"][0]["file"] == "imap_2024_001_2024_002_01.ah.bc"
+
+
+class LambdaClient:
+    """Record the invocations of a lambda client."""
+
+    def __init__(self):
+        """Start without invocations."""
+        self.invocations = []
+
+    def invoke(self, **kwargs):
+        """Record an invocation."""
+        self.invocations.append(kwargs)
+
+
+def test_write_data_to_efs_merges_attitude(s3_client, mount_path, monkeypatch):
+    """Test that staging a historical attitude kernel starts the merge."""
+    monkeypatch.setenv("ATTITUDE_MERGE_FUNCTION_NAME", "attitude-merge-lambda")
+    lambda_client = LambdaClient()
+    s3_key = "spice/ck/imap_2024_001_2024_002_01.ah.bc"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=b"kernel")
+
+    lambda_function.write_data_to_efs(
+        s3_key, BUCKET_NAME, s3_client=s3_client, lambda_client=lambda_client
+    )
+
+    # The merge runs in its own lambda, not while staging
+    assert lambda_client.invocations == [
+        {"FunctionName": "attitude-merge-lambda", "InvocationType": "Event"}
+    ]
+    assert not (mount_path / "merged_attitude_kernel.json").exists()
+    assert (mount_path / "latest_attitude_kernel.ah.a").is_symlink()
+
+    # Other kernels do not start a merge
+    s3_key = "spice/ck/imap_pred_2024_001_2024_002_01.ah.bc"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=b"kernel")
+    lambda_function.write_data_to_efs(
+        s3_key, BUCKET_NAME, s3_client=s3_client, lambda_client=lambda_client
+    )
+    assert len(lambda_client.invocations) == 1
@@ -1,65 +1,174 @@
 """Test the IAlirt ingest lambda function."""
 
+import io
+import struct
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
 import pytest
+from boto3.dynamodb.conditions import Key
 
+from sds_data_manager.lambda_code.IAlirtCode import ialirt_ingest
 from sds_data_manager.lambda_code.IAlirtCode.ialirt_ingest import lambda_handler
 
+from .conftest import BUCKET_NAME
+
+PACKET_FILE = (
+    Path(__file__).parent.parent
+    / "test-data"
+    / "science_block_20221116_163611Z_idle.bin"
+)
+
+
+def make_packet(apid, seq_count, met, data=b"\x00" * 10):
+    """Make a CCSDS packet with a MET secondary header."""
+    body = struct.pack(">I", met) + data
+    return struct.pack(">HHH", 0x0800 | apid, 0xC000 | seq_count, len(body) - 1) + body
 
-@pytest.fixture()
-def populate_table(setup_dynamodb):
-    """Populate DynamoDB table."""
-    ingest_table = setup_dynamodb["ingest_table"]
 
-    items = [
-        {
-            "apid": 478,
-            "met": 123,
-            "ingest_time": "2021-01-01T00:00:00Z",
-            "packet_blob": b"binary_data_string",
-        },
-        {
-            "apid": 478,
-            "met": 124,
-            "ingest_time": "2021-02-01T00:00:00Z",
-            "packet_blob": b"binary_data_string",
-        },
+def test_iter_packets():
+    """Test decoding the packets of the sample file."""
+    with open(PACKET_FILE, "rb") as f:
+        packets = list(ialirt_ingest.iter_packets(f))
+
+    assert len(packets) == 23
+    assert {packet.apid for packet in packets} == {1344}
+    assert [packet.seq_count for packet in packets] == list(range(57, 80))
+    assert packets[0].met == 0x18382ADD
+    assert all(len(packet.data) == 1294 for packet in packets)
+
+    # Packets split across reads are reassembled
+    with open(PACKET_FILE, "rb") as f:
+        assert list(ialirt_ingest.iter_packets(f, chunk_size=100)) == packets
+
+
+def test_iter_packets_truncated():
+    """Test that a truncated last packet is dropped."""
+    stream = io.BytesIO(make_packet(478, 1, 100) + make_packet(478, 2, 101)[:-3])
+    packets = list(ialirt_ingest.iter_packets(stream))
+    assert [(packet.apid, packet.seq_count, packet.met) for packet in packets] == [
+        (478, 1, 100)
     ]
-    for item in items:
-        ingest_table.put_item(Item=item)
 
-    return items
+    with pytest.raises(ValueError, match="too short"):
+        ialirt_ingest.decode_packet(make_packet(478, 1, 100)[:8])
+
+
+def test_sort_key():
+    """Test that the sort key keeps the MET order and the sequence count."""
+    assert ialirt_ingest.get_sort_key(123, 57) == Decimal("123.00057")
+    assert ialirt_ingest.get_sort_key(123, 16383) < ialirt_ingest.get_sort_key(124, 0)
+
+
+def test_ingest_packets_batches(setup_dynamodb):
+    """Test that packets are written in batches of 25 items."""
+    ingest_table = setup_dynamodb["ingest_table"]
+    batch_sizes = []
+
+    def count_items(params, **kwargs):
+        batch_sizes.extend(len(items) for items in params["RequestItems"].values())
+
+    ingest_table.meta.client.meta.events.register(
+        "provide-client-params.dynamodb.BatchWriteItem", count_items
+    )
+    stream = io.BytesIO(
+        b"".join(make_packet(478, seq, 100 + seq // 4) for seq in range(60))
+    )
+    apids = ialirt_ingest.ingest_packets(stream, ingest_table, "packets/test.bin")
+
+    assert apids == {478: {"packets": 60, "last_met": 114}}
+    assert batch_sizes == [25, 25, 10]
+    assert ingest_table.scan(Select="COUNT")["Count"] == 60
 
 
-def test_lambda_handler(setup_dynamodb):
+def test_lambda_handler(setup_dynamodb, s3_client, monkeypatch):
     """Test the lambda_handler function."""
-    # Mock event data
+    monkeypatch.setenv("S3_BUCKET", BUCKET_NAME)
     ingest_table = setup_dynamodb["ingest_table"]
     algorithm_table = setup_dynamodb["algorithm_table"]
+    s3_key = "packets/science_block_20221116_163611Z_idle.bin"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=PACKET_FILE.read_bytes())
 
-    event = {"detail": {"object": {"key": "packets/file.txt"}}}
+    event = {"detail": {"object": {"key": s3_key}}}
+    lambda_handler(event, {})
+
+    items = ingest_table.query(KeyConditionExpression=Key("apid").eq(1344))["Items"]
+    assert len(items) == 23
+    assert items[0]["met"] == Decimal(f"{0x18382ADD}.00057")
+    assert items[0]["seq_count"] == 57
+    assert items[0]["source"] == s3_key
+    assert items[0]["packet_blob"].value == PACKET_FILE.read_bytes()[:1294]
 
+    # Replaying the file overwrites the same items
     lambda_handler(event, {})
+    items = ingest_table.query(KeyConditionExpression=Key("apid").eq(1344))["Items"]
+    assert len(items) == 23
 
-    response = ingest_table.get_item(
-        Key={
-            "apid": 478,
-            "met": 123,
-        }
-    )
-    item = response.get("Item")
+    # No products are written until the algorithms run
+    assert algorithm_table.scan(Select="COUNT")["Count"] == 0
+
+
+def test_ingest_packets_retries_unprocessed(setup_dynamodb, monkeypatch):
+    """Test that unprocessed items of a batch are written again."""
+    ingest_table = setup_dynamodb["ingest_table"]
+    client = ingest_table.meta.client
+    batch_write_item = client.batch_write_item
+    unprocessed = []
+
+    def throttled(RequestItems):  # noqa: N803
+        # Leave the first item of the first batch unprocessed
+        if not unprocessed:
+            (table_name, requests), *_ = RequestItems.items()
+            unprocessed.append(requests[0])
+            batch_write_item(RequestItems={table_name: requests[1:]})
+            return {"UnprocessedItems": {table_name: requests[:1]}}
+        return batch_write_item(RequestItems=RequestItems)
+
+    monkeypatch.setattr(client, "batch_write_item", throttled)
+    stream = io.BytesIO(b"".join(make_packet(478, seq, 100) for seq in range(5)))
+    ialirt_ingest.ingest_packets(stream, ingest_table, "packets/test.bin")
+
+    assert unprocessed
+    assert ingest_table.scan(Select="COUNT")["Count"] == 5
 
-    assert item is not None
-    assert item["met"] == 123
-    assert item["packet_blob"] == b"binary_data_string"
 
-    response = algorithm_table.get_item(
-        Key={
-            "product_name": "hit_product_1",
-            "met": 123,
-        }
+def test_query_packets(setup_dynamodb, monkeypatch):
+    """Test querying a MET window page by page with a projection."""
+    ingest_table = setup_dynamodb["ingest_table"]
+    packets = [make_packet(478, seq, 100 + seq // 4) for seq in range(40)]
+    packets.append(make_packet(1344, 0, 105))
+    ialirt_ingest.ingest_packets(
+        io.BytesIO(b"".join(packets)), ingest_table, "packets/test.bin"
     )
-    item = response.get("Item")
 
-    assert item is not None
-    assert item["met"] == 123
-    assert item["data_product_1"] == str(1234.56)
+    # Pages of 5 items
+    query = ingest_table.query
+    pages = []
+
+    def paged_query(**kwargs):
+        pages.append(kwargs.get("ExclusiveStartKey"))
+        return query(Limit=5, **kwargs)
+
+    monkeypatch.setattr(ingest_table, "query", paged_query)
+    items = ialirt_ingest.query_packets(ingest_table, 478, 102, 105)
+
+    # 4 packets a second, the end second is included
+    assert [item["seq_count"] for item in items] == list(range(8, 24))
+    assert len(pages) > 3
+    assert set(items[0]) == set(ialirt_ingest.PACKET_ATTRIBUTES)
+
+    items = ialirt_ingest.query_recent_packets(ingest_table, 478, 109, window=1)
+    assert [item["seq_count"] for item in items] == list(range(32, 40))
+
+
+def test_packet_expiration():
+    """Test that packet items expire after the time to live."""
+    ingest_time = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    item = ialirt_ingest.get_item(
+        ialirt_ingest.decode_packet(make_packet(478, 1, 100)), ingest_time, "a.bin"
+    )
+    assert item["ingest_time"] == "2024-01-01T00:00:00+00:00"
+    assert item["expiration"] == int(
+        (ingest_time + ialirt_ingest.PACKET_TTL).timestamp()
+    )
@@ -0,0 +1,109 @@
+"""Test the writing and compaction of the I-ALiRT algorithm products."""
+
+import io
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from sds_data_manager.lambda_code.IAlirtCode import ialirt_products
+
+from .conftest import BUCKET_NAME
+
+DAY = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_encode_array():
+    """Test that arrays are stored as 8 bytes per float."""
+    data = ialirt_products.encode_array([1.5, -2.25, 3e10])
+    assert len(data) == 24
+    assert ialirt_products.decode_array(data) == [1.5, -2.25, 3e10]
+
+
+def test_item():
+    """Test the item of a product with scalar and array values."""
+    item = ialirt_products.get_item(
+        "hit_product_1", 123, {"flux": [1.0, 2.0], "count": 7, "mode": "hi"}, DAY
+    )
+    assert item["met"] == Decimal(123)
+    assert item["count"] == Decimal(7)
+    assert item["array_types"] == {"flux": "d"}
+    assert isinstance(item["flux"], bytes)
+    assert item["expiration"] == int((DAY + ialirt_products.PRODUCT_TTL).timestamp())
+
+    product = ialirt_products.decode_item(item)
+    assert product["flux"] == [1.0, 2.0]
+    assert product["count"] == 7
+    assert product["mode"] == "hi"
+    assert "array_types" not in product
+
+
+def test_product_writer_batches(setup_dynamodb):
+    """Test that products are buffered and written in batches."""
+    algorithm_table = setup_dynamodb["algorithm_table"]
+    batch_sizes = []
+
+    def count_items(params, **kwargs):
+        batch_sizes.extend(len(items) for items in params["RequestItems"].values())
+
+    algorithm_table.meta.client.meta.events.register(
+        "provide-client-params.dynamodb.BatchWriteItem", count_items
+    )
+    with ialirt_products.ProductWriter(algorithm_table, flush_seconds=60) as writer:
+        for met in range(30):
+            writer.add("hit_product_1", met, {"flux": [float(met)] * 4})
+        # Computed again before the flush, replaces the buffered product
+        writer.add("hit_product_1", 0, {"flux": [-1.0] * 4})
+        assert batch_sizes == []
+    assert batch_sizes == [25, 5]
+
+    item = algorithm_table.get_item(Key={"product_name": "hit_product_1", "met": 0})
+    assert ialirt_products.decode_item(item["Item"])["flux"] == [-1.0] * 4
+
+    # Written on each product once the interval has passed
+    writer = ialirt_products.ProductWriter(algorithm_table, flush_seconds=0)
+    writer.add("swe_product_1", 1, {"density": 5.5})
+    assert batch_sizes == [25, 5, 1]
+
+
+def test_scan_products(setup_dynamodb):
+    """Test reading back the products of a day."""
+    algorithm_table = setup_dynamodb["algorithm_table"]
+    for day in (1, 2):
+        insert_time = DAY.replace(day=day, hour=12)
+        for met in (20, 10):
+            algorithm_table.put_item(
+                Item=ialirt_products.get_item(
+                    "hit_product_1", met + day, {"flux": [1.0]}, insert_time
+                )
+            )
+
+    products = ialirt_products.scan_products(algorithm_table, DAY, DAY.replace(day=2))
+    assert [row["met"] for row in products["hit_product_1"]] == [11, 21]
+    assert products["hit_product_1"][0]["flux"] == [1.0]
+
+
+def test_compaction_handler(setup_dynamodb, s3_client):
+    """Test compacting the products of a day to Parquet files."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    algorithm_table = setup_dynamodb["algorithm_table"]
+    insert_time = DAY.replace(hour=12)
+    with ialirt_products.ProductWriter(algorithm_table) as writer:
+        for met in range(5):
+            writer.add("hit_product_1", met, {"flux": [float(met)] * 3, "count": met})
+        writer.add("swe_product_1", 2, {"density": 5.5})
+    for item in algorithm_table.scan()["Items"]:
+        algorithm_table.put_item(Item={**item, "insert_time": insert_time.isoformat()})
+
+    response = ialirt_products.compaction_handler({"day": "20240101"}, {})
+    keys = json.loads(response["body"])
+    assert keys == [
+        "products/hit_product_1/2024/01/imap_ialirt_hit_product_1_20240101.parquet",
+        "products/swe_product_1/2024/01/imap_ialirt_swe_product_1_20240101.parquet",
+    ]
+
+    body = s3_client.get_object(Bucket=BUCKET_NAME, Key=keys[0])["Body"].read()
+    table = pq.read_table(io.BytesIO(body))
+    assert table.column("met").to_pylist() == list(range(5))
+    assert table.column("flux").to_pylist()[2] == [2.0] * 3
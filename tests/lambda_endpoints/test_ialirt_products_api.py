@@ -0,0 +1,191 @@
+"""Test the I-ALiRT products API lambda."""
+
+import json
+from datetime import datetime, timezone
+
+import boto3
+import pytest
+
+from sds_data_manager.lambda_code.IAlirtCode import ialirt_products, ialirt_products_api
+
+INSERT_TIME = datetime(2024, 1, 1, 12, 0, 30, 500000, tzinfo=timezone.utc)
+
+
+def put_products(algorithm_table, mets, insert_time=INSERT_TIME):
+    """Put hit products with a flux array."""
+    for met in mets:
+        algorithm_table.put_item(
+            Item=ialirt_products.get_item(
+                "hit_product_1", met, {"flux": [met, met + 0.5]}, insert_time
+            )
+        )
+
+
+@pytest.fixture()
+def queries(setup_dynamodb):
+    """Record the parameters of the queries of the lambda."""
+    queries = []
+
+    def record(params, **kwargs):
+        queries.append(params)
+
+    event_name = "provide-client-params.dynamodb.Query"
+    boto3.DEFAULT_SESSION.events.register(event_name, record)
+    yield queries
+    boto3.DEFAULT_SESSION.events.unregister(event_name, record)
+
+
+def get(**params):
+    """Call the lambda with query parameters, and optional headers."""
+    headers = params.pop("headers", None)
+    event = {"queryStringParameters": params, "headers": headers}
+    return ialirt_products_api.lambda_handler(event, {})
+
+
+def test_time_range(setup_dynamodb):
+    """Test getting the products of a time range."""
+    put_products(setup_dynamodb["algorithm_table"], range(100, 110))
+
+    response = get(product_name="hit_product_1", start_met="102", end_met="104")
+    assert response["statusCode"] == 200
+    products = json.loads(response["body"])
+    assert [product["met"] for product in products] == [102, 103, 104]
+    assert products[0]["flux"] == [102.0, 102.5]
+    assert "expiration" not in products[0]
+
+    response = get(
+        product_name="hit_product_1", start_met="102", end_met="103", format="columnar"
+    )
+    columns = json.loads(response["body"])
+    assert columns["met"] == [102, 103]
+    assert columns["flux"] == [[102.0, 102.5], [103.0, 103.5]]
+    assert columns["product_name"] == ["hit_product_1"] * 2
+
+
+def test_latest(setup_dynamodb, queries):
+    """Test getting the latest products, newest last."""
+    put_products(setup_dynamodb["algorithm_table"], range(100, 103))
+
+    response = get(product_name="hit_product_1", latest="5")
+    products = json.loads(response["body"])
+    assert [product["met"] for product in products] == [100, 101, 102]
+    # moto applies the limit before the descending order, so only check that
+    # the newest items are asked for
+    assert queries[0]["ScanIndexForward"] is False
+    assert queries[0]["Limit"] == 5
+
+
+def test_cache(setup_dynamodb, queries, monkeypatch):
+    """Test that polling within the cache period does not query the table."""
+    algorithm_table = setup_dynamodb["algorithm_table"]
+    put_products(algorithm_table, range(100, 103))
+
+    for _ in range(5):
+        response = get(product_name="hit_product_1", latest="5")
+        assert [p["met"] for p in json.loads(response["body"])] == [100, 101, 102]
+    assert len(queries) == 1
+
+    # Newer products are served once the cache expires
+    put_products(algorithm_table, [103])
+    monkeypatch.setattr(ialirt_products_api, "CACHE_SECONDS", 0)
+    response = get(product_name="hit_product_1", latest="5")
+    assert [p["met"] for p in json.loads(response["body"])] == [100, 101, 102, 103]
+    assert len(queries) == 2
+
+
+def test_if_none_match(setup_dynamodb):
+    """Test that unchanged products are not sent again."""
+    algorithm_table = setup_dynamodb["algorithm_table"]
+    put_products(algorithm_table, range(100, 103))
+
+    response = get(product_name="hit_product_1", start_met="100", end_met="110")
+    etag = response["headers"]["ETag"]
+    assert etag == '"20240101T120030.500000-3"'
+
+    response = get(
+        product_name="hit_product_1",
+        start_met="100",
+        end_met="110",
+        headers={"if-none-match": etag},
+    )
+    assert response["statusCode"] == 304
+    assert response["body"] == ""
+    response = get(
+        product_name="hit_product_1",
+        start_met="100",
+        end_met="110",
+        headers={"If-None-Match": f'"other", W/{etag}'},
+    )
+    assert response["statusCode"] == 304
+
+    # A product written later within the same second changes the tag
+    ialirt_products_api._cache.clear()
+    put_products(algorithm_table, [103], INSERT_TIME.replace(microsecond=700000))
+    response = get(
+        product_name="hit_product_1",
+        start_met="100",
+        end_met="110",
+        headers={"If-None-Match": etag},
+    )
+    assert response["statusCode"] == 200
+    assert response["headers"]["ETag"] == '"20240101T120030.700000-4"'
+
+
+def test_if_modified_since(setup_dynamodb):
+    """Test that only products older than the date are not sent again."""
+    put_products(setup_dynamodb["algorithm_table"], range(100, 103))
+
+    response = get(product_name="hit_product_1", latest="2")
+    last_modified = response["headers"]["Last-Modified"]
+    assert last_modified == "Mon, 01 Jan 2024 12:00:30 GMT"
+
+    # The products are half a second newer than the truncated date, yet the
+    # client sending back the Last-Modified already has them
+    response = get(
+        product_name="hit_product_1",
+        latest="2",
+        headers={"if-modified-since": last_modified},
+    )
+    assert response["statusCode"] == 304
+    assert response["body"] == ""
+
+    response = get(
+        product_name="hit_product_1",
+        latest="2",
+        headers={"If-Modified-Since": "Mon, 01 Jan 2024 12:00:29 GMT"},
+    )
+    assert response["statusCode"] == 200
+
+
+def test_cache_eviction(setup_dynamodb, monkeypatch):
+    """Test that expired query results are removed from the cache."""
+    put_products(setup_dynamodb["algorithm_table"], range(100, 103))
+    ialirt_products_api._cache.clear()
+
+    get(product_name="hit_product_1", latest="1")
+    get(product_name="hit_product_1", latest="2")
+    assert len(ialirt_products_api._cache) == 2
+
+    monkeypatch.setattr(ialirt_products_api, "CACHE_SECONDS", 0)
+    get(product_name="hit_product_1", latest="3")
+    assert list(ialirt_products_api._cache) == [("query_latest", "hit_product_1", 3)]
+
+
+def test_bad_requests(setup_dynamodb):
+    """Test that invalid parameters are rejected."""
+    for params in (
+        {},
+        {"latest": "5"},
+        {"product_name": "hit_product_1"},
+        {"product_name": "hit_product_1", "latest": "0"},
+        {"product_name": "hit_product_1", "latest": "abc"},
+        {"product_name": "hit_product_1", "start_met": "10", "end_met": "5"},
+        {"product_name": "hit_product_1", "latest": "5", "format": "csv"},
+    ):
+        assert get(**params)["statusCode"] == 400
+
+    # No products, no Last-Modified
+    response = get(product_name="swe_product_1", latest="5")
+    assert response["statusCode"] == 200
+    assert json.loads(response["body"]) == []
+    assert "Last-Modified" not in response["headers"]
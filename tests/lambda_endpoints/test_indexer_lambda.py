@@ -1,7 +1,9 @@
 """Tests for the indexer lambda."""
 
+import json
 import os
 from datetime import datetime
+from unittest.mock import patch
 
 import pytest
 from imap_data_access import ScienceFilePath
@@ -115,6 +117,134 @@ def test_batch_job_event(session, events_client):
     assert processing_job.status == models.Status.SUCCEEDED
 
 
+def test_array_batch_job_event(session):
+    """Test that array job children update their own processing records."""
+    jobs = []
+    for index, descriptor in enumerate(["sci", "hk"]):
+        processing_job = models.ProcessingJob(
+            status=models.Status.INPROGRESS,
+            instrument="codice",
+            data_level="l1a",
+            descriptor=descriptor,
+            start_date=datetime(2024, 1, 1),
+            version="v001",
+            batch_job_id=f"parent-id:{index}",
+        )
+        session.add(processing_job)
+        jobs.append(processing_job)
+    session.commit()
+    job_ids = [job.id for job in jobs]
+
+    event = {
+        "detail-type": "Batch Job State Change",
+        "source": "aws.batch",
+        "detail": {
+            "jobName": f"codice-l1a-array-job-{job_ids[0]}",
+            "jobId": "parent-id:1",
+            "arrayProperties": {"index": 1},
+            "status": "SUCCEEDED",
+            "jobDefinition": "ProcessingJob-codice:1",
+            "container": {
+                "image": "codice-repo:latest",
+                "command": ["--array-manifest", "s3://bucket/manifest.json"],
+                "logStreamName": "ProcessingJob-codice/default/1234",
+            },
+        },
+    }
+    returned_value = indexer.lambda_handler(event=event, context={})
+    assert returned_value["statusCode"] == 200
+    statuses = [session.get(models.ProcessingJob, job_id).status for job_id in job_ids]
+    assert statuses == [models.Status.INPROGRESS, models.Status.SUCCEEDED]
+
+    # The parent's summary event does not change any records
+    event["detail"]["jobId"] = "parent-id"
+    event["detail"]["arrayProperties"] = {"size": 2}
+    event["detail"]["status"] = "FAILED"
+    returned_value = indexer.lambda_handler(event=event, context={})
+    assert returned_value["statusCode"] == 200
+    statuses = [session.get(models.ProcessingJob, job_id).status for job_id in job_ids]
+    assert statuses == [models.Status.INPROGRESS, models.Status.SUCCEEDED]
+
+
+def test_batch_job_events_from_sqs(session):
+    """Test a batch of job events delivered through SQS."""
+    processing_job = models.ProcessingJob(
+        status=models.Status.INPROGRESS,
+        instrument="swapi",
+        data_level="l1",
+        descriptor="sci",
+        start_date=datetime(2024, 1, 1),
+        version="v001",
+    )
+    session.add(processing_job)
+    session.commit()
+    job_id = processing_job.id
+
+    def batch_event(status, time, job_name=f"swapi-l1-sci-job-{job_id}"):
+        return {
+            "detail-type": "Batch Job State Change",
+            "source": "aws.batch",
+            "time": time,
+            "detail": {
+                "jobName": job_name,
+                "jobId": "26242c7e-3d49-4e41-9387-74fcaf9630bb",
+                "status": status,
+                "jobDefinition": "ProcessingJob-swapi:1",
+                "createdAt": 1704067140000,
+                "startedAt": 1704067200000,
+                "stoppedAt": 1704067325500,
+                "container": {
+                    "image": "swapi-repo:latest",
+                    "resourceRequirements": [
+                        {"type": "VCPU", "value": "0.5"},
+                        {"type": "MEMORY", "value": "2048"},
+                    ],
+                    "command": ["--instrument", "swapi"],
+                    "logStreamName": "ProcessingJob-swapi/default/1234",
+                },
+            },
+        }
+
+    batch_events = [
+        batch_event("SUCCEEDED", "2024-01-01T00:02:10Z"),
+        # Duplicate delivery
+        batch_event("SUCCEEDED", "2024-01-01T00:02:10Z"),
+        # Older event delivered out of order
+        batch_event("FAILED", "2024-01-01T00:01:00Z"),
+        # Events that don't have a record to update
+        batch_event("FAILED", "2024-01-01T00:03:00Z", job_name="swapi-l1-sci-job"),
+        batch_event("FAILED", "2024-01-01T00:03:00Z", job_name="swapi-job-999999"),
+    ]
+    event = {
+        "Records": [
+            {"eventSource": "aws:sqs", "body": json.dumps(batch_event)}
+            for batch_event in batch_events
+        ]
+    }
+    # A record that cannot be read only fails itself
+    event["Records"].append(
+        {"eventSource": "aws:sqs", "messageId": "bad", "body": "not json"}
+    )
+    returned_value = indexer.lambda_handler(event=event, context={})
+    assert returned_value["statusCode"] == 200
+    assert returned_value["batchItemFailures"] == [{"itemIdentifier": "bad"}]
+
+    processing_job = session.get(models.ProcessingJob, job_id)
+    assert processing_job.status == models.Status.SUCCEEDED
+    assert processing_job.processing_time == 125
+    assert processing_job.queue_time == 60
+    assert processing_job.vcpu == 0.5
+    assert processing_job.memory == 2048
+    assert processing_job.job_definition == "ProcessingJob-swapi:1"
+
+    # A stale event in a later batch is ignored as well
+    event["Records"] = event["Records"][2:3]
+    returned_value = indexer.lambda_handler(event=event, context={})
+    assert returned_value["statusCode"] == 200
+    processing_job = session.get(models.ProcessingJob, job_id)
+    assert processing_job.status == models.Status.SUCCEEDED
+
+
 def test_s3_event(session, s3_client, events_client):
     """Test s3 event."""
     filepath = "imap/hit/l0/2024/01/imap_hit_l0_sci-test_20240101_v001.pkts"
@@ -165,6 +295,32 @@ def test_s3_event(session, s3_client, events_client):
         ScienceFilePath(os.path.basename(event["detail"]["object"]["key"]))
 
 
+def test_s3_spice_event(session, s3_client, events_client):
+    """Test that SPICE kernels are registered without starting processing."""
+    filepath = "spice/spk/imap_recon_20240101_20240107_v01.bsp"
+    # Not a real SPK, so the coverage comes from the file name
+    s3_client.put_object(Bucket="test-data-bucket", Key=filepath, Body=b"test")
+    event = {
+        "detail-type": "Object Created",
+        "source": "aws.s3",
+        "detail": {
+            "bucket": {"name": "test-data-bucket"},
+            "object": {"key": filepath, "reason": "PutObject"},
+        },
+    }
+    with patch.object(indexer, "send_event_from_indexer") as mock_send_event:
+        returned_value = indexer.lambda_handler(event=event, context={})
+    assert returned_value["statusCode"] == 200
+    mock_send_event.assert_not_called()
+
+    kernel = session.get(models.SPICEFiles, filepath)
+    assert kernel.kernel_type == "spk"
+    assert kernel.source == "recon"
+    assert kernel.start_date == datetime(2024, 1, 1)
+    assert kernel.ingestion_date is not None
+    assert session.query(models.ScienceFiles).count() == 0
+
+
 def test_unknown_event(session):
     """Test for unknown event source."""
     event = {"source": "test"}
@@ -0,0 +1,111 @@
+"""Tests for the processing time report."""
+
+from datetime import datetime
+
+import pytest
+
+from sds_data_manager.lambda_code.SDSCode import processing_report
+from sds_data_manager.lambda_code.SDSCode.database import models
+
+
+def _populate_processing_history(session):
+    """Add the processing history of hit l1a and l1b jobs."""
+    jobs = [
+        # hit l1b took 10 to 50 minutes with the default resources
+        *[
+            {
+                "data_level": "l1b",
+                "status": models.Status.SUCCEEDED,
+                "processing_time": minutes * 60,
+                "queue_time": 30,
+            }
+            for minutes in [10, 20, 30, 40, 50]
+        ],
+        {
+            "data_level": "l1b",
+            "status": models.Status.FAILED,
+            "processing_time": 600,
+            "queue_time": 90,
+            "status_reason": "OutOfMemoryError: Container killed due to memory usage",
+        },
+        # hit l1a is quick on a small task
+        *[
+            {
+                "data_level": "l1a",
+                "status": models.Status.SUCCEEDED,
+                "processing_time": 60,
+                "queue_time": 10,
+                "vcpu": 0.5,
+                "memory": 1024,
+            }
+            for _ in range(2)
+        ],
+    ]
+    for day, job in enumerate(jobs, start=1):
+        session.add(
+            models.ProcessingJob(
+                instrument="hit",
+                descriptor="sci",
+                start_date=datetime(2024, 1, day),
+                version="v001",
+                **job,
+            )
+        )
+    session.commit()
+
+
+def test_get_runtime_statistics(session):
+    """Test the runtime percentiles and cost of each product."""
+    _populate_processing_history(session)
+    statistics = processing_report.get_runtime_statistics(session, instrument="hit")
+    assert [entry["data_level"] for entry in statistics] == ["l1a", "l1b"]
+    l1a, l1b = statistics
+
+    assert l1a["jobs"] == 2
+    assert l1a["failed"] == 0
+    assert l1a["p50"] == l1a["p99"] == 60
+    assert l1a["mean_queue_time"] == 10
+
+    assert l1b["jobs"] == 6
+    assert l1b["failed"] == 1
+    # Only successful jobs count towards the runtime
+    assert l1b["p50"] == 30 * 60
+    assert l1b["p95"] == pytest.approx(48 * 60)
+    assert l1b["mean_queue_time"] == 40
+    # 160 minutes at 1 vCPU and 4 GB, failed job included
+    hourly_price = (
+        processing_report.FARGATE_VCPU_HOUR_PRICE
+        + 4 * processing_report.FARGATE_GB_HOUR_PRICE
+    )
+    assert l1b["cost"] == pytest.approx(160 / 60 * hourly_price, abs=1e-4)
+
+
+@pytest.mark.parametrize(
+    ("vcpu", "memory", "p95_runtime", "out_of_memory", "expected"),
+    [
+        # Within the target runtime: unchanged
+        (1, 4096, 10 * 60, 0, {"vcpu": 1, "memory": 4096}),
+        # Too slow: more vCPUs, memory raised to the Fargate minimum
+        (1, 2048, 90 * 60, 0, {"vcpu": 4, "memory": 8192}),
+        # Quick: fewer vCPUs
+        (1, 2048, 60, 0, {"vcpu": 0.5, "memory": 2048}),
+        # Ran out of memory: more memory
+        (1, 4096, 10 * 60, 1, {"vcpu": 1, "memory": 8192}),
+        # More memory than the vCPU supports: more vCPUs
+        (1, 8192, 10 * 60, 1, {"vcpu": 2, "memory": 16384}),
+    ],
+)
+def test_suggest_resources(vcpu, memory, p95_runtime, out_of_memory, expected):
+    """Test suggesting valid Fargate resources."""
+    assert (
+        processing_report.suggest_resources(vcpu, memory, p95_runtime, out_of_memory)
+        == expected
+    )
+
+
+def test_get_resource_suggestions(session):
+    """Test suggesting the resources of each job definition."""
+    _populate_processing_history(session)
+    suggestions = processing_report.get_resource_suggestions(session)
+    # hit l1a and l1b share a job definition, l1b is slow and ran out of memory
+    assert suggestions == {"hit": {"vcpu": 2, "memory": 8192}}
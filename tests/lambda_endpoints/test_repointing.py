@@ -0,0 +1,173 @@
+"""Tests for the repointing table and pointing number lookups."""
+
+import io
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from imap_data_access import ScienceFilePath
+
+from sds_data_manager.lambda_code.SDSCode import (
+    batch_starter,
+    indexer,
+    repointing,
+    spin_table,
+)
+from sds_data_manager.lambda_code.SDSCode.database import models
+
+HEADER = ",".join(spin_table.SPIN_COLUMNS)
+# MET of 2024-01-01T00:00:00 in these tests
+MET_EPOCH = 1000
+
+
+def make_spin_file(pointings):
+    """Make a spin file of (number, first hour, hours) pointings of 1 h spins.
+
+    The first spin of each pointing is flagged as repointing.
+    """
+    lines = [HEADER]
+    spin_number = 0
+    for number, first_hour, hours in pointings:
+        for hour in range(first_hour, first_hour + hours):
+            spin_number += 1
+            utc = datetime(2024, 1, 1) + timedelta(hours=hour)
+            maneuver = "1" if hour == first_hour else "0"
+            lines.append(
+                f"{spin_number},{MET_EPOCH + hour * 3600},0,{utc.isoformat()},"
+                f"1,3600000,0,{maneuver},{number}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def load_pointings(session):
+    """Load pointing 1 from 01:00 to 20:00 and pointing 2 from 21:00 to 48:00."""
+    spin_table.ingest_spin_file(
+        session, io.StringIO(make_spin_file([(1, 0, 20), (2, 20, 28)]))
+    )
+
+
+def test_update_repointings(session):
+    """Test that pointings are derived from the spins outside of repointing."""
+    load_pointings(session)
+
+    pointings = session.query(models.Repointing).order_by(
+        models.Repointing.repointing_number
+    )
+    assert [
+        (pointing.repointing_number, pointing.start_time, pointing.end_time)
+        for pointing in pointings
+    ] == [
+        (1, datetime(2024, 1, 1, 1), datetime(2024, 1, 1, 20)),
+        (2, datetime(2024, 1, 1, 21), datetime(2024, 1, 3)),
+    ]
+    assert pointings[0].start_sc_time == MET_EPOCH + 3600
+    assert pointings[0].end_sc_time == MET_EPOCH + 20 * 3600
+
+
+def test_repointing_index():
+    """Test finding pointings by time with the in-memory index."""
+    index = repointing.RepointingIndex(
+        [
+            models.Repointing(
+                repointing_number=2,
+                start_time=datetime(2024, 1, 2),
+                end_time=datetime(2024, 1, 3),
+            ),
+            models.Repointing(
+                repointing_number=1,
+                start_time=datetime(2024, 1, 1),
+                end_time=datetime(2024, 1, 1, 23),
+            ),
+        ]
+    )
+    assert len(index) == 2
+    assert index.find(datetime(2023, 12, 31)) is None
+    assert index.find(datetime(2024, 1, 1)) == 1
+    # Between the pointings
+    assert index.find(datetime(2024, 1, 1, 23, 30)) is None
+    assert index.find(datetime(2024, 1, 2, 12)) == 2
+    assert index.find(datetime(2024, 1, 3)) is None
+
+    assert index.overlapping(datetime(2024, 1, 1, 12), datetime(2024, 1, 2, 1)) == [
+        1,
+        2,
+    ]
+    assert index.overlapping(datetime(2024, 1, 1, 23), datetime(2024, 1, 2)) == []
+
+    assert (
+        index.find_most_overlapping(datetime(2024, 1, 1, 12), datetime(2024, 1, 2, 1))
+        == 1
+    )
+    assert (
+        index.find_most_overlapping(datetime(2024, 1, 1, 22), datetime(2024, 1, 2, 2))
+        == 2
+    )
+    assert (
+        index.find_most_overlapping(datetime(2024, 1, 3), datetime(2024, 1, 4)) is None
+    )
+
+
+def test_get_day_repointing_is_cached(session, monkeypatch):
+    """Test that lookups use the cached pointings until they are updated."""
+    load_pointings(session)
+    assert repointing.get_day_repointing(session, "glows", datetime(2024, 1, 2)) == 2
+    assert repointing.get_day_repointing(session, "swe", datetime(2024, 1, 2)) is None
+
+    queries = []
+    monkeypatch.setattr(session, "execute", lambda query: queries.append(query))
+    assert repointing.get_day_repointing(session, "hi", datetime(2024, 1, 1)) == 1
+    assert queries == []
+
+    # The cache expires
+    monkeypatch.undo()
+    monkeypatch.setattr(repointing, "REPOINTING_CACHE_SECONDS", 0)
+    session.query(models.Repointing).delete()
+    assert repointing.get_day_repointing(session, "hi", datetime(2024, 1, 1)) is None
+
+
+def test_get_day_repointing_crossing_midnight(session):
+    """Test that a day gets the pointing covering most of it."""
+    # Pointing 1 from 01:00 to 04:00 the next day, pointing 2 until 00:00
+    spin_table.ingest_spin_file(
+        session, io.StringIO(make_spin_file([(1, 0, 28), (2, 28, 20)]))
+    )
+    assert repointing.get_day_repointing(session, "hi", datetime(2024, 1, 1)) == 1
+    # Not the pointing started the day before
+    assert repointing.get_day_repointing(session, "hi", datetime(2024, 1, 2)) == 2
+
+
+def test_downstream_dependencies_repointing(session):
+    """Test that pointing-based dependents are tagged with their pointing."""
+    load_pointings(session)
+    file_params = ScienceFilePath.extract_filename_components(
+        "imap_glows_l1a_hist_20240102_v001.cdf"
+    )
+    dependents = batch_starter.get_downstream_dependencies(session, file_params)
+    assert dependents == [
+        {
+            "instrument": "glows",
+            "data_level": "l1b",
+            "descriptor": "hist",
+            "version": "v001",
+            "start_date": "20240102",
+            "repointing": 2,
+        }
+    ]
+
+
+def test_indexer_tags_repointing(session, s3_client):
+    """Test that the indexer tags pointing-based files with their pointing."""
+    load_pointings(session)
+    filepath = "imap/glows/l1a/2024/01/imap_glows_l1a_hist_20240101_v001.cdf"
+    s3_client.put_object(Bucket="test-data-bucket", Key=filepath, Body=b"test")
+    event = {
+        "detail-type": "Object Created",
+        "source": "aws.s3",
+        "detail": {
+            "bucket": {"name": "test-data-bucket"},
+            "object": {"key": filepath, "reason": "PutObject"},
+        },
+    }
+    with patch.object(indexer, "send_event_from_indexer"):
+        assert indexer.lambda_handler(event=event, context={})["statusCode"] == 200
+
+    assert session.get(models.ScienceFiles, filepath).repointing == 1
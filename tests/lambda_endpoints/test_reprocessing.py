@@ -0,0 +1,241 @@
+"""Tests for the reprocessing campaigns."""
+
+import json
+from datetime import datetime
+from unittest.mock import Mock, patch
+
+import pytest
+
+from sds_data_manager.lambda_code.SDSCode import batch_starter, reprocessing
+from sds_data_manager.lambda_code.SDSCode.database import models
+
+from .conftest import POSTGRES_AVAILABLE
+
+
+def _populate_file_catalog(session):
+    """Add idex l0 files for two days to the ScienceFiles table."""
+    for day in [1, 2]:
+        session.add(
+            models.ScienceFiles(
+                file_path=f"/path/to/imap_idex_l0_raw_2024010{day}_v001.pkts",
+                instrument="idex",
+                data_level="l0",
+                descriptor="raw",
+                start_date=datetime(2024, 1, day),
+                version="v001",
+                extension="pkts",
+                ingestion_date=datetime(2024, 1, 25),
+            )
+        )
+    session.commit()
+
+
+def test_get_all_downstream_nodes():
+    """Test walking the dependency graph downstream."""
+    nodes = reprocessing.get_all_downstream_nodes(("idex", "l0", "raw"))
+    assert nodes == [("idex", "l1a", "sci"), ("idex", "l1b", "sci")]
+
+
+def test_get_campaign_targets(session):
+    """Test enumerating the products to regenerate."""
+    _populate_file_catalog(session)
+
+    targets = reprocessing.get_campaign_targets(
+        session, "idex", "l0", None, "20240101", "20240101", "v002"
+    )
+    assert targets == [
+        {
+            "instrument": "idex",
+            "data_level": "l1a",
+            "descriptor": "sci",
+            "start_date": "20240101",
+            "version": "v002",
+        },
+        {
+            "instrument": "idex",
+            "data_level": "l1b",
+            "descriptor": "sci",
+            "start_date": "20240101",
+            "version": "v002",
+        },
+    ]
+
+    # The end date is inclusive
+    targets = reprocessing.get_campaign_targets(
+        session, "idex", None, None, "20240101", "20240102", "v002"
+    )
+    assert len(targets) == 4
+
+
+def test_dry_run(session):
+    """A dry run reports the jobs without writing them."""
+    _populate_file_catalog(session)
+
+    result = reprocessing.run_campaign(
+        session, "idex", "20240101", "20240102", "v002", dry_run=True
+    )
+    assert result["campaign"] == "idex-all-all-20240101-20240102-v002"
+    assert result["jobs_per_level"] == {"l1a": 2, "l1b": 2}
+    assert result["estimate"]["jobs"] == 4
+    assert result["estimate"]["vcpu_hours"] > 0
+    assert session.query(models.ProcessingJob).count() == 0
+
+
+def test_campaign_is_resumable(session):
+    """Creating the same campaign twice does not duplicate jobs."""
+    _populate_file_catalog(session)
+
+    result = reprocessing.run_campaign(session, "idex", "20240101", "20240102", "v002")
+    assert result["created"] == 4
+    assert result["progress"]["PENDING"] == 4
+
+    result = reprocessing.run_campaign(session, "idex", "20240101", "20240102", "v002")
+    assert result["created"] == 0
+    assert session.query(models.ProcessingJob).count() == 4
+
+
+def test_release_pending_jobs(session, s3_client):
+    """Only jobs with available inputs are released, up to the rate limit."""
+    _populate_file_catalog(session)
+    result = reprocessing.run_campaign(session, "idex", "20240101", "20240102", "v002")
+    campaign = result["campaign"]
+
+    with patch.object(batch_starter, "BATCH_CLIENT", Mock()) as mock_batch_client:
+        summary = reprocessing.release_pending_jobs(session, campaign, max_jobs=1)
+        assert summary["released"] == 1
+        assert mock_batch_client.submit_job.call_count == 1
+
+        # The l1b jobs wait for the l1a files to be produced
+        summary = reprocessing.release_pending_jobs(session, campaign)
+        assert summary == {"released": 1, "duplicate": 0, "waiting": 2}
+        assert mock_batch_client.submit_job.call_count == 2
+
+        # The newest upstream version is passed on to the job
+        command = mock_batch_client.submit_job.call_args.kwargs["containerOverrides"][
+            "command"
+        ]
+        assert command[command.index("--version") + 1] == "v002"
+        manifest_uri = command[command.index("--dependency-manifest") + 1]
+        manifest = json.loads(
+            s3_client.get_object(
+                Bucket="test-data-bucket", Key=manifest_uri.split("/", 3)[-1]
+            )["Body"].read()
+        )
+        assert manifest["inputs"][0]["version"] == "v001"
+
+    progress = reprocessing.get_campaign_progress(session, campaign)
+    assert progress["PENDING"] == 2
+    assert progress["INPROGRESS"] == 2
+
+
+@pytest.mark.skipif(
+    not POSTGRES_AVAILABLE, reason="Only postgres supports partial unique indexes."
+)
+def test_release_removes_duplicates(session):
+    """PENDING jobs that were already started elsewhere are removed."""
+    _populate_file_catalog(session)
+    result = reprocessing.run_campaign(
+        session, "idex", "20240101", "20240101", "v002", data_level="l0"
+    )
+    session.add(
+        models.ProcessingJob(
+            status=models.Status.SUCCEEDED,
+            instrument="idex",
+            data_level="l1a",
+            descriptor="sci",
+            start_date=datetime(2024, 1, 1),
+            version="v002",
+        )
+    )
+    session.commit()
+
+    with patch.object(batch_starter, "BATCH_CLIENT", Mock()) as mock_batch_client:
+        summary = reprocessing.release_pending_jobs(session, result["campaign"])
+        mock_batch_client.submit_job.assert_not_called()
+    assert summary == {"released": 0, "duplicate": 1, "waiting": 1}
+
+
+def test_upstream_campaign_version(session):
+    """Downstream jobs wait for, and use, the new version of their inputs."""
+    _populate_file_catalog(session)
+    result = reprocessing.run_campaign(
+        session, "idex", "20240101", "20240101", "v002", data_level="l0"
+    )
+    assert result["created"] == 2
+    # An older l1a exists, but the campaign produces a new one
+    session.add(
+        models.ScienceFiles(
+            file_path="/path/to/imap_idex_l1a_sci_20240101_v001.cdf",
+            instrument="idex",
+            data_level="l1a",
+            descriptor="sci",
+            start_date=datetime(2024, 1, 1),
+            version="v001",
+            extension="cdf",
+            ingestion_date=datetime(2024, 1, 25),
+        )
+    )
+    session.commit()
+    l1a_job, l1b_job = (
+        session.query(models.ProcessingJob)
+        .order_by(models.ProcessingJob.data_level)
+        .all()
+    )
+
+    # l1b is held while l1a v002 is pending or in progress
+    assert reprocessing.get_upstream_dependencies(session, l1b_job) is None
+    l1a_job.status = models.Status.INPROGRESS
+    session.commit()
+    assert reprocessing.get_upstream_dependencies(session, l1b_job) is None
+
+    # Once l1a v002 succeeded, it is waited for until it is in the catalog
+    l1a_job.status = models.Status.SUCCEEDED
+    session.commit()
+    assert reprocessing.get_upstream_dependencies(session, l1b_job) is None
+    session.add(
+        models.ScienceFiles(
+            file_path="/path/to/imap_idex_l1a_sci_20240101_v002.cdf",
+            instrument="idex",
+            data_level="l1a",
+            descriptor="sci",
+            start_date=datetime(2024, 1, 1),
+            version="v002",
+            extension="cdf",
+            ingestion_date=datetime(2024, 1, 26),
+        )
+    )
+    session.commit()
+    (dependency,) = reprocessing.get_upstream_dependencies(session, l1b_job)
+    assert dependency["version"] == "v002"
+
+
+def test_lambda_handler(session):
+    """Test monitoring and releasing a campaign through the lambda."""
+    _populate_file_catalog(session)
+    campaign = reprocessing.run_campaign(
+        session, "idex", "20240101", "20240102", "v002"
+    )["campaign"]
+
+    event = {"queryStringParameters": {"campaign": campaign}}
+    response = reprocessing.lambda_handler(event, {})
+    assert json.loads(response["body"])["progress"]["PENDING"] == 4
+
+    mock_batch_client = Mock(**{"submit_job.return_value": {"jobId": "parent"}})
+    with patch.object(batch_starter, "BATCH_CLIENT", mock_batch_client):
+        response = reprocessing.lambda_handler({"source": "aws.events"}, {})
+    assert json.loads(response["body"])["released"] == 2
+    # Both days of the same product are submitted as one array job
+    mock_batch_client.submit_job.assert_called_once()
+
+    # Campaigns cannot be created through the API
+    event = {
+        "queryStringParameters": {
+            "instrument": "idex",
+            "start_date": "20240101",
+            "end_date": "20240102",
+            "version": "v003",
+        }
+    }
+    response = reprocessing.lambda_handler(event, {})
+    assert response["statusCode"] == 400
+    assert session.query(models.ProcessingJob).count() == 4
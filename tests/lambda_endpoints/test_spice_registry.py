@@ -0,0 +1,232 @@
+"""Tests for the SPICE kernel registry."""
+
+import random
+import struct
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from sds_data_manager.lambda_code.SDSCode import spice_registry
+
+from .conftest import BUCKET_NAME
+
+
+def make_spk(segments):
+    """Create a minimal little-endian SPK with the given segment coverage."""
+    nd, ni = 2, 6
+    file_record = (
+        b"DAF/SPK "
+        + struct.pack("<2i", nd, ni)
+        + b"test".ljust(60)
+        # The first summary record is record 2
+        + struct.pack("<3i", 2, 2, 4)
+        + b"LTL-IEEE"
+    ).ljust(spice_registry.DAF_RECORD_SIZE, b"\0")
+    summary_record = struct.pack("<3d", 0, 0, len(segments))
+    for start, end in segments:
+        # The integer components of the summary are not used
+        summary_record += struct.pack("<2d", start, end) + bytes(24)
+    return file_record + summary_record.ljust(spice_registry.DAF_RECORD_SIZE, b"\0")
+
+
+@pytest.mark.parametrize(
+    ("file_path", "expected"),
+    [
+        (
+            "spice/spk/imap_recon_20240101_20240107_v02.bsp",
+            {
+                "kernel_type": "spk",
+                "source": "recon",
+                "start_date": datetime(2024, 1, 1),
+                "end_date": datetime(2024, 1, 8),
+                "version": "v002",
+                "extension": "bsp",
+            },
+        ),
+        (
+            "spice/ck/imap_2024_032_2024_034_01.ah.bc",
+            {
+                "kernel_type": "ck",
+                "source": "recon",
+                "start_date": datetime(2024, 2, 1),
+                "end_date": datetime(2024, 2, 4),
+                "version": "v001",
+                "extension": "bc",
+            },
+        ),
+        (
+            "spice/ck/imap_pred_2024_032_2024_034_01.ah.bc",
+            {
+                "kernel_type": "ck",
+                "source": "pred",
+                "start_date": datetime(2024, 2, 1),
+                "end_date": datetime(2024, 2, 4),
+                "version": "v001",
+                "extension": "bc",
+            },
+        ),
+        (
+            "spice/lsk/naif0012.tls",
+            {
+                "kernel_type": "lsk",
+                "source": None,
+                "start_date": None,
+                "end_date": None,
+                "version": "v012",
+                "extension": "tls",
+            },
+        ),
+    ],
+)
+def test_parse_kernel_path(file_path, expected):
+    """Test getting the kernel information from its file name."""
+    assert spice_registry.parse_kernel_path(file_path) == {
+        "file_path": file_path,
+        **expected,
+    }
+
+
+def test_register_kernel(session):
+    """Test that registering a kernel again replaces its record."""
+    file_path = "spice/spk/imap_nom_20240101_20240107_v01.bsp"
+    spice_registry.register_kernel(session, file_path, datetime(2024, 1, 1))
+    spice_registry.register_kernel(session, file_path, datetime(2024, 1, 2))
+
+    kernel = session.get(spice_registry.models.SPICEFiles, file_path)
+    assert kernel.ingestion_date == datetime(2024, 1, 2)
+    assert session.query(spice_registry.models.SPICEFiles).count() == 1
+
+
+def test_resolve_kernels(session):
+    """Test choosing kernels by precedence, version and coverage."""
+    for file_path in [
+        "spice/lsk/naif0011.tls",
+        "spice/lsk/naif0012.tls",
+        "spice/sclk/imap_sclk_0001.tsc",
+        # Predicted covers the whole range
+        "spice/spk/imap_pred_20240101_20240131_v01.bsp",
+        # Nominal covers the 10th, reconstructed the 9th through the 11th,
+        # in two versions
+        "spice/spk/imap_nom_20240110_20240110_v01.bsp",
+        "spice/spk/imap_recon_20240109_20240111_v01.bsp",
+        "spice/spk/imap_recon_20240109_20240111_v02.bsp",
+        # Outside of the range
+        "spice/spk/imap_recon_20240201_20240207_v01.bsp",
+        "spice/ck/imap_2024_010_2024_010_01.ah.bc",
+    ]:
+        spice_registry.register_kernel(session, file_path)
+
+    kernels = spice_registry.resolve_kernels(
+        session, datetime(2024, 1, 10), datetime(2024, 1, 13)
+    )
+    assert [kernel.file_path for kernel in kernels] == [
+        # The latest generic kernels come first
+        "spice/lsk/naif0012.tls",
+        "spice/sclk/imap_sclk_0001.tsc",
+        "spice/ck/imap_2024_010_2024_010_01.ah.bc",
+        # Predicted fills the 12th, loaded first so the better kernels win
+        "spice/spk/imap_pred_20240101_20240131_v01.bsp",
+        "spice/spk/imap_recon_20240109_20240111_v02.bsp",
+    ]
+
+
+def test_get_metakernel():
+    """Test the metakernel furnishes the kernels from the EFS."""
+    kernels = [
+        spice_registry.models.SPICEFiles(file_path="spice/lsk/naif0012.tls"),
+        spice_registry.models.SPICEFiles(
+            file_path="spice/spk/imap_recon_20240109_20240111_v02.bsp"
+        ),
+    ]
+    assert spice_registry.get_metakernel(kernels) == (
+        "KPL/MK\n"
+        "\\begindata\n"
+        "  PATH_VALUES = ( '/mnt/spice' )\n"
+        "  PATH_SYMBOLS = ( 'KERNELS' )\n"
+        "  KERNELS_TO_LOAD = (\n"
+        "    '$KERNELS/naif0012.tls'\n"
+        "    '$KERNELS/imap_recon_20240109_20240111_v02.bsp'\n"
+        "  )\n"
+        "\\begintext\n"
+    )
+
+
+def test_read_daf_coverage():
+    """Test reading the coverage from the segment summaries."""
+    content = make_spk([(100.0, 200.0), (50.0, 150.0)])
+    assert spice_registry.read_daf_coverage(
+        lambda offset, size: content[offset : offset + size]
+    ) == (50.0, 200.0)
+
+    with pytest.raises(ValueError, match="Not a DAF file"):
+        spice_registry.read_daf_coverage(lambda offset, size: b"KPL/MK")
+
+
+def test_get_spk_coverage(s3_client):
+    """Test reading the UTC coverage of an SPK in S3."""
+    # 2024-01-01T00:00:00 and 2024-01-08T00:00:00 UTC in ephemeris time
+    start_et = 757339269.184
+    end_et = start_et + 7 * 86400
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key="spice/spk/test.bsp",
+        Body=make_spk([(start_et, end_et)]),
+    )
+    start, end = spice_registry.get_spk_coverage(
+        s3_client, BUCKET_NAME, "spice/spk/test.bsp"
+    )
+    assert abs(start - datetime(2024, 1, 1)) < timedelta(milliseconds=1)
+    assert abs(end - datetime(2024, 1, 8)) < timedelta(milliseconds=1)
+
+
+def test_coverage_index():
+    """Test the in-memory index against a linear scan."""
+    Kernel = namedtuple("Kernel", ["start_date", "end_date"])
+    rng = random.Random(0)  # noqa: S311
+    epoch = datetime(2024, 1, 1)
+    kernels = []
+    for _ in range(500):
+        start = epoch + timedelta(hours=rng.randrange(24 * 365))
+        kernels.append(
+            Kernel(start, start + timedelta(hours=rng.randrange(1, 24 * 30)))
+        )
+    index = spice_registry.CoverageIndex(kernels)
+
+    for _ in range(100):
+        start = epoch + timedelta(hours=rng.randrange(-24 * 30, 24 * 400))
+        end = start + timedelta(hours=rng.randrange(1, 24 * 10))
+        expected = [
+            kernel
+            for kernel in kernels
+            if kernel.start_date < end and kernel.end_date > start
+        ]
+        assert sorted(index.overlapping(start, end)) == sorted(expected)
+
+
+def test_query_kernels(session):
+    """Test the database and the in-memory index give the same kernels."""
+    for file_path in [
+        "spice/ck/imap_2025_059_2025_060_01.ah.bc",
+        "spice/ck/imap_2025_060_2025_061_01.ah.bc",
+        "spice/ck/imap_2025_062_2025_063_01.ah.bc",
+        "spice/spk/imap_recon_20250301_20250301_v01.bsp",
+    ]:
+        spice_registry.register_kernel(session, file_path)
+
+    # Which attitude kernels cover 2025-03-01 (day of year 60)
+    start, end = datetime(2025, 3, 1), datetime(2025, 3, 2)
+    expected = [
+        "spice/ck/imap_2025_059_2025_060_01.ah.bc",
+        "spice/ck/imap_2025_060_2025_061_01.ah.bc",
+    ]
+    kernels = spice_registry.query_kernels(session, "ck", start, end)
+    assert [kernel.file_path for kernel in kernels] == expected
+    index = spice_registry.get_coverage_index(session, "ck")
+    assert [kernel.file_path for kernel in index.overlapping(start, end)] == expected
+
+    # The cached index is rebuilt when a kernel is registered
+    assert spice_registry.get_coverage_index(session, "ck") is index
+    spice_registry.register_kernel(session, "spice/ck/imap_2025_060_2025_060_02.ah.bc")
+    index = spice_registry.get_coverage_index(session, "ck")
+    assert len(index.overlapping(start, end)) == 3
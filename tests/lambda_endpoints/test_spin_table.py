@@ -0,0 +1,111 @@
+"""Tests for the universal spin table ingestion and API."""
+
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from sds_data_manager.lambda_code.SDSCode import indexer, spin_table, spin_table_api
+from sds_data_manager.lambda_code.SDSCode.database import models
+
+from .conftest import BUCKET_NAME
+
+HEADER = ",".join(spin_table.SPIN_COLUMNS)
+
+
+def make_spin_file(first_spin, n_spins, start=1000, period=15000):
+    """Make a spin file of consecutive spins of 15 s."""
+    lines = [HEADER]
+    for index in range(n_spins):
+        start_ms = start * 1000 + index * period
+        utc = datetime(2024, 1, 1) + timedelta(milliseconds=start_ms)
+        lines.append(
+            f"{first_spin + index},{start_ms // 1000},{start_ms % 1000 * 1000},"
+            f"{utc.isoformat()},1,{period},0,false,0"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def test_read_spin_file():
+    """Test parsing the spins of a spin file."""
+    records = spin_table.read_spin_file(io.StringIO(make_spin_file(1, 2)))
+    assert records[1] == {
+        "spin_number": 2,
+        "spin_start_sc_time": 1015,
+        "spin_start_subsec": 0,
+        "spin_start_utc_time": datetime(2024, 1, 1, 0, 16, 55),
+        "star_tracker_flag": True,
+        "spin_duration": 15000,
+        "thruster_firing_event": False,
+        "repointing": False,
+        "repointing_number": 0,
+    }
+
+    with pytest.raises(ValueError, match="missing the columns"):
+        spin_table.read_spin_file(io.StringIO("spin_number\n1\n"))
+
+
+def test_ingest_replaces_time_range(session):
+    """Test that a spin file supersedes the spins of its time range."""
+    assert spin_table.ingest_spin_file(session, io.StringIO(make_spin_file(1, 10)))
+    # A reprocessed file of the last five spins
+    spin_table.ingest_spin_file(
+        session, io.StringIO(make_spin_file(106, 5, start=1075))
+    )
+
+    spins = session.query(models.UniversalSpinTable).order_by(
+        models.UniversalSpinTable.spin_start_sc_time
+    )
+    assert [spin.spin_number for spin in spins] == [1, 2, 3, 4, 5, *range(106, 111)]
+
+
+def test_query_spins(session):
+    """Test that a time range returns its spins as columns."""
+    spin_table.ingest_spin_file(session, io.StringIO(make_spin_file(1, 10)))
+
+    # 1020 is within the second spin, which starts at 1015
+    spins = spin_table.query_spins(session, 1020, 1050)
+    assert spins["spin_number"] == [2, 3, 4]
+    assert spins["spin_start_sc_time"] == [1015, 1030, 1045]
+    assert spins["spin_start_utc_time"][0] == "2024-01-01T00:16:55"
+    assert set(spins) == set(spin_table.SPIN_COLUMNS)
+
+    assert spin_table.query_spins(session, 0, 500)["spin_number"] == []
+
+
+def test_spin_table_api(session):
+    """Test the spin table API lambda."""
+    spin_table.ingest_spin_file(session, io.StringIO(make_spin_file(1, 10)))
+
+    event = {"queryStringParameters": {"start_time": "1030", "end_time": "1060"}}
+    response = spin_table_api.lambda_handler(event, {})
+    assert response["statusCode"] == 200
+    # The spin started at 1060 is outside of the range
+    assert json.loads(response["body"])["spin_number"] == [2, 3, 4]
+
+    for params in (
+        None,
+        {"start_time": "1030"},
+        {"start_time": "abc", "end_time": "1060"},
+        {"start_time": "1060", "end_time": "1030"},
+        {"start_time": "0", "end_time": str(spin_table_api.MAX_TIME_RANGE + 1)},
+    ):
+        response = spin_table_api.lambda_handler({"queryStringParameters": params}, {})
+        assert response["statusCode"] == 400
+
+
+def test_s3_spin_event(session, s3_client):
+    """Test that the indexer loads spin files dropped in the bucket."""
+    filepath = "spin/imap_2024_001_2024_001_01.spin.csv"
+    s3_client.put_object(Bucket=BUCKET_NAME, Key=filepath, Body=make_spin_file(1, 3))
+    event = {
+        "detail-type": "Object Created",
+        "source": "aws.s3",
+        "detail": {
+            "bucket": {"name": BUCKET_NAME},
+            "object": {"key": filepath, "reason": "PutObject"},
+        },
+    }
+    assert indexer.lambda_handler(event=event, context={})["statusCode"] == 200
+    assert session.query(models.UniversalSpinTable).count() == 3
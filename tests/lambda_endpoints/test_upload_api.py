@@ -1,5 +1,6 @@
 """Tests for the Upload API."""
 
+import json
 import os
 from unittest.mock import patch
 
@@ -100,3 +101,71 @@ def test_input_parameters_missing():
 
     response = upload_api.lambda_handler(event=empty_para_event, context=None)
     assert response["statusCode"] == 400
+
+
+def test_multipart_upload(s3_client):
+    """Test the pre-signed urls of a multipart upload."""
+    event = {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": "/",
+        "pathParameters": {"proxy": "imap_swe_l1b_sci_20100101_v000.cdf"},
+        "queryStringParameters": {"parts": "3"},
+    }
+    response = upload_api.lambda_handler(event=event, context=None)
+    assert response["statusCode"] == 200
+    body = json.loads(response["body"])
+    assert len(body["part_urls"]) == 3
+    for part_number, url in enumerate(body["part_urls"], start=1):
+        assert f"partNumber={part_number}" in url
+        assert f"uploadId={body['upload_id']}" in url
+    assert f"uploadId={body['upload_id']}" in body["complete_url"]
+    assert f"uploadId={body['upload_id']}" in body["abort_url"]
+    uploads = s3_client.list_multipart_uploads(Bucket=os.getenv("S3_BUCKET"))
+    assert [upload["UploadId"] for upload in uploads["Uploads"]] == [body["upload_id"]]
+
+    assert body["next_part"] is None
+
+    event["queryStringParameters"]["parts"] = "0"
+    response = upload_api.lambda_handler(event=event, context=None)
+    assert response["statusCode"] == 400
+
+
+def test_multipart_upload_pages(s3_client, monkeypatch):
+    """Test getting the part urls of a large multipart upload in pages."""
+    monkeypatch.setattr(upload_api, "MAX_PART_URLS", 2)
+    event = {
+        "pathParameters": {"proxy": "imap_swe_l1b_sci_20100102_v000.cdf"},
+        "queryStringParameters": {"parts": "5"},
+    }
+    body = json.loads(upload_api.lambda_handler(event=event, context=None)["body"])
+    upload_id = body["upload_id"]
+    part_urls = body["part_urls"]
+    while body["next_part"] is not None:
+        event["queryStringParameters"].update(
+            upload_id=upload_id, first_part=str(body["next_part"])
+        )
+        response = upload_api.lambda_handler(event=event, context=None)
+        body = json.loads(response["body"])
+        assert body["upload_id"] == upload_id
+        part_urls += body["part_urls"]
+
+    assert len(part_urls) == 5
+    for part_number, url in enumerate(part_urls, start=1):
+        assert f"partNumber={part_number}" in url
+    # Only one upload is started
+    uploads = s3_client.list_multipart_uploads(Bucket=os.getenv("S3_BUCKET"))
+    assert [
+        upload["UploadId"]
+        for upload in uploads["Uploads"]
+        if upload["Key"].endswith("20100102_v000.cdf")
+    ] == [upload_id]
+
+    for params in (
+        {"parts": "5", "first_part": "3"},
+        {"upload_id": upload_id, "first_part": "3"},
+        {"parts": "5", "upload_id": upload_id, "first_part": "6"},
+    ):
+        event["queryStringParameters"] = params
+        response = upload_api.lambda_handler(event=event, context=None)
+        assert response["statusCode"] == 400
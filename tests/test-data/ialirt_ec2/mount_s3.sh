@@ -1,4 +0,0 @@
-#!/bin/bash
-
-# Mount the S3 bucket
-mount-s3 ialirt-301233867300 /mnt/s3
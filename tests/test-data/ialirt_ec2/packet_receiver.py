@@ -0,0 +1,544 @@
+"""Receive the I-ALiRT packet streams of the ground stations.
+
+Ground stations connect to the network load balancer and stream CCSDS
+packets over TCP. Each connection is read packet by packet: the primary
+header gives the length of the rest of the packet, so a packet is always
+read whole however the stream is split into segments.
+
+Packets are handed to one processing task per instrument through a bounded
+queue. When an instrument falls behind, its queue fills up and the
+connection stops being read, so TCP flow control slows the ground station
+down instead of packets piling up in memory. The processing tasks append the
+packets to the in-memory windows of their APID and run the algorithms on
+them.
+
+The raw packets are also buffered and flushed in batches, every
+``FLUSH_PACKETS`` packets or ``FLUSH_SECONDS`` seconds: one DynamoDB batch
+write to the ingest table, then an append to the S3 object of the current
+time partition (see ``s3_writer``). Items are keyed as by the ingest lambda,
+so the lambda ingesting the same packets from the S3 object overwrites them
+instead of duplicating them. A batch that fails to be written is kept in the
+buffer and written again with the next flush.
+
+Every ``METRICS_SECONDS`` the receiver logs its packet rate and processing
+lag in the CloudWatch embedded metric format. CloudWatch Logs turns them
+into the metrics the service scales on. While it has open connections, the
+receiver protects its ECS task from scale in, so that the streams and the
+packet windows are not lost when the service scales in.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import os
+import struct
+import sys
+import time
+import urllib.request
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+import boto3
+from s3_writer import PartitionedS3Writer
+from window_cache import WindowCache
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# CCSDS primary header: version, type, secondary header flag and APID,
+# sequence flags and count, packet data length minus one
+PRIMARY_HEADER = struct.Struct(">HHH")
+# The secondary header starts with the MET in seconds
+MET = struct.Struct(">I")
+
+# Packets waiting per instrument before the connections stop being read
+QUEUE_SIZE = 1000
+# Packets buffered before they are flushed, and longest time they wait
+FLUSH_PACKETS = 500
+FLUSH_SECONDS = 5
+# How long packets are kept in the ingest table, as by the ingest lambda
+PACKET_TTL = timedelta(days=7)
+# Instrument of the packets whose APID is not configured
+UNKNOWN_INSTRUMENT = "unknown"
+# CloudWatch namespace of the metrics, and seconds between them
+METRIC_NAMESPACE = "IALiRT"
+METRICS_SECONDS = 60
+# Minutes the task stays protected from scale in if it is not unprotected,
+# e.g. because the container died, longer than a contact
+PROTECTION_MINUTES = 24 * 60
+
+Packet = namedtuple("Packet", ["apid", "seq_count", "met", "data"])
+
+
+async def read_packet(reader):
+    """Read the next packet of a stream.
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        The stream.
+
+    Returns
+    -------
+    Packet or None
+        The packet, None at the end of the stream.
+    """
+    try:
+        header = await reader.readexactly(PRIMARY_HEADER.size)
+        first, second, length = PRIMARY_HEADER.unpack(header)
+        # The length field is the data length minus one
+        data = header + await reader.readexactly(length + 1)
+    except asyncio.IncompleteReadError as error:
+        if error.partial:
+            logger.warning(f"Dropped {len(error.partial)} bytes of a truncated packet")
+        return None
+    # Packets too short for a secondary header have no MET
+    met = MET.unpack_from(data, PRIMARY_HEADER.size)[0] if length >= 3 else 0
+    return Packet(apid=first & 0x7FF, seq_count=second & 0x3FFF, met=met, data=data)
+
+
+def get_item(packet, ingest_time, source):
+    """Get the ingest table item of a packet.
+
+    Parameters
+    ----------
+    packet : Packet
+        The packet.
+    ingest_time : datetime
+        Time of the flush.
+    source : str
+        S3 key of the packets.
+
+    Returns
+    -------
+    dict
+        The item, as written by the ingest lambda.
+    """
+    return {
+        "apid": packet.apid,
+        "met": Decimal(f"{packet.met}.{packet.seq_count:05d}"),
+        "seq_count": packet.seq_count,
+        "ingest_time": ingest_time.isoformat(),
+        "packet_blob": packet.data,
+        "source": source,
+        "expiration": int((ingest_time + PACKET_TTL).timestamp()),
+    }
+
+
+def set_task_protection(enabled):
+    """Protect the ECS task of the container from scale in, or stop it.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether the task is protected.
+
+    Returns
+    -------
+    bool
+        Whether the protection was updated, False outside of ECS or if the
+        ECS agent could not be reached.
+    """
+    agent_uri = os.environ.get("ECS_AGENT_URI")
+    if not agent_uri:
+        return False
+    state = {"ProtectionEnabled": enabled}
+    if enabled:
+        state["ExpiresInMinutes"] = PROTECTION_MINUTES
+    # The endpoint is set by the ECS agent, always http
+    request = urllib.request.Request(  # noqa: S310
+        f"{agent_uri}/task-protection/v1/state",
+        data=json.dumps(state).encode(),
+        headers={"Content-Type": "application/json"},
+        method="PUT",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=5):  # noqa: S310
+            return True
+    except Exception:
+        logger.exception("Failed to update the task protection")
+        return False
+
+
+class PacketFlusher:
+    """Buffer raw packets and write them to S3 and DynamoDB in batches."""
+
+    def __init__(
+        self,
+        s3_writer,
+        ingest_table,
+        flush_packets=FLUSH_PACKETS,
+        flush_seconds=FLUSH_SECONDS,
+    ):
+        """Create an empty buffer.
+
+        Parameters
+        ----------
+        s3_writer : PartitionedS3Writer
+            Writer of the S3 objects of the packets.
+        ingest_table : boto3 DynamoDB Table
+            The ingest table.
+        flush_packets : int, optional
+            Packets buffered before a flush.
+        flush_seconds : float, optional
+            Seconds between flushes of a partial buffer.
+        """
+        self.s3_writer = s3_writer
+        self.ingest_table = ingest_table
+        self.flush_packets = flush_packets
+        self.flush_seconds = flush_seconds
+        self.packets = []
+        self.flushed = 0
+        # Flushes are written one at a time, in order
+        self.lock = asyncio.Lock()
+
+    async def add(self, packet):
+        """Buffer a packet, flushing the buffer once full.
+
+        The packet is not acknowledged until a full buffer is written, so a
+        slow S3 or DynamoDB slows down the reads as well.
+
+        Parameters
+        ----------
+        packet : Packet
+            The packet.
+        """
+        self.packets.append(packet)
+        if len(self.packets) >= self.flush_packets:
+            await self.flush()
+
+    async def flush(self):
+        """Write the buffered packets.
+
+        Failures are logged rather than raised, so that neither the periodic
+        flushes nor the connections adding the packets stop.
+        """
+        async with self.lock:
+            packets, self.packets = self.packets, []
+            if packets:
+                try:
+                    # boto3 blocks, the connections are read meanwhile
+                    await asyncio.to_thread(self.write, packets)
+                except Exception:
+                    logger.exception(f"Failed to flush {len(packets)} packets")
+                    # Written again, ahead of the packets received meanwhile
+                    self.packets[:0] = packets
+                else:
+                    self.flushed += len(packets)
+            try:
+                # Complete the object of a partition that has ended
+                await asyncio.to_thread(self.s3_writer.roll_over)
+            except Exception:
+                logger.exception("Failed to roll over the packet object")
+
+    async def run(self):
+        """Flush the buffer periodically, until cancelled."""
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            await self.flush()
+
+    async def close(self):
+        """Write the buffered packets and complete the current object."""
+        await self.flush()
+        async with self.lock:
+            await asyncio.to_thread(self.s3_writer.close)
+
+    def write(self, packets):
+        """Write packets to the ingest table and to S3.
+
+        The ingest table is written first: the writes are idempotent, so a
+        batch can be written again if the append to the S3 object fails.
+
+        Parameters
+        ----------
+        packets : list of Packet
+            The packets, in the order they were received.
+        """
+        ingest_time = datetime.now(timezone.utc)
+        key = self.s3_writer.get_time_key(ingest_time)
+        with self.ingest_table.batch_writer(
+            overwrite_by_pkeys=["apid", "met"]
+        ) as batch:
+            for packet in packets:
+                batch.put_item(Item=get_item(packet, ingest_time, key))
+        self.s3_writer.write(b"".join(p.data for p in packets), ingest_time)
+        logger.info(f"Flushed {len(packets)} packets, written to {key}")
+
+
+class PacketReceiver:
+    """Read packet streams and fan the packets out to the instruments."""
+
+    def __init__(
+        self,
+        flusher,
+        instruments=None,
+        algorithms=None,
+        cache=None,
+        queue_size=QUEUE_SIZE,
+        processing_name="local",
+    ):
+        """Create the receiver.
+
+        Parameters
+        ----------
+        flusher : PacketFlusher
+            Writer of the raw packets.
+        instruments : dict, optional
+            Instrument of each APID.
+        algorithms : dict, optional
+            Algorithm of each instrument, called with the window of the APID
+            and the packet after each packet. Can be a coroutine function.
+        cache : WindowCache, optional
+            Packet windows, e.g. warmed up from the ingest table.
+        queue_size : int, optional
+            Packets waiting per instrument before the reads pause.
+        processing_name : str, optional
+            Name of the processing service, dimension of the metrics.
+        """
+        self.flusher = flusher
+        self.instruments = instruments or {}
+        self.algorithms = algorithms or {}
+        self.cache = cache if cache is not None else WindowCache()
+        self.queue_size = queue_size
+        self.queues = {}
+        self.tasks = []
+        self.processing_name = processing_name
+        # Open connections, and whether the task is protected from scale in
+        self.connections = 0
+        self.protected = False
+        self.protection_lock = asyncio.Lock()
+        self.received = 0
+        self.processed = 0
+        # Packets received and longest lag since the last metrics
+        self.metrics_received = 0
+        self.metrics_time = time.monotonic()
+        self.max_lag = 0.0
+
+    def get_queue(self, instrument):
+        """Get the queue of an instrument, starting its processing task.
+
+        Parameters
+        ----------
+        instrument : str
+            The instrument.
+
+        Returns
+        -------
+        asyncio.Queue
+            The queue.
+        """
+        if instrument not in self.queues:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self.queues[instrument] = queue
+            self.tasks.append(asyncio.create_task(self.process(instrument, queue)))
+        return self.queues[instrument]
+
+    async def handle_connection(self, reader, writer):
+        """Read the packets of a connection until it is closed.
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            Reader of the connection.
+        writer : asyncio.StreamWriter
+            Writer of the connection.
+        """
+        peer = writer.get_extra_info("peername")
+        logger.info(f"Connection from {peer}")
+        self.connections += 1
+        try:
+            await self.update_protection()
+            while (packet := await read_packet(reader)) is not None:
+                self.received += 1
+                instrument = self.instruments.get(packet.apid, UNKNOWN_INSTRUMENT)
+                # Waits while the instrument is behind, which pauses the reads
+                await self.get_queue(instrument).put((time.monotonic(), packet))
+                await self.flusher.add(packet)
+        finally:
+            self.connections -= 1
+            writer.close()
+            await writer.wait_closed()
+            logger.info(f"Connection from {peer} closed")
+            await self.update_protection()
+
+    async def update_protection(self):
+        """Protect the task from scale in while it has open connections."""
+        async with self.protection_lock:
+            # Decided under the lock, so the last update wins
+            protected = self.connections > 0
+            if protected != self.protected and await asyncio.to_thread(
+                set_task_protection, protected
+            ):
+                self.protected = protected
+
+    async def process(self, instrument, queue):
+        """Run the algorithm of an instrument on its packets, until cancelled.
+
+        Parameters
+        ----------
+        instrument : str
+            The instrument.
+        queue : asyncio.Queue
+            Queue of the packets of the instrument.
+        """
+        algorithm = self.algorithms.get(instrument)
+        while True:
+            received_time, packet = await queue.get()
+            try:
+                window = self.cache.append(
+                    packet.apid, packet.met, packet.seq_count, packet.data
+                )
+                if algorithm is not None:
+                    result = algorithm(window, packet)
+                    if inspect.isawaitable(result):
+                        await result
+                self.processed += 1
+                self.max_lag = max(self.max_lag, time.monotonic() - received_time)
+            except Exception:
+                # A bad packet must not stop the instrument
+                logger.exception(f"Failed to process a {instrument} packet")
+            finally:
+                queue.task_done()
+
+    def get_metrics(self):
+        """Get the metrics since the last call.
+
+        Returns
+        -------
+        dict
+            "PacketsPerSecond", packets received per second, and
+            "ProcessingLag", longest time in seconds between the reception
+            and the end of the processing of a packet.
+        """
+        now = time.monotonic()
+        metrics = {
+            "PacketsPerSecond": (self.received - self.metrics_received)
+            / max(now - self.metrics_time, 1e-9),
+            "ProcessingLag": self.max_lag,
+        }
+        self.metrics_received = self.received
+        self.metrics_time = now
+        self.max_lag = 0.0
+        return metrics
+
+    def log_metrics(self, stream=None):
+        """Log the metrics in the CloudWatch embedded metric format.
+
+        Parameters
+        ----------
+        stream : file-like, optional
+            Where to write the metrics, the standard output by default,
+            which the container sends to CloudWatch Logs.
+        """
+        metrics = self.get_metrics()
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRIC_NAMESPACE,
+                        "Dimensions": [["ProcessingName"]],
+                        "Metrics": [
+                            {"Name": "PacketsPerSecond", "Unit": "Count/Second"},
+                            {"Name": "ProcessingLag", "Unit": "Seconds"},
+                        ],
+                    }
+                ],
+            },
+            "ProcessingName": self.processing_name,
+            **metrics,
+        }
+        stream = stream or sys.stdout
+        stream.write(json.dumps(record) + "\n")
+        stream.flush()
+
+    async def report_metrics(self):
+        """Log the metrics periodically, until cancelled."""
+        while True:
+            await asyncio.sleep(METRICS_SECONDS)
+            self.log_metrics()
+
+    async def drain(self):
+        """Wait until the received packets are processed and flushed."""
+        for queue in list(self.queues.values()):
+            await queue.join()
+        await self.flusher.flush()
+
+    async def serve(self, host="0.0.0.0", port=8080):
+        """Start listening for connections.
+
+        Parameters
+        ----------
+        host : str, optional
+            Interface to listen on.
+        port : int, optional
+            Port to listen on, 0 for any free port.
+
+        Returns
+        -------
+        asyncio.Server
+            The server, already listening.
+        """
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.tasks.append(asyncio.create_task(self.flusher.run()))
+        self.tasks.append(asyncio.create_task(self.report_metrics()))
+        return server
+
+    async def close(self):
+        """Stop the tasks and flush the remaining packets."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queues = {}
+        await self.flusher.close()
+
+
+def parse_instruments(value):
+    """Parse the instruments of the APIDs from an environment variable.
+
+    Parameters
+    ----------
+    value : str
+        Comma separated ``apid:instrument`` pairs, e.g. "478:hit,1344:swe".
+
+    Returns
+    -------
+    dict
+        Instrument of each APID.
+    """
+    instruments = {}
+    for pair in filter(None, value.split(",")):
+        apid, instrument = pair.split(":")
+        instruments[int(apid)] = instrument.strip()
+    return instruments
+
+
+async def main():
+    """Run the receiver of the container."""
+    instruments = parse_instruments(os.environ.get("APID_INSTRUMENTS", ""))
+    ingest_table = boto3.resource("dynamodb").Table(os.environ["INGEST_TABLE"])
+    cache = WindowCache()
+    cache.warm_up(ingest_table, instruments)
+
+    processing_name = os.environ.get("PROCESSING_NAME", "local")
+    s3_writer = PartitionedS3Writer(
+        boto3.client("s3"), os.environ["S3_BUCKET"], processing_name
+    )
+    flusher = PacketFlusher(s3_writer, ingest_table)
+    receiver = PacketReceiver(
+        flusher, instruments, cache=cache, processing_name=processing_name
+    )
+    server = await receiver.serve(port=int(os.environ.get("PORT", 8080)))
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            await receiver.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig()
+    asyncio.run(main())
@@ -0,0 +1,280 @@
+"""Write the received packets to time-partitioned S3 objects.
+
+Packets are appended to the object of the current partition, one object per
+``PARTITION_SECONDS`` of reception time, instead of one small file per write.
+An object is uploaded as a multipart upload while it grows: every
+``PART_SIZE`` bytes buffered in memory are sent as a part, so memory stays
+bounded however long the partition. When the partition ends the last part is
+sent and the upload completed, and the object appears in the bucket at once.
+Partitions smaller than a part are uploaded with a single PutObject.
+
+Objects are named ``packets/YYYY/MM/DD/imap_ialirt_<name>_<task>_<start>.bin``,
+so the I-ALiRT ingest lambda picks them up when they are created. The task
+is the ECS task of the container, so the tasks of a service scaled out do not
+overwrite each other's objects.
+
+A part that fails to upload stays buffered and is sent again with the next
+one. A partition that cannot be completed is aborted and its object is lost,
+its packets are already in the ingest table.
+"""
+
+import io
+import json
+import logging
+import os
+import socket
+import threading
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Seconds of packets per object
+PARTITION_SECONDS = 60
+# Bytes per part of the uploads, S3 parts are at least 5 MiB but the last
+PART_SIZE = 8 * 1024 * 1024
+
+
+def get_task_id():
+    """Get the ID of the ECS task of the container.
+
+    Returns
+    -------
+    str
+        The last part of the task ARN from the task metadata endpoint, or the
+        host name outside of ECS or if the endpoint cannot be read.
+    """
+    metadata_uri = os.environ.get("ECS_CONTAINER_METADATA_URI_V4")
+    if metadata_uri:
+        try:
+            # The endpoint is set by the ECS agent, always http
+            task_uri = f"{metadata_uri}/task"
+            with urllib.request.urlopen(task_uri, timeout=5) as f:  # noqa: S310
+                return json.load(f)["TaskARN"].split("/")[-1]
+        except Exception:
+            logger.exception("Failed to read the task metadata")
+    return socket.gethostname()
+
+
+def get_partition_start(time, partition_seconds=PARTITION_SECONDS):
+    """Get the start of the partition of a time.
+
+    Parameters
+    ----------
+    time : datetime
+        The time, timezone aware.
+    partition_seconds : int, optional
+        Seconds per partition.
+
+    Returns
+    -------
+    datetime
+        Start of the partition.
+    """
+    seconds = int(time.timestamp()) // partition_seconds * partition_seconds
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+
+class PartitionedS3Writer:
+    """Append packets to the S3 object of their time partition."""
+
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        name,
+        partition_seconds=PARTITION_SECONDS,
+        part_size=PART_SIZE,
+        task_id=None,
+    ):
+        """Create the writer, without an open partition.
+
+        Parameters
+        ----------
+        s3_client : boto3 S3 client
+            Client of the bucket.
+        bucket : str
+            The packet bucket.
+        name : str
+            Name of the writer in the object names, e.g. the processing name.
+        partition_seconds : int, optional
+            Seconds of packets per object.
+        part_size : int, optional
+            Bytes per part of the uploads.
+        task_id : str, optional
+            Task of the writer in the object names, so that the writers of
+            the same name do not overwrite each other's objects. By default
+            the ECS task of the container, see ``get_task_id``.
+        """
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.name = name
+        self.partition_seconds = partition_seconds
+        self.part_size = part_size
+        self.task_id = task_id or get_task_id()
+        # Partitions are written from the flush threads
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """Forget the current partition."""
+        self.partition_start = None
+        self.key = None
+        self.buffer = io.BytesIO()
+        self.upload_id = None
+        self.parts = []
+
+    def get_time_key(self, time):
+        """Get the S3 key of the partition of a time.
+
+        Parameters
+        ----------
+        time : datetime
+            The time, timezone aware.
+
+        Returns
+        -------
+        str
+            The key.
+        """
+        return self.get_key(get_partition_start(time, self.partition_seconds))
+
+    def get_key(self, partition_start):
+        """Get the S3 key of a partition.
+
+        Parameters
+        ----------
+        partition_start : datetime
+            Start of the partition.
+
+        Returns
+        -------
+        str
+            The key.
+        """
+        return (
+            f"packets/{partition_start:%Y/%m/%d}/"
+            f"imap_ialirt_{self.name.lower()}_{self.task_id}_"
+            f"{partition_start:%Y%m%dT%H%M%S}.bin"
+        )
+
+    def write(self, data, time=None):
+        """Append packets to the object of their partition.
+
+        Parameters
+        ----------
+        data : bytes
+            The packets.
+        time : datetime, optional
+            Reception time of the packets, now by default.
+
+        Returns
+        -------
+        str
+            S3 key of the object the packets are written to.
+        """
+        time = time or datetime.now(timezone.utc)
+        with self.lock:
+            partition_start = get_partition_start(time, self.partition_seconds)
+            if self.partition_start != partition_start:
+                self._close()
+                self.partition_start = partition_start
+                self.key = self.get_key(partition_start)
+            self.buffer.write(data)
+            if self.buffer.tell() >= self.part_size:
+                try:
+                    self._upload_part()
+                except Exception:
+                    # The bytes stay buffered and are sent with the next part
+                    logger.exception(f"Failed to upload a part of {self.key}")
+            return self.key
+
+    def roll_over(self, time=None):
+        """Close the partition if it has ended.
+
+        Parameters
+        ----------
+        time : datetime, optional
+            The current time, now by default.
+
+        Returns
+        -------
+        str or None
+            S3 key of the closed object.
+        """
+        time = time or datetime.now(timezone.utc)
+        with self.lock:
+            if self.partition_start is None:
+                return None
+            end = self.partition_start + timedelta(seconds=self.partition_seconds)
+            return self._close() if time >= end else None
+
+    def close(self):
+        """Close the current partition.
+
+        Returns
+        -------
+        str or None
+            S3 key of the closed object.
+        """
+        with self.lock:
+            return self._close()
+
+    def _upload_part(self):
+        """Send the buffered bytes as the next part of the upload."""
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )
+            self.upload_id = response["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue(),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = io.BytesIO()
+
+    def _close(self):
+        """Upload the rest of the partition and complete its object."""
+        key = self.key
+        if key is None:
+            return None
+        try:
+            if self.upload_id is None:
+                self.s3_client.put_object(
+                    Bucket=self.bucket, Key=key, Body=self.buffer.getvalue()
+                )
+            else:
+                if self.buffer.tell():
+                    self._upload_part()
+                self.s3_client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={"Parts": self.parts},
+                )
+        except Exception:
+            # The packets are in the ingest table, only the object is lost
+            logger.exception(f"Failed to write {key}")
+            if self.upload_id is not None:
+                self._abort()
+            key = None
+        else:
+            logger.info(f"Wrote {key} in {max(len(self.parts), 1)} parts")
+        self._reset()
+        return key
+
+    def _abort(self):
+        """Abort the upload of the partition, without raising."""
+        try:
+            self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+        except Exception:
+            # Its parts are kept until the bucket's lifecycle rule removes them
+            logger.exception(f"Failed to abort the upload of {self.key}")
@@ -1,4 +0,0 @@
-#!/bin/bash
-
-# Start the Flask application
-python test_app.py
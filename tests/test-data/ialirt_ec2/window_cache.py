@@ -0,0 +1,235 @@
+"""Rolling windows of recent I-ALiRT packets, held in memory.
+
+The I-ALiRT algorithms need the last few minutes of packets of their APID
+for every new packet. The service keeps those packets in memory instead of
+querying DynamoDB each time: every APID has a ring buffer backed by a NumPy
+structured array, one row per packet, which is overwritten oldest first once
+full. Appending a packet is a copy into the next row, and a window is
+returned as a structured array the algorithms read directly, e.g.
+``window["met"]`` or ``window["data"][:, 10:12]``.
+
+DynamoDB remains the durability log of the packets. When the service
+restarts, the windows are warmed up by reading back the newest packets of
+each APID from the ingest table.
+"""
+
+import logging
+
+import numpy as np
+from boto3.dynamodb.conditions import Key
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Packets kept per APID, about ten minutes at a few packets per second
+DEFAULT_CAPACITY = 4096
+# Largest packet of an APID, in bytes
+DEFAULT_PACKET_SIZE = 1464
+
+
+def get_dtype(packet_size):
+    """Get the structured dtype of the packet rows.
+
+    Parameters
+    ----------
+    packet_size : int
+        Largest packet size in bytes.
+
+    Returns
+    -------
+    numpy.dtype
+        MET (seconds), sequence count, packet length and the packet bytes,
+        zero padded to ``packet_size``.
+    """
+    return np.dtype(
+        [
+            ("met", "u4"),
+            ("seq_count", "u2"),
+            ("length", "u2"),
+            ("data", "u1", (packet_size,)),
+        ]
+    )
+
+
+class PacketWindow:
+    """Ring buffer of the most recent packets of an APID."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, packet_size=DEFAULT_PACKET_SIZE):
+        """Allocate the ring buffer.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of packets kept.
+        packet_size : int, optional
+            Largest packet size in bytes.
+        """
+        self.packets = np.zeros(capacity, dtype=get_dtype(packet_size))
+        self.capacity = capacity
+        self.packet_size = packet_size
+        # Row the next packet is written to, and number of packets held
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        """Get the number of packets held."""
+        return self.count
+
+    def append(self, met, seq_count, data):
+        """Add a packet, overwriting the oldest one if full.
+
+        Parameters
+        ----------
+        met : int
+            MET of the packet in seconds.
+        seq_count : int
+            Sequence count of the packet.
+        data : bytes
+            The packet.
+        """
+        length = len(data)
+        if length > self.packet_size:
+            raise ValueError(
+                f"Packet of {length} bytes is larger than {self.packet_size}"
+            )
+        row = self.packets[self.head]
+        row["met"] = met
+        row["seq_count"] = seq_count
+        row["length"] = length
+        row["data"][:length] = np.frombuffer(data, dtype="u1")
+        row["data"][length:] = 0
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def window(self, start_met=None):
+        """Get the packets held, oldest first.
+
+        Parameters
+        ----------
+        start_met : int, optional
+            Only the packets at or after this MET (seconds).
+
+        Returns
+        -------
+        numpy.ndarray
+            The packets. A view of the buffer while it has not wrapped
+            around, a copy otherwise.
+        """
+        if self.count < self.capacity:
+            packets = self.packets[: self.count]
+        else:
+            packets = np.concatenate(
+                (self.packets[self.head :], self.packets[: self.head])
+            )
+        if start_met is not None:
+            # Packets arrive in MET order
+            packets = packets[np.searchsorted(packets["met"], start_met) :]
+        return packets
+
+    def latest(self, n):
+        """Get the n most recent packets, oldest first.
+
+        Parameters
+        ----------
+        n : int
+            Number of packets.
+
+        Returns
+        -------
+        numpy.ndarray
+            The packets.
+        """
+        return self.window()[-n:] if n else self.packets[:0]
+
+
+class WindowCache:
+    """Packet windows of every APID."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, packet_size=DEFAULT_PACKET_SIZE):
+        """Create an empty cache.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of packets kept per APID.
+        packet_size : int, optional
+            Largest packet size in bytes.
+        """
+        self.capacity = capacity
+        self.packet_size = packet_size
+        self.windows = {}
+
+    def __getitem__(self, apid):
+        """Get the packet window of an APID, created empty if new."""
+        if apid not in self.windows:
+            self.windows[apid] = PacketWindow(self.capacity, self.packet_size)
+        return self.windows[apid]
+
+    def append(self, apid, met, seq_count, data):
+        """Add a packet to the window of its APID.
+
+        Parameters
+        ----------
+        apid : int
+            APID of the packet.
+        met : int
+            MET of the packet in seconds.
+        seq_count : int
+            Sequence count of the packet.
+        data : bytes
+            The packet.
+
+        Returns
+        -------
+        PacketWindow
+            The window of the APID.
+        """
+        window = self[apid]
+        window.append(met, seq_count, data)
+        return window
+
+    def warm_up(self, ingest_table, apids):
+        """Fill the windows with the newest packets of the ingest table.
+
+        Parameters
+        ----------
+        ingest_table : boto3 DynamoDB Table
+            The ingest table, items as written by the ingest lambda.
+        apids : iterable of int
+            The APIDs to warm up.
+
+        Returns
+        -------
+        dict
+            Number of packets read per APID.
+        """
+        counts = {}
+        for apid in apids:
+            items = []
+            query = {
+                "KeyConditionExpression": Key("apid").eq(apid),
+                # Newest first, stop once the window is full
+                "ScanIndexForward": False,
+                "Limit": self.capacity,
+                "ProjectionExpression": "#met, seq_count, packet_blob",
+                "ExpressionAttributeNames": {"#met": "met"},
+            }
+            while len(items) < self.capacity:
+                response = ingest_table.query(**query)
+                items += response["Items"]
+                if "LastEvaluatedKey" not in response:
+                    break
+                query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+                query["Limit"] = self.capacity - len(items)
+
+            items = items[: self.capacity]
+            window = self[apid]
+            for item in reversed(items):
+                window.append(
+                    int(item["met"]),
+                    int(item["seq_count"]),
+                    bytes(item["packet_blob"]),
+                )
+            counts[apid] = len(items)
+        logger.info(f"Warmed up the packet windows: {counts}")
+        return counts